@@ -0,0 +1,23 @@
+-- Migration: Lọc điểm danh theo học sinh trong database
+-- Attendance filtering by student with JSONB containment
+--
+-- Backend lọc attendances theo học sinh bằng records @> '{"<student_id>": {}}'
+-- (filter `cs` của PostgREST) thay vì tải cả trang rồi duyệt records trong Python.
+-- Dùng: GET /api/attendances/?student_id=..., GET /api/attendances/student/{student_id}
+
+-- 1. Chuẩn hóa records cũ được lưu dạng chuỗi JSON ('"{...}"') thành object,
+--    nếu không @> sẽ không khớp các dòng này
+UPDATE attendances
+SET records = (records #>> '{}')::jsonb
+WHERE jsonb_typeof(records) = 'string'
+  AND jsonb_typeof((records #>> '{}')::jsonb) = 'object';
+
+-- 2. GIN index trên records (jsonb_ops mặc định, không dùng jsonb_path_ops: jsonb_path_ops
+--    không tạo entry cho giá trị rỗng như {"<student_id>": {}} nên phải quét cả index)
+CREATE INDEX IF NOT EXISTS idx_attendances_records ON attendances USING GIN (records);
+
+-- 3. Phân trang lịch sử điểm danh theo (date DESC, id DESC)
+CREATE INDEX IF NOT EXISTS idx_attendances_date_id ON attendances(date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_attendances_classroom_date_id ON attendances(classroom_id, date DESC, id DESC);
+
+ANALYZE attendances;
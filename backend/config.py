@@ -12,6 +12,8 @@ class Settings(BaseSettings):
     SUPABASE_KEY: str
     SUPABASE_ANON_KEY: str
     SUPABASE_JWT_SECRET: str = "your-supabase-jwt-secret"  # JWT secret for token verification
+    SUPABASE_JWT_AUDIENCE: str = "authenticated"
+    SUPABASE_JWT_LOCAL_VERIFY: bool = True  # Xác thực token Supabase local, chỉ gọi GoTrue khi không xác thực được
     
     # Database Configuration (Supabase PostgreSQL)
     DATABASE_URL: str = ""
@@ -21,11 +23,82 @@ class Settings(BaseSettings):
     DB_USER: str = ""
     DB_PASSWORD: str = ""
     
+    # Supabase HTTP connection pool (shared by every request in the process)
+    SUPABASE_POOL_MAX_CONNECTIONS: int = 100
+    SUPABASE_POOL_MAX_KEEPALIVE: int = 20
+    SUPABASE_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    SUPABASE_HTTP_TIMEOUT: float = 120.0
+    DB_MAX_WORKERS: int = 32  # Thread pool chạy các query Supabase đồng bộ
+    
     # JWT Configuration
     SECRET_KEY: str = "your-super-secret-key-change-this-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 120  # 2 hours
     
+    # Cache user đã xác thực theo token (0 để tắt)
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+    
+    # Rate limit (sliding window, mỗi phút): backend memory | sqlite | redis
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_DEFAULT_PER_MINUTE: int = 60
+    RATE_LIMIT_LOGIN_PER_MINUTE: int = 10
+    RATE_LIMIT_REPORTS_PER_MINUTE: int = 20
+    RATE_LIMIT_MAX_KEYS: int = 10000  # memory: số client tối đa giữ trong LRU
+    RATE_LIMIT_SQLITE_PATH: str = ""  # Mặc định: file trong thư mục tạm của hệ thống
+    RATE_LIMIT_REDIS_URL: str = "redis://localhost:6379/0"
+    
+    # /api/batch: số sub-request tối đa, số chạy song song, timeout mỗi sub-request (giây)
+    BATCH_MAX_REQUESTS: int = 20
+    BATCH_MAX_CONCURRENCY: int = 8
+    BATCH_SUBREQUEST_TIMEOUT: float = 30.0
+    
+    # Audit log: ghi theo batch từ hàng đợi trong bộ nhớ
+    AUDIT_LOG_ENABLED: bool = True
+    AUDIT_QUEUE_MAX_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 2.0
+    AUDIT_ENQUEUE_TIMEOUT_SECONDS: float = 0.0  # > 0: chờ khi hàng đợi đầy trước khi bỏ log
+    AUDIT_MAX_BODY_BYTES: int = 65536  # Body lớn hơn thì không lưu vào new_values
+    AUDIT_CAPTURE_RESPONSE_BODY: bool = False  # Đọc body của response lỗi để ghi error_message
+    
+    # Đọc bảng điểm từ student_grade_rollups (xem student_grade_rollups_schema.sql)
+    GRADE_ROLLUPS_ENABLED: bool = True
+    
+    # Index kiểm tra trùng lịch (phòng/giáo viên/lớp); nạp lại sau TTL, 0 = không hết hạn
+    SCHEDULE_CONFLICT_INDEX_TTL_SECONDS: float = 300.0
+    SCHEDULE_BULK_MAX_ROWS: int = 5000  # Số lịch tối đa mỗi lần tạo hàng loạt / import CSV
+    SCHEDULE_BULK_CHUNK_SIZE: int = 500
+    
+    # Gửi thông báo hàng loạt (/api/notifications/send)
+    NOTIFICATION_INSERT_CHUNK_SIZE: int = 500
+    NOTIFICATION_SEND_SYNC_MAX_RECIPIENTS: int = 200  # Nhiều hơn thì gửi ở background job
+    NOTIFICATION_NAME_CACHE_TTL_SECONDS: float = 300.0  # Cache tên giáo viên/học sinh/lớp trong danh sách thông báo
+    NOTIFICATION_NAME_CACHE_MAX_ENTRIES: int = 5000
+    NOTIFICATION_UNREAD_CACHE_TTL_SECONDS: float = 60.0  # Bộ đếm chưa đọc theo người nhận
+    
+    # Đẩy thông báo qua SSE (/api/notifications/stream)
+    NOTIFICATION_BROKER_BACKEND: str = "memory"  # memory | redis (nhiều worker)
+    NOTIFICATION_BROKER_REDIS_URL: str = "redis://localhost:6379/0"
+    NOTIFICATION_STREAM_QUEUE_SIZE: int = 100  # Sự kiện chờ tối đa cho mỗi kết nối
+    NOTIFICATION_STREAM_HEARTBEAT_SECONDS: float = 15.0
+    NOTIFICATION_STREAM_RETRY_MS: int = 5000
+    
+    # Đọc theo trang (keyset) cho báo cáo/thống kê trên bảng lớn (services/paging.py)
+    STREAM_FETCH_PAGE_SIZE: int = 1000
+    STREAM_FETCH_MAX_PAGE_BYTES: int = 8 * 1024 * 1024  # Giảm kích thước trang nếu một trang lớn hơn
+    
+    # Tổng hợp tài chính bằng RPC (finance_aggregates.sql, classroom_payment_summaries.sql)
+    FINANCE_AGGREGATE_RPC_ENABLED: bool = True
+    # Snapshot sổ cái theo tháng (xem finance_ledger_snapshots.sql)
+    FINANCE_LEDGER_ENABLED: bool = True
+    
+    # Tạo lớp từ template: số dòng mỗi lần insert khi copy lessons/assignments
+    TEMPLATE_CLONE_CHUNK_SIZE: int = 500
+    
+    # Phân quyền theo role (roles/permissions/user_roles) nạp vào bộ nhớ; nạp lại sau TTL
+    PERMISSION_REGISTRY_TTL_SECONDS: float = 300.0
+    
     # Email Configuration
     SMTP_USER: str = ""
     SMTP_PASSWORD: str = ""
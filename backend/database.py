@@ -1,15 +1,87 @@
 """
 Database Configuration
 Cấu hình Supabase cho hệ thống quản lý trường học
+
+Supabase-py là thư viện đồng bộ: mỗi .execute() là một HTTP round-trip tới
+PostgREST. Database bọc client dùng chung và chạy các lời gọi đó trong một
+thread pool có giới hạn, nên router async chỉ cần `await query.execute()`
+thay vì chặn event loop.
 """
 
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from supabase import Client
+
+from config import settings
 from supabase_client import get_supabase_client
-from typing import Generator
-
-def get_db():
-    """Dependency để lấy Supabase client"""
-    supabase = get_supabase_client()
-    try:
-        yield supabase
-    finally:
-        pass
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_MAX_WORKERS,
+    thread_name_prefix="supabase-db",
+)
+
+
+class Query:
+    """Query builder wrapper: chaining giữ nguyên API postgrest, execute() là coroutine"""
+
+    __slots__ = ("_db", "_builder")
+
+    def __init__(self, db: "Database", builder: Any):
+        self._db = db
+        self._builder = builder
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            # Thuộc tính trả về builder (vd: .not_)
+            return Query(self._db, attr)
+
+        @functools.wraps(attr)
+        def chain(*args, **kwargs):
+            return Query(self._db, attr(*args, **kwargs))
+        return chain
+
+    async def execute(self):
+        return await self._db.run(self._builder.execute)
+
+
+class Database:
+    """Async data-access facade over the pooled Supabase client"""
+
+    def __init__(self, client: Client):
+        self.client = client
+
+    def table(self, table_name: str) -> Query:
+        return Query(self, self.client.table(table_name))
+
+    from_ = table
+
+    def rpc(self, fn: str, params: dict = None) -> Query:
+        return Query(self, self.client.rpc(fn, params or {}))
+
+    @property
+    def auth(self):
+        """GoTrue client (đồng bộ) - gọi qua `await db.run(db.auth...., ...)`"""
+        return self.client.auth
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Chạy một lời gọi blocking trong thread pool của database"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+_database = None
+
+def get_database() -> Database:
+    """Database dùng chung cho toàn bộ process"""
+    global _database
+    if _database is None:
+        _database = Database(get_supabase_client())
+    return _database
+
+async def get_db() -> Database:
+    """Dependency để lấy Database (Supabase client không chặn event loop)"""
+    return get_database()
@@ -16,13 +16,15 @@ import os
 
 from database import get_db
 from config import settings
-<<<<<<< HEAD
-from routers import auth, users, teachers, students, subjects, classrooms, schedules, assignments, attendances, finances, payments, campuses, expense_categories, rooms, lessons, reports, roles, notifications, audit_logs, batch
+from routers import auth, users, teachers, students, subjects, classrooms, schedules, assignments, attendances, finances, payments, campuses, expense_categories, rooms, lessons, reports, roles, notifications, audit_logs, batch, template_classrooms
 from middleware.cache_headers import CacheHeadersMiddleware
 from middleware.rate_limiter import RateLimiterMiddleware
-=======
-from routers import auth, users, teachers, students, subjects, classrooms, schedules, assignments, attendances, finances, payments, campuses, expense_categories, rooms, lessons, notifications, template_classrooms
->>>>>>> origin/master
+from middleware.audit_middleware import AuditMiddleware
+from services.supabase_client import registry as supabase_registry
+from services.token_cache import token_cache
+from services.audit_writer import audit_writer
+from services.notification_broker import notification_broker
+from services.permission_registry import permission_registry
 
 app = FastAPI(
     title="School Management System API",
@@ -53,16 +55,19 @@ async def global_exception_handler(request: Request, exc: Exception):
 async def health_check():
     return {"status": "ok", "message": "Server is running"}
 
-<<<<<<< HEAD
-# Rate limiting middleware - 60 requests per minute per client
-app.add_middleware(RateLimiterMiddleware, requests_per_minute=60)
+# Rate limiting middleware - sliding window per client, riêng cho login và reports
+app.add_middleware(RateLimiterMiddleware, requests_per_minute=settings.RATE_LIMIT_DEFAULT_PER_MINUTE)
 
 # Cache headers middleware - Add HTTP cache headers
 app.add_middleware(CacheHeadersMiddleware)
 
+# Audit log middleware - ghi các request POST/PUT/PATCH/DELETE theo batch ở background
+if settings.AUDIT_LOG_ENABLED:
+    app.add_middleware(AuditMiddleware)
+
 # GZip compression middleware - Compress responses > 1000 bytes
 app.add_middleware(GZipMiddleware, minimum_size=1000)
-=======
+
 # Debug endpoint to check versions and connections
 @app.get("/api/debug")
 async def debug_info():
@@ -93,7 +98,6 @@ async def debug_info():
                 "httpx": getattr(httpx, '__version__', 'unknown'),
             }
         }
->>>>>>> origin/master
 
 # CORS middleware - Allow all origins in development
 app.add_middleware(
@@ -127,12 +131,9 @@ app.include_router(lessons.router, prefix="/api/lessons", tags=["Lessons"])
 app.include_router(reports.router, prefix="/api/reports", tags=["Reports"])
 app.include_router(roles.router, prefix="/api/roles", tags=["Roles & Permissions"])
 app.include_router(notifications.router, prefix="/api/notifications", tags=["Notifications"])
-<<<<<<< HEAD
 app.include_router(audit_logs.router, prefix="/api/audit-logs", tags=["Audit Logs"])
 app.include_router(batch.router, prefix="/api", tags=["Batch"])
-=======
 app.include_router(template_classrooms.router, prefix="/api/template-classrooms", tags=["Template Classrooms"])
->>>>>>> origin/master
 
 @app.get("/")
 async def root():
@@ -142,5 +143,51 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "API is running"}
 
+@app.get("/api/health/pool")
+async def pool_health():
+    """Supabase connection pool occupancy"""
+    return {"status": "healthy", "supabase": supabase_registry.stats()}
+
+@app.get("/api/health/auth-cache")
+async def auth_cache_health():
+    """Hit/miss counters of the verified-token cache"""
+    return {"status": "healthy", "auth_cache": token_cache.stats()}
+
+@app.get("/api/health/audit")
+async def audit_health():
+    """Audit log queue: đã ghi, đang chờ, bị bỏ"""
+    return {"status": "healthy", "audit": audit_writer.stats()}
+
+@app.get("/api/health/notifications")
+async def notifications_health():
+    """Health check cho broker đẩy thông báo (số kết nối stream đang mở)"""
+    return {"status": "healthy", "broker": notification_broker.stats()}
+
+@app.get("/api/health/permissions")
+async def permissions_health():
+    """Registry phân quyền trong bộ nhớ (đã nạp chưa, số role/permission/user)"""
+    return {"status": "healthy", "permissions": permission_registry.stats()}
+
+@app.on_event("startup")
+async def start_audit_writer():
+    if settings.AUDIT_LOG_ENABLED:
+        audit_writer.start()
+
+@app.on_event("startup")
+async def start_notification_broker():
+    await notification_broker.start()
+
+@app.on_event("shutdown")
+async def flush_audit_writer():
+    await audit_writer.stop()
+
+@app.on_event("shutdown")
+async def stop_notification_broker():
+    await notification_broker.stop()
+
+@app.on_event("shutdown")
+def close_supabase_pool():
+    supabase_registry.close()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,165 +1,172 @@
 """
 Audit Middleware
 Middleware để tự động log các hành động vào audit_logs
+
+Middleware ASGI thuần: request body được ghi lại khi nó đi qua (không đọc trước),
+response được stream thẳng cho client, còn bản ghi audit được đưa vào hàng đợi
+của services.audit_writer để ghi theo batch ở background.
 """
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse
-from typing import Callable
 import json
-import time
 from datetime import datetime
-from supabase import Client
-from database import get_db
-
-class AuditMiddleware(BaseHTTPMiddleware):
-    """Middleware để log các request vào audit_logs"""
-    
-    def __init__(self, app, supabase: Client):
-        super().__init__(app)
-        self.supabase = supabase
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Bỏ qua một số endpoints không cần log
-        skip_paths = ['/health', '/api/health', '/docs', '/openapi.json', '/redoc']
-        if any(request.url.path.startswith(path) for path in skip_paths):
-            return await call_next(request)
-        
-        # Chỉ log các method quan trọng
-        if request.method not in ['POST', 'PUT', 'DELETE', 'PATCH']:
-            return await call_next(request)
-        
-        start_time = time.time()
-        
-        # Lấy thông tin user từ request (nếu có)
-        user_id = None
-        try:
-            # Lấy token từ header
-            auth_header = request.headers.get('Authorization', '')
-            if auth_header.startswith('Bearer '):
-                token = auth_header.replace('Bearer ', '')
-                # Decode token để lấy user_id (simplified - trong thực tế cần verify token)
-                # Tạm thời để None, sẽ được set trong router nếu cần
-                pass
-        except:
-            pass
-        
-        # Lấy request body (nếu có)
-        request_body = None
-        try:
-            if request.method in ['POST', 'PUT', 'PATCH']:
-                body = await request.body()
-                if body:
-                    request_body = json.loads(body.decode())
-        except:
-            pass
-        
-        # Gọi next middleware/handler
-        response = await call_next(request)
-        
-        # Tính thời gian xử lý
-        process_time = int((time.time() - start_time) * 1000)
-        
-        # Xác định action và resource_type từ path
-        path = request.url.path
-        method = request.method
-        
-        action = None
-        resource_type = None
-        
-        # Parse path để xác định resource_type
-        if '/api/teachers' in path:
-            resource_type = 'teachers'
-        elif '/api/students' in path:
-            resource_type = 'students'
-        elif '/api/subjects' in path:
-            resource_type = 'subjects'
-        elif '/api/classrooms' in path:
-            resource_type = 'classrooms'
-        elif '/api/finances' in path:
-            resource_type = 'finances'
-        elif '/api/assignments' in path:
-            resource_type = 'assignments'
-        elif '/api/attendances' in path:
-            resource_type = 'attendances'
-        elif '/api/auth' in path:
-            resource_type = 'auth'
-            if 'login' in path:
-                action = 'login'
-            elif 'logout' in path:
-                action = 'logout'
-        else:
-            resource_type = 'other'
-        
-        # Xác định action từ method
-        if not action:
-            if method == 'POST':
-                action = 'create'
-            elif method == 'PUT' or method == 'PATCH':
-                action = 'update'
-            elif method == 'DELETE':
-                action = 'delete'
-        
-        # Lấy resource_id từ path (nếu có)
-        resource_id = None
-        path_parts = path.strip('/').split('/')
-        for i, part in enumerate(path_parts):
-            if part in ['teachers', 'students', 'subjects', 'classrooms', 'finances', 'assignments', 'attendances']:
-                if i + 1 < len(path_parts):
-                    potential_id = path_parts[i + 1]
-                    # Kiểm tra xem có phải UUID không (simplified check)
-                    if len(potential_id) > 20:
-                        resource_id = potential_id
-                        break
-        
-        # Lấy response body (nếu có)
-        response_body = None
-        try:
-            if hasattr(response, 'body'):
-                body_bytes = b''
-                async for chunk in response.body_iterator:
-                    body_bytes += chunk
-                if body_bytes:
-                    response_body = json.loads(body_bytes.decode())
-                # Tạo lại response với body
-                response = Response(
-                    content=body_bytes,
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                    media_type=response.media_type
-                )
-        except:
-            pass
-        
-        # Log vào audit_logs (async, không block response)
+from typing import Any, Dict, Optional
+
+from config import settings
+from database import Database
+from services.audit_writer import AuditLogWriter, audit_writer
+
+SKIP_PATHS = ['/health', '/api/health', '/docs', '/openapi.json', '/redoc']
+AUDITED_METHODS = {'POST', 'PUT', 'DELETE', 'PATCH'}
+RESOURCE_TYPES = ['teachers', 'students', 'subjects', 'classrooms', 'finances', 'assignments', 'attendances']
+
+
+def _resource_type(path: str) -> str:
+    for resource in RESOURCE_TYPES:
+        if f'/api/{resource}' in path:
+            return resource
+    if '/api/auth' in path:
+        return 'auth'
+    return 'other'
+
+
+def _action(path: str, method: str) -> Optional[str]:
+    if '/api/auth' in path:
+        if 'login' in path:
+            return 'login'
+        if 'logout' in path:
+            return 'logout'
+    if method == 'POST':
+        return 'create'
+    if method in ('PUT', 'PATCH'):
+        return 'update'
+    if method == 'DELETE':
+        return 'delete'
+    return None
+
+
+def _resource_id(path: str) -> Optional[str]:
+    path_parts = path.strip('/').split('/')
+    for i, part in enumerate(path_parts):
+        if part in RESOURCE_TYPES and i + 1 < len(path_parts):
+            potential_id = path_parts[i + 1]
+            # Kiểm tra xem có phải UUID không (simplified check)
+            if len(potential_id) > 20:
+                return potential_id
+    return None
+
+
+def _redact(values: Any) -> Any:
+    """Không lưu mật khẩu vào audit log"""
+    if isinstance(values, dict):
+        return {k: ('***' if 'password' in str(k).lower() else _redact(v)) for k, v in values.items()}
+    if isinstance(values, list):
+        return [_redact(v) for v in values]
+    return values
+
+
+def _parse_json(body: bytes) -> Any:
+    if not body:
+        return None
+    try:
+        return json.loads(body.decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class AuditMiddleware:
+    """Middleware để log các request ghi dữ liệu vào audit_logs"""
+
+    def __init__(
+        self,
+        app,
+        supabase=None,
+        writer: Optional[AuditLogWriter] = None,
+        capture_response_body: Optional[bool] = None,
+        max_body_bytes: Optional[int] = None,
+    ):
+        self.app = app
+        self.writer = writer or audit_writer
+        if supabase is not None:
+            self.writer.bind(supabase if isinstance(supabase, Database) else Database(supabase))
+        self.capture_response_body = (
+            settings.AUDIT_CAPTURE_RESPONSE_BODY if capture_response_body is None else capture_response_body
+        )
+        self.max_body_bytes = settings.AUDIT_MAX_BODY_BYTES if max_body_bytes is None else max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('method') not in AUDITED_METHODS:
+            await self.app(scope, receive, send)
+            return
+        path = scope.get('path', '')
+        if any(path.startswith(skip) for skip in SKIP_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        request_body = bytearray()
+        request_body_truncated = False
+        response_body = bytearray()
+        response_status = {'code': 500}
+
+        async def receive_wrapper():
+            nonlocal request_body_truncated
+            message = await receive()
+            if message['type'] == 'http.request' and not request_body_truncated:
+                chunk = message.get('body', b'')
+                if len(request_body) + len(chunk) > self.max_body_bytes:
+                    request_body_truncated = True
+                    request_body.clear()
+                else:
+                    request_body.extend(chunk)
+            return message
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response_status['code'] = message['status']
+            elif (
+                message['type'] == 'http.response.body'
+                and self.capture_response_body
+                and response_status['code'] >= 400
+                and len(response_body) < self.max_body_bytes
+            ):
+                response_body.extend(message.get('body', b'')[:self.max_body_bytes - len(response_body)])
+            await send(message)
+
         try:
-            log_data = {
-                'user_id': user_id,
-                'action': action,
-                'resource_type': resource_type,
-                'resource_id': resource_id,
-                'old_values': None,  # Có thể lấy từ database nếu là update/delete
-                'new_values': request_body if request_body else None,
-                'ip_address': request.client.host if request.client else None,
-                'user_agent': request.headers.get('user-agent'),
-                'request_method': method,
-                'request_path': path,
-                'status_code': response.status_code,
-                'error_message': None,
-                'created_at': datetime.now().isoformat()
-            }
-            
-            # Insert vào database (async, không await để không block)
-            # Trong production nên dùng background task
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
             try:
-                self.supabase.table('audit_logs').insert(log_data).execute()
+                await self.writer.submit(self._build_record(
+                    scope, path, response_status['code'],
+                    None if request_body_truncated else bytes(request_body),
+                    bytes(response_body),
+                ))
             except Exception as e:
-                # Log error nhưng không fail request
-                print(f"Error logging audit: {str(e)}")
-        except Exception as e:
-            # Không fail request nếu audit log fail
-            print(f"Error in audit middleware: {str(e)}")
-        
-        return response
+                # Không fail request nếu audit log fail
+                print(f"Error in audit middleware: {str(e)}")
+
+    def _build_record(self, scope, path: str, status_code: int, request_body: Optional[bytes], response_body: bytes) -> Dict[str, Any]:
+        method = scope['method']
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        client = scope.get('client')
+
+        error_message = None
+        parsed = _parse_json(response_body)
+        if parsed is not None:
+            detail = parsed.get('detail', parsed) if isinstance(parsed, dict) else parsed
+            error_message = detail if isinstance(detail, str) else json.dumps(detail, ensure_ascii=False, default=str)
 
+        return {
+            'user_id': None,  # Token chưa được verify ở tầng middleware
+            'action': _action(path, method),
+            'resource_type': _resource_type(path),
+            'resource_id': _resource_id(path),
+            'old_values': None,
+            'new_values': _redact(_parse_json(request_body)),
+            'ip_address': client[0] if client else None,
+            'user_agent': headers.get('user-agent'),
+            'request_method': method,
+            'request_path': path,
+            'status_code': status_code,
+            'error_message': error_message,
+            'created_at': datetime.now().isoformat()
+        }
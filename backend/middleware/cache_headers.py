@@ -19,8 +19,8 @@ class CacheHeadersMiddleware(BaseHTTPMiddleware):
         
         # Cache API GET responses for 60 seconds
         elif request.method == "GET" and request.url.path.startswith("/api/"):
-            # Don't cache auth endpoints
-            if "/api/auth/" not in request.url.path:
+            # Don't cache auth endpoints; giữ Cache-Control do endpoint tự đặt
+            if "/api/auth/" not in request.url.path and "cache-control" not in response.headers:
                 response.headers["Cache-Control"] = "public, max-age=60"
                 response.headers["Vary"] = "Accept, Authorization"
         
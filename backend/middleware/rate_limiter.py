@@ -1,84 +1,340 @@
 """
 Rate Limiting Middleware
-Simple in-memory rate limiter (for production, use Redis)
+Sliding-window counter rate limiter
+
+Mỗi client (theo nhóm route) chỉ giữ 3 số: đầu cửa sổ hiện tại, số request trong
+cửa sổ hiện tại và trong cửa sổ trước. Số request ước lượng trong 60s gần nhất
+= prev * (phần còn lại của cửa sổ trước) + current, nên mỗi request tốn O(1).
+
+Storage có thể thay thế:
+- memory: trong process, LRU giới hạn số client (mặc định)
+- sqlite: dùng chung giữa các worker uvicorn trên cùng một máy
+- redis: dùng chung giữa nhiều máy (cần `pip install redis`, hoạt động với mọi
+  server tương thích Redis)
 """
 
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from collections import defaultdict
-from datetime import datetime, timedelta
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
 import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from config import settings
+
+# (window_start, current_count, previous_count)
+WindowState = Tuple[float, int, int]
+
+
+@dataclass
+class RateLimitRule:
+    """Giới hạn riêng cho một nhóm route (khớp theo prefix của path)"""
+    name: str
+    requests_per_minute: int
+    prefixes: Tuple[str, ...] = ()
+    methods: Optional[Tuple[str, ...]] = None
+
+    def matches(self, path: str, method: str) -> bool:
+        if self.methods and method not in self.methods:
+            return False
+        return any(path.startswith(prefix) for prefix in self.prefixes)
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_at: float
+    retry_after: float
+
+
+def sliding_window_hit(state: Optional[WindowState], now: float, limit: int, window: float) -> Tuple[WindowState, RateLimitResult]:
+    """Áp một request vào state của sliding-window counter"""
+    window_start = math.floor(now / window) * window
+    current, previous = 0, 0
+    if state is not None:
+        if state[0] == window_start:
+            current, previous = state[1], state[2]
+        elif state[0] == window_start - window:
+            previous = state[1]
+
+    elapsed = now - window_start
+    estimated = previous * (window - elapsed) / window + current
+    reset_at = window_start + window
+
+    if estimated + 1 > limit:
+        if current + 1 > limit or previous == 0:
+            retry_after = reset_at - now
+        else:
+            # Thời điểm phần đóng góp của cửa sổ trước giảm đủ để nhận thêm 1 request
+            retry_after = max(0.0, window - (limit - current - 1) * window / previous - elapsed)
+        result = RateLimitResult(False, limit, 0, reset_at, retry_after)
+        return (window_start, current, previous), result
+
+    current += 1
+    remaining = max(0, int(limit - estimated - 1))
+    return (window_start, current, previous), RateLimitResult(True, limit, remaining, reset_at, 0.0)
+
+
+class RateLimitStore(ABC):
+    """Storage interface: áp một request cho `key` và trả về kết quả"""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Storage trong process; bỏ client ít dùng nhất khi vượt `max_keys`"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._states: "OrderedDict[str, WindowState]" = OrderedDict()
+        self.evictions = 0
+
+    async def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        state, result = sliding_window_hit(self._states.get(key), time.time(), limit, window)
+        self._states[key] = state
+        self._states.move_to_end(key)
+        if len(self._states) > self.max_keys:
+            self._states.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._states), "max_keys": self.max_keys, "evictions": self.evictions}
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Storage dùng chung giữa các worker trên cùng một máy (file SQLite, WAL)"""
+
+    _PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            " key TEXT PRIMARY KEY, window_start REAL NOT NULL,"
+            " current_count INTEGER NOT NULL, previous_count INTEGER NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _hit_sync(self, key: str, limit: int, window: float) -> RateLimitResult:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT window_start, current_count, previous_count FROM rate_limits WHERE key = ?", (key,)
+            ).fetchone()
+            state, result = sliding_window_hit(tuple(row) if row else None, now, limit, window)
+            conn.execute(
+                "INSERT INTO rate_limits (key, window_start, current_count, previous_count) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET window_start = excluded.window_start,"
+                " current_count = excluded.current_count, previous_count = excluded.previous_count",
+                (key, *state),
+            )
+            self._hits += 1
+            if self._hits % self._PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE window_start < ?", (now - 2 * window,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
 
-class RateLimiterMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, requests_per_minute: int = 60):
-        super().__init__(app)
+    async def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        return await asyncio.to_thread(self._hit_sync, key, limit, window)
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "path": self.path}
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """Storage dùng chung qua Redis (hoặc server tương thích: Valkey, KeyDB, Dragonfly...)"""
+
+    # Cùng thuật toán với sliding_window_hit, chạy nguyên tử trong Redis
+    _SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local limit = tonumber(ARGV[2])
+    local window = tonumber(ARGV[3])
+    local window_start = math.floor(now / window) * window
+    local state = redis.call('HMGET', KEYS[1], 'ws', 'cur', 'prev')
+    local current, previous = 0, 0
+    local ws = tonumber(state[1])
+    if ws == window_start then
+        current = tonumber(state[2]) or 0
+        previous = tonumber(state[3]) or 0
+    elseif ws == window_start - window then
+        previous = tonumber(state[2]) or 0
+    end
+    local elapsed = now - window_start
+    local estimated = previous * (window - elapsed) / window + current
+    local allowed = 0
+    if estimated + 1 <= limit then
+        current = current + 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'ws', window_start, 'cur', current, 'prev', previous)
+    redis.call('EXPIRE', KEYS[1], math.ceil(window * 2))
+    return {allowed, tostring(estimated), tostring(window_start), current, previous}
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis cần package `redis` (pip install redis)") from e
+        self.url = url
+        self.prefix = prefix
+        self._redis = redis_asyncio.from_url(url)
+        self._script = self._redis.register_script(self._SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> RateLimitResult:
+        now = time.time()
+        allowed, estimated, window_start, current, previous = await self._script(
+            keys=[self.prefix + key], args=[now, limit, window]
+        )
+        estimated, window_start = float(estimated), float(window_start)
+        reset_at = window_start + window
+        if allowed:
+            return RateLimitResult(True, limit, max(0, int(limit - estimated - 1)), reset_at, 0.0)
+        # Tính retry_after giống sliding_window_hit
+        _, result = sliding_window_hit((window_start, int(current), int(previous)), now, limit, window)
+        return result
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+def create_store(backend: Optional[str] = None) -> RateLimitStore:
+    """Tạo storage theo RATE_LIMIT_BACKEND"""
+    backend = (backend or settings.RATE_LIMIT_BACKEND).lower()
+    if backend == "sqlite":
+        path = settings.RATE_LIMIT_SQLITE_PATH or os.path.join(tempfile.gettempdir(), "school-management-ratelimit.db")
+        return SQLiteRateLimitStore(path)
+    if backend == "redis":
+        return RedisRateLimitStore(settings.RATE_LIMIT_REDIS_URL)
+    return MemoryRateLimitStore(settings.RATE_LIMIT_MAX_KEYS)
+
+
+def default_rules() -> List[RateLimitRule]:
+    """Các nhóm route có giới hạn riêng (login, báo cáo nặng)"""
+    return [
+        RateLimitRule("login", settings.RATE_LIMIT_LOGIN_PER_MINUTE, ("/api/auth/login", "/api/auth/register"), ("POST",)),
+        RateLimitRule("reports", settings.RATE_LIMIT_REPORTS_PER_MINUTE, ("/api/reports",)),
+    ]
+
+
+class RateLimiterMiddleware:
+    """ASGI middleware giới hạn số request mỗi phút cho mỗi client và nhóm route"""
+
+    SKIP_PATHS = ("/health", "/api/health")
+
+    def __init__(
+        self,
+        app,
+        requests_per_minute: int = 60,
+        store: Optional[RateLimitStore] = None,
+        rules: Optional[Iterable[RateLimitRule]] = None,
+        window_seconds: float = 60.0,
+    ):
+        self.app = app
         self.requests_per_minute = requests_per_minute
-        self.requests = defaultdict(list)
-        self.cleanup_interval = 60  # Clean up old entries every 60 seconds
-        self.last_cleanup = time.time()
-    
-    def _cleanup_old_entries(self):
-        """Remove entries older than 1 minute"""
-        current_time = time.time()
-        if current_time - self.last_cleanup < self.cleanup_interval:
-            return
-        
-        cutoff_time = current_time - 60
-        for key in list(self.requests.keys()):
-            self.requests[key] = [
-                req_time for req_time in self.requests[key]
-                if req_time > cutoff_time
-            ]
-            if not self.requests[key]:
-                del self.requests[key]
-        
-        self.last_cleanup = current_time
-    
-    def _get_client_id(self, request: Request) -> str:
-        """Get client identifier (IP address or user ID)"""
-        # Try to get user ID from request if authenticated
-        if hasattr(request.state, 'user') and request.state.user:
-            return f"user:{request.state.user.id}"
-        
-        # Fallback to IP address
-        client_ip = request.client.host if request.client else "unknown"
+        self.window = window_seconds
+        self.store = store or create_store()
+        self.rules = list(default_rules() if rules is None else rules)
+
+    def _get_client_id(self, scope) -> str:
+        """Get client identifier (IP address)"""
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
         return f"ip:{client_ip}"
-    
-    async def dispatch(self, request: Request, call_next):
+
+    def _match_rule(self, path: str, method: str) -> Tuple[str, int]:
+        for rule in self.rules:
+            if rule.matches(path, method):
+                return rule.name, rule.requests_per_minute
+        return "default", self.requests_per_minute
+
+    async def check(self, scope, path: Optional[str] = None, method: Optional[str] = None) -> Optional[RateLimitResult]:
+        """Tính một request của client trong `scope` vào nhóm route của `path`
+        (mặc định path của scope). None nếu path không bị giới hạn hoặc storage lỗi.
+
+        Cũng dùng cho sub-request của /api/batch (không đi qua middleware)."""
+        path = scope.get("path", "") if path is None else path
         # Skip rate limiting for health checks
-        if request.url.path in ["/health", "/api/health"]:
-            return await call_next(request)
-        
-        # Cleanup old entries periodically
-        self._cleanup_old_entries()
-        
-        # Get client identifier
-        client_id = self._get_client_id(request)
-        current_time = time.time()
-        
-        # Remove requests older than 1 minute
-        cutoff_time = current_time - 60
-        self.requests[client_id] = [
-            req_time for req_time in self.requests[client_id]
-            if req_time > cutoff_time
+        if path in self.SKIP_PATHS or path.startswith("/api/health/"):
+            return None
+        group, limit = self._match_rule(path, method or scope.get("method", "GET"))
+        try:
+            return await self.store.hit(f"{group}:{self._get_client_id(scope)}", limit, self.window)
+        except Exception as e:
+            # Storage lỗi (vd: Redis mất kết nối) thì không chặn request
+            print(f"[rate_limiter] Storage error, allowing request: {e}")
+            return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Route bên trong (vd: /api/batch) tìm limiter qua scope
+        scope["rate_limiter"] = self
+        result = await self.check(scope)
+        if result is None:
+            await self.app(scope, receive, send)
+            return
+        limit = result.limit
+
+        headers = [
+            (b"x-ratelimit-limit", str(result.limit).encode()),
+            (b"x-ratelimit-remaining", str(result.remaining).encode()),
+            (b"x-ratelimit-reset", str(int(result.reset_at)).encode()),
         ]
-        
-        # Check rate limit
-        if len(self.requests[client_id]) >= self.requests_per_minute:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Rate limit exceeded: {self.requests_per_minute} requests per minute"
-            )
-        
-        # Record this request
-        self.requests[client_id].append(current_time)
-        
-        # Add rate limit headers
-        response = await call_next(request)
-        remaining = self.requests_per_minute - len(self.requests[client_id])
-        response.headers["X-RateLimit-Limit"] = str(self.requests_per_minute)
-        response.headers["X-RateLimit-Remaining"] = str(remaining)
-        response.headers["X-RateLimit-Reset"] = str(int(current_time + 60))
-        
-        return response
 
+        if not result.allowed:
+            body = json.dumps({
+                "detail": f"Rate limit exceeded: {limit} requests per minute"
+            }).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(result.retry_after))).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
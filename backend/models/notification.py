@@ -8,32 +8,44 @@ from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class NotificationCreate(BaseModel):
+    recipient_type: str = "teacher"  # teacher, student
+    teacher_id: Optional[str] = None
+    student_id: Optional[str] = None
+    classroom_id: Optional[str] = None
+    type: str = "general"  # general, attendance_request, ...
     title: str
     message: str
-    notification_type: str = "info"  # info, success, warning, error, system
-    target_type: str  # user, role, classroom, all
-    target_id: Optional[str] = None
-    action_url: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = {}
-    expires_at: Optional[str] = None
+    priority: str = "normal"  # low, normal, high, urgent
 
 class NotificationUpdate(BaseModel):
-    is_read: Optional[bool] = None
+    read: Optional[bool] = None
 
 class NotificationResponse(BaseModel):
     id: str
+    recipient_type: Optional[str] = None
+    teacher_id: Optional[str] = None
+    student_id: Optional[str] = None
+    classroom_id: Optional[str] = None
+    type: Optional[str] = None
     title: str
     message: str
-    notification_type: str
-    target_type: str
-    target_id: Optional[str]
-    is_read: bool
-    read_at: Optional[str]
-    action_url: Optional[str]
-    metadata: Dict[str, Any]
-    created_by: Optional[str]
-    created_at: str
-    expires_at: Optional[str]
+    priority: Optional[str] = None
+    read: bool = False
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    # Thông báo gửi qua /send (target_type/target_id)
+    notification_type: Optional[str] = None
+    target_type: Optional[str] = None
+    target_id: Optional[str] = None
+    action_url: Optional[str] = None
+    metadata: Optional[Dict[str, Any]] = None
+    expires_at: Optional[str] = None
+    # Thông tin người nhận được enrich
+    teacher_name: Optional[str] = None
+    student_name: Optional[str] = None
+    student_code: Optional[str] = None
+    classroom_name: Optional[str] = None
+    classroom_grade: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -76,3 +88,12 @@ class SendNotificationRequest(BaseModel):
     action_url: Optional[str] = None
     expires_at: Optional[str] = None
 
+
+class SendNotificationResponse(BaseModel):
+    status: str  # completed (đã gửi xong) hoặc queued (đang gửi ở background)
+    job_id: Optional[str] = None  # Xem tiến độ: GET /api/notifications/jobs/{job_id}
+    target_type: str
+    total_recipients: int
+    created: int = 0
+    failed: int = 0
+    notifications: List[NotificationResponse] = []
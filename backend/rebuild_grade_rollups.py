@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Tính lại bảng student_grade_rollups từ assignment_submissions (backfill)
+
+Chạy sau khi áp dụng student_grade_rollups_schema.sql, hoặc bất cứ khi nào rollup
+bị lệch so với dữ liệu gốc:
+
+    python rebuild_grade_rollups.py                 # toàn bộ học sinh
+    python rebuild_grade_rollups.py <student_id>... # chỉ một số học sinh
+"""
+
+import asyncio
+import sys
+
+from database import get_database
+from services import grade_rollups
+
+
+async def main(student_ids):
+    supabase = get_database()
+    rows = await grade_rollups.rebuild(supabase, student_ids or None)
+    scope = f"{len(student_ids)} học sinh" if student_ids else "toàn bộ học sinh"
+    print(f"Đã tính lại rollup điểm cho {scope}: {rows} dòng")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(sys.argv[1:]))
+    except Exception as e:
+        print(f"ERROR: Không thể tính lại rollup điểm: {e}")
+        sys.exit(1)
@@ -7,18 +7,34 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from models.user import User, UserRole
 from routers.auth import get_current_user
+from services.relations import fetch_in_paged, load_related
+from services.paging import stream_rows
+from services import grade_rollups
+from services.grades import aggregate_scores, calculate_grade_classification, empty_score_totals, score_summary
 
 router = APIRouter()
 
-def get_teacher_id_from_user(supabase: Client, user_id: str) -> Optional[str]:
+async def attach_classroom_ids(supabase: Database, assignments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gắn classroom_ids cho cả danh sách assignments bằng một query assignment_classrooms"""
+    links = await load_related(
+        supabase,
+        "assignment_classrooms",
+        "assignment_id",
+        [a["id"] for a in assignments],
+        "assignment_id, classroom_id"
+    )
+    for assignment in assignments:
+        assignment["classroom_ids"] = [item["classroom_id"] for item in links.get(assignment["id"], [])]
+    return assignments
+
+async def get_teacher_id_from_user(supabase: Database, user_id: str) -> Optional[str]:
     """Lấy teacher_id từ user_id"""
     try:
-        result = supabase.table("teachers").select("id").eq("user_id", user_id).execute()
+        result = await supabase.table("teachers").select("id").eq("user_id", user_id).execute()
         if result.data and len(result.data) > 0:
             return result.data[0]["id"]
         return None
@@ -26,8 +42,8 @@ def get_teacher_id_from_user(supabase: Client, user_id: str) -> Optional[str]:
         print(f"Error getting teacher_id: {e}")
         return None
 
-def validate_classrooms_belong_to_teacher(
-    supabase: Client, 
+async def validate_classrooms_belong_to_teacher(
+    supabase: Database, 
     classroom_ids: List[str], 
     teacher_id: str
 ) -> bool:
@@ -37,7 +53,7 @@ def validate_classrooms_belong_to_teacher(
     
     try:
         # Lấy tất cả classrooms (bao gồm is_template)
-        result = supabase.table("classrooms").select("id, teacher_id, is_template").in_("id", classroom_ids).execute()
+        result = await supabase.table("classrooms").select("id, teacher_id, is_template").in_("id", classroom_ids).execute()
         classrooms = result.data or []
         
         # Kiểm tra số lượng (đảm bảo tất cả classroom_ids đều tồn tại)
@@ -58,8 +74,8 @@ def validate_classrooms_belong_to_teacher(
         print(f"Error validating classrooms: {e}")
         return False
 
-def validate_assignment_access(
-    supabase: Client,
+async def validate_assignment_access(
+    supabase: Database,
     assignment_id: str,
     current_user: User
 ) -> bool:
@@ -72,12 +88,12 @@ def validate_assignment_access(
     
     if current_user.role == UserRole.TEACHER:
         # Lấy teacher_id từ user
-        teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+        teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
         if not teacher_id:
             return False
         
         # Kiểm tra assignment có thuộc về giáo viên này không
-        assignment_result = supabase.table("assignments").select("teacher_id").eq("id", assignment_id).execute()
+        assignment_result = await supabase.table("assignments").select("teacher_id").eq("id", assignment_id).execute()
         if not assignment_result.data:
             return False
         
@@ -181,7 +197,7 @@ class AssignmentSubmissionResponse(BaseModel):
 async def create_assignment(
     assignment_data: AssignmentCreate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo bài tập mới (chỉ giáo viên)"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -194,7 +210,7 @@ async def create_assignment(
         # Lấy teacher_id từ current_user
         teacher_id = None
         if current_user.role == UserRole.TEACHER:
-            teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+            teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
             if not teacher_id:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -208,7 +224,7 @@ async def create_assignment(
         
         # Validate các lớp học phải thuộc về giáo viên này
         if assignment_data.classroom_ids and teacher_id:
-            if not validate_classrooms_belong_to_teacher(supabase, assignment_data.classroom_ids, teacher_id):
+            if not await validate_classrooms_belong_to_teacher(supabase, assignment_data.classroom_ids, teacher_id):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Bạn chỉ có thể gán bài tập cho các lớp mà bạn đang dạy"
@@ -247,7 +263,7 @@ async def create_assignment(
             "is_active": True
         }
         
-        result = supabase.table("assignments").insert(assignment_dict).execute()
+        result = await supabase.table("assignments").insert(assignment_dict).execute()
         
         if not result.data:
             raise HTTPException(
@@ -264,13 +280,10 @@ async def create_assignment(
                 {"assignment_id": assignment_id, "classroom_id": class_id}
                 for class_id in assignment_data.classroom_ids
             ]
-            supabase.table("assignment_classrooms").insert(classroom_assignments).execute()
-        
-        # Lấy danh sách lớp được gán
-        class_result = supabase.table("assignment_classrooms").select("classroom_id").eq("assignment_id", assignment_id).execute()
-        classroom_ids = [item["classroom_id"] for item in (class_result.data or [])]
+            await supabase.table("assignment_classrooms").insert(classroom_assignments).execute()
         
-        assignment["classroom_ids"] = classroom_ids
+        # Danh sách lớp được gán chính là danh sách vừa insert
+        assignment["classroom_ids"] = list(dict.fromkeys(assignment_data.classroom_ids))
         return AssignmentResponse(**assignment)
         
     except Exception as e:
@@ -288,7 +301,7 @@ async def get_assignments(
     teacher_id: Optional[str] = Query(None),
     assignment_type: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách bài tập
     - Admin: có thể xem tất cả hoặc filter theo teacher_id
@@ -297,7 +310,7 @@ async def get_assignments(
     try:
         # Tự động filter theo teacher_id nếu là giáo viên
         if current_user.role == UserRole.TEACHER:
-            teacher_id_from_user = get_teacher_id_from_user(supabase, current_user.id)
+            teacher_id_from_user = await get_teacher_id_from_user(supabase, current_user.id)
             if not teacher_id_from_user:
                 return []
             # Override teacher_id từ query param nếu có
@@ -311,7 +324,7 @@ async def get_assignments(
         # Nếu filter theo classroom_id, cần join với assignment_classrooms
         if classroom_id:
             # Lấy danh sách assignment_id từ assignment_classrooms
-            class_result = supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
+            class_result = await supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
             assignment_ids = [item["assignment_id"] for item in (class_result.data or [])]
             
             if not assignment_ids:
@@ -328,14 +341,12 @@ async def get_assignments(
         if assignment_type:
             query = query.eq("assignment_type", assignment_type)
         
-        result = query.order("created_at", desc=True).range(skip, skip + limit - 1).execute()
+        result = await query.order("created_at", desc=True).range(skip, skip + limit - 1).execute()
         
         assignments = result.data or []
         
-        # Lấy danh sách lớp cho mỗi assignment
-        for assignment in assignments:
-            class_result = supabase.table("assignment_classrooms").select("classroom_id").eq("assignment_id", assignment["id"]).execute()
-            assignment["classroom_ids"] = [item["classroom_id"] for item in (class_result.data or [])]
+        # Lấy danh sách lớp cho cả trang trong một query
+        await attach_classroom_ids(supabase, assignments)
         
         return [AssignmentResponse(**a) for a in assignments]
         
@@ -349,11 +360,11 @@ async def get_assignments(
 async def get_assignment(
     assignment_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin một bài tập"""
     try:
-        result = supabase.table("assignments").select("*").eq("id", assignment_id).execute()
+        result = await supabase.table("assignments").select("*").eq("id", assignment_id).execute()
         
         if not result.data:
             raise HTTPException(
@@ -364,8 +375,7 @@ async def get_assignment(
         assignment = result.data[0]
         
         # Lấy danh sách lớp được gán
-        class_result = supabase.table("assignment_classrooms").select("classroom_id").eq("assignment_id", assignment_id).execute()
-        assignment["classroom_ids"] = [item["classroom_id"] for item in (class_result.data or [])]
+        await attach_classroom_ids(supabase, [assignment])
         
         return AssignmentResponse(**assignment)
         
@@ -383,7 +393,7 @@ async def update_assignment(
     assignment_id: str,
     assignment_data: AssignmentUpdate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật bài tập (chỉ giáo viên)"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -394,7 +404,7 @@ async def update_assignment(
     
     try:
         # Kiểm tra assignment có tồn tại không và lấy teacher_id
-        check_result = supabase.table("assignments").select("id, teacher_id").eq("id", assignment_id).execute()
+        check_result = await supabase.table("assignments").select("id, teacher_id").eq("id", assignment_id).execute()
         if not check_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -405,7 +415,7 @@ async def update_assignment(
         
         # Kiểm tra quyền: giáo viên chỉ có thể sửa bài tập của mình
         if current_user.role == UserRole.TEACHER:
-            teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+            teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
             if not teacher_id:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -420,7 +430,7 @@ async def update_assignment(
         # Validate start_date < due_date nếu cả hai đều có giá trị
         if assignment_data.start_date is not None or assignment_data.due_date is not None:
             # Lấy giá trị hiện tại từ database nếu không được cung cấp
-            current_assignment = supabase.table("assignments").select("start_date, due_date").eq("id", assignment_id).execute()
+            current_assignment = await supabase.table("assignments").select("start_date, due_date").eq("id", assignment_id).execute()
             if current_assignment.data:
                 current_start = current_assignment.data[0].get("start_date")
                 current_due = current_assignment.data[0].get("due_date")
@@ -446,7 +456,7 @@ async def update_assignment(
         
         # Cập nhật
         update_dict = assignment_data.dict(exclude_unset=True)
-        result = supabase.table("assignments").update(update_dict).eq("id", assignment_id).execute()
+        result = await supabase.table("assignments").update(update_dict).eq("id", assignment_id).execute()
         
         if not result.data:
             raise HTTPException(
@@ -456,9 +466,12 @@ async def update_assignment(
         
         assignment = result.data[0]
         
+        # Đổi môn thì rollup điểm của các bài đã nộp phải tính lại
+        if "subject_id" in update_dict:
+            await grade_rollups.rebuild_for_assignment(supabase, assignment_id)
+        
         # Lấy danh sách lớp được gán
-        class_result = supabase.table("assignment_classrooms").select("classroom_id").eq("assignment_id", assignment_id).execute()
-        assignment["classroom_ids"] = [item["classroom_id"] for item in (class_result.data or [])]
+        await attach_classroom_ids(supabase, [assignment])
         
         return AssignmentResponse(**assignment)
         
@@ -475,7 +488,7 @@ async def update_assignment(
 async def delete_assignment(
     assignment_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa bài tập (chỉ giáo viên)"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -485,8 +498,13 @@ async def delete_assignment(
         )
     
     try:
+        # Học sinh có bài nộp (submissions bị xóa theo cascade) cần tính lại rollup điểm
+        affected_students = await grade_rollups.students_with_submissions(supabase, assignment_id)
+        
         # Xóa assignment (cascade sẽ xóa assignment_classrooms và assignment_questions)
-        result = supabase.table("assignments").delete().eq("id", assignment_id).execute()
+        result = await supabase.table("assignments").delete().eq("id", assignment_id).execute()
+        
+        await grade_rollups.rebuild_for_assignment(supabase, assignment_id, affected_students)
         
         return {"message": "Assignment deleted successfully"}
         
@@ -504,7 +522,7 @@ async def assign_classrooms(
     assignment_id: str,
     classroom_ids: List[str],
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Gán bài tập cho các lớp học"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -515,7 +533,7 @@ async def assign_classrooms(
     
     try:
         # Kiểm tra assignment có tồn tại và thuộc về giáo viên này không
-        assignment_result = supabase.table("assignments").select("teacher_id").eq("id", assignment_id).execute()
+        assignment_result = await supabase.table("assignments").select("teacher_id").eq("id", assignment_id).execute()
         if not assignment_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -527,7 +545,7 @@ async def assign_classrooms(
         # Lấy teacher_id từ current_user
         teacher_id = None
         if current_user.role == UserRole.TEACHER:
-            teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+            teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
             if not teacher_id:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -544,14 +562,14 @@ async def assign_classrooms(
         
         # Validate các lớp học phải thuộc về giáo viên này
         if classroom_ids:
-            if not validate_classrooms_belong_to_teacher(supabase, classroom_ids, teacher_id):
+            if not await validate_classrooms_belong_to_teacher(supabase, classroom_ids, teacher_id):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Bạn chỉ có thể gán bài tập cho các lớp mà bạn đang dạy"
                 )
         
         # Xóa các gán cũ
-        supabase.table("assignment_classrooms").delete().eq("assignment_id", assignment_id).execute()
+        await supabase.table("assignment_classrooms").delete().eq("assignment_id", assignment_id).execute()
         
         # Thêm các gán mới
         if classroom_ids:
@@ -559,7 +577,9 @@ async def assign_classrooms(
                 {"assignment_id": assignment_id, "classroom_id": class_id}
                 for class_id in classroom_ids
             ]
-            supabase.table("assignment_classrooms").insert(classroom_assignments).execute()
+            await supabase.table("assignment_classrooms").insert(classroom_assignments).execute()
+        
+        await grade_rollups.rebuild_for_assignment(supabase, assignment_id)
         
         return {"message": "Classrooms assigned successfully"}
         
@@ -574,11 +594,11 @@ async def assign_classrooms(
 async def get_assignment_classrooms(
     assignment_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách lớp học được gán cho bài tập"""
     try:
-        result = supabase.table("assignment_classrooms").select("classroom_id").eq("assignment_id", assignment_id).execute()
+        result = await supabase.table("assignment_classrooms").select("classroom_id").eq("assignment_id", assignment_id).execute()
         classroom_ids = [item["classroom_id"] for item in (result.data or [])]
         return {"classroom_ids": classroom_ids}
         
@@ -593,7 +613,7 @@ async def add_question(
     assignment_id: str,
     question_data: AssignmentQuestionCreate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Thêm câu hỏi vào bài tập"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -604,7 +624,7 @@ async def add_question(
     
     try:
         # Kiểm tra assignment có tồn tại không
-        check_result = supabase.table("assignments").select("id").eq("id", assignment_id).execute()
+        check_result = await supabase.table("assignments").select("id").eq("id", assignment_id).execute()
         if not check_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -623,7 +643,7 @@ async def add_question(
             "attachment_link": question_data.attachment_link
         }
         
-        result = supabase.table("assignment_questions").insert(question_dict).execute()
+        result = await supabase.table("assignment_questions").insert(question_dict).execute()
         
         if not result.data:
             raise HTTPException(
@@ -646,11 +666,11 @@ async def add_question(
 async def get_questions(
     assignment_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách câu hỏi của bài tập"""
     try:
-        result = supabase.table("assignment_questions").select("*").eq("assignment_id", assignment_id).order("order_index").execute()
+        result = await supabase.table("assignment_questions").select("*").eq("assignment_id", assignment_id).order("order_index").execute()
         questions = result.data or []
         return [AssignmentQuestionResponse(**q) for q in questions]
         
@@ -664,7 +684,7 @@ async def update_question(
     question_id: str,
     question_data: AssignmentQuestionCreate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật câu hỏi"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -685,7 +705,7 @@ async def update_question(
             "attachment_link": question_data.attachment_link
         }
         
-        result = supabase.table("assignment_questions").update(update_dict).eq("id", question_id).eq("assignment_id", assignment_id).execute()
+        result = await supabase.table("assignment_questions").update(update_dict).eq("id", question_id).eq("assignment_id", assignment_id).execute()
         
         if not result.data:
             raise HTTPException(
@@ -709,7 +729,7 @@ async def delete_question(
     assignment_id: str,
     question_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa câu hỏi"""
     if current_user.role not in [UserRole.TEACHER, UserRole.ADMIN]:
@@ -719,7 +739,7 @@ async def delete_question(
         )
     
     try:
-        supabase.table("assignment_questions").delete().eq("id", question_id).eq("assignment_id", assignment_id).execute()
+        await supabase.table("assignment_questions").delete().eq("id", question_id).eq("assignment_id", assignment_id).execute()
         return {"message": "Question deleted successfully"}
         
     except Exception as e:
@@ -736,7 +756,7 @@ async def submit_assignment(
     assignment_id: str,
     submission_data: AssignmentSubmissionCreate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Nộp bài tập (chỉ học sinh) - với auto-grading cho multiple choice"""
     if current_user.role != UserRole.STUDENT:
@@ -747,7 +767,7 @@ async def submit_assignment(
     
     try:
         # Kiểm tra assignment có tồn tại không và lấy thông tin
-        assignment_result = supabase.table("assignments").select("*").eq("id", assignment_id).execute()
+        assignment_result = await supabase.table("assignments").select("*").eq("id", assignment_id).execute()
         if not assignment_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -768,7 +788,7 @@ async def submit_assignment(
                 )
         
         # Kiểm tra số lần nộp
-        existing_submissions = supabase.table("assignment_submissions").select("id, attempt_number").eq("assignment_id", assignment_id).eq("student_id", submission_data.student_id).execute()
+        existing_submissions = await supabase.table("assignment_submissions").select("id, attempt_number").eq("assignment_id", assignment_id).eq("student_id", submission_data.student_id).execute()
         attempts_allowed = assignment.get("attempts_allowed", 1)
         
         # Tính số lần đã làm (dựa trên số lượng submissions)
@@ -789,7 +809,7 @@ async def submit_assignment(
         
         if assignment["assignment_type"] == "multiple_choice":
             # Lấy danh sách câu hỏi và đáp án đúng
-            questions_result = supabase.table("assignment_questions").select("*").eq("assignment_id", assignment_id).execute()
+            questions_result = await supabase.table("assignment_questions").select("*").eq("assignment_id", assignment_id).execute()
             questions = questions_result.data or []
             
             if questions:
@@ -834,13 +854,13 @@ async def submit_assignment(
         submission_dict_with_attempt = {**submission_dict, "attempt_number": next_attempt_number}
         
         try:
-            result = supabase.table("assignment_submissions").insert(submission_dict_with_attempt).execute()
+            result = await supabase.table("assignment_submissions").insert(submission_dict_with_attempt).execute()
         except Exception as insert_error:
             # Nếu lỗi do cột attempt_number không tồn tại, thử insert không có attempt_number
             error_str = str(insert_error)
             if "attempt_number" in error_str.lower() or "42703" in error_str:
                 # Cột chưa tồn tại, insert không có attempt_number
-                result = supabase.table("assignment_submissions").insert(submission_dict).execute()
+                result = await supabase.table("assignment_submissions").insert(submission_dict).execute()
             else:
                 # Lỗi khác, ném lại
                 raise
@@ -851,6 +871,8 @@ async def submit_assignment(
                 detail="Failed to submit assignment"
             )
         
+        await grade_rollups.record_submission(supabase, submission_dict, first_attempt=attempts_used == 0)
+        
         return AssignmentSubmissionResponse(**result.data[0])
         
     except HTTPException:
@@ -866,7 +888,7 @@ async def submit_assignment(
 async def get_submissions(
     assignment_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách bài nộp
     - Admin: có thể xem tất cả
@@ -880,13 +902,13 @@ async def get_submissions(
     
     try:
         # Kiểm tra quyền truy cập assignment
-        if not validate_assignment_access(supabase, assignment_id, current_user):
+        if not await validate_assignment_access(supabase, assignment_id, current_user):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Bạn không có quyền truy cập assignment này"
             )
         
-        result = supabase.table("assignment_submissions").select("*").eq("assignment_id", assignment_id).order("submitted_at", desc=True).execute()
+        result = await supabase.table("assignment_submissions").select("*").eq("assignment_id", assignment_id).order("submitted_at", desc=True).execute()
         submissions = result.data or []
         # Ensure files and links are included in response
         for submission in submissions:
@@ -914,7 +936,7 @@ async def grade_submission(
     submission_id: str,
     grade_data: GradeSubmissionRequest,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Chấm điểm thủ công cho bài tập
     - Admin: có thể chấm điểm tất cả
@@ -930,14 +952,14 @@ async def grade_submission(
         from datetime import datetime
         
         # Kiểm tra quyền truy cập assignment
-        if not validate_assignment_access(supabase, assignment_id, current_user):
+        if not await validate_assignment_access(supabase, assignment_id, current_user):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Bạn không có quyền chấm điểm assignment này"
             )
         
         # Kiểm tra submission có tồn tại không
-        submission_result = supabase.table("assignment_submissions").select("*").eq("id", submission_id).eq("assignment_id", assignment_id).execute()
+        submission_result = await supabase.table("assignment_submissions").select("*").eq("id", submission_id).eq("assignment_id", assignment_id).execute()
         if not submission_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -952,7 +974,7 @@ async def grade_submission(
             "graded_at": datetime.now().isoformat()
         }
         
-        result = supabase.table("assignment_submissions").update(update_data).eq("id", submission_id).execute()
+        result = await supabase.table("assignment_submissions").update(update_data).eq("id", submission_id).execute()
         
         if not result.data:
             raise HTTPException(
@@ -960,6 +982,8 @@ async def grade_submission(
                 detail="Failed to grade submission"
             )
         
+        await grade_rollups.record_grade(supabase, submission_result.data[0], grade_data.score)
+        
         return {"message": "Submission graded successfully", "submission": result.data[0]}
         
     except HTTPException:
@@ -977,7 +1001,7 @@ async def grade_submission(
 async def get_assignment_statistics(
     assignment_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thống kê bài tập
     - Admin: có thể xem thống kê tất cả
@@ -991,14 +1015,14 @@ async def get_assignment_statistics(
     
     try:
         # Kiểm tra quyền truy cập assignment
-        if not validate_assignment_access(supabase, assignment_id, current_user):
+        if not await validate_assignment_access(supabase, assignment_id, current_user):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Bạn không có quyền xem thống kê assignment này"
             )
         
         # Lấy thông tin assignment
-        assignment_result = supabase.table("assignments").select("*").eq("id", assignment_id).execute()
+        assignment_result = await supabase.table("assignments").select("*").eq("id", assignment_id).execute()
         if not assignment_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -1013,27 +1037,9 @@ async def get_assignment_statistics(
         # Đếm tổng số học sinh trong các lớp
         total_students = 0
         if classroom_ids:
-            students_result = supabase.table("students").select("id").in_("classroom_id", classroom_ids).execute()
-            total_students = len(students_result.data or [])
-        
-        # Lấy danh sách submissions
-        submissions_result = supabase.table("assignment_submissions").select("*").eq("assignment_id", assignment_id).execute()
-        submissions = submissions_result.data or []
-        
-        # Tính toán thống kê
-        total_submissions = len(submissions)
-        graded_submissions = [s for s in submissions if s.get("is_graded")]
-        total_graded = len(graded_submissions)
-        
-        # Tính điểm trung bình
-        average_score = None
-        if graded_submissions:
-            scores = [s.get("score", 0) for s in graded_submissions if s.get("score") is not None]
-            if scores:
-                average_score = sum(scores) / len(scores)
-        
-        # Tính tỷ lệ hoàn thành
-        completion_rate = (total_submissions / total_students * 100) if total_students > 0 else 0
+            # Chỉ cần số lượng: count='exact' không bị giới hạn số dòng trả về
+            students_result = await supabase.table("students").select("id", count="exact").in_("classroom_id", classroom_ids).limit(1).execute()
+            total_students = students_result.count or 0
         
         # Phân phối điểm
         score_distribution = {
@@ -1044,9 +1050,22 @@ async def get_assignment_statistics(
             "poor": 0        # < 60
         }
         
-        for submission in graded_submissions:
+        # Đọc submissions theo trang và cộng dồn
+        total_submissions = 0
+        total_graded = 0
+        score_sum = 0.0
+        score_count = 0
+        async for submission in stream_rows(
+            lambda: supabase.table("assignment_submissions").select("id, is_graded, score").eq("assignment_id", assignment_id)
+        ):
+            total_submissions += 1
+            if not submission.get("is_graded"):
+                continue
+            total_graded += 1
             score = submission.get("score")
             if score is not None:
+                score_sum += score
+                score_count += 1
                 percentage = (score / assignment.get("total_points", 100)) * 100
                 if percentage >= 90:
                     score_distribution["excellent"] += 1
@@ -1058,7 +1077,13 @@ async def get_assignment_statistics(
                     score_distribution["below_average"] += 1
                 else:
                     score_distribution["poor"] += 1
-        
+
+        # Tính điểm trung bình
+        average_score = score_sum / score_count if score_count else None
+
+        # Tính tỷ lệ hoàn thành
+        completion_rate = (total_submissions / total_students * 100) if total_students > 0 else 0
+
         return {
             "assignment_id": assignment_id,
             "assignment_title": assignment.get("title"),
@@ -1082,37 +1107,29 @@ async def get_assignment_statistics(
 
 # ========== Student Grade Summary ==========
 
-def calculate_grade_classification(average_score: float) -> str:
-    """Tính xếp loại học sinh dựa trên điểm trung bình"""
-    if average_score >= 8.0:
-        return "Giỏi"
-    elif average_score >= 6.5:
-        return "Khá"
-    elif average_score >= 5.0:
-        return "Trung bình"
-    elif average_score >= 3.5:
-        return "Yếu"
-    else:
-        return "Kém"
-
 @router.get("/students/{student_id}/grade-summary")
 async def get_student_grade_summary(
     student_id: str,
     classroom_id: Optional[str] = Query(None),
     subject_id: Optional[str] = Query(None),
+    include_assignments: bool = Query(False, description="Trả về danh sách điểm từng bài"),
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy tổng điểm, điểm trung bình và xếp loại của học sinh
     - Admin: có thể xem tất cả
     - Teacher: chỉ có thể xem học sinh trong lớp của mình
     - Student: chỉ có thể xem điểm của chính mình
+    
+    Tổng điểm đọc từ student_grade_rollups; assignment_submissions chỉ được quét khi
+    cần danh sách từng bài (include_assignments), khi lọc theo lớp khác lớp hiện tại
+    của học sinh, hoặc khi chưa có bảng rollup. Bài đã chấm: is_graded và có score.
     """
     try:
         # Kiểm tra quyền truy cập
         if current_user.role == UserRole.STUDENT:
             # Học sinh chỉ có thể xem điểm của chính mình
-            student_result = supabase.table("students").select("id, user_id").eq("user_id", current_user.id).execute()
+            student_result = await supabase.table("students").select("id, user_id").eq("user_id", current_user.id).execute()
             if not student_result.data or student_result.data[0]["id"] != student_id:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
@@ -1120,7 +1137,7 @@ async def get_student_grade_summary(
                 )
         elif current_user.role == UserRole.TEACHER:
             # Giáo viên chỉ có thể xem học sinh trong lớp của mình
-            teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+            teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
             if not teacher_id:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -1128,7 +1145,7 @@ async def get_student_grade_summary(
                 )
             
             # Kiểm tra học sinh có trong lớp của giáo viên không
-            student_result = supabase.table("students").select("classroom_id").eq("id", student_id).execute()
+            student_result = await supabase.table("students").select("classroom_id").eq("id", student_id).execute()
             if not student_result.data:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -1137,48 +1154,49 @@ async def get_student_grade_summary(
             
             student_classroom_id = student_result.data[0].get("classroom_id")
             if student_classroom_id:
-                classroom_result = supabase.table("classrooms").select("teacher_id").eq("id", student_classroom_id).execute()
+                classroom_result = await supabase.table("classrooms").select("teacher_id").eq("id", student_classroom_id).execute()
                 if classroom_result.data and classroom_result.data[0].get("teacher_id") != teacher_id:
                     raise HTTPException(
                         status_code=status.HTTP_403_FORBIDDEN,
                         detail="Bạn chỉ có thể xem điểm của học sinh trong lớp của mình"
                     )
         
-        # Lấy tất cả submissions của học sinh
-        submissions_query = supabase.table("assignment_submissions").select("*, assignments(*)").eq("student_id", student_id).eq("is_graded", True)
-        
-        # Filter theo classroom_id nếu có
+        # Rollup giữ lớp hiện tại của học sinh: chỉ dùng được khi không lọc lớp hoặc
+        # lọc đúng lớp hiện tại (bài tập được giao cho lớp đó, giống điều kiện quét)
+        use_rollup = True
         if classroom_id:
-            # Lấy danh sách assignment_id từ assignment_classrooms
-            class_result = supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
-            assignment_ids = [item["assignment_id"] for item in (class_result.data or [])]
-            if assignment_ids:
-                submissions_query = submissions_query.in_("assignment_id", assignment_ids)
-            else:
-                # Không có assignment nào trong lớp này
-                return {
-                    "student_id": student_id,
-                    "classroom_id": classroom_id,
-                    "subject_id": subject_id,
-                    "total_assignments": 0,
-                    "graded_assignments": 0,
-                    "total_score": 0.0,
-                    "average_score": 0.0,
-                    "classification": "Chưa có điểm",
-                    "assignments": []
-                }
-        
-        submissions_result = submissions_query.execute()
-        submissions = submissions_result.data or []
-        
-        # Filter theo subject_id nếu có
-        if subject_id:
-            submissions = [s for s in submissions if s.get("assignments") and s["assignments"].get("subject_id") == subject_id]
+            student_result = await supabase.table("students").select("classroom_id").eq("id", student_id).execute()
+            current_classroom_id = student_result.data[0].get("classroom_id") if student_result.data else None
+            use_rollup = current_classroom_id == classroom_id
+        rollup_rows = await grade_rollups.load_rollups(supabase, student_id, classroom_id, subject_id) if use_rollup else None
+        
+        graded_submissions = []
+        submitted_assignment_ids = set()
+        if include_assignments or rollup_rows is None:
+            # Bài nộp của học sinh (lọc lớp qua assignment_classrooms, lọc môn qua assignments)
+            def submissions_query():
+                select = "*, assignments!inner(*, assignment_classrooms!inner(classroom_id))" if classroom_id else "*, assignments!inner(*)"
+                query = supabase.table("assignment_submissions").select(select).eq("student_id", student_id)
+                if classroom_id:
+                    query = query.eq("assignments.assignment_classrooms.classroom_id", classroom_id)
+                if subject_id:
+                    query = query.eq("assignments.subject_id", subject_id)
+                return query
+            
+            async for submission in stream_rows(submissions_query):
+                submitted_assignment_ids.add(submission.get("assignment_id"))
+                if submission.get("is_graded") and submission.get("score") is not None:
+                    (submission.get("assignments") or {}).pop("assignment_classrooms", None)
+                    graded_submissions.append(submission)
         
         # Tính toán điểm số
-        graded_submissions = [s for s in submissions if s.get("score") is not None]
-        total_score = sum(float(s.get("score", 0)) for s in graded_submissions)
-        graded_count = len(graded_submissions)
+        if rollup_rows is not None:
+            rollup_totals = grade_rollups.combine(rollup_rows)
+            total_score = rollup_totals["total_score"]
+            graded_count = rollup_totals["graded_count"]
+        else:
+            total_score = sum(float(s.get("score", 0)) for s in graded_submissions)
+            graded_count = len(graded_submissions)
         average_score = (total_score / graded_count) if graded_count > 0 else 0.0
         
         # Tính xếp loại
@@ -1186,54 +1204,50 @@ async def get_student_grade_summary(
         
         # Lấy thông tin chi tiết từng assignment
         assignments_detail = []
-        for submission in graded_submissions:
-            assignment = submission.get("assignments", {})
-            assignments_detail.append({
-                "submission_id": submission.get("id"),  # Thêm submission_id
-                "assignment_id": submission.get("assignment_id"),
-                "assignment_title": assignment.get("title", ""),
-                "assignment_type": assignment.get("assignment_type", ""),  # Thêm assignment_type
-                "subject_id": assignment.get("subject_id"),
-                "subject_name": None,  # Sẽ load sau nếu cần
-                "score": float(submission.get("score", 0)),
-                "total_points": float(assignment.get("total_points", 100)),
-                "percentage": (float(submission.get("score", 0)) / float(assignment.get("total_points", 100)) * 100) if assignment.get("total_points", 100) > 0 else 0,
-                "submitted_at": submission.get("submitted_at"),
-                "graded_at": submission.get("graded_at")
-            })
+        if include_assignments:
+            for submission in graded_submissions:
+                assignment = submission.get("assignments", {})
+                assignments_detail.append({
+                    "submission_id": submission.get("id"),  # Thêm submission_id
+                    "assignment_id": submission.get("assignment_id"),
+                    "assignment_title": assignment.get("title", ""),
+                    "assignment_type": assignment.get("assignment_type", ""),  # Thêm assignment_type
+                    "subject_id": assignment.get("subject_id"),
+                    "subject_name": None,  # Sẽ load sau nếu cần
+                    "score": float(submission.get("score", 0)),
+                    "total_points": float(assignment.get("total_points", 100)),
+                    "percentage": (float(submission.get("score", 0)) / float(assignment.get("total_points", 100)) * 100) if assignment.get("total_points", 100) > 0 else 0,
+                    "submitted_at": submission.get("submitted_at"),
+                    "graded_at": submission.get("graded_at")
+                })
         
         # Load subject names
         subject_ids = list(set([a["subject_id"] for a in assignments_detail if a["subject_id"]]))
         subjects_map = {}
         if subject_ids:
-            subjects_result = supabase.table("subjects").select("id, name").in_("id", subject_ids).execute()
+            subjects_result = await supabase.table("subjects").select("id, name").in_("id", subject_ids).execute()
             subjects_map = {s["id"]: s["name"] for s in (subjects_result.data or [])}
         
         for assignment_detail in assignments_detail:
             if assignment_detail["subject_id"] in subjects_map:
                 assignment_detail["subject_name"] = subjects_map[assignment_detail["subject_id"]]
         
-        # Lấy tổng số assignment (cả chưa chấm)
-        all_assignments_query = supabase.table("assignments").select("id")
+        # Tổng số assignment (cả chưa chấm, cùng bộ lọc môn):
+        # - Có classroom_id: số bài được giao cho lớp (một query count)
+        # - Không: số bài khác nhau học sinh đã nộp
         if classroom_id:
-            class_result = supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
-            assignment_ids = [item["assignment_id"] for item in (class_result.data or [])]
-            if assignment_ids:
-                all_assignments_query = all_assignments_query.in_("id", assignment_ids)
-            else:
-                total_assignments = 0
-        else:
-            # Lấy tất cả assignment mà học sinh đã nộp hoặc được gán
-            submission_assignments = supabase.table("assignment_submissions").select("assignment_id").eq("student_id", student_id).execute()
-            assignment_ids = [s["assignment_id"] for s in (submission_assignments.data or [])]
-            if assignment_ids:
-                all_assignments_query = all_assignments_query.in_("id", assignment_ids)
-        
-        if classroom_id and not assignment_ids:
-            total_assignments = 0
+            count_query = supabase.table("assignment_classrooms").select(
+                "assignment_id" + (", assignments!inner(subject_id)" if subject_id else ""),
+                count="exact"
+            ).eq("classroom_id", classroom_id)
+            if subject_id:
+                count_query = count_query.eq("assignments.subject_id", subject_id)
+            count_result = await count_query.limit(1).execute()
+            total_assignments = count_result.count or 0
+        elif rollup_rows is not None:
+            total_assignments = rollup_totals["assignment_count"]
         else:
-            all_assignments_result = all_assignments_query.execute()
-            total_assignments = len(all_assignments_result.data or [])
+            total_assignments = len(submitted_assignment_ids)
         
         return {
             "student_id": student_id,
@@ -1262,7 +1276,7 @@ async def get_classroom_grade_summary(
     classroom_id: str,
     subject_id: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy bảng điểm tổng hợp của cả lớp
     - Admin: có thể xem tất cả
@@ -1277,14 +1291,14 @@ async def get_classroom_grade_summary(
     try:
         # Kiểm tra quyền truy cập lớp học
         if current_user.role == UserRole.TEACHER:
-            teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+            teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
             if not teacher_id:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Teacher profile not found"
                 )
             
-            classroom_result = supabase.table("classrooms").select("teacher_id").eq("id", classroom_id).execute()
+            classroom_result = await supabase.table("classrooms").select("teacher_id").eq("id", classroom_id).execute()
             if not classroom_result.data:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -1298,82 +1312,52 @@ async def get_classroom_grade_summary(
                 )
         
         # Lấy danh sách học sinh trong lớp
-        students_result = supabase.table("students").select("id, user_id").eq("classroom_id", classroom_id).execute()
+        students_result = await supabase.table("students").select("id, user_id").eq("classroom_id", classroom_id).execute()
         students = students_result.data or []
+        student_ids = [s["id"] for s in students]
         
         # Lấy thông tin user để có tên học sinh
         user_ids = [s["user_id"] for s in students if s.get("user_id")]
         users_map = {}
         if user_ids:
-            users_result = supabase.table("users").select("id, full_name").in_("id", user_ids).execute()
+            users_result = await supabase.table("users").select("id, full_name").in_("id", user_ids).execute()
             users_map = {u["id"]: u["full_name"] for u in (users_result.data or [])}
         
-        # Tính điểm cho từng học sinh
+        # Assignment của lớp (và của môn nếu có) - chỉ tải một lần cho cả lớp
+        class_assignments = await supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
+        assignment_ids = [a["assignment_id"] for a in (class_assignments.data or [])]
+        total_assignments = len(assignment_ids)
+        if subject_id:
+            subject_assignments = []
+            if assignment_ids:
+                assignments_result = await supabase.table("assignments").select("id").in_("id", assignment_ids).eq("subject_id", subject_id).execute()
+                subject_assignments = [a["id"] for a in (assignments_result.data or [])]
+            total_assignments = len(subject_assignments)
+            subject_assignment_ids = set(subject_assignments)
+        
+        # Submissions đã chấm của cả lớp, gom theo học sinh trong một lượt
+        submissions = []
+        if student_ids and (not subject_id or subject_assignment_ids):
+            # Cả lớp có thể vượt max-rows của PostgREST: đọc theo trang
+            submissions = await fetch_in_paged(
+                supabase,
+                "assignment_submissions",
+                "student_id",
+                student_ids,
+                "id, student_id, assignment_id, score",
+                filters={"is_graded": True}
+            )
+            if subject_id:
+                submissions = [s for s in submissions if s.get("assignment_id") in subject_assignment_ids]
+        totals = aggregate_scores(submissions)
+        
         students_grades = []
         for student in students:
-            student_id = student["id"]
-            
-            # Lấy submissions của học sinh này
-            submissions_query = supabase.table("assignment_submissions").select("*, assignments(*)").eq("student_id", student_id).eq("is_graded", True)
-            
-            # Filter theo subject_id nếu có
-            if subject_id:
-                # Lấy assignment_ids của subject này trong lớp
-                class_assignments = supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
-                assignment_ids = [a["assignment_id"] for a in (class_assignments.data or [])]
-                if assignment_ids:
-                    assignments_result = supabase.table("assignments").select("id").in_("id", assignment_ids).eq("subject_id", subject_id).execute()
-                    filtered_assignment_ids = [a["id"] for a in (assignments_result.data or [])]
-                    if filtered_assignment_ids:
-                        submissions_query = submissions_query.in_("assignment_id", filtered_assignment_ids)
-                    else:
-                        # Không có assignment nào của subject này
-                        students_grades.append({
-                            "student_id": student_id,
-                            "student_name": users_map.get(student["user_id"], "Học sinh"),
-                            "total_assignments": 0,
-                            "graded_assignments": 0,
-                            "total_score": 0.0,
-                            "average_score": 0.0,
-                            "classification": "Chưa có điểm"
-                        })
-                        continue
-            
-            submissions_result = submissions_query.execute()
-            submissions = submissions_result.data or []
-            
-            # Filter theo subject_id trong submissions
-            if subject_id:
-                submissions = [s for s in submissions if s.get("assignments") and s["assignments"].get("subject_id") == subject_id]
-            
-            graded_submissions = [s for s in submissions if s.get("score") is not None]
-            total_score = sum(float(s.get("score", 0)) for s in graded_submissions)
-            graded_count = len(graded_submissions)
-            average_score = (total_score / graded_count) if graded_count > 0 else 0.0
-            classification = calculate_grade_classification(average_score) if graded_count > 0 else "Chưa có điểm"
-            
-            # Đếm tổng số assignment
-            if subject_id:
-                class_assignments = supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
-                assignment_ids = [a["assignment_id"] for a in (class_assignments.data or [])]
-                if assignment_ids:
-                    assignments_result = supabase.table("assignments").select("id").in_("id", assignment_ids).eq("subject_id", subject_id).execute()
-                    total_assignments = len(assignments_result.data or [])
-                else:
-                    total_assignments = 0
-            else:
-                class_assignments = supabase.table("assignment_classrooms").select("assignment_id").eq("classroom_id", classroom_id).execute()
-                total_assignments = len(class_assignments.data or [])
-            
+            student_totals = totals.get(student["id"]) or empty_score_totals()
             students_grades.append({
-                "student_id": student_id,
+                "student_id": student["id"],
                 "student_name": users_map.get(student["user_id"], "Học sinh"),
-                "total_assignments": total_assignments,
-                "graded_assignments": graded_count,
-                "pending_assignments": total_assignments - graded_count,
-                "total_score": round(total_score, 2),
-                "average_score": round(average_score, 2),
-                "classification": classification
+                **score_summary(student_totals["graded_count"], student_totals["total_score"], total_assignments)
             })
         
         # Sắp xếp theo điểm trung bình giảm dần
@@ -3,14 +3,15 @@ Attendances Router
 Router cho quản lý điểm danh (Supabase)
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel, validator
 from datetime import date, datetime
-from supabase import Client
+import base64
 import json
+import uuid
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user
 
 router = APIRouter()
@@ -47,6 +48,10 @@ def normalize_records(records: Any) -> Dict[str, Dict[str, Any]]:
     
     return normalized
 
+def records_containing(student_id: str) -> str:
+    """Giá trị cho filter `cs` (records @> ...): điểm danh có bản ghi của học sinh"""
+    return json.dumps({student_id: {}})
+
 class AttendanceCreate(BaseModel):
     classroom_id: str
     date: str  # YYYY-MM-DD format
@@ -102,16 +107,16 @@ async def get_attendances(
     classroom_id: Optional[str] = Query(None),
     date: Optional[str] = Query(None),  # YYYY-MM-DD format
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy danh sách điểm danh"""
     try:
         query = supabase.table("attendances").select("*")
         
         if student_id:
-            # If filtering by student_id, we need to check records field
-            # This is a JSONB field, so we'll filter after fetching
-            pass
+            # records @> {"<student_id>": {}}: lọc trong database (GIN index trên
+            # records), trước khi phân trang
+            query = query.filter("records", "cs", records_containing(student_id))
         
         if classroom_id:
             query = query.eq("classroom_id", classroom_id)
@@ -119,10 +124,10 @@ async def get_attendances(
         if date:
             query = query.eq("date", date)
         
-        # Apply pagination
-        query = query.range(skip, skip + limit - 1)
+        # Apply pagination (thứ tự cố định để các trang không trùng / sót)
+        query = query.order("date", desc=True).order("id").range(skip, skip + limit - 1)
         
-        result = query.execute()
+        result = await query.execute()
         attendances = result.data or []
         
         # Normalize records (parse string JSON if needed)
@@ -134,23 +139,6 @@ async def get_attendances(
                 print(f"[get_attendances] Normalized records type: {type(att['records'])}")
                 print(f"[get_attendances] Normalized records keys: {list(att['records'].keys()) if isinstance(att['records'], dict) else 'N/A'}")
         
-        # Filter by student_id if provided (check in records JSONB)
-        if student_id:
-            filtered = []
-            for att in attendances:
-                records = att.get("records", {})
-                if isinstance(records, dict):
-                    # Check if student_id exists as key or in record's student_id field
-                    if student_id in records:
-                        filtered.append(att)
-                    else:
-                        # Check in record values
-                        for record in records.values():
-                            if isinstance(record, dict) and record.get("student_id") == student_id:
-                                filtered.append(att)
-                                break
-            attendances = filtered
-        
         return {"data": attendances, "count": len(attendances)}
     except Exception as e:
         print(f"Error in get_attendances: {e}")
@@ -159,15 +147,131 @@ async def get_attendances(
             detail=f"Failed to fetch attendances: {str(e)}"
         )
 
+MAX_HISTORY_PAGE_SIZE = 500
+MAX_HISTORY_WINDOW_DAYS = 366
+
+
+def encode_history_cursor(row: Dict[str, Any]) -> str:
+    payload = json.dumps([row.get("date"), row.get("id")])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        attendance_date, attendance_id = json.loads(base64.urlsafe_b64decode(padded))
+        if not attendance_date or not attendance_id:
+            raise ValueError("incomplete cursor")
+        # Cả hai giá trị được ghép vào or_() nên phải chuẩn hóa, không dùng nguyên chuỗi client gửi
+        return date.fromisoformat(str(attendance_date)[:10]).isoformat(), str(uuid.UUID(str(attendance_id)))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def _ensure_student_access(supabase: Database, current_user, student_id: str) -> None:
+    """Học sinh chỉ xem được lịch sử điểm danh của chính mình"""
+    if current_user.role != "student":
+        return
+    result = await supabase.table("students").select("id").eq("id", student_id).eq("user_id", current_user.id).execute()
+    if not result.data:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Bạn chỉ có thể xem điểm danh của chính mình"
+        )
+
+
+@router.get("/student/{student_id}")
+async def get_student_attendance_history(
+    student_id: str,
+    response: Response,
+    from_date: Optional[date] = Query(None, alias="from", description="Từ ngày (YYYY-MM-DD)"),
+    to_date: Optional[date] = Query(None, alias="to", description="Đến ngày (YYYY-MM-DD)"),
+    classroom_id: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Cursor lấy từ header X-Next-Cursor của trang trước"),
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db),
+):
+    """Lịch sử điểm danh của một học sinh, mới nhất trước
+
+    Chỉ các buổi có bản ghi của học sinh (records @> {student_id: {}}) và chỉ phần
+    records của học sinh đó được đọc từ database. Phân trang keyset theo
+    (date DESC, id DESC): nếu còn trang sau, header `X-Next-Cursor` chứa cursor.
+    """
+    if from_date and to_date:
+        if to_date < from_date:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'to' must not be before 'from'")
+        if (to_date - from_date).days >= MAX_HISTORY_WINDOW_DAYS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Date window must be shorter than {MAX_HISTORY_WINDOW_DAYS} days"
+            )
+    keyset = decode_history_cursor(cursor) if cursor else None
+
+    await _ensure_student_access(supabase, current_user, student_id)
+
+    try:
+        # Chỉ lấy bản ghi của học sinh này thay vì cả bảng điểm danh của lớp
+        record_path = 'record:records->"' + student_id.replace('"', '') + '"'
+        query = (
+            supabase.table("attendances")
+            .select(f"id, classroom_id, date, confirmed_at, {record_path}")
+            .filter("records", "cs", records_containing(student_id))
+        )
+        if classroom_id:
+            query = query.eq("classroom_id", classroom_id)
+        if from_date:
+            query = query.gte("date", from_date.isoformat())
+        if to_date:
+            query = query.lte("date", to_date.isoformat())
+        if keyset:
+            cursor_date, cursor_id = keyset
+            query = query.or_(f"date.lt.{cursor_date},and(date.eq.{cursor_date},id.lt.{cursor_id})")
+
+        # Lấy thêm 1 dòng để biết còn trang sau hay không
+        result = await query.order("date", desc=True).order("id", desc=True).limit(limit + 1).execute()
+        rows = result.data or []
+
+        page = rows[:limit]
+        if len(rows) > limit and page:
+            response.headers["X-Next-Cursor"] = encode_history_cursor(page[-1])
+
+        history = []
+        for row in page:
+            record = row.get("record") or {}
+            if isinstance(record, str):
+                try:
+                    record = json.loads(record)
+                except json.JSONDecodeError:
+                    record = {}
+            history.append({
+                "attendance_id": row.get("id"),
+                "classroom_id": row.get("classroom_id"),
+                "date": row.get("date"),
+                "confirmed_at": row.get("confirmed_at"),
+                "status": record.get("status"),
+                "notes": record.get("notes"),
+                "timestamp": record.get("timestamp"),
+            })
+        return {"student_id": student_id, "data": history, "count": len(history)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in get_student_attendance_history: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch attendance history: {str(e)}"
+        )
+
 @router.get("/{attendance_id}")
 async def get_attendance(
     attendance_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy thông tin một điểm danh"""
     try:
-        result = supabase.table("attendances").select("*").eq("id", attendance_id).execute()
+        result = await supabase.table("attendances").select("*").eq("id", attendance_id).execute()
         
         if not result.data or len(result.data) == 0:
             raise HTTPException(
@@ -198,7 +302,7 @@ async def get_attendance(
 async def create_attendance(
     attendance_data: AttendanceCreate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Tạo điểm danh mới (chỉ giáo viên và admin)"""
     if current_user.role not in ["teacher", "admin"]:
@@ -209,7 +313,7 @@ async def create_attendance(
     
     try:
         # Kiểm tra classroom có tồn tại không
-        classroom_result = supabase.table("classrooms").select("id").eq("id", attendance_data.classroom_id).execute()
+        classroom_result = await supabase.table("classrooms").select("id").eq("id", attendance_data.classroom_id).execute()
         if not classroom_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -217,7 +321,7 @@ async def create_attendance(
             )
         
         # Kiểm tra đã điểm danh chưa (theo classroom_id và date)
-        existing_result = supabase.table("attendances").select("id").eq(
+        existing_result = await supabase.table("attendances").select("id").eq(
             "classroom_id", attendance_data.classroom_id
         ).eq("date", attendance_data.date).execute()
         
@@ -249,7 +353,7 @@ async def create_attendance(
         print(f"[create_attendance] Saving records keys: {list(normalized_records.keys()) if isinstance(normalized_records, dict) else 'N/A'}")
         print(f"[create_attendance] Saving date: {attendance_data.date}")
         
-        result = supabase.table("attendances").insert(attendance_record).execute()
+        result = await supabase.table("attendances").insert(attendance_record).execute()
         
         if not result.data:
             raise HTTPException(
@@ -278,7 +382,7 @@ async def update_attendance(
     attendance_id: str,
     attendance_data: AttendanceUpdate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Cập nhật điểm danh (chỉ giáo viên và admin)"""
     if current_user.role not in ["teacher", "admin"]:
@@ -289,7 +393,7 @@ async def update_attendance(
     
     try:
         # Kiểm tra attendance có tồn tại không
-        existing_result = supabase.table("attendances").select("id").eq("id", attendance_id).execute()
+        existing_result = await supabase.table("attendances").select("id").eq("id", attendance_id).execute()
         if not existing_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -317,7 +421,7 @@ async def update_attendance(
         
         update_data["updated_at"] = datetime.utcnow().isoformat()
         
-        result = supabase.table("attendances").update(update_data).eq("id", attendance_id).execute()
+        result = await supabase.table("attendances").update(update_data).eq("id", attendance_id).execute()
         
         # Normalize records in response
         if result.data and len(result.data) > 0:
@@ -344,7 +448,7 @@ async def update_attendance(
 async def delete_attendance(
     attendance_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Xóa điểm danh (chỉ admin)"""
     if current_user.role != "admin":
@@ -354,7 +458,7 @@ async def delete_attendance(
         )
     
     try:
-        result = supabase.table("attendances").delete().eq("id", attendance_id).execute()
+        result = await supabase.table("attendances").delete().eq("id", attendance_id).execute()
         
         return {"message": "Attendance deleted successfully", "deleted": True}
     except Exception as e:
@@ -6,10 +6,10 @@ Router cho audit logging
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from datetime import datetime
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user_dev
+from services.paging import stream_rows
 from models.audit_log import AuditLogResponse, AuditLogFilter
 
 router = APIRouter()
@@ -26,7 +26,7 @@ async def get_audit_logs(
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách audit logs (chỉ admin)"""
     if current_user.role != 'admin':
@@ -53,7 +53,7 @@ async def get_audit_logs(
         if ip_address:
             query = query.eq('ip_address', ip_address)
         
-        result = query.order('created_at', desc=True).limit(limit).offset(offset).execute()
+        result = await query.order('created_at', desc=True).limit(limit).offset(offset).execute()
         return result.data if result.data else []
     except Exception as e:
         raise HTTPException(
@@ -66,7 +66,7 @@ async def get_audit_log_stats(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thống kê audit logs (chỉ admin)"""
     if current_user.role != 'admin':
@@ -76,23 +76,22 @@ async def get_audit_log_stats(
         )
     
     try:
-        query = supabase.table('audit_logs').select('action, resource_type, status_code')
+        def logs_query():
+            query = supabase.table('audit_logs').select('id, action, resource_type, status_code')
+            if start_date:
+                query = query.gte('created_at', start_date)
+            if end_date:
+                query = query.lte('created_at', end_date)
+            return query
         
-        if start_date:
-            query = query.gte('created_at', start_date)
-        if end_date:
-            query = query.lte('created_at', end_date)
-        
-        result = query.execute()
-        logs = result.data if result.data else []
-        
-        # Tính toán thống kê
-        total_logs = len(logs)
+        # Tính toán thống kê (đọc theo trang, không giữ toàn bộ log trong bộ nhớ)
+        total_logs = 0
         actions_count = {}
         resource_types_count = {}
         status_codes_count = {}
         
-        for log in logs:
+        async for log in stream_rows(logs_query):
+            total_logs += 1
             action = log.get('action', 'unknown')
             resource_type = log.get('resource_type', 'unknown')
             status_code = log.get('status_code')
@@ -118,7 +117,7 @@ async def get_audit_log_stats(
 async def delete_audit_logs(
     older_than_days: int = Query(90, ge=1, description="Delete logs older than X days"),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa audit logs cũ (chỉ admin)"""
     if current_user.role != 'admin':
@@ -131,7 +130,7 @@ async def delete_audit_logs(
         from datetime import timedelta
         cutoff_date = (datetime.now() - timedelta(days=older_than_days)).isoformat()
         
-        result = supabase.table('audit_logs').delete().lt('created_at', cutoff_date).execute()
+        result = await supabase.table('audit_logs').delete().lt('created_at', cutoff_date).execute()
         
         return {
             "message": f"Deleted audit logs older than {older_than_days} days",
@@ -5,16 +5,18 @@ Router cho xác thực người dùng
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import Client
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 import os
 
-from database import get_db
-from supabase_client import get_supabase_client
+from database import get_db, get_database, Database
+from supabase_client import create_session_client
 from config import settings
+from services.token_cache import token_cache
+from services.permission_registry import permission_registry
+from services.supabase_jwt import is_supabase_token, verify_supabase_token
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -74,19 +76,19 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_user_by_email(supabase: Client, email: str) -> Optional[User]:
+async def get_user_by_email(supabase: Database, email: str) -> Optional[User]:
     """Lấy user theo email"""
     try:
-        response = supabase.table('users').select('*').eq('email', email).single().execute()
+        response = await supabase.table('users').select('*').eq('email', email).single().execute()
         if response.data:
             return User(**response.data)
         return None
     except:
         return None
 
-def authenticate_user(supabase: Client, email: str, password: str) -> Optional[User]:
+async def authenticate_user(supabase: Database, email: str, password: str) -> Optional[User]:
     """Xác thực người dùng"""
-    user = get_user_by_email(supabase, email)
+    user = await get_user_by_email(supabase, email)
     if not user:
         return None
     
@@ -109,11 +111,64 @@ async def get_current_user_dev() -> User:
         updated_at=datetime.now().isoformat()
     )
 
+def _token_exp(token: str) -> Optional[float]:
+    """Đọc exp của token (token đã được xác thực trước khi gọi hàm này)"""
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+        return float(exp) if exp is not None else None
+    except Exception:
+        return None
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ) -> User:
-    """Lấy user hiện tại từ token"""
+    """Lấy user hiện tại từ token (có cache theo token hash)"""
+    token = credentials.credentials
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+    
+    user = await _resolve_current_user(token, supabase)
+    token_cache.set(token, user, _token_exp(token))
+    return user
+
+def require_permission(permission: str):
+    """Dependency kiểm tra quyền theo role (vd: Depends(require_permission("teachers.update")))"""
+    async def checker(
+        current_user: User = Depends(get_current_user),
+        supabase: Database = Depends(get_db)
+    ) -> User:
+        await permission_registry.ensure_loaded(supabase)
+        if not permission_registry.has_permission(current_user, permission):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough permissions"
+            )
+        return current_user
+    return checker
+
+async def _supabase_identity(token: str, supabase: Database):
+    """(id, email, user_metadata) của một token Supabase Auth
+    
+    Xác thực local bằng SUPABASE_JWT_SECRET/JWKS; chỉ gọi auth.get_user() khi
+    không xác thực local được. App JWT (teacher/student) không qua GoTrue.
+    """
+    if settings.SUPABASE_JWT_LOCAL_VERIFY and not is_supabase_token(token):
+        raise ValueError("Not a Supabase Auth token")
+    
+    claims = await verify_supabase_token(token)
+    if claims is not None:
+        return claims.get('sub'), claims.get('email'), claims.get('user_metadata') or {}
+    
+    auth_user_response = await supabase.run(supabase.auth.get_user, token)
+    auth_user = getattr(auth_user_response, 'user', None)
+    if not auth_user:
+        return None, None, {}
+    return getattr(auth_user, 'id', None), getattr(auth_user, 'email', None), getattr(auth_user, 'user_metadata', {}) or {}
+
+async def _resolve_current_user(token: str, supabase: Database) -> User:
+    """Xác thực token với Supabase Auth / app JWT và lấy user từ DB"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -123,13 +178,10 @@ async def get_current_user(
     # Xác thực bằng Supabase Auth token
     try:
         print(f"[get_current_user] Attempting Supabase Auth validation...")
-        auth_user_response = supabase.auth.get_user(credentials.credentials)
-        if not getattr(auth_user_response, 'user', None):
+        auth_id, auth_email, user_metadata = await _supabase_identity(token, supabase)
+        if not auth_id:
             print(f"[get_current_user] Supabase Auth: No user in response")
             raise credentials_exception
-        auth_user = auth_user_response.user
-        auth_email = getattr(auth_user, 'email', None)
-        auth_id = getattr(auth_user, 'id', None)
         if not auth_email or not auth_id:
             print(f"[get_current_user] Supabase Auth: Missing email or id. Email: {auth_email}, ID: {auth_id}")
             raise credentials_exception
@@ -138,12 +190,12 @@ async def get_current_user(
 
         # Lấy thông tin ứng dụng từ bảng users
         try:
-            db_user_resp = supabase.table('users').select('*').eq('id', auth_id).single().execute()
+            db_user_resp = await supabase.table('users').select('*').eq('id', auth_id).single().execute()
             if not db_user_resp.data:
                 # Nếu chưa có thì tạo bản ghi tối thiểu
                 print(f"[get_current_user] User not found in DB, creating minimal record...")
-                full_name = (getattr(auth_user, 'user_metadata', {}) or {}).get('full_name', auth_email.split('@')[0])
-                insert_resp = supabase.table('users').insert({
+                full_name = user_metadata.get('full_name', auth_email.split('@')[0])
+                insert_resp = await supabase.table('users').insert({
                     'id': auth_id,
                     'email': auth_email,
                     'full_name': full_name,
@@ -174,7 +226,7 @@ async def get_current_user(
         print(f"[get_current_user] Supabase Auth failed: {str(supabase_error)}, trying JWT fallback...")
         # Fallback: thử xác thực bằng app JWT do backend cấp
         try:
-            payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             user_id: str = payload.get("sub")
             email: Optional[str] = payload.get("email")
             role: Optional[str] = payload.get("role")
@@ -185,9 +237,9 @@ async def get_current_user(
             # Lấy user từ DB theo id (ưu tiên) hoặc email
             try:
                 if user_id:
-                    db_user_resp = supabase.table('users').select('*').eq('id', user_id).single().execute()
+                    db_user_resp = await supabase.table('users').select('*').eq('id', user_id).single().execute()
                 elif email:
-                    db_user_resp = supabase.table('users').select('*').eq('email', email).single().execute()
+                    db_user_resp = await supabase.table('users').select('*').eq('email', email).single().execute()
                 else:
                     print(f"[get_current_user] JWT: No user_id or email")
                     raise credentials_exception
@@ -225,10 +277,10 @@ async def login(login_data: UserLogin):
     - Teacher/Student: uses password_hash from users table
     """
     try:
-        supabase = get_supabase_client()
+        supabase = get_database()
         
         # First, get user from users table to check role
-        user_result = supabase.table("users").select("*").eq("email", login_data.email).execute()
+        user_result = await supabase.table("users").select("*").eq("email", login_data.email).execute()
         
         if not user_result.data or len(user_result.data) == 0:
             raise HTTPException(
@@ -251,7 +303,7 @@ async def login(login_data: UserLogin):
             # Try Supabase Auth first
             auth_success = False
             try:
-                auth_response = supabase.auth.sign_in_with_password({
+                auth_response = await supabase.run(create_session_client().auth.sign_in_with_password, {
                     "email": login_data.email,
                     "password": login_data.password
                 })
@@ -272,7 +324,7 @@ async def login(login_data: UserLogin):
                     auth_success = True
                     # Update last login
                     try:
-                        supabase.table("users").update({
+                        await supabase.table("users").update({
                             "last_login": datetime.utcnow().isoformat()
                         }).eq("id", user["id"]).execute()
                     except Exception:
@@ -318,7 +370,7 @@ async def login(login_data: UserLogin):
                 
                 # Update last login
                 try:
-                    supabase.table("users").update({
+                    await supabase.table("users").update({
                         "last_login": datetime.utcnow().isoformat()
                     }).eq("id", user["id"]).execute()
                 except Exception:
@@ -367,7 +419,7 @@ async def login(login_data: UserLogin):
             
             # Update last login
             try:
-                supabase.table("users").update({
+                await supabase.table("users").update({
                     "last_login": datetime.utcnow().isoformat()
                 }).eq("id", user["id"]).execute()
             except Exception:
@@ -405,11 +457,11 @@ async def login(login_data: UserLogin):
         )
 
 @router.post("/register", response_model=dict)
-async def register(user_data: UserRegister, supabase: Client = Depends(get_db)):
+async def register(user_data: UserRegister, supabase: Database = Depends(get_db)):
     """Đăng ký tài khoản mới"""
     try:
         # Kiểm tra email đã tồn tại
-        existing_user = get_user_by_email(supabase, user_data.email)
+        existing_user = await get_user_by_email(supabase, user_data.email)
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -417,7 +469,7 @@ async def register(user_data: UserRegister, supabase: Client = Depends(get_db)):
             )
         
         # Tạo user trong Supabase Auth trước
-        auth_response = supabase.auth.sign_up({
+        auth_response = await supabase.run(create_session_client().auth.sign_up, {
             'email': user_data.email,
             'password': user_data.password,
             'options': {
@@ -460,7 +512,7 @@ async def register(user_data: UserRegister, supabase: Client = Depends(get_db)):
             "is_active": True
         }
         
-        response = supabase.table('users').insert(user_data_dict).execute()
+        response = await supabase.table('users').insert(user_data_dict).execute()
         
         return {"message": "User created successfully", "user_id": user_id}
     except HTTPException:
@@ -1,120 +1,189 @@
 """
 Batch API Router
 Allows multiple API calls in a single request for better performance
+
+Mỗi sub-request GET được chuyển thẳng vào routing table của app (cùng
+dependencies, cùng header Authorization của request gốc), các sub-request chạy
+song song với giới hạn BATCH_MAX_CONCURRENCY cho mỗi batch. Mỗi sub-request được
+tính vào rate limit của nhóm route tương ứng như khi gọi trực tiếp.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import json
+import math
+import time
+from urllib.parse import urlencode, urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-from supabase import Client
+from typing import List, Dict, Any, Optional, Tuple
 
-from database import get_db
+from config import settings
 from routers.auth import get_current_user_dev
 
 router = APIRouter()
 
+# Header của request gốc không áp dụng cho sub-request
+_SKIPPED_HEADERS = {b"content-length", b"content-type", b"accept-encoding", b"transfer-encoding"}
+_MAX_REDIRECTS = 1
+
 class BatchRequest(BaseModel):
     requests: List[Dict[str, Any]]
 
 class BatchResponse(BaseModel):
     responses: List[Dict[str, Any]]
 
+def _split_path(path: str, params: Dict[str, Any]) -> Tuple[str, bytes]:
+    """Tách query string có sẵn trong path và gộp với params"""
+    parts = urlsplit(path)
+    query = parts.query
+    extra = urlencode({k: v for k, v in (params or {}).items() if v is not None}, doseq=True)
+    if extra:
+        query = f"{query}&{extra}" if query else extra
+    return parts.path, query.encode("latin-1")
+
+def _sub_scope(parent: Dict[str, Any], path: str, query_string: bytes) -> Dict[str, Any]:
+    headers = [(k, v) for k, v in parent.get("headers", []) if k not in _SKIPPED_HEADERS]
+    return {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": query_string,
+        "headers": headers,
+        "app": parent.get("app"),
+        "state": parent.get("state", {}),
+    }
+
+async def _call_route(request: Request, path: str, query_string: bytes) -> Tuple[int, Dict[str, str], bytes]:
+    """Gọi routing table của app (không qua middleware) và thu response"""
+    scope = _sub_scope(request.scope, path, query_string)
+    response_start: Dict[str, Any] = {}
+    body = bytearray()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response_start.update(message)
+        elif message["type"] == "http.response.body":
+            body.extend(message.get("body", b""))
+
+    await request.app.router(scope, receive, send)
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in response_start.get("headers", [])}
+    return response_start.get("status", 500), headers, bytes(body)
+
+def _decode_body(headers: Dict[str, str], body: bytes) -> Any:
+    if not body:
+        return None
+    if "json" in headers.get("content-type", ""):
+        return json.loads(body)
+    return body.decode("utf-8", errors="replace")
+
+async def _dispatch(request: Request, item: Dict[str, Any]) -> Dict[str, Any]:
+    method = str(item.get("method", "GET")).upper()
+    path = item.get("path", "")
+
+    if not isinstance(path, str) or not path.startswith("/api/"):
+        return {"error": "Invalid path", "status": 400}
+    if method != "GET":
+        return {"error": f"Method '{method}' not supported in batch", "status": 400}
+
+    route_path, query_string = _split_path(path, item.get("params", {}))
+    if route_path.rstrip("/") == "/api/batch":
+        return {"error": "Nested batch requests are not allowed", "status": 400}
+
+    # Sub-request không đi qua middleware: tính rate limit theo path của chính nó
+    limiter = request.scope.get("rate_limiter")
+    if limiter is not None:
+        limited = await limiter.check(request.scope, route_path, method)
+        if limited is not None and not limited.allowed:
+            return {
+                "status": status.HTTP_429_TOO_MANY_REQUESTS,
+                "error": f"Rate limit exceeded: {limited.limit} requests per minute",
+                "retry_after": max(1, math.ceil(limited.retry_after)),
+            }
+
+    try:
+        for _ in range(_MAX_REDIRECTS + 1):
+            status_code, headers, body = await _call_route(request, route_path, query_string)
+            # redirect_slashes (vd: /api/students -> /api/students/)
+            if status_code in (307, 308) and headers.get("location"):
+                location = urlsplit(headers["location"])
+                route_path, query_string = location.path, location.query.encode("latin-1")
+                continue
+            break
+    except StarletteHTTPException as e:
+        return {"status": e.status_code, "error": e.detail}
+    except RequestValidationError as e:
+        return {"status": status.HTTP_422_UNPROCESSABLE_ENTITY, "error": jsonable_encoder(e.errors())}
+
+    data = _decode_body(headers, body)
+    if status_code >= 400:
+        error = data.get("detail", data) if isinstance(data, dict) else data
+        return {"status": status_code, "error": error}
+    return {"status": status_code, "data": data}
+
+async def _run_item(request: Request, item: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    path = item.get("path", "unknown")
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(_dispatch(request, item), timeout=settings.BATCH_SUBREQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            result = {"error": "Sub-request timed out", "status": status.HTTP_504_GATEWAY_TIMEOUT}
+        except Exception as e:
+            print(f"Batch sub-request {path} failed: {e}")
+            result = {"error": str(e), "status": 500}
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    response: Dict[str, Any] = {"path": path}
+    if item.get("id") is not None:
+        response["id"] = item["id"]
+    response.update(result)
+    return response
+
 @router.post("/batch", response_model=BatchResponse)
 async def batch_request(
     batch_data: BatchRequest,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    request: Request,
+    current_user = Depends(get_current_user_dev)
 ):
     """
     Execute multiple API requests in a single batch
     Reduces network overhead and improves performance
-    
+
+    Mỗi sub-request đi qua đúng route/dependencies/auth như khi gọi trực tiếp và có
+    status, duration_ms riêng; thứ tự responses giống thứ tự requests.
+
     Example:
     {
       "requests": [
         {"method": "GET", "path": "/api/students", "params": {"limit": 20}},
         {"method": "GET", "path": "/api/teachers", "params": {"limit": 20}},
-        {"method": "GET", "path": "/api/classrooms", "params": {}}
+        {"id": "classes", "method": "GET", "path": "/api/classrooms", "params": {}}
       ]
     }
     """
-    if len(batch_data.requests) > 20:
+    if len(batch_data.requests) > settings.BATCH_MAX_REQUESTS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Maximum 20 requests per batch"
+            detail=f"Maximum {settings.BATCH_MAX_REQUESTS} requests per batch"
         )
-    
-    responses = []
-    
-    for req in batch_data.requests:
-        try:
-            method = req.get("method", "GET").upper()
-            path = req.get("path", "")
-            params = req.get("params", {})
-            
-            # Validate path
-            if not path.startswith("/api/"):
-                responses.append({
-                    "error": "Invalid path",
-                    "status": 400
-                })
-                continue
-            
-            # For now, only support GET requests
-            # In production, you'd want to route to actual endpoints
-            if method == "GET":
-                # Extract resource type from path
-                resource = path.split("/")[2] if len(path.split("/")) > 2 else ""
-                
-                if resource == "students":
-                    from routers.students import get_students
-                    result = await get_students(
-                        skip=params.get("skip", 0),
-                        limit=params.get("limit", 20),
-                        search=params.get("search"),
-                        classroom_id=params.get("classroom_id"),
-                        current_user=current_user,
-                        supabase=supabase
-                    )
-                    responses.append({
-                        "path": path,
-                        "status": 200,
-                        "data": result
-                    })
-                elif resource == "teachers":
-                    from routers.teachers import get_teachers
-                    result = await get_teachers(
-                        skip=params.get("skip", 0),
-                        limit=params.get("limit", 20),
-                        search=params.get("search"),
-                        department=params.get("department"),
-                        current_user=current_user,
-                        supabase=supabase
-                    )
-                    responses.append({
-                        "path": path,
-                        "status": 200,
-                        "data": result
-                    })
-                else:
-                    responses.append({
-                        "path": path,
-                        "error": f"Resource '{resource}' not supported in batch",
-                        "status": 400
-                    })
-            else:
-                responses.append({
-                    "path": path,
-                    "error": f"Method '{method}' not supported in batch",
-                    "status": 400
-                })
-                
-        except Exception as e:
-            responses.append({
-                "path": req.get("path", "unknown"),
-                "error": str(e),
-                "status": 500
-            })
-    
-    return BatchResponse(responses=responses)
 
+    semaphore = asyncio.Semaphore(max(1, settings.BATCH_MAX_CONCURRENCY))
+    responses = await asyncio.gather(*[
+        _run_item(request, req, semaphore) for req in batch_data.requests
+    ])
+
+    return BatchResponse(responses=list(responses))
@@ -6,9 +6,8 @@ Router cho quản lý lớp học (Supabase)
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Optional
 from pydantic import BaseModel, constr, conint
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user
 
 router = APIRouter()
@@ -78,7 +77,7 @@ class ClassroomResponse(BaseModel):
 async def create_classroom(
     classroom_data: ClassroomCreate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Tạo lớp học mới (chỉ admin)"""
     if current_user.role != "admin":
@@ -96,7 +95,7 @@ async def create_classroom(
     # Tạo code tự động nếu client gửi Class
     if normalized_code.lower() == "class":
         # Lấy tất cả code dạng Class#### (giới hạn để an toàn)
-        codes_res = supabase.table("classrooms").select("code").ilike("code", "Class%").limit(1000).execute()
+        codes_res = await supabase.table("classrooms").select("code").ilike("code", "Class%").limit(1000).execute()
         max_num = 0
         if codes_res.data:
             for row in codes_res.data:
@@ -112,7 +111,7 @@ async def create_classroom(
         attempt = 1
         while True:
             candidate = f"Class{attempt:04d}"
-            dup = supabase.table("classrooms").select("id").eq("code", candidate).execute()
+            dup = await supabase.table("classrooms").select("id").eq("code", candidate).execute()
             if not dup.data:
                 normalized_code = candidate
                 break
@@ -124,25 +123,25 @@ async def create_classroom(
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom code must be in format Class0001, Class0002, etc.")
         
         # Kiểm tra code đã tồn tại chưa (unique constraint)
-        existing = supabase.table("classrooms").select("id").eq("code", normalized_code).execute()
+        existing = await supabase.table("classrooms").select("id").eq("code", normalized_code).execute()
         if existing.data:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom code already exists")
 
     # Kiểm tra teacher có tồn tại không (nếu có)
     if normalized_teacher_id:
-        teacher = supabase.table("teachers").select("id").eq("id", normalized_teacher_id).execute()
+        teacher = await supabase.table("teachers").select("id").eq("id", normalized_teacher_id).execute()
         if not teacher.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Teacher not found")
 
     # Kiểm tra subject có tồn tại không (nếu có)
     if normalized_subject_id:
-        subject = supabase.table("subjects").select("id").eq("id", normalized_subject_id).execute()
+        subject = await supabase.table("subjects").select("id").eq("id", normalized_subject_id).execute()
         if not subject.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subject not found")
 
     # Kiểm tra campus có tồn tại không (nếu có)
     if normalized_campus_id:
-        campus = supabase.table("campuses").select("id").eq("id", normalized_campus_id).execute()
+        campus = await supabase.table("campuses").select("id").eq("id", normalized_campus_id).execute()
         if not campus.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campus not found")
 
@@ -160,7 +159,7 @@ async def create_classroom(
         "close_date": classroom_data.close_date or None,
     }
 
-    result = supabase.table("classrooms").insert(insert_payload).execute()
+    result = await supabase.table("classrooms").insert(insert_payload).execute()
     if not result.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create classroom")
     created_classroom = result.data[0]
@@ -170,7 +169,7 @@ async def create_classroom(
         # Only keep non-empty ids
         ids = [sid for sid in classroom_data.student_ids if sid and sid.strip()]
         if ids:
-            supabase.table("students").update({"classroom_id": created_classroom["id"]}).in_("id", ids).execute()
+            await supabase.table("students").update({"classroom_id": created_classroom["id"]}).in_("id", ids).execute()
 
     return created_classroom
 
@@ -182,13 +181,13 @@ async def get_classrooms(
     teacher_id: Optional[str] = None,
     campus_id: Optional[str] = None,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy danh sách lớp học"""
     # Nếu là giáo viên và có teacher_id trong query, validate quyền
     if current_user.role == "teacher" and teacher_id:
         # Lấy teacher_id của current_user
-        teacher_result = supabase.table("teachers").select("id").eq("user_id", current_user.id).execute()
+        teacher_result = await supabase.table("teachers").select("id").eq("user_id", current_user.id).execute()
         if teacher_result.data:
             current_teacher_id = teacher_result.data[0]["id"]
             # Chỉ cho phép xem lớp của chính giáo viên đó
@@ -206,21 +205,21 @@ async def get_classrooms(
         query = query.eq("teacher_id", teacher_id)
     if campus_id:
         query = query.eq("campus_id", campus_id)
-    result = query.order("created_at", desc=True).range(skip, skip + limit - 1).execute()
+    result = await query.order("created_at", desc=True).range(skip, skip + limit - 1).execute()
     return result.data or []
 
 
 @router.get("/next-code")
 async def get_next_class_code(
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy mã lớp tiếp theo (admin và teacher)"""
     if current_user.role not in ["admin", "teacher"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Lấy tất cả code dạng Class#### (giới hạn để an toàn)
-    codes_res = supabase.table("classrooms").select("code").ilike("code", "Class%").limit(1000).execute()
+    codes_res = await supabase.table("classrooms").select("code").ilike("code", "Class%").limit(1000).execute()
     max_num = 0
     if codes_res.data:
         for row in codes_res.data:
@@ -237,7 +236,7 @@ async def get_next_class_code(
     attempt = 1
     while True:
         candidate = f"Class{attempt:04d}"
-        dup = supabase.table("classrooms").select("id").eq("code", candidate).execute()
+        dup = await supabase.table("classrooms").select("id").eq("code", candidate).execute()
         if not dup.data:
             return {"next_code": candidate}
         attempt += 1
@@ -247,7 +246,7 @@ async def get_next_class_code(
 async def get_classroom(
     classroom_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy thông tin một lớp học
     - Admin: có thể xem tất cả lớp học
@@ -263,7 +262,7 @@ async def get_classroom(
         
         # Admin có thể xem tất cả
         if user_role == "admin":
-            result = supabase.table("classrooms").select("*").eq("id", classroom_id).execute()
+            result = await supabase.table("classrooms").select("*").eq("id", classroom_id).execute()
             if not result.data:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
             return result.data[0]
@@ -272,11 +271,11 @@ async def get_classroom(
         if user_role == "teacher":
             try:
                 # Lấy teacher_id của current_user
-                teacher_result = supabase.table("teachers").select("id").eq("user_id", current_user.id).execute()
+                teacher_result = await supabase.table("teachers").select("id").eq("user_id", current_user.id).execute()
                 if teacher_result.data:
                     current_teacher_id = teacher_result.data[0]["id"]
                     # Kiểm tra lớp có thuộc về giáo viên này không
-                    result = supabase.table("classrooms").select("*").eq("id", classroom_id).eq("teacher_id", current_teacher_id).execute()
+                    result = await supabase.table("classrooms").select("*").eq("id", classroom_id).eq("teacher_id", current_teacher_id).execute()
                     if not result.data:
                         print(f"[get_classroom] Teacher {current_teacher_id} does not have access to classroom {classroom_id}")
                         raise HTTPException(
@@ -303,7 +302,7 @@ async def get_classroom(
         if user_role == "student":
             try:
                 # Lấy student_id của current_user
-                student_result = supabase.table("students").select("id, classroom_id").eq("user_id", current_user.id).execute()
+                student_result = await supabase.table("students").select("id, classroom_id").eq("user_id", current_user.id).execute()
                 if student_result.data:
                     student_classroom_ids = [s["classroom_id"] for s in student_result.data if s.get("classroom_id")]
                     if classroom_id not in student_classroom_ids:
@@ -313,7 +312,7 @@ async def get_classroom(
                             detail="Bạn chỉ có thể xem các lớp mà bạn đang học"
                         )
                     # Lấy thông tin lớp
-                    result = supabase.table("classrooms").select("*").eq("id", classroom_id).execute()
+                    result = await supabase.table("classrooms").select("*").eq("id", classroom_id).execute()
                     if not result.data:
                         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
                     return result.data[0]
@@ -355,14 +354,14 @@ async def update_classroom(
     classroom_id: str,
     classroom_data: ClassroomUpdate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Cập nhật thông tin lớp học (chỉ admin)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Tồn tại lớp?
-    existing = supabase.table("classrooms").select("id").eq("id", classroom_id).execute()
+    existing = await supabase.table("classrooms").select("id").eq("id", classroom_id).execute()
     if not existing.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
 
@@ -374,31 +373,31 @@ async def update_classroom(
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom code must be in format Class0001, Class0002, etc.")
         
         code_check = (
-            supabase.table("classrooms").select("id").eq("code", classroom_data.code).neq("id", classroom_id).execute()
+            await supabase.table("classrooms").select("id").eq("code", classroom_data.code).neq("id", classroom_id).execute()
         )
         if code_check.data:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Classroom code already exists")
 
     # Kiểm tra teacher tồn tại nếu thay đổi teacher_id
     if classroom_data.teacher_id:
-        teacher = supabase.table("teachers").select("id").eq("id", classroom_data.teacher_id).execute()
+        teacher = await supabase.table("teachers").select("id").eq("id", classroom_data.teacher_id).execute()
         if not teacher.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Teacher not found")
 
     # Kiểm tra subject tồn tại nếu thay đổi subject_id
     if classroom_data.subject_id:
-        subject = supabase.table("subjects").select("id").eq("id", classroom_data.subject_id).execute()
+        subject = await supabase.table("subjects").select("id").eq("id", classroom_data.subject_id).execute()
         if not subject.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subject not found")
 
     # Kiểm tra campus tồn tại nếu thay đổi campus_id
     if classroom_data.campus_id:
-        campus = supabase.table("campuses").select("id").eq("id", classroom_data.campus_id).execute()
+        campus = await supabase.table("campuses").select("id").eq("id", classroom_data.campus_id).execute()
         if not campus.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campus not found")
 
     update_data = classroom_data.dict(exclude_unset=True)
-    result = supabase.table("classrooms").update(update_data).eq("id", classroom_id).execute()
+    result = await supabase.table("classrooms").update(update_data).eq("id", classroom_id).execute()
     if not result.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update classroom")
     return result.data[0]
@@ -408,17 +407,17 @@ async def update_classroom(
 async def delete_classroom(
     classroom_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Xóa lớp học (chỉ admin)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
-    existing = supabase.table("classrooms").select("id").eq("id", classroom_id).execute()
+    existing = await supabase.table("classrooms").select("id").eq("id", classroom_id).execute()
     if not existing.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
 
-    result = supabase.table("classrooms").delete().eq("id", classroom_id).execute()
+    result = await supabase.table("classrooms").delete().eq("id", classroom_id).execute()
     if not result.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to delete classroom")
     return {"message": "Classroom deleted successfully"}
@@ -434,14 +433,14 @@ async def add_students_to_classroom(
     classroom_id: str,
     payload: ClassroomAssignStudents,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Thêm nhiều học sinh vào lớp (chỉ admin)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Check classroom exists
-    existing = supabase.table("classrooms").select("id").eq("id", classroom_id).execute()
+    existing = await supabase.table("classrooms").select("id").eq("id", classroom_id).execute()
     if not existing.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
 
@@ -450,10 +449,10 @@ async def add_students_to_classroom(
         return {"updated": 0}
 
     # Update students' classroom_id
-    update_result = supabase.table("students").update({"classroom_id": classroom_id}).in_("id", ids).execute()
+    update_result = await supabase.table("students").update({"classroom_id": classroom_id}).in_("id", ids).execute()
 
     # Supabase python client doesn't return affected count reliably; fetch to count
-    updated_students = supabase.table("students").select("id").eq("classroom_id", classroom_id).in_("id", ids).execute()
+    updated_students = await supabase.table("students").select("id").eq("classroom_id", classroom_id).in_("id", ids).execute()
     return {"updated": len(updated_students.data or [])}
 
 
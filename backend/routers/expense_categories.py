@@ -6,9 +6,8 @@ Router cho quản lý danh mục chi phí
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Optional
 from pydantic import BaseModel, constr
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user_dev
 
 router = APIRouter()
@@ -47,16 +46,16 @@ class ExpenseCategoryResponse(BaseModel):
         from_attributes = True
 
 
-def _generate_next_category_code(supabase: Client) -> str:
+async def _generate_next_category_code(supabase: Database) -> str:
     """Hàm helper để tạo mã danh mục tiếp theo theo mẫu DM001, DM002, ..."""
     # Lấy tất cả code dạng DM### (giới hạn để an toàn)
-    codes_res = supabase.table('expense_categories').select('code').ilike('code', 'DM%').limit(1000).execute()
+    codes_res = await supabase.table('expense_categories').select('code').ilike('code', 'DM%').limit(1000).execute()
     
     # Tìm mã tiếp theo có sẵn
     attempt = 1
     while attempt <= 999:  # Giới hạn tối đa DM999
         candidate = f"DM{attempt:03d}"
-        dup = supabase.table('expense_categories').select('id').eq('code', candidate).execute()
+        dup = await supabase.table('expense_categories').select('id').eq('code', candidate).execute()
         if not dup.data:
             return candidate
         attempt += 1
@@ -70,11 +69,11 @@ def _generate_next_category_code(supabase: Client) -> str:
 @router.get("/next-code")
 async def get_next_category_code(
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy mã danh mục tiếp theo theo mẫu DM001, DM002, ..."""
     try:
-        next_code = _generate_next_category_code(supabase)
+        next_code = await _generate_next_category_code(supabase)
         return {"next_code": next_code}
     except HTTPException:
         raise
@@ -89,7 +88,7 @@ async def get_next_category_code(
 async def create_expense_category(
     category_data: ExpenseCategoryCreate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo danh mục chi phí mới"""
     try:
@@ -97,12 +96,12 @@ async def create_expense_category(
         category_code = category_data.code
         if not category_code or not category_code.strip():
             # Lấy mã tiếp theo
-            category_code = _generate_next_category_code(supabase)
+            category_code = await _generate_next_category_code(supabase)
         else:
             # Normalize code: uppercase và strip
             category_code = category_code.strip().upper()
             # Check if code already exists
-            existing = supabase.table('expense_categories').select('id').eq('code', category_code).execute()
+            existing = await supabase.table('expense_categories').select('id').eq('code', category_code).execute()
             if existing.data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -117,7 +116,7 @@ async def create_expense_category(
             del category_dict['created_by']
 
         # Insert và chỉ select các cột cần thiết (không có created_by)
-        result = supabase.table('expense_categories').insert(
+        result = await supabase.table('expense_categories').insert(
             category_dict
         ).select('id, name, code, description, color, is_active, sort_order, created_at, updated_at').execute()
 
@@ -146,7 +145,7 @@ async def create_expense_category(
 async def get_expense_categories(
     is_active: Optional[bool] = None,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách danh mục chi phí"""
     try:
@@ -157,7 +156,7 @@ async def get_expense_categories(
             query = query.eq('is_active', is_active)
         
         query = query.order('sort_order').order('name')
-        result = query.execute()
+        result = await query.execute()
 
         # Loại bỏ created_by nếu có trong response (phòng trường hợp cache)
         categories = []
@@ -178,12 +177,12 @@ async def get_expense_categories(
 async def get_expense_category(
     category_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin danh mục chi phí"""
     try:
         # Chỉ select các cột cần thiết (không có created_by)
-        result = supabase.table('expense_categories').select(
+        result = await supabase.table('expense_categories').select(
             'id, name, code, description, color, is_active, sort_order, created_at, updated_at'
         ).eq('id', category_id).single().execute()
 
@@ -213,12 +212,12 @@ async def update_expense_category(
     category_id: str,
     category_data: ExpenseCategoryUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật danh mục chi phí"""
     try:
         # Check if category exists
-        existing = supabase.table('expense_categories').select('id').eq('id', category_id).single().execute()
+        existing = await supabase.table('expense_categories').select('id').eq('id', category_id).single().execute()
         if not existing.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -227,7 +226,7 @@ async def update_expense_category(
 
         # Check if code already exists (if updating code)
         if category_data.code:
-            code_check = supabase.table('expense_categories').select('id').eq('code', category_data.code).neq('id', category_id).execute()
+            code_check = await supabase.table('expense_categories').select('id').eq('code', category_data.code).neq('id', category_id).execute()
             if code_check.data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -241,7 +240,7 @@ async def update_expense_category(
             del update_dict['created_by']
         
         # Update và chỉ select các cột cần thiết (không có created_by)
-        result = supabase.table('expense_categories').update(update_dict).eq('id', category_id).select(
+        result = await supabase.table('expense_categories').update(update_dict).eq('id', category_id).select(
             'id, name, code, description, color, is_active, sort_order, created_at, updated_at'
         ).execute()
 
@@ -270,12 +269,12 @@ async def update_expense_category(
 async def delete_expense_category(
     category_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa danh mục chi phí"""
     try:
         # Check if category exists
-        existing = supabase.table('expense_categories').select('id').eq('id', category_id).single().execute()
+        existing = await supabase.table('expense_categories').select('id').eq('id', category_id).single().execute()
         if not existing.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -283,14 +282,14 @@ async def delete_expense_category(
             )
 
         # Check if category is used in finances
-        finances_check = supabase.table('finances').select('id').eq('category', existing.data.get('code')).limit(1).execute()
+        finances_check = await supabase.table('finances').select('id').eq('category', existing.data.get('code')).limit(1).execute()
         if finances_check.data:
             # Instead of deleting, deactivate it
-            result = supabase.table('expense_categories').update({'is_active': False}).eq('id', category_id).execute()
+            result = await supabase.table('expense_categories').update({'is_active': False}).eq('id', category_id).execute()
             return {"message": "Danh mục đã được vô hiệu hóa vì đang được sử dụng", "deactivated": True}
         else:
             # Delete if not used
-            result = supabase.table('expense_categories').delete().eq('id', category_id).execute()
+            result = await supabase.table('expense_categories').delete().eq('id', category_id).execute()
             return {"message": "Danh mục đã được xóa", "deleted": True}
     except HTTPException:
         raise
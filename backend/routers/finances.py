@@ -7,10 +7,11 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user_dev, get_current_user
+from services import finance_ledger
+from services.finance_aggregates import finance_totals
 import re
 
 router = APIRouter()
@@ -52,6 +53,15 @@ class FinanceResponse(BaseModel):
     created_at: str
     updated_at: str
 
+async def _ensure_open_period(supabase: Database, *dates) -> None:
+    """Không cho ghi giao dịch vào tháng đã khóa sổ"""
+    closed = await finance_ledger.closed_months(supabase, dates)
+    if closed:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Finance period {', '.join(m[:7] for m in closed)} is closed"
+        )
+
 def is_valid_uuid(uuid_string):
     """Kiểm tra xem string có phải UUID hợp lệ không"""
     uuid_pattern = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
@@ -61,7 +71,7 @@ def is_valid_uuid(uuid_string):
 async def create_finance(
     finance_data: FinanceCreate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo giao dịch tài chính mới"""
     try:
@@ -97,7 +107,8 @@ async def create_finance(
         if user_id:
             finance_dict['created_by'] = user_id
         
-        result = supabase.table('finances').insert(finance_dict).execute()
+        await _ensure_open_period(supabase, finance_data.date)
+        result = await supabase.table('finances').insert(finance_dict).execute()
         
         if not result.data:
             raise HTTPException(
@@ -105,6 +116,7 @@ async def create_finance(
                 detail="Failed to create finance record"
             )
         
+        await finance_ledger.record_change(supabase, None, result.data[0])
         return FinanceResponse(**result.data[0])
     except HTTPException:
         raise
@@ -123,7 +135,7 @@ async def get_finances(
     classroom_id: Optional[str] = Query(None),
     student_id: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách giao dịch tài chính"""
     try:
@@ -141,7 +153,7 @@ async def get_finances(
         query = query.order('date', desc=True)
         query = query.range(skip, skip + limit - 1)
         
-        result = query.execute()
+        result = await query.execute()
         
         return [FinanceResponse(**item) for item in result.data]
     except Exception as e:
@@ -154,11 +166,11 @@ async def get_finances(
 async def get_finance(
     finance_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin một giao dịch tài chính"""
     try:
-        result = supabase.table('finances').select('*').eq('id', finance_id).single().execute()
+        result = await supabase.table('finances').select('*').eq('id', finance_id).single().execute()
         
         if not result.data:
             raise HTTPException(
@@ -180,17 +192,18 @@ async def update_finance(
     finance_id: str,
     finance_data: FinanceUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật giao dịch tài chính"""
     try:
         # Check if finance exists
-        check_result = supabase.table('finances').select('id').eq('id', finance_id).single().execute()
+        check_result = await supabase.table('finances').select('*').eq('id', finance_id).single().execute()
         if not check_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Finance record not found"
             )
+        previous = check_result.data
         
         # Build update data
         update_data = {}
@@ -218,7 +231,8 @@ async def update_finance(
         # Không cập nhật created_by khi update
         # created_by chỉ được set khi tạo mới
         
-        result = supabase.table('finances').update(update_data).eq('id', finance_id).execute()
+        await _ensure_open_period(supabase, previous.get('date'), update_data.get('date'))
+        result = await supabase.table('finances').update(update_data).eq('id', finance_id).execute()
         
         if not result.data:
             raise HTTPException(
@@ -226,6 +240,7 @@ async def update_finance(
                 detail="Failed to update finance record"
             )
         
+        await finance_ledger.record_change(supabase, previous, result.data[0])
         return FinanceResponse(**result.data[0])
     except HTTPException:
         raise
@@ -239,19 +254,21 @@ async def update_finance(
 async def delete_finance(
     finance_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa giao dịch tài chính"""
     try:
         # Check if finance exists
-        check_result = supabase.table('finances').select('id').eq('id', finance_id).single().execute()
+        check_result = await supabase.table('finances').select('*').eq('id', finance_id).single().execute()
         if not check_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Finance record not found"
             )
         
-        supabase.table('finances').delete().eq('id', finance_id).execute()
+        await _ensure_open_period(supabase, check_result.data.get('date'))
+        await supabase.table('finances').delete().eq('id', finance_id).execute()
+        await finance_ledger.record_change(supabase, check_result.data, None)
         
         return {"message": "Finance record deleted successfully"}
     except HTTPException:
@@ -266,22 +283,16 @@ async def delete_finance(
 async def get_finance_summary(
     classroom_id: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy tổng quan tài chính"""
     try:
-        query_income = supabase.table('finances').select('amount').eq('finance_type', 'income')
-        query_expense = supabase.table('finances').select('amount').eq('finance_type', 'expense')
-        
-        if classroom_id:
-            query_income = query_income.eq('classroom_id', classroom_id)
-            query_expense = query_expense.eq('classroom_id', classroom_id)
-        
-        income_result = query_income.execute()
-        expense_result = query_expense.execute()
-        
-        total_income = sum(float(item['amount']) for item in income_result.data) if income_result.data else 0
-        total_expense = sum(float(item['amount']) for item in expense_result.data) if expense_result.data else 0
+        # Đọc từ snapshot theo tháng; tính lại từ finances nếu chưa có ledger
+        totals = await finance_ledger.load_totals(supabase, classroom_id=classroom_id)
+        if totals is None:
+            totals = await finance_totals(supabase, classroom_id=classroom_id)
+        total_income = totals['totals']['income']
+        total_expense = totals['totals']['expense']
         profit = total_income - total_expense
         
         return {
@@ -295,3 +306,121 @@ async def get_finance_summary(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching finance summary: {str(e)}"
         )
+
+@router.get("/stats/monthly")
+async def get_monthly_finance_summary(
+    year: Optional[int] = Query(None, ge=2000, le=2100, description="Mặc định là năm hiện tại"),
+    classroom_id: Optional[str] = Query(None),
+    current_user = Depends(get_current_user_dev),
+    supabase: Database = Depends(get_db)
+):
+    """Thu/chi/lợi nhuận từng tháng trong năm (đọc snapshot sổ cái)"""
+    try:
+        year = year or datetime.now().year
+        totals = await finance_ledger.load_totals(supabase, f"{year}-01-01", f"{year}-12-01", classroom_id)
+        if totals is None:
+            totals = await finance_totals(supabase, f"{year}-01-01", f"{year}-12-31T23:59:59.999999", classroom_id)
+        
+        months = []
+        for month in range(1, 13):
+            key = f"{year}-{month:02d}-01"
+            income = totals['by_month']['income'].get(key, 0.0)
+            expense = totals['by_month']['expense'].get(key, 0.0)
+            months.append({
+                "month": key[:7],
+                "total_income": income,
+                "total_expense": expense,
+                "profit": income - expense
+            })
+        total_income = sum(m['total_income'] for m in months)
+        total_expense = sum(m['total_expense'] for m in months)
+        return {
+            "year": year,
+            "classroom_id": classroom_id,
+            "months": months,
+            "total_income": total_income,
+            "total_expense": total_expense,
+            "profit": total_income - total_expense
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching monthly finance summary: {str(e)}"
+        )
+
+# ==================== LEDGER ====================
+
+class LedgerCloseRequest(BaseModel):
+    month: str  # YYYY-MM
+    notes: Optional[str] = None
+
+@router.get("/ledger/periods")
+async def get_closed_periods(
+    current_user = Depends(get_current_user_dev),
+    supabase: Database = Depends(get_db)
+):
+    """Danh sách các tháng đã khóa sổ"""
+    try:
+        result = await supabase.table('finance_ledger_periods').select('*').order('month', desc=True).execute()
+        return result.data or []
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching closed periods: {str(e)}"
+        )
+
+@router.post("/ledger/close")
+async def close_period(
+    request: LedgerCloseRequest,
+    current_user = Depends(get_current_user_dev),
+    supabase: Database = Depends(get_db)
+):
+    """Khóa sổ một tháng (chỉ admin): snapshot được tính lại lần cuối rồi đóng băng"""
+    if current_user.role != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    try:
+        month = finance_ledger.month_of(request.month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be in format YYYY-MM")
+    if month >= datetime.now().strftime("%Y-%m-01"):
+        raise HTTPException(status_code=400, detail="Only past months can be closed")
+    
+    try:
+        closed_by = current_user.id if is_valid_uuid(current_user.id) else None
+        await finance_ledger.close_month(supabase, month, closed_by, request.notes)
+        return {"message": f"Finance period {month[:7]} closed", "month": month}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error closing finance period: {str(e)}"
+        )
+
+@router.post("/ledger/rebuild")
+async def rebuild_ledger(
+    month: Optional[str] = Query(None, description="YYYY-MM; bỏ trống = mọi tháng chưa khóa"),
+    current_user = Depends(get_current_user_dev),
+    supabase: Database = Depends(get_db)
+):
+    """Tính lại snapshot sổ cái từ finances (chỉ admin; tháng đã khóa không đổi)"""
+    if current_user.role != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    try:
+        if month:
+            finance_ledger.month_of(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be in format YYYY-MM")
+    
+    try:
+        rows = await finance_ledger.rebuild(supabase, month)
+        return {"message": "Finance ledger rebuilt", "snapshot_rows": rows}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error rebuilding finance ledger: {str(e)}"
+        )
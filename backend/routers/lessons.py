@@ -7,9 +7,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from models.user import User, UserRole
 from models.lesson import Lesson, LessonCreate, LessonUpdate
 from routers.auth import get_current_user
@@ -17,10 +16,10 @@ from routers.auth import get_current_user
 router = APIRouter()
 
 
-def get_teacher_id_from_user(supabase: Client, user_id: str) -> Optional[str]:
+async def get_teacher_id_from_user(supabase: Database, user_id: str) -> Optional[str]:
     """Lấy teacher_id từ user_id"""
     try:
-        result = supabase.table("teachers").select("id").eq("user_id", user_id).execute()
+        result = await supabase.table("teachers").select("id").eq("user_id", user_id).execute()
         if result.data and len(result.data) > 0:
             return result.data[0]["id"]
         return None
@@ -29,8 +28,8 @@ def get_teacher_id_from_user(supabase: Client, user_id: str) -> Optional[str]:
         return None
 
 
-def validate_classroom_access(
-    supabase: Client,
+async def validate_classroom_access(
+    supabase: Database,
     classroom_id: str,
     current_user: User
 ) -> bool:
@@ -40,12 +39,12 @@ def validate_classroom_access(
 
     if current_user.role == UserRole.TEACHER:
         # Lấy teacher_id từ user
-        teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+        teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
         if not teacher_id:
             return False
 
         # Kiểm tra classroom có thuộc về giáo viên này không
-        classroom_result = supabase.table("classrooms").select("teacher_id").eq("id", classroom_id).execute()
+        classroom_result = await supabase.table("classrooms").select("teacher_id").eq("id", classroom_id).execute()
         if not classroom_result.data:
             return False
 
@@ -55,8 +54,8 @@ def validate_classroom_access(
     return False
 
 
-def validate_lesson_access(
-    supabase: Client,
+async def validate_lesson_access(
+    supabase: Database,
     lesson_id: str,
     current_user: User
 ) -> bool:
@@ -66,17 +65,17 @@ def validate_lesson_access(
 
     if current_user.role == UserRole.TEACHER:
         # Lấy teacher_id từ user
-        teacher_id = get_teacher_id_from_user(supabase, current_user.id)
+        teacher_id = await get_teacher_id_from_user(supabase, current_user.id)
         if not teacher_id:
             return False
 
         # Kiểm tra lesson thông qua classroom
-        lesson_result = supabase.table("lessons").select("classroom_id").eq("id", lesson_id).execute()
+        lesson_result = await supabase.table("lessons").select("classroom_id").eq("id", lesson_id).execute()
         if not lesson_result.data:
             return False
 
         classroom_id = lesson_result.data[0].get("classroom_id")
-        return validate_classroom_access(supabase, classroom_id, current_user)
+        return await validate_classroom_access(supabase, classroom_id, current_user)
 
     return False
 
@@ -100,7 +99,7 @@ class CopyLessonsResponse(BaseModel):
 async def get_lessons_by_classroom(
     classroom_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách bài học theo lớp học"""
     # Kiểm tra quyền truy cập
@@ -112,7 +111,7 @@ async def get_lessons_by_classroom(
 
     # Nếu là giáo viên hoặc admin, kiểm tra quyền truy cập classroom
     if current_user.role in [UserRole.ADMIN, UserRole.TEACHER]:
-        if not validate_classroom_access(supabase, classroom_id, current_user):
+        if not await validate_classroom_access(supabase, classroom_id, current_user):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Không có quyền truy cập lớp học này"
@@ -120,7 +119,7 @@ async def get_lessons_by_classroom(
 
     # Nếu là học sinh, kiểm tra xem có thuộc lớp này không
     if current_user.role == UserRole.STUDENT:
-        student_result = supabase.table("students").select("classroom_id").eq("user_id", current_user.id).execute()
+        student_result = await supabase.table("students").select("classroom_id").eq("user_id", current_user.id).execute()
         if not student_result.data or student_result.data[0].get("classroom_id") != classroom_id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -129,7 +128,7 @@ async def get_lessons_by_classroom(
 
     try:
         # Lấy lessons theo classroom_id, sắp xếp theo sort_order và created_at
-        result = supabase.table("lessons").select("*").eq("classroom_id", classroom_id).execute()
+        result = await supabase.table("lessons").select("*").eq("classroom_id", classroom_id).execute()
 
         lessons = result.data or []
 
@@ -149,7 +148,7 @@ async def get_lessons_by_classroom(
 async def create_lesson(
     lesson_data: LessonCreate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo bài học mới"""
     if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
@@ -159,7 +158,7 @@ async def create_lesson(
         )
 
     # Kiểm tra quyền truy cập classroom
-    if not validate_classroom_access(supabase, lesson_data.classroom_id, current_user):
+    if not await validate_classroom_access(supabase, lesson_data.classroom_id, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Không có quyền tạo bài học cho lớp học này"
@@ -185,7 +184,7 @@ async def create_lesson(
         lesson_dict["shared_classroom_ids"] = lesson_dict.get("shared_classroom_ids") or []
 
         # Tạo lesson
-        result = supabase.table("lessons").insert(lesson_dict).execute()
+        result = await supabase.table("lessons").insert(lesson_dict).execute()
 
         if not result.data:
             raise HTTPException(
@@ -214,7 +213,7 @@ async def create_lesson(
                 })
 
             if lesson_files_data:
-                supabase.table("lesson_files").insert(lesson_files_data).execute()
+                await supabase.table("lesson_files").insert(lesson_files_data).execute()
 
         return lesson
 
@@ -230,7 +229,7 @@ async def update_lesson(
     lesson_id: str,
     lesson_data: LessonUpdate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật bài học"""
     if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
@@ -240,7 +239,7 @@ async def update_lesson(
         )
 
     # Kiểm tra quyền truy cập lesson
-    if not validate_lesson_access(supabase, lesson_id, current_user):
+    if not await validate_lesson_access(supabase, lesson_id, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Không có quyền cập nhật bài học này"
@@ -270,7 +269,7 @@ async def update_lesson(
             update_dict["shared_classroom_ids"] = update_dict["shared_classroom_ids"] or []
 
         # Cập nhật lesson
-        result = supabase.table("lessons").update(update_dict).eq("id", lesson_id).execute()
+        result = await supabase.table("lessons").update(update_dict).eq("id", lesson_id).execute()
 
         if not result.data:
             raise HTTPException(
@@ -287,7 +286,7 @@ async def update_lesson(
             storage_paths = update_dict.get("storage_paths", [])
 
             # Get current max sort_order for this lesson
-            existing_files = supabase.table("lesson_files").select("sort_order").eq("lesson_id", lesson_id).execute()
+            existing_files = await supabase.table("lesson_files").select("sort_order").eq("lesson_id", lesson_id).execute()
             max_sort_order = max([f.get("sort_order", 0) for f in existing_files.data or []], default=-1)
 
             # Add new files
@@ -304,7 +303,7 @@ async def update_lesson(
                 })
 
             if lesson_files_data:
-                supabase.table("lesson_files").insert(lesson_files_data).execute()
+                await supabase.table("lesson_files").insert(lesson_files_data).execute()
 
         return lesson
 
@@ -319,7 +318,7 @@ async def update_lesson(
 async def delete_lesson(
     lesson_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa bài học"""
     if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
@@ -329,7 +328,7 @@ async def delete_lesson(
         )
 
     # Kiểm tra quyền truy cập lesson
-    if not validate_lesson_access(supabase, lesson_id, current_user):
+    if not await validate_lesson_access(supabase, lesson_id, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Không có quyền xóa bài học này"
@@ -337,10 +336,10 @@ async def delete_lesson(
 
     try:
         # Lấy thông tin lesson để xóa file nếu cần
-        lesson_result = supabase.table("lessons").select("storage_path").eq("id", lesson_id).execute()
+        lesson_result = await supabase.table("lessons").select("storage_path").eq("id", lesson_id).execute()
 
         # Xóa lesson
-        result = supabase.table("lessons").delete().eq("id", lesson_id).execute()
+        result = await supabase.table("lessons").delete().eq("id", lesson_id).execute()
 
         if not result.data:
             raise HTTPException(
@@ -364,7 +363,7 @@ async def delete_lesson(
 async def copy_lessons(
     copy_data: CopyLessonsRequest,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Sao chép nhiều bài học sang lớp khác"""
     if current_user.role not in [UserRole.ADMIN, UserRole.TEACHER]:
@@ -381,14 +380,14 @@ async def copy_lessons(
 
     # Kiểm tra quyền truy cập tất cả lessons
     for lesson_id in copy_data.lesson_ids:
-        if not validate_lesson_access(supabase, lesson_id, current_user):
+        if not await validate_lesson_access(supabase, lesson_id, current_user):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Không có quyền truy cập bài học {lesson_id}"
             )
 
     # Kiểm tra quyền truy cập target classroom
-    if not validate_classroom_access(supabase, copy_data.target_classroom_id, current_user):
+    if not await validate_classroom_access(supabase, copy_data.target_classroom_id, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Không có quyền tạo bài học cho lớp đích"
@@ -396,7 +395,7 @@ async def copy_lessons(
 
     try:
         # Lấy thông tin các lessons cần copy
-        lessons_result = supabase.table("lessons").select("*").in_("id", copy_data.lesson_ids).execute()
+        lessons_result = await supabase.table("lessons").select("*").in_("id", copy_data.lesson_ids).execute()
         lessons_to_copy = lessons_result.data or []
 
         if len(lessons_to_copy) != len(copy_data.lesson_ids):
@@ -422,7 +421,7 @@ async def copy_lessons(
                 if copy_data.target_classroom_id not in new_lesson.get("shared_classroom_ids", []):
                     new_lesson["shared_classroom_ids"] = new_lesson.get("shared_classroom_ids", []) + [copy_data.target_classroom_id]
 
-                supabase.table("lessons").insert(new_lesson).execute()
+                await supabase.table("lessons").insert(new_lesson).execute()
                 copied_count += 1
 
             except Exception as e:
@@ -3,96 +3,310 @@ Notifications Router
 Router cho hệ thống thông báo
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
-from supabase import Client
+import asyncio
+import json
+from postgrest.types import ReturnMethod
 
-from database import get_db
+from config import settings
+from database import get_db, Database
 from routers.auth import get_current_user_dev
 from models.notification import (
-    NotificationCreate, NotificationUpdate, NotificationResponse,
+    NotificationCreate, NotificationResponse,
     NotificationTemplateCreate, NotificationTemplateUpdate, NotificationTemplateResponse,
-    SendNotificationRequest
+    SendNotificationRequest, SendNotificationResponse
 )
+from services import notification_broker as broker
+from services.background_jobs import BackgroundJob, job_registry
+from services.paging import stream_rows
+from services.relations import Relation, fetch_in_paged, hydrate
+from services.ttl_cache import TTLCache
 
 router = APIRouter()
 
 # ==================== NOTIFICATIONS ====================
 
+# Quan hệ dùng để hiển thị người nhận/lớp của thông báo
+RECIPIENT_RELATIONS = {
+    'teacher': Relation('teachers', 'teacher_id', 'id, user_id', nested={
+        'user': Relation('users', 'user_id', 'id, full_name'),
+    }),
+    'student': Relation('students', 'student_id', 'id, user_id, student_code', nested={
+        'user': Relation('users', 'user_id', 'id, full_name'),
+    }),
+    'classroom': Relation('classrooms', 'classroom_id', '*'),
+}
+
+# Tên hiển thị ít thay đổi: cache theo (loại, id)
+_display_names = TTLCache(
+    max_entries=settings.NOTIFICATION_NAME_CACHE_MAX_ENTRIES,
+    ttl=settings.NOTIFICATION_NAME_CACHE_TTL_SECONDS,
+)
+
+def _display_fields(kind: str, record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if kind == 'teacher':
+        if record is None:
+            return {'teacher_name': None}
+        return {'teacher_name': (record.get('user') or {}).get('full_name') or 'Giáo viên'}
+    if kind == 'student':
+        if record is None:
+            return {'student_name': None, 'student_code': None}
+        return {
+            'student_name': (record.get('user') or {}).get('full_name') or 'Học sinh',
+            'student_code': record.get('student_code'),
+        }
+    if record is None:
+        return {'classroom_name': None, 'classroom_grade': None}
+    grade = record.get('grade')
+    return {'classroom_name': record.get('name'), 'classroom_grade': str(grade) if grade is not None else None}
+
+async def _enrich_notifications(supabase: Database, notifications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gắn teacher_name, student_name/code, classroom_name/grade cho cả trang.
+
+    Tên lấy từ cache; các id chưa có trong cache được tải bằng một query in_()
+    cho mỗi bảng (hydrate), rồi đưa vào cache."""
+    keys = {
+        (kind, notification[relation.foreign_key])
+        for notification in notifications
+        for kind, relation in RECIPIENT_RELATIONS.items()
+        if notification.get(relation.foreign_key)
+    }
+    fields = _display_names.get_many(keys)
+
+    missing = [key for key in keys if key not in fields]
+    if missing:
+        # Mỗi dòng giả chỉ mang khóa ngoại cần tải
+        pending = [{RECIPIENT_RELATIONS[kind].foreign_key: record_id, '_key': (kind, record_id)} for kind, record_id in missing]
+        await hydrate(supabase, pending, RECIPIENT_RELATIONS)
+        loaded = {row['_key']: _display_fields(row['_key'][0], row.get(row['_key'][0])) for row in pending}
+        _display_names.set_many(loaded)
+        fields.update(loaded)
+
+    enriched_notifications = []
+    for notification in notifications:
+        enriched = dict(notification)
+        for kind, relation in RECIPIENT_RELATIONS.items():
+            record_id = notification.get(relation.foreign_key)
+            if record_id:
+                enriched.update(fields.get((kind, record_id)) or _display_fields(kind, None))
+        enriched_notifications.append(enriched)
+    return enriched_notifications
+
+# user_id -> hồ sơ người nhận (giáo viên/học sinh), ít thay đổi
+_recipients = TTLCache(
+    max_entries=settings.NOTIFICATION_NAME_CACHE_MAX_ENTRIES,
+    ttl=settings.NOTIFICATION_NAME_CACHE_TTL_SECONDS,
+)
+
+# Số thông báo chưa đọc theo người nhận: ("teacher", id), ("student", id) hoặc
+# ALL_UNREAD (admin xem tất cả). Được cộng/trừ khi tạo/đọc thông báo; hết hạn sau
+# NOTIFICATION_UNREAD_CACHE_TTL_SECONDS để khớp lại với thay đổi từ worker khác.
+ALL_UNREAD = ('all', None)
+_unread_counts = TTLCache(
+    max_entries=settings.NOTIFICATION_NAME_CACHE_MAX_ENTRIES,
+    ttl=settings.NOTIFICATION_UNREAD_CACHE_TTL_SECONDS,
+)
+
+def _unread_keys(notification: Dict[str, Any]) -> List[Tuple[str, Optional[str]]]:
+    """Các bộ đếm chứa thông báo này"""
+    keys = [ALL_UNREAD]
+    recipient_type = notification.get('recipient_type')
+    if recipient_type == 'teacher' and notification.get('teacher_id'):
+        keys.append(('teacher', notification['teacher_id']))
+    elif recipient_type == 'student' and notification.get('student_id'):
+        keys.append(('student', notification['student_id']))
+    return keys
+
+def _channels(keys: List[Tuple[str, Optional[str]]]) -> List[str]:
+    """Kênh của broker cho các người nhận ("teacher:<id>", "student:<id>", "all")"""
+    return [broker.ALL_CHANNEL if key == ALL_UNREAD else f"{key[0]}:{key[1]}" for key in keys]
+
+def _adjust_unread(keys: List[Tuple[str, Optional[str]]], delta: int) -> None:
+    for key in keys:
+        _unread_counts.update(key, lambda count: max(0, count + delta))
+
+async def _resolve_recipient(current_user, supabase: Database) -> Optional[Tuple[str, Optional[str]]]:
+    """("teacher", id) / ("student", id) theo user; ALL_UNREAD cho admin; None nếu user
+    không có hồ sơ giáo viên/học sinh"""
+    if current_user.role not in ('teacher', 'student'):
+        return ALL_UNREAD
+    recipient = _recipients.get(current_user.id)
+    if recipient is not None:
+        return recipient
+    table = 'teachers' if current_user.role == 'teacher' else 'students'
+    result = await supabase.table(table).select('id').eq('user_id', current_user.id).execute()
+    if not result.data:
+        return None
+    recipient = (current_user.role, result.data[0]['id'])
+    _recipients.set(current_user.id, recipient)
+    return recipient
+
+def _apply_recipient_filter(query, recipient: Tuple[str, Optional[str]]):
+    kind, recipient_id = recipient
+    if kind == 'teacher':
+        return query.eq('recipient_type', 'teacher').eq('teacher_id', recipient_id)
+    if kind == 'student':
+        return query.eq('recipient_type', 'student').eq('student_id', recipient_id)
+    return query
+
+async def _filter_for_recipient(query, current_user, supabase: Database):
+    """Giới hạn query theo người nhận; trả về None nếu user không có hồ sơ giáo viên/học sinh"""
+    recipient = await _resolve_recipient(current_user, supabase)
+    if recipient is None:
+        return None
+    return _apply_recipient_filter(query, recipient)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(',')}
+    return '*' in candidates or etag in candidates or etag.removeprefix('W/') in candidates
+
 @router.get("/", response_model=List[NotificationResponse])
 async def get_notifications(
-    target_type: Optional[str] = Query(None),
-    is_read: Optional[bool] = Query(None),
-    limit: int = Query(50, ge=1, le=100),
-    offset: int = Query(0, ge=0),
+    teacher_id: Optional[str] = Query(None),
+    student_id: Optional[str] = Query(None),
+    classroom_id: Optional[str] = Query(None),
+    read: Optional[bool] = Query(None, description="Filter by read status (true/false)"),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
-    """Lấy danh sách thông báo cho user hiện tại"""
+    """
+    Lấy danh sách thông báo
+    
+    - Admin: Xem TẤT CẢ thông báo (của tất cả giáo viên và học sinh)
+    - Teacher: Chỉ xem thông báo được chỉ định cho chính họ
+    - Student: Chỉ xem thông báo được chỉ định cho chính họ
+    
+    Admin có thể filter bằng query params (teacher_id, student_id, classroom_id, read)
+    """
     try:
-        user_id = current_user.id if hasattr(current_user, 'id') else None
-        
-        # Lấy thông báo cho user hoặc all
         query = supabase.table('notifications').select('*')
         
-        # Filter theo target
-        if target_type:
-            query = query.eq('target_type', target_type)
-            if target_type == 'user' and user_id:
-                query = query.eq('target_id', user_id)
-        elif user_id:
-            # Mặc định lấy thông báo cho user và all
-            query = query.or_(f'target_type.eq.all,target_type.eq.user.and.target_id.eq.{user_id}')
+        # Admin: xem tất cả; Teacher/Student: chỉ xem thông báo được chỉ định cho chính họ
+        query = await _filter_for_recipient(query, current_user, supabase)
+        if query is None:
+            return []
         
-        # Filter theo is_read
-        if is_read is not None:
-            query = query.eq('is_read', is_read)
+        # Admin có thể filter bằng query params (optional filters)
+        if teacher_id and current_user.role == 'admin':
+            query = query.eq('teacher_id', teacher_id)
         
-        # Filter expired
-        now = datetime.now().isoformat()
-        query = query.or_(f'expires_at.is.null,expires_at.gt.{now}')
+        if student_id and current_user.role == 'admin':
+            query = query.eq('student_id', student_id)
+        
+        if classroom_id:
+            query = query.eq('classroom_id', classroom_id)
+        
+        if read is not None:
+            # Ensure read is a boolean
+            read_bool = bool(read) if read is not None else None
+            query = query.eq('read', read_bool)
+        
+        query = query.order('created_at', desc=True)
+        
+        result = await query.execute()
+        notifications = result.data or []
+        
+        # Enrich with recipient and classroom info
+        enriched_notifications = await _enrich_notifications(supabase, notifications)
+        
+        return enriched_notifications
         
-        result = query.order('created_at', desc=True).limit(limit).offset(offset).execute()
-        return result.data if result.data else []
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error fetching notifications: {str(e)}"
-        )
+        print(f"Error fetching notifications: {e}")
+        return []
 
 @router.get("/unread-count")
 async def get_unread_count(
+    request: Request,
+    response: Response,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
-    """Lấy số lượng thông báo chưa đọc"""
+    """Lấy số lượng thông báo chưa đọc
+
+    Trả về từ bộ đếm trong cache (chỉ chạy query count khi cache miss). Response có
+    ETag: client gửi lại If-None-Match sẽ nhận 304 nếu số lượng không đổi.
+    """
     try:
-        user_id = current_user.id if hasattr(current_user, 'id') else None
-        
-        query = supabase.table('notifications').select('id', count='exact')
-        query = query.eq('is_read', False)
-        
-        if user_id:
-            query = query.or_(f'target_type.eq.all,target_type.eq.user.and.target_id.eq.{user_id}')
-        
-        # Filter expired
-        now = datetime.now().isoformat()
-        query = query.or_(f'expires_at.is.null,expires_at.gt.{now}')
-        
-        result = query.execute()
-        return {"count": result.count if hasattr(result, 'count') else 0}
+        recipient = await _resolve_recipient(current_user, supabase)
+        if recipient is None:
+            count = 0
+        else:
+            count = _unread_counts.get(recipient)
+            if count is None:
+                query = supabase.table('notifications').select('id', count='exact').eq('read', False)
+                result = await _apply_recipient_filter(query, recipient).execute()
+                count = result.count if hasattr(result, 'count') and result.count is not None else 0
+                _unread_counts.set(recipient, count)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching unread count: {str(e)}"
         )
 
+    etag = f'W/"unread-{count}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return {"count": count}
+
+@router.get("/stream")
+async def stream_notifications(
+    current_user = Depends(get_current_user_dev),
+    supabase: Database = Depends(get_db)
+):
+    """Nhận thông báo mới theo thời gian thực (Server-Sent Events)
+
+    Sự kiện: `notification` (thông báo mới), `read`, `read_all`,
+    `notifications_created` (gửi hàng loạt) và `resync` (kết nối quá chậm nên đã
+    bỏ bớt sự kiện; client nên tải lại danh sách). Dòng `: keep-alive` được gửi
+    định kỳ để giữ kết nối qua proxy.
+    """
+    recipient = await _resolve_recipient(current_user, supabase)
+    if recipient is None:
+        raise HTTPException(status_code=404, detail="Recipient profile not found")
+    subscription = broker.notification_broker.subscribe(_channels([recipient]))
+    heartbeat = settings.NOTIFICATION_STREAM_HEARTBEAT_SECONDS
+
+    async def events():
+        try:
+            yield f"retry: {int(settings.NOTIFICATION_STREAM_RETRY_MS)}\n\n"
+            while True:
+                event = await subscription.get(timeout=heartbeat)
+                if subscription.dropped:
+                    subscription.dropped = 0
+                    yield "event: resync\ndata: {}\n\n"
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                data = json.dumps(event.get("data"), ensure_ascii=False, default=str)
+                yield f"event: {event.get('type', 'message')}\ndata: {data}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            # GZipMiddleware gom dữ liệu stream lại; "identity" để bỏ qua nén
+            "Content-Encoding": "identity",
+        },
+    )
+
 @router.post("/", response_model=NotificationResponse)
 async def create_notification(
     notification_data: NotificationCreate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo thông báo mới (chỉ admin)"""
     if current_user.role != 'admin':
@@ -102,91 +316,26 @@ async def create_notification(
         )
     
     try:
-        now = datetime.now().isoformat()
-        notification_dict = {
+        notification_record = {
+            'recipient_type': notification_data.recipient_type,
+            'teacher_id': notification_data.teacher_id if notification_data.recipient_type == 'teacher' else None,
+            'student_id': notification_data.student_id if notification_data.recipient_type == 'student' else None,
+            'classroom_id': notification_data.classroom_id,
+            'type': notification_data.type,
             'title': notification_data.title,
             'message': notification_data.message,
-            'notification_type': notification_data.notification_type,
-            'target_type': notification_data.target_type,
-            'target_id': notification_data.target_id,
-            'action_url': notification_data.action_url,
-            'metadata': notification_data.metadata or {},
-            'created_by': current_user.id if hasattr(current_user, 'id') else None,
-            'created_at': now,
-            'expires_at': notification_data.expires_at
+            'priority': notification_data.priority,
+            'read': False
         }
-        
-<<<<<<< HEAD
-        result = supabase.table('notifications').insert(notification_dict).execute()
-        return result.data[0]
-=======
-        result = supabase.table('notifications').insert(notification_record).execute()
+        result = await supabase.table('notifications').insert(notification_record).execute()
         
         if result.data and len(result.data) > 0:
             notification = result.data[0]
+            _adjust_unread(_unread_keys(notification_record), 1)
+            await broker.publish(_channels(_unread_keys(notification_record)), {"type": "notification", "data": notification})
             
             # Enrich with recipient info
-            enriched = dict(notification)
-            
-            # Get teacher name if teacher notification
-            if notification_data.recipient_type == 'teacher' and notification_data.teacher_id:
-                try:
-                    teacher_res = supabase.table('teachers').select('*, users(full_name)').eq('id', notification_data.teacher_id).execute()
-                    if teacher_res.data:
-                        teacher_data = teacher_res.data[0]
-                        # Handle nested users data safely
-                        users_data = teacher_data.get('users')
-                        if isinstance(users_data, dict):
-                            enriched['teacher_name'] = users_data.get('full_name') or teacher_data.get('name') or 'Giáo viên'
-                        elif isinstance(users_data, list) and len(users_data) > 0:
-                            enriched['teacher_name'] = users_data[0].get('full_name') or teacher_data.get('name') or 'Giáo viên'
-                        else:
-                            enriched['teacher_name'] = teacher_data.get('name') or 'Giáo viên'
-                    else:
-                        enriched['teacher_name'] = None
-                except Exception as e:
-                    print(f"Error fetching teacher info: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    enriched['teacher_name'] = None
-            
-            # Get student name if student notification
-            if notification_data.recipient_type == 'student' and notification_data.student_id:
-                try:
-                    student_res = supabase.table('students').select('*, users(full_name)').eq('id', notification_data.student_id).execute()
-                    if student_res.data:
-                        student_data = student_res.data[0]
-                        # Handle nested users data safely
-                        users_data = student_data.get('users')
-                        if isinstance(users_data, dict):
-                            enriched['student_name'] = users_data.get('full_name') or 'Học sinh'
-                        elif isinstance(users_data, list) and len(users_data) > 0:
-                            enriched['student_name'] = users_data[0].get('full_name') or 'Học sinh'
-                        else:
-                            enriched['student_name'] = 'Học sinh'
-                        enriched['student_code'] = student_data.get('student_code')
-                    else:
-                        enriched['student_name'] = None
-                        enriched['student_code'] = None
-                except Exception as e:
-                    print(f"Error fetching student info: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    enriched['student_name'] = None
-                    enriched['student_code'] = None
-            
-            # Get classroom info
-            if notification_data.classroom_id:
-                try:
-                    classroom_res = supabase.table('classrooms').select('name, grade').eq('id', notification_data.classroom_id).execute()
-                    if classroom_res.data:
-                        classroom_data = classroom_res.data[0]
-                        enriched['classroom_name'] = classroom_data.get('name')
-                        enriched['classroom_grade'] = classroom_data.get('grade')
-                except Exception as e:
-                    print(f"Error fetching classroom info: {e}")
-                    enriched['classroom_name'] = None
-                    enriched['classroom_grade'] = None
+            enriched = (await _enrich_notifications(supabase, [notification]))[0]
             
             return NotificationResponse(**enriched)
         else:
@@ -197,266 +346,33 @@ async def create_notification(
             
     except HTTPException:
         raise
->>>>>>> origin/master
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error creating notification: {str(e)}"
         )
 
-<<<<<<< HEAD
-@router.put("/{notification_id}", response_model=NotificationResponse)
-async def update_notification(
-=======
-@router.get("/", response_model=List[NotificationResponse])
-async def get_notifications(
-    teacher_id: Optional[str] = Query(None),
-    student_id: Optional[str] = Query(None),
-    classroom_id: Optional[str] = Query(None),
-    read: Optional[bool] = Query(None, description="Filter by read status (true/false)"),
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
-):
-    """
-    Lấy danh sách thông báo
-    
-    - Admin: Xem TẤT CẢ thông báo (của tất cả giáo viên và học sinh)
-    - Teacher: Chỉ xem thông báo được chỉ định cho chính họ
-    - Student: Chỉ xem thông báo được chỉ định cho chính họ
-    
-    Admin có thể filter bằng query params (teacher_id, student_id, classroom_id, read)
-    """
-    try:
-        query = supabase.table('notifications').select('*')
-        
-        # Filter based on current user role
-        # Admin: Không filter gì, xem tất cả thông báo
-        if current_user.role == 'teacher':
-            # Teacher: Chỉ xem thông báo được chỉ định cho chính họ
-            teacher_result = supabase.table('teachers').select('id').eq('user_id', current_user.id).execute()
-            if teacher_result.data:
-                # Show notifications where this teacher is the recipient
-                query = query.eq('recipient_type', 'teacher').eq('teacher_id', teacher_result.data[0]['id'])
-            else:
-                return []
-        elif current_user.role == 'student':
-            # Student: Chỉ xem thông báo được chỉ định cho chính họ
-            student_result = supabase.table('students').select('id').eq('user_id', current_user.id).execute()
-            if student_result.data:
-                # Show notifications where this student is the recipient
-                query = query.eq('recipient_type', 'student').eq('student_id', student_result.data[0]['id'])
-            else:
-                return []
-        # Admin: Không có filter mặc định, xem tất cả thông báo
-        
-        # Admin có thể filter bằng query params (optional filters)
-        if teacher_id and current_user.role == 'admin':
-            query = query.eq('teacher_id', teacher_id)
-        
-        if student_id and current_user.role == 'admin':
-            query = query.eq('student_id', student_id)
-        
-        if classroom_id:
-            query = query.eq('classroom_id', classroom_id)
-        
-        if read is not None:
-            # Ensure read is a boolean
-            read_bool = bool(read) if read is not None else None
-            query = query.eq('read', read_bool)
-        
-        query = query.order('created_at', desc=True)
-        
-        result = query.execute()
-        notifications = result.data or []
-        
-        # Enrich with recipient and classroom info
-        enriched_notifications = []
-        for notification in notifications:
-            try:
-                enriched = dict(notification)
-                
-                # Get teacher name if teacher notification
-                if notification.get('teacher_id'):
-                    try:
-                        teacher_res = supabase.table('teachers').select('*, users(full_name)').eq('id', notification['teacher_id']).execute()
-                        if teacher_res.data:
-                            teacher_data = teacher_res.data[0]
-                            # Handle nested users data safely
-                            users_data = teacher_data.get('users')
-                            if isinstance(users_data, dict):
-                                enriched['teacher_name'] = users_data.get('full_name') or teacher_data.get('name') or 'Giáo viên'
-                            elif isinstance(users_data, list) and len(users_data) > 0:
-                                enriched['teacher_name'] = users_data[0].get('full_name') or teacher_data.get('name') or 'Giáo viên'
-                            else:
-                                enriched['teacher_name'] = teacher_data.get('name') or 'Giáo viên'
-                        else:
-                            enriched['teacher_name'] = None
-                    except Exception as e:
-                        print(f"Error fetching teacher info for notification {notification.get('id')}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        enriched['teacher_name'] = None
-                
-                # Get student name if student notification
-                if notification.get('student_id'):
-                    try:
-                        student_res = supabase.table('students').select('*, users(full_name)').eq('id', notification['student_id']).execute()
-                        if student_res.data:
-                            student_data = student_res.data[0]
-                            # Handle nested users data safely
-                            users_data = student_data.get('users')
-                            if isinstance(users_data, dict):
-                                enriched['student_name'] = users_data.get('full_name') or 'Học sinh'
-                            elif isinstance(users_data, list) and len(users_data) > 0:
-                                enriched['student_name'] = users_data[0].get('full_name') or 'Học sinh'
-                            else:
-                                enriched['student_name'] = 'Học sinh'
-                            enriched['student_code'] = student_data.get('student_code')
-                        else:
-                            enriched['student_name'] = None
-                            enriched['student_code'] = None
-                    except Exception as e:
-                        print(f"Error fetching student info for notification {notification.get('id')}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        enriched['student_name'] = None
-                        enriched['student_code'] = None
-                
-                # Get classroom info
-                if notification.get('classroom_id'):
-                    try:
-                        classroom_res = supabase.table('classrooms').select('name, grade').eq('id', notification['classroom_id']).execute()
-                        if classroom_res.data:
-                            classroom_data = classroom_res.data[0]
-                            enriched['classroom_name'] = classroom_data.get('name')
-                            enriched['classroom_grade'] = classroom_data.get('grade')
-                        else:
-                            enriched['classroom_name'] = None
-                            enriched['classroom_grade'] = None
-                    except Exception as e:
-                        print(f"Error fetching classroom info for notification {notification.get('id')}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        enriched['classroom_name'] = None
-                        enriched['classroom_grade'] = None
-                
-                enriched_notifications.append(enriched)
-            except Exception as e:
-                print(f"Error enriching notification {notification.get('id', 'unknown')}: {e}")
-                import traceback
-                traceback.print_exc()
-                # Still add the notification without enrichment
-                enriched_notifications.append(dict(notification))
-        
-        return enriched_notifications
-        
-    except Exception as e:
-        print(f"Error fetching notifications: {e}")
-        return []
-
 @router.put("/{notification_id}/read", response_model=NotificationResponse)
 async def mark_notification_read(
->>>>>>> origin/master
     notification_id: str,
-    notification_data: NotificationUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
-    """Cập nhật thông báo (chủ yếu để đánh dấu đã đọc)"""
+    """Đánh dấu thông báo đã đọc"""
     try:
-        user_id = current_user.id if hasattr(current_user, 'id') else None
-        
-        # Kiểm tra notification có tồn tại không
-        existing = supabase.table('notifications').select('*').eq('id', notification_id).single().execute()
+        existing = await supabase.table('notifications').select('*').eq('id', notification_id).execute()
         if not existing.data:
             raise HTTPException(status_code=404, detail="Notification not found")
         
-        # Chỉ cho phép user đánh dấu đọc thông báo của mình
-        notification = existing.data
-        if notification.get('target_type') == 'user' and notification.get('target_id') != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not enough permissions"
-            )
-        
-        update_dict = {}
-        if notification_data.is_read is not None:
-            update_dict['is_read'] = notification_data.is_read
-            if notification_data.is_read:
-                update_dict['read_at'] = datetime.now().isoformat()
-        
-<<<<<<< HEAD
-        if update_dict:
-            result = supabase.table('notifications').update(update_dict).eq('id', notification_id).execute()
-            return result.data[0]
-        
-        return notification
-=======
+        result = await supabase.table('notifications').update({'read': True}).eq('id', notification_id).execute()
         if result.data and len(result.data) > 0:
             updated_notification = result.data[0]
+            if not existing.data[0].get('read'):
+                _adjust_unread(_unread_keys(existing.data[0]), -1)
+                await broker.publish(_channels(_unread_keys(existing.data[0])), {"type": "read", "data": {"id": notification_id}})
             
             # Enrich with recipient and classroom info
-            enriched = dict(updated_notification)
-            
-            # Get teacher name if teacher notification
-            if updated_notification.get('teacher_id'):
-                try:
-                    teacher_res = supabase.table('teachers').select('*, users(full_name)').eq('id', updated_notification['teacher_id']).execute()
-                    if teacher_res.data:
-                        teacher_data = teacher_res.data[0]
-                        # Handle nested users data safely
-                        users_data = teacher_data.get('users')
-                        if isinstance(users_data, dict):
-                            enriched['teacher_name'] = users_data.get('full_name') or teacher_data.get('name') or 'Giáo viên'
-                        elif isinstance(users_data, list) and len(users_data) > 0:
-                            enriched['teacher_name'] = users_data[0].get('full_name') or teacher_data.get('name') or 'Giáo viên'
-                        else:
-                            enriched['teacher_name'] = teacher_data.get('name') or 'Giáo viên'
-                    else:
-                        enriched['teacher_name'] = None
-                except Exception as e:
-                    print(f"Error fetching teacher info: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    enriched['teacher_name'] = None
-            
-            # Get student name if student notification
-            if updated_notification.get('student_id'):
-                try:
-                    student_res = supabase.table('students').select('*, users(full_name)').eq('id', updated_notification['student_id']).execute()
-                    if student_res.data:
-                        student_data = student_res.data[0]
-                        # Handle nested users data safely
-                        users_data = student_data.get('users')
-                        if isinstance(users_data, dict):
-                            enriched['student_name'] = users_data.get('full_name') or 'Học sinh'
-                        elif isinstance(users_data, list) and len(users_data) > 0:
-                            enriched['student_name'] = users_data[0].get('full_name') or 'Học sinh'
-                        else:
-                            enriched['student_name'] = 'Học sinh'
-                        enriched['student_code'] = student_data.get('student_code')
-                    else:
-                        enriched['student_name'] = None
-                        enriched['student_code'] = None
-                except Exception as e:
-                    print(f"Error fetching student info: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    enriched['student_name'] = None
-                    enriched['student_code'] = None
-            
-            # Get classroom info
-            if updated_notification.get('classroom_id'):
-                try:
-                    classroom_res = supabase.table('classrooms').select('name, grade').eq('id', updated_notification['classroom_id']).execute()
-                    if classroom_res.data:
-                        classroom_data = classroom_res.data[0]
-                        enriched['classroom_name'] = classroom_data.get('name')
-                        enriched['classroom_grade'] = classroom_data.get('grade')
-                except Exception as e:
-                    print(f"Error fetching classroom info: {e}")
-                    enriched['classroom_name'] = None
-                    enriched['classroom_grade'] = None
+            enriched = (await _enrich_notifications(supabase, [updated_notification]))[0]
             
             return NotificationResponse(**enriched)
         else:
@@ -465,7 +381,6 @@ async def mark_notification_read(
                 detail="Failed to update notification"
             )
             
->>>>>>> origin/master
     except HTTPException:
         raise
     except Exception as e:
@@ -477,24 +392,23 @@ async def mark_notification_read(
 @router.post("/mark-all-read")
 async def mark_all_notifications_read(
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Đánh dấu tất cả thông báo là đã đọc"""
     try:
-        user_id = current_user.id if hasattr(current_user, 'id') else None
-        
-        now = datetime.now().isoformat()
-        
         # Cập nhật tất cả thông báo chưa đọc của user
-        query = supabase.table('notifications').update({
-            'is_read': True,
-            'read_at': now
-        }).eq('is_read', False)
-        
-        if user_id:
-            query = query.or_(f'target_type.eq.all,target_type.eq.user.and.target_id.eq.{user_id}')
-        
-        query.execute()
+        recipient = await _resolve_recipient(current_user, supabase)
+        if recipient is not None:
+            query = supabase.table('notifications').update({'read': True}).eq('read', False)
+            await _apply_recipient_filter(query, recipient).execute()
+            if recipient == ALL_UNREAD:
+                # Mọi thông báo đều đã đọc
+                _unread_counts.clear()
+                _unread_counts.set(ALL_UNREAD, 0)
+            else:
+                _unread_counts.set(recipient, 0)
+                _unread_counts.invalidate(ALL_UNREAD)
+            await broker.publish(_channels([recipient]), {"type": "read_all", "data": {}})
         
         return {"message": "All notifications marked as read"}
     except Exception as e:
@@ -503,13 +417,104 @@ async def mark_all_notifications_read(
             detail=f"Error marking notifications as read: {str(e)}"
         )
 
-@router.post("/send", response_model=List[NotificationResponse])
+def _group_by_count(rows: List[Dict[str, Any]]) -> Dict[int, List[Tuple[str, Optional[str]]]]:
+    """{số thông báo mới: [bộ đếm/kênh]} cho một nhóm dòng vừa tạo"""
+    counts: Dict[Tuple[str, Optional[str]], int] = {}
+    for row in rows:
+        for key in _unread_keys(row):
+            counts[key] = counts.get(key, 0) + 1
+    grouped: Dict[int, List[Tuple[str, Optional[str]]]] = {}
+    for key, count in counts.items():
+        grouped.setdefault(count, []).append(key)
+    return grouped
+
+async def _send_recipients(supabase: Database, request: SendNotificationRequest) -> List[Tuple[str, str, Optional[str]]]:
+    """(recipient_type, teacher/student id, classroom_id) cho target của /send"""
+    async def profiles(user_ids: List[str]) -> List[Tuple[str, str, Optional[str]]]:
+        teachers, students = await asyncio.gather(
+            fetch_in_paged(supabase, 'teachers', 'user_id', user_ids, 'id, user_id'),
+            fetch_in_paged(supabase, 'students', 'user_id', user_ids, 'id, user_id'),
+        )
+        return [('teacher', t['id'], None) for t in teachers] + [('student', st['id'], None) for st in students]
+
+    if request.target_type == 'user' and request.target_id:
+        return await profiles([request.target_id])
+    if request.target_type == 'role' and request.target_id:
+        # Mọi giáo viên/học sinh có user được gán role này
+        user_roles = [
+            row async for row in stream_rows(
+                lambda: supabase.table('user_roles').select('id, user_id').eq('role_id', request.target_id)
+            )
+        ]
+        return await profiles([ur['user_id'] for ur in user_roles])
+    if request.target_type == 'classroom' and request.target_id:
+        # Tất cả học sinh trong lớp
+        return [
+            ('student', st['id'], request.target_id)
+            async for st in stream_rows(
+                lambda: supabase.table('students').select('id').eq('classroom_id', request.target_id)
+            )
+        ]
+    if request.target_type == 'all':
+        # Mọi giáo viên và học sinh
+        teachers = [('teacher', t['id'], None) async for t in stream_rows(lambda: supabase.table('teachers').select('id'))]
+        students = [('student', st['id'], None) async for st in stream_rows(lambda: supabase.table('students').select('id'))]
+        return teachers + students
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="target_type must be one of: user, role, classroom, all (with target_id unless 'all')"
+    )
+
+async def _insert_notifications(
+    supabase: Database,
+    rows: List[Dict[str, Any]],
+    job: Optional[BackgroundJob] = None,
+) -> Tuple[List[Dict[str, Any]], int, int]:
+    """Insert theo chunk; trả về (các dòng đã tạo, số tạo được, số lỗi).
+
+    Khi chạy trong job chỉ đếm (không lấy lại dữ liệu các dòng vừa insert) và
+    cập nhật tiến độ sau mỗi chunk."""
+    created_rows: List[Dict[str, Any]] = []
+    created = failed = 0
+    chunk_size = max(1, settings.NOTIFICATION_INSERT_CHUNK_SIZE)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            if job is None:
+                result = await supabase.table('notifications').insert(chunk).execute()
+                created_rows.extend(result.data or [])
+                for row in result.data or []:
+                    await broker.publish(_channels(_unread_keys(row)), {"type": "notification", "data": row})
+            else:
+                await supabase.table('notifications').insert(chunk, returning=ReturnMethod.minimal).execute()
+                # Không có dữ liệu từng dòng: báo số lượng cho từng người nhận để client tải lại
+                for count, keys in _group_by_count(chunk).items():
+                    await broker.publish(_channels(keys), {"type": "notifications_created", "data": {"count": count, "job_id": job.id}})
+            created += len(chunk)
+            for row in chunk:
+                _adjust_unread(_unread_keys(row), 1)
+            if job is not None:
+                job.advance(processed=len(chunk))
+        except Exception as e:
+            print(f"Error inserting {len(chunk)} notifications: {e}")
+            failed += len(chunk)
+            if job is not None:
+                job.advance(processed=len(chunk), failed=len(chunk))
+    return created_rows, created, failed
+
+@router.post("/send", response_model=SendNotificationResponse)
 async def send_notification(
     request: SendNotificationRequest,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
-    """Gửi thông báo sử dụng template hoặc custom (chỉ admin)"""
+    """Gửi thông báo sử dụng template hoặc custom (chỉ admin)
+
+    Target (user/role/classroom/all) được chuyển thành một thông báo cho mỗi giáo
+    viên/học sinh nhận, giống thông báo tạo qua POST /. Tất cả thông báo được insert theo chunk. Khi số người nhận vượt
+    NOTIFICATION_SEND_SYNC_MAX_RECIPIENTS (thường là gửi theo role), việc insert chạy
+    ở background: response có status "queued" và job_id để theo dõi tiến độ.
+    """
     if current_user.role != 'admin':
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -522,7 +527,7 @@ async def send_notification(
         
         # Nếu có template_id, sử dụng template
         if request.template_id:
-            template = supabase.table('notification_templates').select('*').eq('id', request.template_id).single().execute()
+            template = await supabase.table('notification_templates').select('*').eq('id', request.template_id).single().execute()
             if not template.data:
                 raise HTTPException(status_code=404, detail="Template not found")
             
@@ -544,45 +549,51 @@ async def send_notification(
                 detail="Title and message are required"
             )
         
-        # Xác định danh sách target_ids
-        target_ids = []
-        if request.target_type == 'user' and request.target_id:
-            target_ids = [request.target_id]
-        elif request.target_type == 'role' and request.target_id:
-            # Lấy tất cả users có role này
-            user_roles = supabase.table('user_roles').select('user_id').eq('role_id', request.target_id).execute()
-            target_ids = [ur['user_id'] for ur in (user_roles.data if user_roles.data else [])]
-        elif request.target_type == 'classroom' and request.target_id:
-            # Lấy tất cả students trong classroom
-            students = supabase.table('students').select('id').eq('classroom_id', request.target_id).execute()
-            target_ids = [s['id'] for s in (students.data if students.data else [])]
-        elif request.target_type == 'all':
-            # Gửi cho tất cả (target_id = None)
-            target_ids = [None]
-        
-        # Tạo notifications
-        now = datetime.now().isoformat()
-        notifications = []
-        
-        for target_id in target_ids:
-            notification_dict = {
+        # Một thông báo cho mỗi giáo viên/học sinh nhận (recipient_type + teacher_id/student_id)
+        recipients = list(dict.fromkeys(await _send_recipients(supabase, request)))
+        created_by = current_user.id if hasattr(current_user, 'id') else None
+        rows = [
+            {
+                'recipient_type': recipient_type,
+                'teacher_id': recipient_id if recipient_type == 'teacher' else None,
+                'student_id': recipient_id if recipient_type == 'student' else None,
+                'classroom_id': classroom_id,
+                'type': request.notification_type,
                 'title': title,
                 'message': message,
-                'notification_type': request.notification_type,
-                'target_type': request.target_type if request.target_type != 'all' else 'all',
-                'target_id': target_id,
-                'action_url': request.action_url,
-                'metadata': {},
-                'created_by': current_user.id if hasattr(current_user, 'id') else None,
-                'created_at': now,
-                'expires_at': request.expires_at
+                'priority': 'normal',
+                'read': False,
             }
+            for recipient_type, recipient_id, classroom_id in recipients
+        ]
+        
+        if len(rows) > settings.NOTIFICATION_SEND_SYNC_MAX_RECIPIENTS:
+            async def run(job: BackgroundJob):
+                _, created, failed = await _insert_notifications(supabase, rows, job)
+                return {"created": created, "failed": failed}
             
-            result = supabase.table('notifications').insert(notification_dict).execute()
-            if result.data:
-                notifications.append(result.data[0])
+            job = job_registry.start("notifications.send", run, total=len(rows), created_by=created_by)
+            return SendNotificationResponse(
+                status="queued",
+                job_id=job.id,
+                target_type=request.target_type,
+                total_recipients=len(rows),
+            )
         
-        return notifications
+        notifications, created, failed = await _insert_notifications(supabase, rows)
+        if rows and not created:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to send notification"
+            )
+        return SendNotificationResponse(
+            status="completed",
+            target_type=request.target_type,
+            total_recipients=len(rows),
+            created=created,
+            failed=failed,
+            notifications=notifications,
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -591,16 +602,32 @@ async def send_notification(
             detail=f"Error sending notification: {str(e)}"
         )
 
+@router.get("/jobs/{job_id}")
+async def get_send_job(
+    job_id: str,
+    current_user = Depends(get_current_user_dev),
+):
+    """Trạng thái/tiến độ của một lần gửi thông báo chạy ở background (chỉ admin)"""
+    if current_user.role != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    job = job_registry.get(job_id)
+    if job is None or job.kind != "notifications.send":
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 # ==================== NOTIFICATION TEMPLATES ====================
 
 @router.get("/templates", response_model=List[NotificationTemplateResponse])
 async def get_notification_templates(
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách notification templates"""
     try:
-        result = supabase.table('notification_templates').select('*').order('created_at', desc=True).execute()
+        result = await supabase.table('notification_templates').select('*').order('created_at', desc=True).execute()
         return result.data if result.data else []
     except Exception as e:
         raise HTTPException(
@@ -612,7 +639,7 @@ async def get_notification_templates(
 async def create_notification_template(
     template_data: NotificationTemplateCreate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo notification template mới (chỉ admin)"""
     if current_user.role != 'admin':
@@ -633,7 +660,7 @@ async def create_notification_template(
             'updated_at': now
         }
         
-        result = supabase.table('notification_templates').insert(template_dict).execute()
+        result = await supabase.table('notification_templates').insert(template_dict).execute()
         return result.data[0]
     except Exception as e:
         raise HTTPException(
@@ -646,7 +673,7 @@ async def update_notification_template(
     template_id: str,
     template_data: NotificationTemplateUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật notification template (chỉ admin)"""
     if current_user.role != 'admin':
@@ -670,7 +697,7 @@ async def update_notification_template(
         if template_data.variables is not None:
             update_dict['variables'] = template_data.variables
         
-        result = supabase.table('notification_templates').update(update_dict).eq('id', template_id).execute()
+        result = await supabase.table('notification_templates').update(update_dict).eq('id', template_id).execute()
         if not result.data:
             raise HTTPException(status_code=404, detail="Template not found")
         
@@ -687,7 +714,7 @@ async def update_notification_template(
 async def delete_notification_template(
     template_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa notification template (chỉ admin)"""
     if current_user.role != 'admin':
@@ -697,7 +724,7 @@ async def delete_notification_template(
         )
     
     try:
-        supabase.table('notification_templates').delete().eq('id', template_id).execute()
+        await supabase.table('notification_templates').delete().eq('id', template_id).execute()
         return {"message": "Template deleted successfully"}
     except Exception as e:
         raise HTTPException(
@@ -7,10 +7,12 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user_dev
+from services import finance_ledger
+from services.payment_summaries import classroom_payment_summaries
+from services.relations import Relation, hydrate
 import re
 
 router = APIRouter()
@@ -64,11 +66,18 @@ class PaymentWithStudentResponse(PaymentResponse):
     classroom_name: Optional[str] = None
     classroom_code: Optional[str] = None
 
+PAYMENT_RELATIONS = {
+    'student': Relation('students', 'student_id', 'id, student_code, user_id', nested={
+        'user': Relation('users', 'user_id', 'id, full_name'),
+    }),
+    'classroom': Relation('classrooms', 'classroom_id', 'id, name, code'),
+}
+
 @router.post("/", response_model=PaymentResponse)
 async def create_payment(
     payment_data: PaymentCreate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo thanh toán mới cho học sinh"""
     try:
@@ -104,7 +113,15 @@ async def create_payment(
         if user_id:
             payment_dict['created_by'] = user_id
         
-        result = supabase.table('student_payments').insert(payment_dict).execute()
+        # Học phí được ghi thành thu nhập trong finances: không ghi vào tháng đã khóa sổ
+        closed = await finance_ledger.closed_months(supabase, [payment_data.payment_date])
+        if closed:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Finance period {', '.join(m[:7] for m in closed)} is closed"
+            )
+        
+        result = await supabase.table('student_payments').insert(payment_dict).execute()
         
         if not result.data:
             raise HTTPException(
@@ -131,7 +148,9 @@ async def create_payment(
             if user_id:
                 finance_dict['created_by'] = user_id
             
-            supabase.table('finances').insert(finance_dict).execute()
+            finance_result = await supabase.table('finances').insert(finance_dict).execute()
+            if finance_result.data:
+                await finance_ledger.record_change(supabase, None, finance_result.data[0])
         except Exception:
             pass  # Không chặn tạo payment nếu finance creation fail
         
@@ -152,7 +171,7 @@ async def get_payments(
     classroom_id: Optional[str] = Query(None),
     payment_status: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách thanh toán"""
     try:
@@ -168,31 +187,22 @@ async def get_payments(
         query = query.order('payment_date', desc=True)
         query = query.range(skip, skip + limit - 1)
         
-        result = query.execute()
+        result = await query.execute()
+        
+        # Thông tin học sinh/lớp cho cả trang: một query in_() cho mỗi bảng
+        rows = await hydrate(supabase, [dict(payment) for payment in result.data], PAYMENT_RELATIONS)
         
         payments = []
-        for payment in result.data:
-            payment_dict = dict(payment)
-            
-            # Lấy thông tin học sinh
-            try:
-                student_result = supabase.table('students').select('student_code').eq('id', payment['student_id']).single().execute()
-                if student_result.data:
-                    user_result = supabase.table('users').select('full_name').eq('id', student_result.data.get('user_id')).single().execute()
-                    if user_result.data:
-                        payment_dict['student_name'] = user_result.data['full_name']
-                    payment_dict['student_code'] = student_result.data['student_code']
-            except:
-                pass
-            
-            # Lấy thông tin lớp học
-            try:
-                classroom_result = supabase.table('classrooms').select('name, code').eq('id', payment['classroom_id']).single().execute()
-                if classroom_result.data:
-                    payment_dict['classroom_name'] = classroom_result.data['name']
-                    payment_dict['classroom_code'] = classroom_result.data['code']
-            except:
-                pass
+        for payment_dict in rows:
+            student = payment_dict.pop('student', None) or {}
+            classroom = payment_dict.pop('classroom', None) or {}
+            user = student.get('user') or {}
+            if student:
+                payment_dict['student_code'] = student.get('student_code')
+                payment_dict['student_name'] = user.get('full_name')
+            if classroom:
+                payment_dict['classroom_name'] = classroom.get('name')
+                payment_dict['classroom_code'] = classroom.get('code')
             
             payments.append(PaymentWithStudentResponse(**payment_dict))
         
@@ -207,11 +217,11 @@ async def get_payments(
 async def get_payment(
     payment_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin một thanh toán"""
     try:
-        result = supabase.table('student_payments').select('*').eq('id', payment_id).single().execute()
+        result = await supabase.table('student_payments').select('*').eq('id', payment_id).single().execute()
         
         if not result.data:
             raise HTTPException(
@@ -233,12 +243,12 @@ async def update_payment(
     payment_id: str,
     payment_data: PaymentUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật thanh toán"""
     try:
         # Check if payment exists
-        check_result = supabase.table('student_payments').select('id').eq('id', payment_id).single().execute()
+        check_result = await supabase.table('student_payments').select('id').eq('id', payment_id).single().execute()
         if not check_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -267,7 +277,7 @@ async def update_payment(
         
         update_data['updated_at'] = datetime.now().isoformat()
         
-        result = supabase.table('student_payments').update(update_data).eq('id', payment_id).execute()
+        result = await supabase.table('student_payments').update(update_data).eq('id', payment_id).execute()
         
         if not result.data:
             raise HTTPException(
@@ -288,19 +298,19 @@ async def update_payment(
 async def delete_payment(
     payment_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa thanh toán"""
     try:
         # Check if payment exists
-        check_result = supabase.table('student_payments').select('id').eq('id', payment_id).single().execute()
+        check_result = await supabase.table('student_payments').select('id').eq('id', payment_id).single().execute()
         if not check_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Payment record not found"
             )
         
-        supabase.table('student_payments').delete().eq('id', payment_id).execute()
+        await supabase.table('student_payments').delete().eq('id', payment_id).execute()
         
         return {"message": "Payment record deleted successfully"}
     except HTTPException:
@@ -311,41 +321,33 @@ async def delete_payment(
             detail=f"Error deleting payment: {str(e)}"
         )
 
+@router.get("/classrooms/summary")
+async def get_classrooms_payment_summary(
+    classroom_ids: Optional[List[str]] = Query(None, description="Bỏ trống = mọi lớp (trừ lớp mẫu)"),
+    current_user = Depends(get_current_user_dev),
+    supabase: Database = Depends(get_db)
+):
+    """Tổng quan thanh toán của nhiều lớp trong một lần gọi"""
+    try:
+        # Bỏ trống: RPC với p_classroom_ids NULL tính mọi lớp (trừ lớp mẫu) trong một query
+        summaries = await classroom_payment_summaries(supabase, classroom_ids or None)
+        return list(summaries.values())
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching classroom payment summaries: {str(e)}"
+        )
+
 @router.get("/classroom/{classroom_id}/summary")
 async def get_classroom_payment_summary(
     classroom_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy tổng quan thanh toán của lớp học"""
     try:
-        # Lấy tất cả học sinh trong lớp
-        students_result = supabase.table('students').select('id').eq('classroom_id', classroom_id).execute()
-        student_ids = [s['id'] for s in students_result.data] if students_result.data else []
-        
-        # Lấy tổng số tiền đã thu
-        paid_payments = supabase.table('student_payments').select('amount').eq('classroom_id', classroom_id).eq('payment_status', 'paid').execute()
-        total_paid = sum(float(p['amount']) for p in paid_payments.data) if paid_payments.data else 0
-        
-        # Lấy tổng số tiền chưa thu
-        pending_payments = supabase.table('student_payments').select('amount').eq('classroom_id', classroom_id).eq('payment_status', 'pending').execute()
-        total_pending = sum(float(p['amount']) for p in pending_payments.data) if pending_payments.data else 0
-        
-        # Lấy số học sinh đã đóng tiền
-        paid_students = supabase.table('student_payments').select('student_id', distinct=True).eq('classroom_id', classroom_id).eq('payment_status', 'paid').execute()
-        paid_student_count = len(set(p['student_id'] for p in paid_students.data)) if paid_students.data else 0
-        
-        # Lấy danh sách học sinh đã đóng tiền
-        paid_student_ids = list(set(p['student_id'] for p in paid_students.data)) if paid_students.data else []
-        
-        return {
-            "classroom_id": classroom_id,
-            "total_students": len(student_ids),
-            "paid_student_count": paid_student_count,
-            "total_paid": total_paid,
-            "total_pending": total_pending,
-            "paid_student_ids": paid_student_ids
-        }
+        summaries = await classroom_payment_summaries(supabase, [classroom_id])
+        return summaries[classroom_id]
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
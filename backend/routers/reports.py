@@ -6,11 +6,13 @@ Router cho báo cáo và phân tích nâng cao
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
-from supabase import Client
 from pydantic import BaseModel
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user_dev
+from services import grade_rollups
+from services.finance_aggregates import finance_totals
+from services.paging import stream_rows
 from models.report import (
     ReportDefinitionCreate, ReportDefinitionUpdate, ReportDefinitionResponse,
     ReportExecutionCreate, ReportExecutionResponse,
@@ -26,7 +28,7 @@ router = APIRouter()
 async def get_report_definitions(
     report_type: Optional[str] = Query(None, description="Filter by report type"),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách các định nghĩa báo cáo"""
     try:
@@ -35,7 +37,7 @@ async def get_report_definitions(
         if report_type:
             query = query.eq('report_type', report_type)
         
-        result = query.order('created_at', desc=True).execute()
+        result = await query.order('created_at', desc=True).execute()
         return result.data
     except Exception as e:
         raise HTTPException(
@@ -47,7 +49,7 @@ async def get_report_definitions(
 async def create_report_definition(
     report_data: ReportDefinitionCreate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo định nghĩa báo cáo mới (chỉ admin)"""
     if current_user.role != 'admin':
@@ -70,7 +72,7 @@ async def create_report_definition(
             'updated_at': now
         }
         
-        result = supabase.table('report_definitions').insert(report_dict).execute()
+        result = await supabase.table('report_definitions').insert(report_dict).execute()
         return result.data[0]
     except Exception as e:
         raise HTTPException(
@@ -80,39 +82,80 @@ async def create_report_definition(
 
 # ==================== STUDENT PERFORMANCE REPORT ====================
 
+async def _grades_by_subject(supabase: Database, rollup_rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Điểm theo môn từ các dòng rollup (gộp các lớp của cùng một môn)"""
+    subjects: Dict[Any, Dict[str, Any]] = {}
+    for row in rollup_rows:
+        entry = subjects.setdefault(row.get('subject_id'), {'rows': [], 'latest': None})
+        entry['rows'].append(row)
+        if row.get('latest_graded_at') and (entry['latest'] is None or row['latest_graded_at'] > entry['latest'].get('latest_graded_at', '')):
+            entry['latest'] = row
+    
+    subject_ids = [subject_id for subject_id in subjects if subject_id]
+    names = {}
+    if subject_ids:
+        subjects_result = await supabase.table('subjects').select('id, name').in_('id', subject_ids).execute()
+        names = {s['id']: s['name'] for s in (subjects_result.data or [])}
+    
+    grades = []
+    for subject_id, entry in subjects.items():
+        totals = grade_rollups.combine(entry['rows'])
+        graded = totals['graded_count']
+        grades.append({
+            'subject_id': subject_id,
+            'subject_name': names.get(subject_id, 'Chưa phân loại'),
+            'total_assignments': totals['submission_count'],
+            'graded_assignments': graded,
+            'average_score': round(totals['total_score'] / graded, 2) if graded else 0,
+            'latest_score': entry['latest'].get('latest_score') if entry['latest'] else None
+        })
+    return grades
+
 @router.get("/students/{student_id}/performance", response_model=StudentPerformanceReport)
 async def get_student_performance_report(
     student_id: str,
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Báo cáo học tập chi tiết của học sinh"""
     try:
         # Lấy thông tin học sinh
-        student = supabase.table('students').select('*, users(name, email)').eq('id', student_id).execute()
+        student = await supabase.table('students').select('*, users(name, email)').eq('id', student_id).execute()
         if not student.data:
             raise HTTPException(status_code=404, detail="Student not found")
         
         student_data = student.data[0]
         student_name = student_data.get('users', {}).get('name', '') if isinstance(student_data.get('users'), dict) else ''
         
-        # Lấy danh sách bài tập và điểm
-        assignments_query = supabase.table('assignment_submissions').select('*, assignments(*)').eq('student_id', student_id)
-        if start_date:
-            assignments_query = assignments_query.gte('submitted_at', start_date)
-        if end_date:
-            assignments_query = assignments_query.lte('submitted_at', end_date)
-        
-        submissions = assignments_query.execute()
-        submissions_data = submissions.data if submissions.data else []
+        # Điểm số: không lọc theo ngày thì đọc bảng rollup, ngược lại quét submissions
+        rollup_rows = None
+        if not start_date and not end_date:
+            rollup_rows = await grade_rollups.load_rollups(supabase, student_id)
         
-        # Tính toán thống kê
-        total_assignments = len(submissions_data)
-        completed_assignments = len([s for s in submissions_data if s.get('is_graded', False)])
-        scores = [float(s.get('score', 0)) for s in submissions_data if s.get('score') is not None]
-        average_score = sum(scores) / len(scores) if scores else 0
+        grades_by_subject = []
+        if rollup_rows is not None:
+            totals = grade_rollups.combine(rollup_rows)
+            total_assignments = totals['submission_count']
+            completed_assignments = totals['graded_count']
+            average_score = totals['total_score'] / totals['graded_count'] if totals['graded_count'] else 0
+            grades_by_subject = await _grades_by_subject(supabase, rollup_rows)
+        else:
+            assignments_query = supabase.table('assignment_submissions').select('*, assignments(*)').eq('student_id', student_id)
+            if start_date:
+                assignments_query = assignments_query.gte('submitted_at', start_date)
+            if end_date:
+                assignments_query = assignments_query.lte('submitted_at', end_date)
+            
+            submissions = await assignments_query.execute()
+            submissions_data = submissions.data if submissions.data else []
+            
+            # Tính toán thống kê
+            total_assignments = len(submissions_data)
+            completed_assignments = len([s for s in submissions_data if s.get('is_graded', False)])
+            scores = [float(s.get('score', 0)) for s in submissions_data if s.get('score') is not None]
+            average_score = sum(scores) / len(scores) if scores else 0
         
         # Lấy điểm danh
         attendances_query = supabase.table('attendances').select('*').eq('student_id', student_id)
@@ -121,7 +164,7 @@ async def get_student_performance_report(
         if end_date:
             attendances_query = attendances_query.lte('date', end_date)
         
-        attendances = attendances_query.execute()
+        attendances = await attendances_query.execute()
         attendances_data = attendances.data if attendances.data else []
         
         total_attendance = len(attendances_data)
@@ -133,14 +176,11 @@ async def get_student_performance_report(
         classroom_id = None
         classroom_name = None
         if student_data.get('classroom_id'):
-            classroom = supabase.table('classrooms').select('id, name').eq('id', student_data['classroom_id']).execute()
+            classroom = await supabase.table('classrooms').select('id, name').eq('id', student_data['classroom_id']).execute()
             if classroom.data:
                 classroom_id = classroom.data[0]['id']
                 classroom_name = classroom.data[0]['name']
         
-        # Điểm theo môn học (simplified)
-        grades_by_subject = []
-        
         return StudentPerformanceReport(
             student_id=student_id,
             student_name=student_name or student_data.get('student_code', ''),
@@ -170,19 +210,19 @@ async def get_student_performance_report(
 async def get_classroom_performance_report(
     classroom_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Báo cáo học tập của lớp học"""
     try:
         # Lấy thông tin lớp học
-        classroom = supabase.table('classrooms').select('*').eq('id', classroom_id).execute()
+        classroom = await supabase.table('classrooms').select('*').eq('id', classroom_id).execute()
         if not classroom.data:
             raise HTTPException(status_code=404, detail="Classroom not found")
         
         classroom_data = classroom.data[0]
         
         # Lấy danh sách học sinh trong lớp
-        students = supabase.table('students').select('id').eq('classroom_id', classroom_id).execute()
+        students = await supabase.table('students').select('id').eq('classroom_id', classroom_id).execute()
         student_ids = [s['id'] for s in (students.data if students.data else [])]
         
         if not student_ids:
@@ -200,7 +240,7 @@ async def get_classroom_performance_report(
             )
         
         # Lấy điểm số của tất cả học sinh
-        submissions = supabase.table('assignment_submissions').select('student_id, score, is_graded').in_('student_id', student_ids).execute()
+        submissions = await supabase.table('assignment_submissions').select('student_id, score, is_graded').in_('student_id', student_ids).execute()
         submissions_data = submissions.data if submissions.data else []
         
         # Tính toán thống kê
@@ -212,7 +252,7 @@ async def get_classroom_performance_report(
         completion_rate = (graded_count / total_submissions * 100) if total_submissions > 0 else 0
         
         # Lấy điểm danh
-        attendances = supabase.table('attendances').select('*').eq('classroom_id', classroom_id).execute()
+        attendances = await supabase.table('attendances').select('*').eq('classroom_id', classroom_id).execute()
         attendances_data = attendances.data if attendances.data else []
         
         total_attendance_records = len(attendances_data)
@@ -258,12 +298,12 @@ async def get_classroom_performance_report(
 async def get_teacher_summary_report(
     teacher_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Báo cáo tổng hợp giáo viên"""
     try:
         # Lấy thông tin giáo viên
-        teacher = supabase.table('teachers').select('*, users(name)').eq('id', teacher_id).execute()
+        teacher = await supabase.table('teachers').select('*, users(name)').eq('id', teacher_id).execute()
         if not teacher.data:
             raise HTTPException(status_code=404, detail="Teacher not found")
         
@@ -271,19 +311,19 @@ async def get_teacher_summary_report(
         teacher_name = teacher_data.get('users', {}).get('name', '') if isinstance(teacher_data.get('users'), dict) else ''
         
         # Lấy lớp học của giáo viên
-        classrooms = supabase.table('classrooms').select('id').eq('teacher_id', teacher_id).execute()
+        classrooms = await supabase.table('classrooms').select('id').eq('teacher_id', teacher_id).execute()
         classroom_ids = [c['id'] for c in (classrooms.data if classrooms.data else [])]
         
         # Lấy học sinh
-        students = supabase.table('students').select('id').in_('classroom_id', classroom_ids).execute()
+        students = await supabase.table('students').select('id').in_('classroom_id', classroom_ids).execute()
         student_ids = [s['id'] for s in (students.data if students.data else [])]
         
         # Lấy bài tập
-        assignments = supabase.table('assignments').select('id').eq('teacher_id', teacher_id).execute()
+        assignments = await supabase.table('assignments').select('id').eq('teacher_id', teacher_id).execute()
         assignment_ids = [a['id'] for a in (assignments.data if assignments.data else [])]
         
         # Tính toán completion rate
-        submissions = supabase.table('assignment_submissions').select('is_graded').in_('assignment_id', assignment_ids).execute()
+        submissions = await supabase.table('assignment_submissions').select('is_graded').in_('assignment_id', assignment_ids).execute()
         submissions_data = submissions.data if submissions.data else []
         graded_count = len([s for s in submissions_data if s.get('is_graded', False)])
         completion_rate = (graded_count / len(submissions_data) * 100) if submissions_data else 0
@@ -316,7 +356,7 @@ async def get_finance_summary_report(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Báo cáo tài chính tổng hợp"""
     try:
@@ -326,52 +366,15 @@ async def get_finance_summary_report(
         if not end_date:
             end_date = datetime.now().isoformat()
         
-        # Lấy thu nhập
-        income_query = supabase.table('finances').select('amount, category, classroom_id').eq('finance_type', 'income')
-        if start_date:
-            income_query = income_query.gte('date', start_date)
-        if end_date:
-            income_query = income_query.lte('date', end_date)
-        
-        incomes = income_query.execute()
-        income_data = incomes.data if incomes.data else []
-        
-        # Lấy chi phí
-        expense_query = supabase.table('finances').select('amount, category').eq('finance_type', 'expense')
-        if start_date:
-            expense_query = expense_query.gte('date', start_date)
-        if end_date:
-            expense_query = expense_query.lte('date', end_date)
-        
-        expenses = expense_query.execute()
-        expense_data = expenses.data if expenses.data else []
-        
-        # Tính toán
-        total_income = sum(float(i.get('amount', 0)) for i in income_data)
-        total_expense = sum(float(e.get('amount', 0)) for e in expense_data)
+        # Tổng hợp trong database (RPC finance_summary_totals)
+        totals = await finance_totals(supabase, start_date, end_date)
+        total_income = totals['totals']['income']
+        total_expense = totals['totals']['expense']
         net_profit = total_income - total_expense
         
-        # Income by category
-        income_by_category = {}
-        for income in income_data:
-            category = income.get('category', 'other')
-            amount = float(income.get('amount', 0))
-            income_by_category[category] = income_by_category.get(category, 0) + amount
-        
-        # Expense by category
-        expense_by_category = {}
-        for expense in expense_data:
-            category = expense.get('category', 'other')
-            amount = float(expense.get('amount', 0))
-            expense_by_category[category] = expense_by_category.get(category, 0) + amount
-        
-        # Revenue by classroom
-        revenue_by_classroom = {}
-        for income in income_data:
-            classroom_id = income.get('classroom_id')
-            if classroom_id:
-                amount = float(income.get('amount', 0))
-                revenue_by_classroom[classroom_id] = revenue_by_classroom.get(classroom_id, 0) + amount
+        income_by_category = totals['by_category']['income']
+        expense_by_category = totals['by_category']['expense']
+        revenue_by_classroom = totals['by_classroom']['income']
         
         return FinanceSummaryReport(
             period_start=start_date,
@@ -396,7 +399,7 @@ async def get_attendance_statistics_report(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Thống kê điểm danh"""
     try:
@@ -406,35 +409,39 @@ async def get_attendance_statistics_report(
         if not end_date:
             end_date = datetime.now().date().isoformat()
         
-        # Lấy tất cả điểm danh trong khoảng thời gian
-        attendances_query = supabase.table('attendances').select('*, classrooms(id, name)')
-        if start_date:
-            attendances_query = attendances_query.gte('date', start_date)
-        if end_date:
-            attendances_query = attendances_query.lte('date', end_date)
-        
-        attendances = attendances_query.execute()
-        attendances_data = attendances.data if attendances.data else []
-        
-        # Tính toán
-        student_ids = set(a.get('student_id') for a in attendances_data if a.get('student_id'))
-        total_students = len(student_ids)
-        
-        total_records = len(attendances_data)
-        present_records = len([a for a in attendances_data if a.get('is_present', False)])
-        average_attendance_rate = (present_records / total_records * 100) if total_records > 0 else 0
-        
-        # Attendance by classroom
+        # Đọc mọi điểm danh trong khoảng thời gian theo trang và cộng dồn
+        def attendances_query():
+            query = supabase.table('attendances').select('id, student_id, classroom_id, is_present')
+            if start_date:
+                query = query.gte('date', start_date)
+            if end_date:
+                query = query.lte('date', end_date)
+            return query
+        
+        student_ids = set()
+        total_records = 0
+        present_records = 0
         attendance_by_classroom = {}
-        for attendance in attendances_data:
+        async for attendance in stream_rows(attendances_query):
+            if attendance.get('student_id'):
+                student_ids.add(attendance['student_id'])
+            total_records += 1
+            is_present = attendance.get('is_present', False)
+            if is_present:
+                present_records += 1
+            
+            # Attendance by classroom
             classroom_id = attendance.get('classroom_id')
             if classroom_id:
                 if classroom_id not in attendance_by_classroom:
                     attendance_by_classroom[classroom_id] = {'total': 0, 'present': 0}
                 attendance_by_classroom[classroom_id]['total'] += 1
-                if attendance.get('is_present', False):
+                if is_present:
                     attendance_by_classroom[classroom_id]['present'] += 1
         
+        total_students = len(student_ids)
+        average_attendance_rate = (present_records / total_records * 100) if total_records > 0 else 0
+        
         # Convert to percentage
         attendance_by_classroom_percent = {}
         for classroom_id, stats in attendance_by_classroom.items():
@@ -5,10 +5,10 @@ Router cho quản lý roles và permissions
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
-from supabase import Client
 
-from database import get_db
-from routers.auth import get_current_user_dev
+from database import get_db, Database
+from routers.auth import get_current_user, require_permission
+from services.permission_registry import permission_registry
 from models.role import (
     RoleCreate, RoleUpdate, RoleResponse,
     PermissionResponse, UserRoleAssign, UserRoleResponse
@@ -16,13 +16,16 @@ from models.role import (
 
 router = APIRouter()
 
+# Quyền quản lý roles / gán roles cho user (xem phase1_database_schema.sql)
+ROLES_MANAGE_PERMISSION = "system.users"
+
 # ==================== PERMISSIONS ====================
 
 @router.get("/permissions", response_model=List[PermissionResponse])
 async def get_permissions(
     module: Optional[str] = Query(None, description="Filter by module"),
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách tất cả permissions"""
     try:
@@ -30,7 +33,7 @@ async def get_permissions(
         if module:
             query = query.eq('module', module)
         
-        result = query.order('module', desc=False).order('action', desc=False).execute()
+        result = await query.order('module', desc=False).order('action', desc=False).execute()
         return result.data
     except Exception as e:
         raise HTTPException(
@@ -40,25 +43,22 @@ async def get_permissions(
 
 # ==================== ROLES ====================
 
+def _with_permissions(role: dict) -> dict:
+    """Chuyển role_permissions(permissions(*)) đã embed thành danh sách permissions"""
+    links = role.pop('role_permissions', None) or []
+    role['permissions'] = [link['permissions'] for link in links if link.get('permissions')]
+    return role
+
 @router.get("/", response_model=List[RoleResponse])
 async def get_roles(
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách tất cả roles"""
     try:
-        result = supabase.table('roles').select('*').order('created_at', desc=True).execute()
-        
-        # Lấy permissions cho mỗi role
-        roles_with_permissions = []
-        for role in result.data:
-            role_id = role['id']
-            permissions_result = supabase.table('role_permissions').select('permissions(*)').eq('role_id', role_id).execute()
-            permissions = [p['permissions'] for p in (permissions_result.data if permissions_result.data else []) if p.get('permissions')]
-            role['permissions'] = permissions
-            roles_with_permissions.append(role)
-        
-        return roles_with_permissions
+        # Một query: embed permissions của mọi role qua role_permissions
+        result = await supabase.table('roles').select('*, role_permissions(permissions(*))').order('created_at', desc=True).execute()
+        return [_with_permissions(role) for role in (result.data or [])]
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -68,23 +68,16 @@ async def get_roles(
 @router.get("/{role_id}", response_model=RoleResponse)
 async def get_role(
     role_id: str,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin chi tiết của một role"""
     try:
-        result = supabase.table('roles').select('*').eq('id', role_id).single().execute()
+        result = await supabase.table('roles').select('*, role_permissions(permissions(*))').eq('id', role_id).single().execute()
         if not result.data:
             raise HTTPException(status_code=404, detail="Role not found")
         
-        role = result.data
-        
-        # Lấy permissions
-        permissions_result = supabase.table('role_permissions').select('permissions(*)').eq('role_id', role_id).execute()
-        permissions = [p['permissions'] for p in (permissions_result.data if permissions_result.data else []) if p.get('permissions')]
-        role['permissions'] = permissions
-        
-        return role
+        return _with_permissions(result.data)
     except HTTPException:
         raise
     except Exception as e:
@@ -96,16 +89,10 @@ async def get_role(
 @router.post("/", response_model=RoleResponse)
 async def create_role(
     role_data: RoleCreate,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(require_permission(ROLES_MANAGE_PERMISSION)),
+    supabase: Database = Depends(get_db)
 ):
-    """Tạo role mới (chỉ admin)"""
-    if current_user.role != 'admin':
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
+    """Tạo role mới (quyền system.users)"""
     try:
         from datetime import datetime
         now = datetime.now().isoformat()
@@ -119,7 +106,7 @@ async def create_role(
             'updated_at': now
         }
         
-        result = supabase.table('roles').insert(role_dict).execute()
+        result = await supabase.table('roles').insert(role_dict).execute()
         role = result.data[0]
         role_id = role['id']
         
@@ -129,7 +116,8 @@ async def create_role(
                 {'role_id': role_id, 'permission_id': perm_id}
                 for perm_id in role_data.permission_ids
             ]
-            supabase.table('role_permissions').insert(role_permissions).execute()
+            await supabase.table('role_permissions').insert(role_permissions).execute()
+        permission_registry.invalidate()
         
         # Lấy lại role với permissions
         return await get_role(role_id, current_user, supabase)
@@ -143,19 +131,13 @@ async def create_role(
 async def update_role(
     role_id: str,
     role_data: RoleUpdate,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(require_permission(ROLES_MANAGE_PERMISSION)),
+    supabase: Database = Depends(get_db)
 ):
-    """Cập nhật role (chỉ admin)"""
-    if current_user.role != 'admin':
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
+    """Cập nhật role (quyền system.users)"""
     try:
         # Kiểm tra role có tồn tại không
-        existing = supabase.table('roles').select('*').eq('id', role_id).single().execute()
+        existing = await supabase.table('roles').select('*').eq('id', role_id).single().execute()
         if not existing.data:
             raise HTTPException(status_code=404, detail="Role not found")
         
@@ -179,12 +161,12 @@ async def update_role(
             update_dict['description'] = role_data.description
         
         if update_dict:
-            supabase.table('roles').update(update_dict).eq('id', role_id).execute()
+            await supabase.table('roles').update(update_dict).eq('id', role_id).execute()
         
         # Cập nhật permissions nếu có
         if role_data.permission_ids is not None:
             # Xóa permissions cũ
-            supabase.table('role_permissions').delete().eq('role_id', role_id).execute()
+            await supabase.table('role_permissions').delete().eq('role_id', role_id).execute()
             
             # Thêm permissions mới
             if role_data.permission_ids:
@@ -192,7 +174,8 @@ async def update_role(
                     {'role_id': role_id, 'permission_id': perm_id}
                     for perm_id in role_data.permission_ids
                 ]
-                supabase.table('role_permissions').insert(role_permissions).execute()
+                await supabase.table('role_permissions').insert(role_permissions).execute()
+            permission_registry.invalidate()
         
         # Lấy lại role với permissions
         return await get_role(role_id, current_user, supabase)
@@ -207,19 +190,13 @@ async def update_role(
 @router.delete("/{role_id}")
 async def delete_role(
     role_id: str,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(require_permission(ROLES_MANAGE_PERMISSION)),
+    supabase: Database = Depends(get_db)
 ):
-    """Xóa role (chỉ admin)"""
-    if current_user.role != 'admin':
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
+    """Xóa role (quyền system.users)"""
     try:
         # Kiểm tra role có tồn tại không
-        existing = supabase.table('roles').select('*').eq('id', role_id).single().execute()
+        existing = await supabase.table('roles').select('*').eq('id', role_id).single().execute()
         if not existing.data:
             raise HTTPException(status_code=404, detail="Role not found")
         
@@ -231,7 +208,8 @@ async def delete_role(
             )
         
         # Xóa role (cascade sẽ xóa role_permissions và user_roles)
-        supabase.table('roles').delete().eq('id', role_id).execute()
+        await supabase.table('roles').delete().eq('id', role_id).execute()
+        permission_registry.invalidate()
         
         return {"message": "Role deleted successfully"}
     except HTTPException:
@@ -247,12 +225,12 @@ async def delete_role(
 @router.get("/users/{user_id}/roles", response_model=List[UserRoleResponse])
 async def get_user_roles(
     user_id: str,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách roles của một user"""
     try:
-        result = supabase.table('user_roles').select('*, roles(name)').eq('user_id', user_id).execute()
+        result = await supabase.table('user_roles').select('*, roles(name)').eq('user_id', user_id).execute()
         
         user_roles = []
         for ur in (result.data if result.data else []):
@@ -275,19 +253,13 @@ async def get_user_roles(
 @router.post("/users/assign", response_model=List[UserRoleResponse])
 async def assign_roles_to_user(
     assignment: UserRoleAssign,
-    current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    current_user = Depends(require_permission(ROLES_MANAGE_PERMISSION)),
+    supabase: Database = Depends(get_db)
 ):
-    """Gán roles cho user (chỉ admin)"""
-    if current_user.role != 'admin':
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
+    """Gán roles cho user (quyền system.users)"""
     try:
         # Xóa roles cũ
-        supabase.table('user_roles').delete().eq('user_id', assignment.user_id).execute()
+        await supabase.table('user_roles').delete().eq('user_id', assignment.user_id).execute()
         
         # Thêm roles mới
         if assignment.role_ids:
@@ -295,7 +267,8 @@ async def assign_roles_to_user(
                 {'user_id': assignment.user_id, 'role_id': role_id}
                 for role_id in assignment.role_ids
             ]
-            supabase.table('user_roles').insert(user_roles).execute()
+            await supabase.table('user_roles').insert(user_roles).execute()
+        permission_registry.invalidate()
         
         # Lấy lại danh sách roles
         return await get_user_roles(assignment.user_id, current_user, supabase)
@@ -305,3 +278,29 @@ async def assign_roles_to_user(
             detail=f"Error assigning roles: {str(e)}"
         )
 
+
+@router.get("/users/{user_id}/permissions")
+async def get_user_permissions(
+    user_id: str,
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db)
+):
+    """Lấy các quyền hiệu lực của user (hợp quyền của mọi role được gán)"""
+    await permission_registry.ensure_loaded(supabase)
+    if current_user.id != user_id and not permission_registry.has_permission(current_user, ROLES_MANAGE_PERMISSION):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    try:
+        return {
+            'user_id': user_id,
+            'roles': permission_registry.roles_for(user_id),
+            'permissions': permission_registry.permissions_for(user_id)
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching user permissions: {str(e)}"
+        )
@@ -6,9 +6,8 @@ CRUD cho phòng học (Supabase)
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Optional
 from pydantic import BaseModel, constr
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user
 
 router = APIRouter()
@@ -48,19 +47,19 @@ class RoomResponse(BaseModel):
 async def create_room(
     room_data: RoomCreate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Check if campus exists
-    campus_check = supabase.table("campuses").select("id").eq("id", room_data.campus_id).execute()
+    campus_check = await supabase.table("campuses").select("id").eq("id", room_data.campus_id).execute()
     if not campus_check.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campus not found")
 
     code = room_data.code.strip()
     # Check unique code within campus
-    dup = supabase.table("rooms").select("id").eq("campus_id", room_data.campus_id).eq("code", code).execute()
+    dup = await supabase.table("rooms").select("id").eq("campus_id", room_data.campus_id).eq("code", code).execute()
     if dup.data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Room code already exists in this campus")
 
@@ -71,7 +70,7 @@ async def create_room(
         "capacity": room_data.capacity or 30,
         "description": room_data.description or None,
     }
-    res = supabase.table("rooms").insert(payload).execute()
+    res = await supabase.table("rooms").insert(payload).execute()
     if not res.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create room")
     return res.data[0]
@@ -81,12 +80,12 @@ async def create_room(
 async def list_rooms(
     campus_id: Optional[str] = None,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     query = supabase.table("rooms").select("*, campuses(*)")
     if campus_id:
         query = query.eq("campus_id", campus_id)
-    res = query.order("created_at", desc=True).execute()
+    res = await query.order("created_at", desc=True).execute()
     return res.data or []
 
 
@@ -94,9 +93,9 @@ async def list_rooms(
 async def get_room(
     room_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
-    res = supabase.table("rooms").select("*, campuses(*)").eq("id", room_id).single().execute()
+    res = await supabase.table("rooms").select("*, campuses(*)").eq("id", room_id).single().execute()
     if not res.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
     return res.data
@@ -107,13 +106,13 @@ async def update_room(
     room_id: str,
     room_data: RoomUpdate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Check exists
-    exists = supabase.table("rooms").select("id, campus_id").eq("id", room_id).execute()
+    exists = await supabase.table("rooms").select("id, campus_id").eq("id", room_id).execute()
     if not exists.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
 
@@ -121,11 +120,11 @@ async def update_room(
     if "code" in data and data["code"]:
         # Check unique code within campus
         campus_id = exists.data[0]["campus_id"]
-        dup = supabase.table("rooms").select("id").eq("campus_id", campus_id).eq("code", data["code"]).neq("id", room_id).execute()
+        dup = await supabase.table("rooms").select("id").eq("campus_id", campus_id).eq("code", data["code"]).neq("id", room_id).execute()
         if dup.data:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Room code already exists in this campus")
 
-    res = supabase.table("rooms").update(data).eq("id", room_id).execute()
+    res = await supabase.table("rooms").update(data).eq("id", room_id).execute()
     if not res.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update room")
     return res.data[0]
@@ -135,16 +134,16 @@ async def update_room(
 async def delete_room(
     room_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
-    exists = supabase.table("rooms").select("id").eq("id", room_id).execute()
+    exists = await supabase.table("rooms").select("id").eq("id", room_id).execute()
     if not exists.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
 
-    res = supabase.table("rooms").delete().eq("id", room_id).execute()
+    res = await supabase.table("rooms").delete().eq("id", room_id).execute()
     if not res.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to delete room")
     return {"message": "Room deleted successfully"}
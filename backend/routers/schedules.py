@@ -3,14 +3,22 @@ Schedules Router
 Router cho quản lý thời khóa biểu (Supabase)
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, File, Form, UploadFile
 from typing import List, Optional, Dict, Any, Union, Set, Tuple
-from pydantic import BaseModel, Field
-from datetime import time, date
-from supabase import Client
+from pydantic import BaseModel, Field, ValidationError
+from datetime import time, date, timedelta
+import asyncio
+import base64
+import csv
+import io
+import json
+import uuid
 
-from database import get_db
+from config import settings
+from database import get_db, Database
 from routers.auth import get_current_user
+from services.relations import IN_CHUNK_SIZE, fetch_by_ids, fetch_in
+from services.schedule_conflicts import ScheduleSlot, schedule_index
 
 router = APIRouter()
 
@@ -55,26 +63,37 @@ class ScheduleResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class TimetableItem(ScheduleCreate):
+    id: Optional[str] = None  # Lịch đã có sẽ được thay bằng dòng này
 
-def _fetch_records_by_ids(
-    supabase: Client,
+class TimetableValidationRequest(BaseModel):
+    schedules: List[TimetableItem]
+
+class RecurringPattern(BaseModel):
+    """Mẫu lịch của một học kỳ: mỗi session lặp lại hằng tuần theo day_of_week"""
+    start_date: date
+    end_date: date
+    sessions: List[ScheduleCreate]
+    skip_dates: List[date] = []  # Ngày nghỉ (lễ, thi...)
+
+class TimetableBulkRequest(BaseModel):
+    schedules: List[ScheduleCreate] = []
+    pattern: Optional[RecurringPattern] = None
+    dry_run: bool = False
+    all_or_nothing: bool = False  # True: có dòng lỗi thì không tạo dòng nào
+
+
+async def _fetch_records_by_ids(
+    supabase: Database,
     table: str,
     ids: Set[str],
     columns: str = "*"
 ) -> Dict[str, Dict[str, Any]]:
-    if not ids:
-        return {}
-    try:
-        response = supabase.table(table).select(columns).in_("id", list(ids)).execute()
-        data = response.data or []
-        return {item["id"]: item for item in data if item.get("id")}
-    except Exception as fetch_error:
-        print(f"Warning: Failed to fetch {table} records: {fetch_error}")
-        return {}
+    return await fetch_by_ids(supabase, table, ids, columns)
 
 
-def hydrate_schedule_relations(
-    supabase: Client,
+async def hydrate_schedule_relations(
+    supabase: Database,
     schedules: List[Dict[str, Any]]
 ) -> List[Dict[str, Any]]:
     if not schedules:
@@ -96,7 +115,7 @@ def hydrate_schedule_relations(
         if schedule.get("teacher_id")
     }
 
-    classroom_map = _fetch_records_by_ids(
+    classroom_map = await _fetch_records_by_ids(
         supabase,
         "classrooms",
         classroom_ids,
@@ -107,20 +126,20 @@ def hydrate_schedule_relations(
         for classroom in classroom_map.values()
         if classroom.get("campus_id")
     }
-    campus_map = _fetch_records_by_ids(
+    campus_map = await _fetch_records_by_ids(
         supabase,
         "campuses",
         campus_ids,
         "id,name,code"
     )
-    subject_map = _fetch_records_by_ids(
+    subject_map = await _fetch_records_by_ids(
         supabase,
         "subjects",
         subject_ids,
         "id,name,code"
     )
     teacher_map: Dict[str, Dict[str, Any]] = {}
-    teacher_records = _fetch_records_by_ids(
+    teacher_records = await _fetch_records_by_ids(
         supabase,
         "teachers",
         teacher_ids,
@@ -131,7 +150,7 @@ def hydrate_schedule_relations(
         for teacher in teacher_records.values()
         if teacher.get("user_id")
     }
-    user_map = _fetch_records_by_ids(
+    user_map = await _fetch_records_by_ids(
         supabase,
         "users",
         user_ids,
@@ -151,7 +170,7 @@ def hydrate_schedule_relations(
         for schedule in schedules
         if schedule.get("room_id")
     }
-    room_map = _fetch_records_by_ids(
+    room_map = await _fetch_records_by_ids(
         supabase,
         "rooms",
         room_ids,
@@ -181,13 +200,13 @@ def hydrate_schedule_relations(
     return schedules
 
 
-def hydrate_single_schedule(supabase: Client, schedule: Dict[str, Any]) -> Dict[str, Any]:
-    hydrated = hydrate_schedule_relations(supabase, [schedule])
+async def hydrate_single_schedule(supabase: Database, schedule: Dict[str, Any]) -> Dict[str, Any]:
+    hydrated = await hydrate_schedule_relations(supabase, [schedule])
     return hydrated[0] if hydrated else schedule
 
 
-def _resolve_room_reference(
-    supabase: Client,
+async def _resolve_room_reference(
+    supabase: Database,
     campus_id: Optional[str],
     room_id: Optional[str],
     room_label: Optional[str],
@@ -201,7 +220,7 @@ def _resolve_room_reference(
 
     if room_id:
         response = (
-            supabase.table("rooms")
+            await supabase.table("rooms")
             .select("id, code, name, campus_id")
             .eq("id", room_id)
             .limit(1)
@@ -223,7 +242,7 @@ def _resolve_room_reference(
             resolved_label = room_record.get("code") or room_record.get("name") or ""
     elif campus_id and resolved_label:
         response = (
-            supabase.table("rooms")
+            await supabase.table("rooms")
             .select("id, code, name, campus_id")
             .eq("campus_id", campus_id)
             .eq("code", resolved_label)
@@ -233,7 +252,7 @@ def _resolve_room_reference(
         data = response.data or []
         if not data:
             response = (
-                supabase.table("rooms")
+                await supabase.table("rooms")
                 .select("id, code, name, campus_id")
                 .eq("campus_id", campus_id)
                 .eq("name", resolved_label)
@@ -258,33 +277,79 @@ def _resolve_room_reference(
 
     return room_record, resolved_label
 
+def _schedule_slot(
+    schedule_data: ScheduleCreate,
+    schedule_date: Optional[date],
+    campus_id: Optional[str],
+    room_value: str,
+    schedule_id: Optional[str] = None,
+) -> ScheduleSlot:
+    return ScheduleSlot.from_row({
+        "id": schedule_id,
+        "classroom_id": schedule_data.classroom_id,
+        "teacher_id": schedule_data.teacher_id,
+        "campus_id": campus_id,
+        "room": room_value,
+        "date": schedule_date,
+        "day_of_week": schedule_data.day_of_week,
+        "start_time": schedule_data.start_time,
+        "end_time": schedule_data.end_time,
+    })
+
+
+def _conflict_message(conflict: Dict[str, Any], slot: ScheduleSlot) -> str:
+    if slot.date:
+        date_info = f"ngày {date.fromisoformat(slot.date).strftime('%d/%m/%Y')}"
+    else:
+        date_info = f"thứ {slot.day_of_week + 2}"
+    time_range = f"{conflict['start_time']} - {conflict['end_time']}"
+    if conflict["type"] == "room":
+        return f"Phòng {slot.room} đã được sử dụng trong khung giờ {time_range} vào {date_info} tại cơ sở này. Vui lòng chọn phòng khác hoặc khung giờ khác."
+    if conflict["type"] == "teacher":
+        return f"Giáo viên đã có lịch dạy trong khung giờ {time_range} vào {date_info}. Vui lòng chọn giáo viên khác hoặc khung giờ khác."
+    return f"Lớp học đã có lịch học trong khung giờ {time_range} vào {date_info}. Vui lòng chọn ngày hoặc giờ khác."
+
+
+async def _check_schedule_conflicts(supabase: Database, slot: ScheduleSlot) -> None:
+    """Kiểm tra trùng phòng/giáo viên/lớp bằng index trong bộ nhớ"""
+    try:
+        await schedule_index.ensure_loaded(supabase)
+    except Exception as e:
+        # Không nạp được index: bỏ qua kiểm tra, ràng buộc unique trong database vẫn áp dụng
+        print(f"Warning: Conflict check failed (could not load schedule index): {str(e)}")
+        return
+    conflicts = schedule_index.find_conflicts(slot)
+    if conflicts:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=_conflict_message(conflicts[0], slot))
+
+
 @router.post("/", response_model=ScheduleResponse)
 async def create_schedule(
     schedule_data: ScheduleCreate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Tạo thời khóa biểu mới (chỉ admin)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Kiểm tra classroom có tồn tại không
-    classroom = supabase.table("classrooms").select("id").eq("id", schedule_data.classroom_id).execute()
+    classroom = await supabase.table("classrooms").select("id").eq("id", schedule_data.classroom_id).execute()
     if not classroom.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
     
     # Kiểm tra subject có tồn tại không
-    subject = supabase.table("subjects").select("id").eq("id", schedule_data.subject_id).execute()
+    subject = await supabase.table("subjects").select("id").eq("id", schedule_data.subject_id).execute()
     if not subject.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subject not found")
     
     # Kiểm tra teacher có tồn tại không
-    teacher = supabase.table("teachers").select("id").eq("id", schedule_data.teacher_id).execute()
+    teacher = await supabase.table("teachers").select("id").eq("id", schedule_data.teacher_id).execute()
     if not teacher.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Teacher not found")
 
     # Lấy thông tin classroom để kiểm tra campus_id
-    classroom_info = supabase.table("classrooms").select("campus_id").eq("id", schedule_data.classroom_id).execute()
+    classroom_info = await supabase.table("classrooms").select("campus_id").eq("id", schedule_data.classroom_id).execute()
     if not classroom_info.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
     
@@ -306,7 +371,7 @@ async def create_schedule(
         else:
             schedule_date = schedule_data.date
 
-    room_record, resolved_room_label = _resolve_room_reference(
+    room_record, resolved_room_label = await _resolve_room_reference(
         supabase,
         campus_id,
         schedule_data.room_id,
@@ -319,108 +384,10 @@ async def create_schedule(
             detail="Vui lòng chọn phòng học hợp lệ.",
         )
     
-    # Kiểm tra xung đột phòng học: ưu tiên kiểm tra ngày cụ thể trước
-    if room_value and campus_id:
-        try:
-            # Nếu có ngày cụ thể, kiểm tra theo ngày cụ thể
-            if schedule_date:
-                # Tìm các lịch học có cùng phòng, cùng cơ sở, cùng ngày cụ thể
-                conflict_query = supabase.table("schedules").select("""
-                    id,
-                    start_time,
-                    end_time,
-                    room,
-                    date,
-                    classrooms!inner(
-                        campus_id
-                    )
-            """).eq("date", schedule_date.isoformat()).eq("room", room_value)
-                
-                # Filter by campus_id through classroom
-                conflict_result = conflict_query.eq("classrooms.campus_id", campus_id).execute()
-            else:
-                # Nếu không có ngày cụ thể, kiểm tra theo day_of_week (tương thích với dữ liệu cũ)
-                conflict_query = supabase.table("schedules").select("""
-                    id,
-                    start_time,
-                    end_time,
-                    room,
-                    date,
-                    classrooms!inner(
-                        campus_id
-                    )
-            """).eq("day_of_week", schedule_data.day_of_week).eq("room", room_value).is_("date", "null")
-                
-                # Filter by campus_id through classroom
-                conflict_result = conflict_query.eq("classrooms.campus_id", campus_id).execute()
-            
-            if conflict_result.data:
-                # Kiểm tra xung đột thời gian
-                new_start_str = schedule_data.start_time.isoformat() if hasattr(schedule_data.start_time, 'isoformat') else str(schedule_data.start_time)
-                new_end_str = schedule_data.end_time.isoformat() if hasattr(schedule_data.end_time, 'isoformat') else str(schedule_data.end_time)
-                
-                # Convert to time objects for comparison
-                from datetime import time
-                new_start = time.fromisoformat(new_start_str.split('T')[-1])
-                new_end = time.fromisoformat(new_end_str.split('T')[-1])
-                
-                for existing in conflict_result.data:
-                    existing_start = time.fromisoformat(existing["start_time"])
-                    existing_end = time.fromisoformat(existing["end_time"])
-                    
-                    # Kiểm tra xung đột thời gian
-                    if (new_start < existing_end and new_end > existing_start):
-                        date_info = f"ngày {schedule_date.strftime('%d/%m/%Y')}" if schedule_date else f"thứ {schedule_data.day_of_week + 2}"
-                        raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST, 
-                            detail=f"Phòng {schedule_data.room} đã được sử dụng trong khung giờ {existing['start_time']} - {existing['end_time']} vào {date_info} tại cơ sở này. Vui lòng chọn phòng khác hoặc khung giờ khác."
-                        )
-        except HTTPException:
-            # Re-raise HTTP exceptions
-            raise
-        except Exception as conflict_error:
-            # Nếu conflict check fail (có thể do column date chưa tồn tại hoặc query issue), log và bỏ qua
-            print(f"Warning: Conflict check failed (may be due to missing date column or query issue): {str(conflict_error)}")
-            # Continue without conflict check - schedule will be created anyway
-
-    # Kiểm tra duplicate trước khi insert
-    # Nếu có date: kiểm tra (classroom_id, date, start_time)
-    # Nếu không có date: kiểm tra (classroom_id, day_of_week, start_time)
-    try:
-        if schedule_date:
-            # Kiểm tra duplicate cho lịch có ngày cụ thể
-            duplicate_check = supabase.table("schedules").select("id, date, start_time").eq(
-                "classroom_id", schedule_data.classroom_id
-            ).eq("date", schedule_date.isoformat()).eq(
-                "start_time", schedule_data.start_time.isoformat() if hasattr(schedule_data.start_time, 'isoformat') else str(schedule_data.start_time)
-            ).execute()
-            
-            if duplicate_check.data and len(duplicate_check.data) > 0:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Đã tồn tại lịch học cho lớp này vào ngày {schedule_date.strftime('%d/%m/%Y')} lúc {schedule_data.start_time.strftime('%H:%M')}. Vui lòng chọn ngày hoặc giờ khác."
-                )
-        else:
-            # Kiểm tra duplicate cho lịch định kỳ (không có date)
-            duplicate_check = supabase.table("schedules").select("id, day_of_week, start_time").eq(
-                "classroom_id", schedule_data.classroom_id
-            ).eq("day_of_week", schedule_data.day_of_week).eq(
-                "start_time", schedule_data.start_time.isoformat() if hasattr(schedule_data.start_time, 'isoformat') else str(schedule_data.start_time)
-            ).is_("date", "null").execute()
-            
-            if duplicate_check.data and len(duplicate_check.data) > 0:
-                days = ['Thứ hai', 'Thứ ba', 'Thứ tư', 'Thứ năm', 'Thứ sáu', 'Thứ bảy', 'Chủ nhật']
-                day_name = days[schedule_data.day_of_week] if 0 <= schedule_data.day_of_week < 7 else f"Thứ {schedule_data.day_of_week + 2}"
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Đã tồn tại lịch học cho lớp này vào {day_name} lúc {schedule_data.start_time.strftime('%H:%M')}. Vui lòng chọn ngày hoặc giờ khác."
-                )
-    except HTTPException:
-        raise
-    except Exception as dup_check_error:
-        # Nếu kiểm tra duplicate fail, log và tiếp tục (có thể do column date chưa tồn tại)
-        print(f"Warning: Duplicate check failed: {str(dup_check_error)}")
-        # Continue - sẽ bắt lỗi ở database level nếu có duplicate
+    # Kiểm tra trùng phòng (cùng cơ sở), giáo viên và lớp trong cùng khung giờ
+    await _check_schedule_conflicts(
+        supabase, _schedule_slot(schedule_data, schedule_date, campus_id, room_value)
+    )
 
     payload = {
         "classroom_id": schedule_data.classroom_id,
@@ -442,7 +409,7 @@ async def create_schedule(
         payload["room_id"] = room_record["id"]
 
     try:
-        result = supabase.table("schedules").insert(payload).execute()
+        result = await supabase.table("schedules").insert(payload).execute()
         if not result.data:
             error_msg = "Failed to create schedule"
             if hasattr(result, 'error') and result.error:
@@ -451,7 +418,8 @@ async def create_schedule(
         
         # Hydrate relations for the newly created schedule
         response_data = result.data[0]
-        return hydrate_single_schedule(supabase, response_data)
+        schedule_index.record(response_data)
+        return await hydrate_single_schedule(supabase, response_data)
     except HTTPException:
         raise
     except Exception as e:
@@ -482,8 +450,9 @@ async def create_schedule(
                 print("Retrying without date field...")
                 payload_without_date = {k: v for k, v in payload.items() if k != "date"}
                 try:
-                    result = supabase.table("schedules").insert(payload_without_date).execute()
+                    result = await supabase.table("schedules").insert(payload_without_date).execute()
                     if result.data:
+                        schedule_index.record(result.data[0])
                         return result.data[0]
                 except Exception as retry_error:
                     raise HTTPException(
@@ -499,33 +468,498 @@ async def create_schedule(
             detail=f"Failed to create schedule: {error_detail}"
         )
 
+async def _resolve_timetable(
+    supabase: Database,
+    items: List[ScheduleCreate],
+) -> Tuple[List[Optional[Dict[str, Any]]], Dict[int, List[str]]]:
+    """Chuẩn hóa và kiểm tra tham chiếu của nhiều lịch bằng các query theo tập hợp.
+
+    Trả về (payload cho từng dòng hoặc None nếu dòng lỗi, {vị trí dòng: [lỗi]}).
+    Payload có cùng các cột như khi tạo lịch qua POST /api/schedules.
+    """
+    classrooms, subjects, teachers, rooms_by_id = await asyncio.gather(
+        fetch_by_ids(supabase, "classrooms", (i.classroom_id for i in items), "id, campus_id"),
+        fetch_by_ids(supabase, "subjects", (i.subject_id for i in items), "id"),
+        fetch_by_ids(supabase, "teachers", (i.teacher_id for i in items), "id"),
+        fetch_by_ids(supabase, "rooms", (i.room_id for i in items), "id, code, name, campus_id"),
+    )
+
+    def campus_of(item: ScheduleCreate) -> Optional[str]:
+        classroom = classrooms.get(item.classroom_id)
+        return (classroom or {}).get("campus_id") or item.campus_id
+
+    # Phòng chỉ có nhãn: tìm theo code rồi theo name trong cơ sở của lớp
+    label_campuses = {campus_of(i) for i in items if not i.room_id and (i.room or "").strip()}
+    rooms_by_label: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    if label_campuses - {None}:
+        campus_rooms = await fetch_in(supabase, "rooms", "campus_id", label_campuses - {None}, "id, code, name, campus_id")
+        for field_name in ("name", "code"):
+            for room in campus_rooms:
+                if room.get(field_name):
+                    rooms_by_label[(room["campus_id"], str(room[field_name]).strip().lower())] = room
+
+    payloads: List[Optional[Dict[str, Any]]] = []
+    errors: Dict[int, List[str]] = {}
+    for position, item in enumerate(items):
+        row_errors: List[str] = []
+        if item.classroom_id not in classrooms:
+            row_errors.append("Classroom not found")
+        if item.subject_id not in subjects:
+            row_errors.append("Subject not found")
+        if item.teacher_id not in teachers:
+            row_errors.append("Teacher not found")
+        if not 0 <= item.day_of_week <= 6:
+            row_errors.append("day_of_week phải nằm trong khoảng 0-6")
+        if item.end_time <= item.start_time:
+            row_errors.append("Giờ kết thúc phải sau giờ bắt đầu")
+
+        schedule_date = None
+        if item.date:
+            try:
+                schedule_date = date.fromisoformat(item.date)
+            except ValueError:
+                row_errors.append("Invalid date format. Use YYYY-MM-DD")
+
+        campus_id = campus_of(item)
+        if item.classroom_id in classrooms and not campus_id:
+            row_errors.append("Lớp học chưa được gán cơ sở.")
+
+        room_record = None
+        room_value = (item.room or "").strip()
+        if item.room_id:
+            room_record = rooms_by_id.get(item.room_id)
+            if not room_record:
+                row_errors.append("Phòng học đã chọn không tồn tại.")
+            elif campus_id and room_record.get("campus_id") != campus_id:
+                row_errors.append("Phòng học không thuộc cùng cơ sở với lớp học.")
+        elif room_value and campus_id:
+            room_record = rooms_by_label.get((campus_id, room_value.lower()))
+            if not room_record:
+                row_errors.append("Không tìm thấy phòng học tương ứng trong cơ sở đã chọn.")
+        if room_record and not room_value:
+            room_value = room_record.get("code") or room_record.get("name") or ""
+        if not room_value:
+            row_errors.append("Vui lòng chọn phòng học hợp lệ.")
+
+        if row_errors:
+            errors[position] = row_errors
+            payloads.append(None)
+            continue
+
+        payload = {
+            "classroom_id": item.classroom_id,
+            "subject_id": item.subject_id,
+            "teacher_id": item.teacher_id,
+            "day_of_week": item.day_of_week,
+            "start_time": item.start_time.isoformat(),
+            "end_time": item.end_time.isoformat(),
+            "room": room_value,
+            "campus_id": campus_id,
+        }
+        if schedule_date:
+            payload["date"] = schedule_date.isoformat()
+        if room_record:
+            payload["room_id"] = room_record["id"]
+        payloads.append(payload)
+    return payloads, errors
+
+
+@router.post("/validate")
+async def validate_timetable(
+    request: TimetableValidationRequest,
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db),
+):
+    """Kiểm tra cả một thời khóa biểu đề xuất trong một lần gọi (không ghi dữ liệu).
+
+    Mỗi dòng được kiểm tra tham chiếu (lớp, môn, giáo viên, phòng) và trùng phòng /
+    giáo viên / lớp với dữ liệu hiện có và với các dòng khác trong cùng request.
+    Dòng có `id` được coi là thay thế lịch đó (lịch cũ không tính là xung đột).
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    items = request.schedules
+    payloads, errors = await _resolve_timetable(supabase, items)
+
+    try:
+        await schedule_index.ensure_loaded(supabase)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Could not load existing schedules: {str(e)}"
+        )
+
+    positions = [i for i, payload in enumerate(payloads) if payload is not None]
+    slots = [ScheduleSlot.from_row({**payloads[i], "id": items[i].id}) for i in positions]
+    conflicts = {
+        positions[slot_position]: [
+            {**c, "row": positions[c["row"]]} if "row" in c else c for c in found
+        ]
+        for slot_position, found in schedule_index.validate_batch(slots).items()
+    }
+
+    rows = [
+        {"row": i, "errors": errors.get(i, []), "conflicts": conflicts.get(i, [])}
+        for i in sorted(set(errors) | set(conflicts))
+    ]
+    return {
+        "valid": not rows,
+        "total": len(items),
+        "invalid_rows": len(rows),
+        "rows": rows,
+    }
+
+def _expand_pattern(pattern: RecurringPattern) -> List[ScheduleCreate]:
+    """Sinh các buổi học có ngày cụ thể từ mẫu lịch tuần"""
+    if pattern.end_date < pattern.start_date:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_date must not be before start_date")
+    skip = set(pattern.skip_dates)
+    items: List[ScheduleCreate] = []
+    day = pattern.start_date
+    while day <= pattern.end_date:
+        if day not in skip:
+            for session in pattern.sessions:
+                if session.day_of_week == day.weekday():
+                    items.append(session.copy(update={"date": day.isoformat()}))
+        day += timedelta(days=1)
+    return items
+
+
+async def _rollback_bulk_schedules(supabase: Database, schedule_ids: List[str]) -> List[str]:
+    """all_or_nothing: xóa các lịch đã tạo trong batch khi một chunk insert lỗi.
+    Trả về các id không xóa được"""
+    remaining: List[str] = []
+    for start in range(0, len(schedule_ids), IN_CHUNK_SIZE):
+        chunk = schedule_ids[start:start + IN_CHUNK_SIZE]
+        try:
+            await supabase.table("schedules").delete().in_("id", chunk).execute()
+        except Exception as e:
+            # Không xóa được: nạp lại index từ database để không giữ lịch ảo
+            print(f"Error rolling back bulk schedules: {str(e)}")
+            schedule_index.invalidate()
+            remaining.extend(chunk)
+            continue
+        for schedule_id in chunk:
+            schedule_index.discard(schedule_id)
+    return remaining
+
+
+async def _bulk_create_schedules(
+    supabase: Database,
+    items: List[Optional[ScheduleCreate]],
+    row_errors: Dict[int, List[str]],
+    dry_run: bool,
+    all_or_nothing: bool,
+) -> Dict[str, Any]:
+    """Kiểm tra (tham chiếu + trùng lịch trong bộ nhớ) rồi insert theo chunk.
+
+    `items[i]` là None khi dòng đã lỗi từ bước parse (lỗi nằm trong `row_errors`).
+    Dòng lỗi hoặc xung đột bị bỏ qua, các dòng còn lại vẫn được tạo (trừ khi
+    all_or_nothing: khi đó một chunk insert lỗi sẽ xóa mọi lịch đã tạo trong batch).
+    Giữa các dòng trong batch, dòng đến trước được giữ.
+    """
+    if len(items) > settings.SCHEDULE_BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Maximum {settings.SCHEDULE_BULK_MAX_ROWS} schedules per request"
+        )
+
+    positions = [i for i, item in enumerate(items) if item is not None]
+    payloads, errors = await _resolve_timetable(supabase, [items[i] for i in positions])
+    errors = {positions[i]: e for i, e in errors.items()}
+    for position, messages in row_errors.items():
+        errors.setdefault(position, []).extend(messages)
+
+    try:
+        await schedule_index.ensure_loaded(supabase)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Could not load existing schedules: {str(e)}"
+        )
+
+    valid = [(positions[i], payload) for i, payload in enumerate(payloads) if payload is not None]
+    found = schedule_index.validate_batch([ScheduleSlot.from_row(payload) for _, payload in valid])
+    conflicts = {
+        valid[i][0]: [{**c, "row": valid[c["row"]][0]} if "row" in c else c for c in row_conflicts]
+        for i, row_conflicts in found.items()
+    }
+    accepted = [(position, payload) for position, payload in valid if position not in conflicts]
+
+    created_ids: List[str] = []
+    rejected = bool(errors or conflicts)
+    if not dry_run and accepted and not (all_or_nothing and rejected):
+        chunk_size = max(1, settings.SCHEDULE_BULK_CHUNK_SIZE)
+        for start in range(0, len(accepted), chunk_size):
+            chunk = accepted[start:start + chunk_size]
+            if all_or_nothing:
+                # id sinh trước để xóa được cả chunk mà request lỗi sau khi database đã ghi
+                for _, payload in chunk:
+                    payload.setdefault("id", str(uuid.uuid4()))
+            try:
+                result = await supabase.table("schedules").insert([payload for _, payload in chunk]).execute()
+            except Exception as e:
+                # Mỗi chunk là một câu INSERT: lỗi thì cả chunk không được tạo
+                print(f"Error bulk inserting schedules: {str(e)}")
+                for position, _ in chunk:
+                    errors.setdefault(position, []).append(f"Insert failed: {str(e)}")
+                if all_or_nothing:
+                    # Chunk lỗi có thể vẫn được ghi nếu lỗi xảy ra sau khi database nhận
+                    created_ids = await _rollback_bulk_schedules(
+                        supabase, created_ids + [payload["id"] for _, payload in chunk]
+                    )
+                    for position, _ in accepted:
+                        if position not in errors:
+                            errors[position] = ["Not created: all_or_nothing batch was rolled back"]
+                    break
+                continue
+            for row in result.data or []:
+                schedule_index.record(row)
+                created_ids.append(row.get("id"))
+
+    report = [
+        {"row": i, "errors": errors.get(i, []), "conflicts": conflicts.get(i, [])}
+        for i in sorted(set(errors) | set(conflicts))
+    ]
+    return {
+        "total": len(items),
+        "valid": len(accepted),
+        "created": len(created_ids),
+        "failed": len(report),
+        "dry_run": dry_run,
+        "schedule_ids": created_ids,
+        "rows": report,
+    }
+
+
+@router.post("/bulk")
+async def bulk_create_schedules(
+    request: TimetableBulkRequest,
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db),
+):
+    """Tạo nhiều lịch trong một request (chỉ admin).
+
+    Nhận danh sách `schedules` và/hoặc `pattern` (mẫu tuần + khoảng ngày của học kỳ,
+    được sinh thành các buổi có ngày cụ thể). Trả về số dòng đã tạo và lỗi/xung
+    đột của từng dòng (`row` là vị trí trong danh sách: schedules trước, rồi các
+    buổi sinh từ pattern). `dry_run` chỉ kiểm tra, không ghi dữ liệu.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    items: List[Optional[ScheduleCreate]] = list(request.schedules)
+    if request.pattern:
+        items.extend(_expand_pattern(request.pattern))
+    if not items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No schedules to create")
+
+    return await _bulk_create_schedules(supabase, items, {}, request.dry_run, request.all_or_nothing)
+
+
+@router.post("/import")
+async def import_schedules_csv(
+    file: UploadFile = File(...),
+    dry_run: bool = Form(False),
+    all_or_nothing: bool = Form(False),
+    current_user = Depends(get_current_user),
+    supabase: Database = Depends(get_db),
+):
+    """Import thời khóa biểu từ file CSV (chỉ admin).
+
+    Cột: classroom_id, subject_id, teacher_id, day_of_week, start_time, end_time,
+    room, room_id, date (room/room_id/date có thể để trống). Trong báo cáo lỗi,
+    `line` là số dòng trong file (dòng 1 là header).
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="CSV file must be UTF-8 encoded")
+
+    reader = csv.DictReader(io.StringIO(text))
+    items: List[Optional[ScheduleCreate]] = []
+    parse_errors: Dict[int, List[str]] = {}
+    for position, raw in enumerate(reader):
+        row = {
+            (key or "").strip().lower(): (value.strip() if isinstance(value, str) and value.strip() else None)
+            for key, value in raw.items()
+        }
+        try:
+            items.append(ScheduleCreate(**{k: v for k, v in row.items() if k and v is not None}))
+        except ValidationError as e:
+            items.append(None)
+            parse_errors[position] = [
+                f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+            ]
+    if not items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="CSV file has no rows")
+
+    result = await _bulk_create_schedules(supabase, items, parse_errors, dry_run, all_or_nothing)
+    for row in result["rows"]:
+        row["line"] = row["row"] + 2
+    return result
+
 @router.get("/test")
-async def test_schedules(supabase: Client = Depends(get_db)):
+async def test_schedules(supabase: Database = Depends(get_db)):
     """Test endpoint without authentication"""
     try:
-        result = supabase.table("schedules").select("*").limit(5).execute()
+        result = await supabase.table("schedules").select("*").limit(5).execute()
         return {"data": result.data, "count": len(result.data)}
     except Exception as e:
         return {"error": str(e)}
 
+MAX_SCHEDULE_PAGE_SIZE = 1000
+MAX_SCHEDULE_WINDOW_DAYS = 62
+
+
+def _quote(value: Any) -> str:
+    """Giá trị trong filter or/and của PostgREST (đặt trong dấu nháy kép)"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def encode_schedule_cursor(row: Dict[str, Any]) -> str:
+    payload = json.dumps([row.get("date"), row.get("start_time"), row.get("id")])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_schedule_cursor(cursor: str) -> Tuple[Optional[str], str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        schedule_date, start_time, schedule_id = json.loads(base64.urlsafe_b64decode(padded))
+        if schedule_date is not None:
+            schedule_date = date.fromisoformat(schedule_date).isoformat()
+        if not start_time or not schedule_id:
+            raise ValueError("incomplete cursor")
+        return schedule_date, str(start_time), str(schedule_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _keyset_condition(cursor: Tuple[Optional[str], str, str]) -> str:
+    """Điều kiện "sau cursor" theo thứ tự (date ASC NULLS LAST, start_time, id)"""
+    schedule_date, start_time, schedule_id = cursor
+    same_date_after = (
+        f"start_time.gt.{_quote(start_time)},"
+        f"and(start_time.eq.{_quote(start_time)},id.gt.{_quote(schedule_id)})"
+    )
+    if schedule_date is None:
+        # Lịch định kỳ (date NULL) nằm cuối danh sách
+        return f"and(date.is.null,or({same_date_after}))"
+    return (
+        f"or(date.gt.{_quote(schedule_date)},date.is.null,"
+        f"and(date.eq.{_quote(schedule_date)},or({same_date_after})))"
+    )
+
+
+def _window_condition(from_date: date, to_date: date) -> str:
+    """Lịch có ngày cụ thể trong [from, to] + lịch định kỳ rơi vào các thứ trong khoảng đó"""
+    weekdays = sorted({(from_date + timedelta(days=i)).weekday() for i in range(min((to_date - from_date).days + 1, 7))})
+    return (
+        f"or(and(date.gte.{from_date.isoformat()},date.lte.{to_date.isoformat()}),"
+        f"and(date.is.null,day_of_week.in.({','.join(str(d) for d in weekdays)})))"
+    )
+
+
 @router.get("/")
 async def get_schedules(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    skip: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_SCHEDULE_PAGE_SIZE),
     classroom_id: Optional[str] = None,
     teacher_id: Optional[str] = None,
     campus_id: Optional[str] = None,
-    day_of_week: Optional[int] = None,
+    day_of_week: Optional[int] = Query(None, ge=0, le=6),
+    cursor: Optional[str] = Query(None, description="Cursor lấy từ header X-Next-Cursor của trang trước"),
+    from_date: Optional[date] = Query(None, alias="from", description="Chế độ tuần/lịch: từ ngày"),
+    to_date: Optional[date] = Query(None, alias="to", description="Chế độ tuần/lịch: đến ngày"),
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
-    """Lấy danh sách thời khóa biểu"""
+    """Lấy danh sách thời khóa biểu
+
+    Lọc và phân trang chạy trong database, sắp xếp theo (date, start_time, id).
+    - Phân trang offset: `skip`/`limit`
+    - Phân trang keyset: truyền `cursor` (khi đó bỏ qua `skip`)
+    - Không truyền `skip`/`limit`/`cursor`: trả về toàn bộ lịch khớp bộ lọc (đọc
+      theo trang keyset bên trong), như trước khi có phân trang
+    - Chế độ tuần: `from`/`to` trả về lịch có ngày trong khoảng và lịch định kỳ
+      (date NULL) có day_of_week rơi vào khoảng đó
+    Nếu còn trang sau, header `X-Next-Cursor` chứa cursor của trang tiếp theo.
+    """
+    if (from_date is None) != (to_date is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Both 'from' and 'to' are required")
+    if from_date and to_date:
+        if to_date < from_date:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'to' must not be before 'from'")
+        if (to_date - from_date).days >= MAX_SCHEDULE_WINDOW_DAYS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Date window must be shorter than {MAX_SCHEDULE_WINDOW_DAYS} days"
+            )
+    keyset = decode_schedule_cursor(cursor) if cursor else None
+
+    def build(after: Optional[Tuple[Optional[str], str, str]]):
+        query = supabase.table("schedules").select("*")
+        if classroom_id:
+            query = query.eq("classroom_id", classroom_id)
+        if teacher_id:
+            query = query.eq("teacher_id", teacher_id)
+        if campus_id:
+            query = query.eq("campus_id", campus_id)
+        if day_of_week is not None:
+            query = query.eq("day_of_week", day_of_week)
+
+        conditions = []
+        if from_date and to_date:
+            conditions.append(_window_condition(from_date, to_date))
+        if after:
+            conditions.append(_keyset_condition(after))
+        if conditions:
+            # Một tham số `or` duy nhất; and(...) bên trong để ghép các điều kiện
+            query = query.or_(f"and({','.join(conditions)})")
+
+        return (
+            query.order("date", nullsfirst=False)
+            .order("start_time")
+            .order("id")
+        )
+
     try:
-        # Simple query to avoid Unicode issues
-        result = supabase.table("schedules").select("*").execute()
-        schedules = result.data or []
-        hydrated = hydrate_schedule_relations(supabase, schedules)
-        return hydrated
+        if limit is None and skip is None and keyset is None:
+            # Client cũ không phân trang: đọc hết theo keyset, chỉ dừng khi gặp trang
+            # rỗng (trang ngắn có thể do max-rows của PostgREST)
+            page: List[Dict[str, Any]] = []
+            after = None
+            while True:
+                result = await build(after).range(0, MAX_SCHEDULE_PAGE_SIZE - 1).execute()
+                rows = result.data or []
+                if not rows:
+                    break
+                last = (rows[-1].get("date"), str(rows[-1].get("start_time")), str(rows[-1].get("id")))
+                if last == after:
+                    print(f"[get_schedules] keyset did not advance past {after!r}, stopping")
+                    break
+                page.extend(rows)
+                after = last
+            return await hydrate_schedule_relations(supabase, page)
+
+        limit = limit or 100
+        # Lấy thêm 1 dòng để biết còn trang sau hay không
+        start = 0 if keyset else (skip or 0)
+        result = await build(keyset).range(start, start + limit).execute()
+        rows = result.data or []
+
+        page = rows[:limit]
+        if len(rows) > limit and page:
+            response.headers["X-Next-Cursor"] = encode_schedule_cursor(page[-1])
+
+        return await hydrate_schedule_relations(supabase, page)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_schedules: {e}")
         return []
@@ -534,32 +968,32 @@ async def get_schedules(
 async def get_schedule(
     schedule_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy thông tin một thời khóa biểu"""
-    result = supabase.table("schedules").select("*").eq("id", schedule_id).execute()
+    result = await supabase.table("schedules").select("*").eq("id", schedule_id).execute()
     if not result.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Schedule not found")
-    return hydrate_single_schedule(supabase, result.data[0])
+    return await hydrate_single_schedule(supabase, result.data[0])
 
 @router.put("/{schedule_id}", response_model=ScheduleResponse)
 async def update_schedule(
     schedule_id: str,
     schedule_data: ScheduleCreate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Cập nhật thời khóa biểu"""
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     # Check if schedule exists
-    existing = supabase.table("schedules").select("id").eq("id", schedule_id).execute()
+    existing = await supabase.table("schedules").select("id").eq("id", schedule_id).execute()
     if not existing.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Schedule not found")
 
     # Lấy thông tin classroom để kiểm tra campus_id
-    classroom_info = supabase.table("classrooms").select("campus_id").eq("id", schedule_data.classroom_id).execute()
+    classroom_info = await supabase.table("classrooms").select("campus_id").eq("id", schedule_data.classroom_id).execute()
     if not classroom_info.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Classroom not found")
     
@@ -578,7 +1012,7 @@ async def update_schedule(
         except ValueError:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid date format. Use YYYY-MM-DD")
     
-    room_record, resolved_room_label = _resolve_room_reference(
+    room_record, resolved_room_label = await _resolve_room_reference(
         supabase,
         campus_id,
         schedule_data.room_id,
@@ -591,61 +1025,10 @@ async def update_schedule(
             detail="Vui lòng chọn phòng học hợp lệ.",
         )
     
-    # Kiểm tra xung đột phòng học: ưu tiên kiểm tra ngày cụ thể trước
-    if room_value and campus_id:
-        # Nếu có ngày cụ thể, kiểm tra theo ngày cụ thể
-        if schedule_date:
-            # Tìm các lịch học có cùng phòng, cùng cơ sở, cùng ngày cụ thể (trừ lịch hiện tại)
-            conflict_query = supabase.table("schedules").select("""
-                id,
-                start_time,
-                end_time,
-                room,
-                date,
-                classrooms!inner(
-                    campus_id
-                )
-            """).eq("date", schedule_date.isoformat()).eq("room", room_value).neq("id", schedule_id)
-            
-            # Filter by campus_id through classroom
-            conflict_result = conflict_query.eq("classrooms.campus_id", campus_id).execute()
-        else:
-            # Nếu không có ngày cụ thể, kiểm tra theo day_of_week (tương thích với dữ liệu cũ)
-            conflict_query = supabase.table("schedules").select("""
-                id,
-                start_time,
-                end_time,
-                room,
-                date,
-                classrooms!inner(
-                    campus_id
-                )
-            """).eq("day_of_week", schedule_data.day_of_week).eq("room", room_value).is_("date", "null").neq("id", schedule_id)
-            
-            # Filter by campus_id through classroom
-            conflict_result = conflict_query.eq("classrooms.campus_id", campus_id).execute()
-        
-        if conflict_result.data:
-            # Kiểm tra xung đột thời gian
-            new_start_str = schedule_data.start_time.isoformat() if hasattr(schedule_data.start_time, 'isoformat') else str(schedule_data.start_time)
-            new_end_str = schedule_data.end_time.isoformat() if hasattr(schedule_data.end_time, 'isoformat') else str(schedule_data.end_time)
-            
-            # Convert to time objects for comparison
-            from datetime import time
-            new_start = time.fromisoformat(new_start_str.split('T')[-1])
-            new_end = time.fromisoformat(new_end_str.split('T')[-1])
-            
-            for existing in conflict_result.data:
-                existing_start = time.fromisoformat(existing["start_time"])
-                existing_end = time.fromisoformat(existing["end_time"])
-                
-                # Kiểm tra xung đột thời gian
-                if (new_start < existing_end and new_end > existing_start):
-                    date_info = f"ngày {schedule_date.strftime('%d/%m/%Y')}" if schedule_date else f"thứ {schedule_data.day_of_week + 2}"
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST, 
-                        detail=f"Phòng {room_value} đã được sử dụng trong khung giờ {existing['start_time']} - {existing['end_time']} vào {date_info} tại cơ sở này. Vui lòng chọn phòng khác hoặc khung giờ khác."
-                    )
+    # Kiểm tra trùng phòng (cùng cơ sở), giáo viên và lớp, bỏ qua chính lịch đang sửa
+    await _check_schedule_conflicts(
+        supabase, _schedule_slot(schedule_data, schedule_date, campus_id, room_value, schedule_id)
+    )
 
     update_data = schedule_data.dict(exclude_unset=True)
     if "start_time" in update_data:
@@ -668,26 +1051,28 @@ async def update_schedule(
     if room_record:
         update_data["room_id"] = room_record["id"]
 
-    result = supabase.table("schedules").update(update_data).eq("id", schedule_id).execute()
+    result = await supabase.table("schedules").update(update_data).eq("id", schedule_id).execute()
     if not result.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update schedule")
-    return hydrate_single_schedule(supabase, result.data[0])
+    schedule_index.record(result.data[0])
+    return await hydrate_single_schedule(supabase, result.data[0])
 
 @router.delete("/{schedule_id}")
 async def delete_schedule(
     schedule_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Xóa thời khóa biểu (chỉ admin)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
-    existing = supabase.table("schedules").select("id").eq("id", schedule_id).execute()
+    existing = await supabase.table("schedules").select("id").eq("id", schedule_id).execute()
     if not existing.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Schedule not found")
 
-    result = supabase.table("schedules").delete().eq("id", schedule_id).execute()
+    result = await supabase.table("schedules").delete().eq("id", schedule_id).execute()
     if not result.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to delete schedule")
+    schedule_index.discard(schedule_id)
     return {"message": "Schedule deleted successfully"}
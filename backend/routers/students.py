@@ -7,10 +7,13 @@ from datetime import datetime
 from typing import List, Optional
 from types import SimpleNamespace
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from supabase import Client
 
 from models.student import StudentCreate, StudentCreateFromUser, StudentUpdate, StudentResponse
-from database import get_db
+from database import get_db, Database
+from supabase_client import create_session_client
+from services.token_cache import token_cache
+from services.permission_registry import permission_registry
+from services import grade_rollups
 from routers.auth import get_current_user_dev
 
 router = APIRouter()
@@ -19,7 +22,7 @@ router = APIRouter()
 async def create_student(
     student_data: StudentCreateFromUser,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo học sinh mới"""
     try:
@@ -38,7 +41,7 @@ async def create_student(
             )
         
         # Check if email already exists
-        existing_user = supabase.table('users').select('id').eq('email', student_data.email).execute()
+        existing_user = await supabase.table('users').select('id').eq('email', student_data.email).execute()
         if existing_user.data:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -53,7 +56,7 @@ async def create_student(
             
             # Try using admin API first (requires service role key)
             try:
-                admin_resp = supabase.auth.admin.create_user({
+                admin_resp = await supabase.run(supabase.auth.admin.create_user, {
                     'email': student_data.email,
                     'password': password,
                     'email_confirm': True,  # Auto-confirm email
@@ -79,7 +82,7 @@ async def create_student(
             except Exception as admin_error:
                 print(f"Admin API failed, trying sign_up: {str(admin_error)}")
                 # Fallback to sign_up if admin API fails
-                auth_resp = supabase.auth.sign_up({
+                auth_resp = await supabase.run(create_session_client().auth.sign_up, {
                     'email': student_data.email,
                     'password': password,
                     'options': {
@@ -141,7 +144,7 @@ async def create_student(
         password_hash = pwd_context.hash(password)
         
         # Tạo user trước
-        user_result = supabase.table('users').insert({
+        user_result = await supabase.table('users').insert({
             'id': user_id,
             'full_name': student_data.name,
             'email': student_data.email,
@@ -159,7 +162,7 @@ async def create_student(
             )
         
         # Tạo student
-        student_result = supabase.table('students').insert({
+        student_result = await supabase.table('students').insert({
             'id': str(uuid.uuid4()),
             'user_id': user_id,
             'student_code': student_code,
@@ -178,11 +181,11 @@ async def create_student(
             try:
                 # Try to delete auth user
                 try:
-                    supabase.auth.admin.delete_user(user_id)
+                    await supabase.run(supabase.auth.admin.delete_user, user_id)
                 except:
                     pass  # Ignore if admin API not available
                 # Delete user from database
-                supabase.table('users').delete().eq('id', user_id).execute()
+                await supabase.table('users').delete().eq('id', user_id).execute()
             except:
                 pass  # Ignore cleanup errors
             raise HTTPException(
@@ -194,7 +197,7 @@ async def create_student(
         student_data_result = student_result.data[0]
         
         # Get user info from database to ensure consistency
-        user_info = supabase.table('users').select('full_name, email').eq('id', user_id).execute()
+        user_info = await supabase.table('users').select('full_name, email').eq('id', user_id).execute()
         user_data = user_info.data[0] if user_info.data else {}
         
         return StudentResponse(
@@ -227,12 +230,12 @@ async def create_student(
             if 'user_id' in locals() and user_id:
                 # Try to delete auth user if exists
                 try:
-                    supabase.auth.admin.delete_user(user_id)
+                    await supabase.run(supabase.auth.admin.delete_user, user_id)
                 except:
                     pass  # Ignore if admin API not available or user doesn't exist
                 # Delete user from database
                 try:
-                    supabase.table('users').delete().eq('id', user_id).execute()
+                    await supabase.table('users').delete().eq('id', user_id).execute()
                 except:
                     pass  # Ignore if user doesn't exist
         except Exception as cleanup_error:
@@ -249,7 +252,7 @@ async def get_students(
     search: Optional[str] = Query(None),
     classroom_id: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách học sinh với thông tin user và pagination"""
     try:
@@ -269,14 +272,14 @@ async def get_students(
             count_query = count_query.eq('classroom_id', classroom_id)
         
         # Get total count
-        count_result = count_query.execute()
+        count_result = await count_query.execute()
         total = count_result.count if hasattr(count_result, 'count') and count_result.count is not None else 0
         
         # Order by created_at desc
         query = query.order('created_at', desc=True)
         
         # Apply pagination
-        result = query.range(skip, skip + limit - 1).execute()
+        result = await query.range(skip, skip + limit - 1).execute()
         
         if not result.data:
             return {
@@ -324,11 +327,11 @@ async def get_students(
 
 @router.get("/simple", response_model=List[StudentResponse])
 async def get_students_simple(
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách học sinh đơn giản (không cần auth)"""
     try:
-        result = supabase.table('students').select('*').order('created_at', desc=True).execute()
+        result = await supabase.table('students').select('*').order('created_at', desc=True).execute()
         return result.data or []
     except Exception as e:
         print(f"Error fetching students: {e}")
@@ -338,11 +341,11 @@ async def get_students_simple(
 async def get_student(
     student_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin học sinh theo ID"""
     try:
-        result = supabase.table('students').select('*, users(full_name, email)').eq('id', student_id).execute()
+        result = await supabase.table('students').select('*, users(full_name, email)').eq('id', student_id).execute()
         if not result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -377,12 +380,12 @@ async def update_student(
     student_id: str,
     student_data: StudentUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật thông tin học sinh"""
     try:
         # Kiểm tra học sinh có tồn tại không và lấy user_id
-        existing_student = supabase.table('students').select('id, user_id').eq('id', student_id).execute()
+        existing_student = await supabase.table('students').select('id, user_id').eq('id', student_id).execute()
         if not existing_student.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -393,7 +396,7 @@ async def update_student(
         
         # Kiểm tra email đã tồn tại chưa (nếu cập nhật email)
         if student_data.email:
-            email_check = supabase.table('users').select('id').eq('email', student_data.email).neq('id', user_id).execute()
+            email_check = await supabase.table('users').select('id').eq('email', student_data.email).neq('id', user_id).execute()
             if email_check.data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -410,12 +413,15 @@ async def update_student(
             user_update_data['role'] = student_data.role
         
         if user_update_data:
-            user_result = supabase.table('users').update(user_update_data).eq('id', user_id).execute()
+            user_result = await supabase.table('users').update(user_update_data).eq('id', user_id).execute()
             if not user_result.data:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Failed to update user"
                 )
+            token_cache.invalidate_user(user_id)
+            if 'role' in user_update_data:
+                permission_registry.invalidate()
         
         # Cập nhật students table
         student_update_data = {}
@@ -433,15 +439,17 @@ async def update_student(
             student_update_data['classroom_id'] = student_data.classroom_id
         
         if student_update_data:
-            student_result = supabase.table('students').update(student_update_data).eq('id', student_id).execute()
+            student_result = await supabase.table('students').update(student_update_data).eq('id', student_id).execute()
             if not student_result.data:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Failed to update student"
                 )
+            if 'classroom_id' in student_update_data:
+                await grade_rollups.refresh_students(supabase, [student_id])
         
         # Lấy thông tin cập nhật với join
-        updated_student = supabase.table('students').select('*, users(full_name, email)').eq('id', student_id).execute()
+        updated_student = await supabase.table('students').select('*, users(full_name, email)').eq('id', student_id).execute()
         if not updated_student.data:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -476,12 +484,12 @@ async def update_student(
 async def delete_student(
     student_id: str,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa học sinh"""
     try:
         # Lấy user_id trước khi xóa
-        student_info = supabase.table('students').select('user_id').eq('id', student_id).execute()
+        student_info = await supabase.table('students').select('user_id').eq('id', student_id).execute()
         if not student_info.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -491,7 +499,7 @@ async def delete_student(
         user_id = student_info.data[0]['user_id']
         
         # Xóa student trước (foreign key constraint)
-        student_result = supabase.table('students').delete().eq('id', student_id).execute()
+        student_result = await supabase.table('students').delete().eq('id', student_id).execute()
         if not student_result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -499,12 +507,14 @@ async def delete_student(
             )
         
         # Xóa user (CASCADE sẽ tự động xóa student)
-        user_result = supabase.table('users').delete().eq('id', user_id).execute()
+        user_result = await supabase.table('users').delete().eq('id', user_id).execute()
         if not user_result.data:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to delete user"
             )
+        token_cache.invalidate_user(user_id)
+        permission_registry.invalidate()
         
         return {"message": "Student deleted successfully"}
         
@@ -521,7 +531,7 @@ async def get_student_grades(
     classroom_id: Optional[str] = Query(None),
     subject_id: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy điểm số của học sinh - convenience endpoint with frontend-compatible format"""
     # Import here to avoid circular dependency at module level
@@ -569,12 +579,13 @@ async def get_student_grades(
             student_id=student_id,
             classroom_id=classroom_id,
             subject_id=subject_id,
+            include_assignments=True,
             current_user=user_obj,
             supabase=supabase
         )
         
         # Get student name
-        student_result = supabase.table('students').select('*, users(full_name)').eq('id', student_id).execute()
+        student_result = await supabase.table('students').select('*, users(full_name)').eq('id', student_id).execute()
         student_name = 'Học sinh'
         if student_result.data and student_result.data[0].get('users'):
             student_name = student_result.data[0]['users'].get('full_name', 'Học sinh')
@@ -672,24 +683,24 @@ async def get_student_grades(
 @router.get("/stats/overview")
 async def get_student_stats(
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thống kê tổng quan học sinh"""
     try:
         # Tổng số học sinh
-        total_students = supabase.table('students').select('id', count='exact').execute()
+        total_students = await supabase.table('students').select('id', count='exact').execute()
         total_count = total_students.count if total_students.count else 0
         
         # Học sinh có địa chỉ
-        students_with_address = supabase.table('students').select('id', count='exact').not_.is_('address', 'null').execute()
+        students_with_address = await supabase.table('students').select('id', count='exact').not_.is_('address', 'null').execute()
         address_count = students_with_address.count if students_with_address.count else 0
         
         # Học sinh có ngày sinh
-        students_with_birthday = supabase.table('students').select('id', count='exact').not_.is_('date_of_birth', 'null').execute()
+        students_with_birthday = await supabase.table('students').select('id', count='exact').not_.is_('date_of_birth', 'null').execute()
         birthday_count = students_with_birthday.count if students_with_birthday.count else 0
         
         # Học sinh có thông tin phụ huynh
-        students_with_parent = supabase.table('students').select('id', count='exact').not_.is_('parent_name', 'null').execute()
+        students_with_parent = await supabase.table('students').select('id', count='exact').not_.is_('parent_name', 'null').execute()
         parent_count = students_with_parent.count if students_with_parent.count else 0
         
         return {
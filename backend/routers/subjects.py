@@ -6,9 +6,8 @@ Router cho quản lý môn học
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from pydantic import BaseModel
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from models.subject import Subject, SubjectCreate, SubjectUpdate
 from routers.auth import get_current_user
 
@@ -29,7 +28,7 @@ class SubjectResponse(BaseModel):
 async def create_subject(
     subject_data: SubjectCreate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo môn học mới (chỉ admin)"""
     if current_user.role != 'admin':
@@ -39,7 +38,7 @@ async def create_subject(
         )
     
     # Kiểm tra code đã tồn tại chưa
-    existing_subject = supabase.table('subjects').select('id').eq('code', subject_data.code).execute()
+    existing_subject = await supabase.table('subjects').select('id').eq('code', subject_data.code).execute()
     if existing_subject.data:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -47,7 +46,7 @@ async def create_subject(
         )
     
     # Tạo môn học mới
-    result = supabase.table('subjects').insert(subject_data.dict()).execute()
+    result = await supabase.table('subjects').insert(subject_data.dict()).execute()
     if not result.data:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -61,20 +60,20 @@ async def get_subjects(
     skip: int = 0,
     limit: int = 100,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách môn học"""
-    result = supabase.table('subjects').select('*').order('created_at', desc=True).range(skip, skip + limit - 1).execute()
+    result = await supabase.table('subjects').select('*').order('created_at', desc=True).range(skip, skip + limit - 1).execute()
     return result.data or []
 
 @router.get("/{subject_id}", response_model=SubjectResponse)
 async def get_subject(
     subject_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin một môn học"""
-    result = supabase.table('subjects').select('*').eq('id', subject_id).execute()
+    result = await supabase.table('subjects').select('*').eq('id', subject_id).execute()
     if not result.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -87,7 +86,7 @@ async def update_subject(
     subject_id: str,
     subject_data: SubjectUpdate,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật thông tin môn học"""
     if current_user.role != 'admin':
@@ -97,7 +96,7 @@ async def update_subject(
         )
     
     # Kiểm tra môn học có tồn tại không
-    existing_subject = supabase.table('subjects').select('id').eq('id', subject_id).execute()
+    existing_subject = await supabase.table('subjects').select('id').eq('id', subject_id).execute()
     if not existing_subject.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -106,7 +105,7 @@ async def update_subject(
     
     # Kiểm tra code mới có trùng không (nếu có thay đổi code)
     if subject_data.code:
-        code_check = supabase.table('subjects').select('id').eq('code', subject_data.code).neq('id', subject_id).execute()
+        code_check = await supabase.table('subjects').select('id').eq('code', subject_data.code).neq('id', subject_id).execute()
         if code_check.data:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -115,7 +114,7 @@ async def update_subject(
     
     # Cập nhật môn học
     update_data = subject_data.dict(exclude_unset=True)
-    result = supabase.table('subjects').update(update_data).eq('id', subject_id).execute()
+    result = await supabase.table('subjects').update(update_data).eq('id', subject_id).execute()
     
     if not result.data:
         raise HTTPException(
@@ -129,7 +128,7 @@ async def update_subject(
 async def delete_subject(
     subject_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa môn học (chỉ admin)"""
     if current_user.role != 'admin':
@@ -139,7 +138,7 @@ async def delete_subject(
         )
     
     # Kiểm tra môn học có tồn tại không
-    existing_subject = supabase.table('subjects').select('id').eq('id', subject_id).execute()
+    existing_subject = await supabase.table('subjects').select('id').eq('id', subject_id).execute()
     if not existing_subject.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -147,7 +146,7 @@ async def delete_subject(
         )
     
     # Xóa môn học
-    result = supabase.table('subjects').delete().eq('id', subject_id).execute()
+    result = await supabase.table('subjects').delete().eq('id', subject_id).execute()
     
     if not result.data:
         raise HTTPException(
@@ -161,8 +160,8 @@ async def delete_subject(
 async def search_subjects(
     query: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tìm kiếm môn học theo tên hoặc mã"""
-    result = supabase.table('subjects').select('*').or_(f'name.ilike.%{query}%,code.ilike.%{query}%').order('created_at', desc=True).execute()
+    result = await supabase.table('subjects').select('*').or_(f'name.ilike.%{query}%,code.ilike.%{query}%').order('created_at', desc=True).execute()
     return result.data or []
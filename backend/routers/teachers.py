@@ -6,9 +6,12 @@ Router cho quản lý giáo viên
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from pydantic import BaseModel
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
+from supabase_client import create_session_client
+from services.token_cache import token_cache
+from services.permission_registry import permission_registry
+from services.paging import stream_rows
 from models.teacher import Teacher, TeacherCreate, TeacherUpdate, TeacherCreateFromUser
 from routers.auth import get_current_user, get_current_user_dev
 
@@ -35,7 +38,7 @@ class TeacherResponse(BaseModel):
 async def create_teacher(
     teacher_data: TeacherCreateFromUser,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo giáo viên mới từ user data (chỉ admin)"""
     if current_user.role != 'admin':
@@ -49,7 +52,7 @@ async def create_teacher(
     teacher_code = f"GV{str(uuid.uuid4())[:6].upper()}"
     
     # Kiểm tra email đã tồn tại trong bảng users
-    existing_user = supabase.table('users').select('id').eq('email', teacher_data.email).execute()
+    existing_user = await supabase.table('users').select('id').eq('email', teacher_data.email).execute()
     if existing_user.data:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -57,7 +60,7 @@ async def create_teacher(
         )
     
     # Kiểm tra teacher_code đã tồn tại chưa
-    existing_teacher = supabase.table('teachers').select('id').eq('teacher_code', teacher_code).execute()
+    existing_teacher = await supabase.table('teachers').select('id').eq('teacher_code', teacher_code).execute()
     if existing_teacher.data:
         # Regenerate teacher_code if exists
         teacher_code = f"GV{str(uuid.uuid4())[:6].upper()}"
@@ -81,7 +84,7 @@ async def create_teacher(
         try:
             # Try using admin API first (requires service role key)
             try:
-                admin_resp = supabase.auth.admin.create_user({
+                admin_resp = await supabase.run(supabase.auth.admin.create_user, {
                     'email': teacher_data.email,
                     'password': password,
                     'email_confirm': True,  # Auto-confirm email
@@ -105,7 +108,7 @@ async def create_teacher(
             except Exception as admin_error:
                 print(f"Admin API failed for teacher, trying sign_up: {str(admin_error)}")
                 # Fallback to sign_up if admin API fails
-                auth_resp = supabase.auth.sign_up({
+                auth_resp = await supabase.run(create_session_client().auth.sign_up, {
                     'email': teacher_data.email,
                     'password': password,
                     'options': {
@@ -159,7 +162,7 @@ async def create_teacher(
         pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
         password_hash = pwd_context.hash(password)
         
-        user_result = supabase.table('users').insert({
+        user_result = await supabase.table('users').insert({
             'id': user_id,
             'full_name': teacher_data.name,
             'email': teacher_data.email,
@@ -177,7 +180,7 @@ async def create_teacher(
             )
         
         # 3) Tạo teacher
-        teacher_result = supabase.table('teachers').insert({
+        teacher_result = await supabase.table('teachers').insert({
             'id': str(uuid.uuid4()),
             'user_id': user_id,
             'teacher_code': teacher_code,
@@ -191,7 +194,7 @@ async def create_teacher(
         
         if not teacher_result.data:
             # Rollback user creation
-            supabase.table('users').delete().eq('id', user_id).execute()
+            await supabase.table('users').delete().eq('id', user_id).execute()
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to create teacher"
@@ -201,7 +204,7 @@ async def create_teacher(
         teacher_data_result = teacher_result.data[0]
         
         # Get user info from database to ensure consistency
-        user_info = supabase.table('users').select('full_name, email').eq('id', user_id).execute()
+        user_info = await supabase.table('users').select('full_name, email').eq('id', user_id).execute()
         user_data = user_info.data[0] if user_info.data else {}
         
         return TeacherResponse(
@@ -220,7 +223,7 @@ async def create_teacher(
         
     except Exception as e:
         # Cleanup on error
-        supabase.table('users').delete().eq('id', user_id).execute()
+        await supabase.table('users').delete().eq('id', user_id).execute()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create teacher: {str(e)}"
@@ -233,7 +236,7 @@ async def get_teachers(
     search: Optional[str] = Query(None),
     department: Optional[str] = Query(None),
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách giáo viên với thông tin user và pagination"""
     try:
@@ -253,14 +256,14 @@ async def get_teachers(
             count_query = count_query.eq('specialization', department)
         
         # Get total count
-        count_result = count_query.execute()
+        count_result = await count_query.execute()
         total = count_result.count if hasattr(count_result, 'count') and count_result.count is not None else 0
         
         # Order by created_at desc
         query = query.order('created_at', desc=True)
         
         # Apply pagination
-        result = query.range(skip, skip + limit - 1).execute()
+        result = await query.range(skip, skip + limit - 1).execute()
         
         if not result.data:
             return {
@@ -306,30 +309,30 @@ async def get_teachers(
 
 @router.get("/simple", response_model=List[TeacherResponse])
 async def get_teachers_simple(
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách giáo viên (không cần auth)"""
-    result = supabase.table('teachers').select('*').order('created_at', desc=True).execute()
+    result = await supabase.table('teachers').select('*').order('created_at', desc=True).execute()
     return result.data or []
 
 @router.get("/public-list", response_model=List[TeacherResponse])
 async def get_teachers_public(
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách giáo viên công khai"""
-    result = supabase.table('teachers').select('*').order('created_at', desc=True).execute()
+    result = await supabase.table('teachers').select('*').order('created_at', desc=True).execute()
     return result.data or []
 
 @router.get("/{teacher_id}", response_model=TeacherResponse)
 async def get_teacher(
     teacher_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin giáo viên theo ID (kèm thông tin user)"""
     try:
         # Join teachers with users table to get full_name and email
-        result = supabase.table('teachers').select('*, users(full_name, email)').eq('id', teacher_id).execute()
+        result = await supabase.table('teachers').select('*, users(full_name, email)').eq('id', teacher_id).execute()
         if not result.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -365,13 +368,13 @@ async def update_teacher(
     teacher_id: str,
     teacher_data: TeacherUpdate,
     current_user = Depends(get_current_user_dev),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật thông tin giáo viên"""
     try:
     
         # Kiểm tra giáo viên có tồn tại không và lấy user_id
-        existing_teacher = supabase.table('teachers').select('id, user_id').eq('id', teacher_id).execute()
+        existing_teacher = await supabase.table('teachers').select('id, user_id').eq('id', teacher_id).execute()
         if not existing_teacher.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -382,7 +385,7 @@ async def update_teacher(
         
         # Kiểm tra email đã tồn tại chưa (nếu cập nhật email)
         if teacher_data.email:
-            email_check = supabase.table('users').select('id').eq('email', teacher_data.email).neq('id', user_id).execute()
+            email_check = await supabase.table('users').select('id').eq('email', teacher_data.email).neq('id', user_id).execute()
             if email_check.data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -399,12 +402,15 @@ async def update_teacher(
             user_update_data['role'] = teacher_data.role
         
         if user_update_data:
-            user_result = supabase.table('users').update(user_update_data).eq('id', user_id).execute()
+            user_result = await supabase.table('users').update(user_update_data).eq('id', user_id).execute()
             if not user_result.data:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Failed to update user"
                 )
+            token_cache.invalidate_user(user_id)
+            if 'role' in user_update_data:
+                permission_registry.invalidate()
         
         # Cập nhật teachers table
         teacher_update_data = {}
@@ -422,7 +428,7 @@ async def update_teacher(
             teacher_update_data['degree_name'] = teacher_data.degree_name
         
         if teacher_update_data:
-            teacher_result = supabase.table('teachers').update(teacher_update_data).eq('id', teacher_id).execute()
+            teacher_result = await supabase.table('teachers').update(teacher_update_data).eq('id', teacher_id).execute()
             if not teacher_result.data:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -430,7 +436,7 @@ async def update_teacher(
                 )
         
         # Lấy thông tin cập nhật với join
-        updated_teacher = supabase.table('teachers').select('*, users(full_name, email)').eq('id', teacher_id).execute()
+        updated_teacher = await supabase.table('teachers').select('*, users(full_name, email)').eq('id', teacher_id).execute()
         if not updated_teacher.data:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -463,7 +469,7 @@ async def update_teacher(
 async def delete_teacher(
     teacher_id: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa giáo viên (chỉ admin)"""
     if current_user.role != 'admin':
@@ -473,7 +479,7 @@ async def delete_teacher(
         )
     
     # Kiểm tra giáo viên có tồn tại không
-    existing_teacher = supabase.table('teachers').select('id').eq('id', teacher_id).execute()
+    existing_teacher = await supabase.table('teachers').select('id').eq('id', teacher_id).execute()
     if not existing_teacher.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -481,17 +487,17 @@ async def delete_teacher(
         )
     
     # Xóa giáo viên
-    result = supabase.table('teachers').delete().eq('id', teacher_id).execute()
+    result = await supabase.table('teachers').delete().eq('id', teacher_id).execute()
     return {"message": "Teacher deleted successfully"}
 
 @router.get("/search/{query}", response_model=List[TeacherResponse])
 async def search_teachers(
     query: str,
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tìm kiếm giáo viên"""
-    result = supabase.table('teachers').select('*').or_(
+    result = await supabase.table('teachers').select('*').or_(
         f'name.ilike.%{query}%,email.ilike.%{query}%,subject.ilike.%{query}%'
     ).order('created_at', desc=True).execute()
     return result.data or []
@@ -499,22 +505,19 @@ async def search_teachers(
 @router.get("/stats/overview")
 async def get_teacher_stats(
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thống kê giáo viên"""
-    # Tổng số giáo viên
-    total_teachers = supabase.table('teachers').select('id', count='exact').execute()
-    
-    # Giáo viên theo bộ môn
-    departments = supabase.table('teachers').select('department').execute()
+    # Giáo viên theo bộ môn (đọc theo trang để không bị giới hạn số dòng cắt bớt)
+    total_teachers = 0
     department_stats = {}
-    if departments.data:
-        for teacher in departments.data:
-            dept = teacher.get('department', 'Chưa phân loại')
-            department_stats[dept] = department_stats.get(dept, 0) + 1
+    async for teacher in stream_rows(lambda: supabase.table('teachers').select('id, department')):
+        total_teachers += 1
+        dept = teacher.get('department', 'Chưa phân loại')
+        department_stats[dept] = department_stats.get(dept, 0) + 1
     
     return {
-        "total_teachers": total_teachers.count or 0,
+        "total_teachers": total_teachers,
         "departments": department_stats,
         "average_salary": 0,  # TODO: Calculate average salary
         "recent_hires": 0     # TODO: Calculate recent hires
@@ -533,7 +536,7 @@ async def test_teachers_simple():
 @router.post("/create-sample")
 async def create_sample_teachers(
     current_user = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Tạo dữ liệu mẫu cho giáo viên"""
     if current_user.role != 'admin':
@@ -569,5 +572,5 @@ async def create_sample_teachers(
         }
     ]
     
-    result = supabase.table('teachers').insert(sample_teachers).execute()
+    result = await supabase.table('teachers').insert(sample_teachers).execute()
     return {"message": f"Created {len(result.data)} sample teachers", "data": result.data}
\ No newline at end of file
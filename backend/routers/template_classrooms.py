@@ -4,18 +4,21 @@ Router cho quản lý lớp học mẫu (template)
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status, Form, File, UploadFile
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel, constr, conint
-from supabase import Client
 from uuid import UUID
 import json
 
-from database import get_db
+from database import get_db, Database
 from routers.auth import get_current_user
+from services.background_jobs import BackgroundJob, job_registry
+from services.classroom_clone import ClassroomCloner, build_clone_rows, load_template_graph
 from .classrooms import ClassroomCreate, ClassroomResponse
 
 router = APIRouter()
 
+CLONE_JOB_KIND = "template_classrooms.clone"
+
 
 class TemplateClassroomCreate(BaseModel):
     name: constr(strip_whitespace=True, min_length=1, max_length=255)
@@ -82,7 +85,7 @@ class TemplateUsageResponse(BaseModel):
 async def create_template(
     template_data: TemplateClassroomCreate,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Tạo lớp học mẫu mới (chỉ admin và teacher)"""
     if current_user.role not in ["admin", "teacher"]:
@@ -102,7 +105,7 @@ async def create_template(
     if not normalized_code:
         # Lấy tất cả code dạng Template####
         codes_res = (
-            supabase.table("classrooms")
+            await supabase.table("classrooms")
             .select("code")
             .ilike("code", "Template%")
             .eq("is_template", True)
@@ -125,7 +128,7 @@ async def create_template(
         while True:
             candidate = f"Template{attempt:04d}"
             dup = (
-                supabase.table("classrooms")
+                await supabase.table("classrooms")
                 .select("id")
                 .eq("code", candidate)
                 .execute()
@@ -137,7 +140,7 @@ async def create_template(
 
     # Kiểm tra code đã tồn tại chưa
     existing = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id")
         .eq("code", normalized_code)
         .execute()
@@ -151,7 +154,7 @@ async def create_template(
     # Kiểm tra subject có tồn tại không (nếu có)
     if normalized_subject_id:
         subject = (
-            supabase.table("subjects")
+            await supabase.table("subjects")
             .select("id")
             .eq("id", normalized_subject_id)
             .execute()
@@ -171,7 +174,7 @@ async def create_template(
         "is_template": True,  # Đánh dấu là template
     }
 
-    result = supabase.table("classrooms").insert(insert_payload).execute()
+    result = await supabase.table("classrooms").insert(insert_payload).execute()
     if not result.data:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -186,7 +189,7 @@ async def get_templates(
     limit: int = 100,
     subject_id: Optional[str] = None,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy danh sách lớp học mẫu"""
     query = supabase.table("classrooms").select("*").eq("is_template", True)
@@ -194,7 +197,7 @@ async def get_templates(
     if subject_id:
         query = query.eq("subject_id", subject_id)
     
-    result = query.order("created_at", desc=True).range(skip, skip + limit - 1).execute()
+    result = await query.order("created_at", desc=True).range(skip, skip + limit - 1).execute()
     return result.data or []
 
 
@@ -202,11 +205,11 @@ async def get_templates(
 async def get_template(
     template_id: str,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy thông tin một lớp học mẫu"""
     result = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("*")
         .eq("id", template_id)
         .eq("is_template", True)
@@ -225,7 +228,7 @@ async def update_template(
     template_id: str,
     template_data: TemplateClassroomUpdate,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Cập nhật thông tin lớp học mẫu (chỉ admin và teacher)"""
     if current_user.role not in ["admin", "teacher"]:
@@ -236,7 +239,7 @@ async def update_template(
 
     # Kiểm tra template có tồn tại không
     existing = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id, is_template")
         .eq("id", template_id)
         .execute()
@@ -256,7 +259,7 @@ async def update_template(
     # Kiểm tra code trùng nếu thay đổi
     if template_data.code:
         code_check = (
-            supabase.table("classrooms")
+            await supabase.table("classrooms")
             .select("id")
             .eq("code", template_data.code)
             .neq("id", template_id)
@@ -271,7 +274,7 @@ async def update_template(
     # Kiểm tra subject tồn tại nếu thay đổi
     if template_data.subject_id:
         subject = (
-            supabase.table("subjects")
+            await supabase.table("subjects")
             .select("id")
             .eq("id", template_data.subject_id)
             .execute()
@@ -284,7 +287,7 @@ async def update_template(
 
     update_data = template_data.dict(exclude_unset=True)
     result = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .update(update_data)
         .eq("id", template_id)
         .execute()
@@ -301,7 +304,7 @@ async def update_template(
 async def delete_template(
     template_id: str,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Xóa lớp học mẫu (chỉ admin)"""
     if current_user.role != "admin":
@@ -311,7 +314,7 @@ async def delete_template(
         )
 
     existing = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id, is_template")
         .eq("id", template_id)
         .execute()
@@ -328,7 +331,7 @@ async def delete_template(
             detail="This is not a template"
         )
 
-    result = supabase.table("classrooms").delete().eq("id", template_id).execute()
+    result = await supabase.table("classrooms").delete().eq("id", template_id).execute()
     if not result.data:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -337,23 +340,15 @@ async def delete_template(
     return {"message": "Template deleted successfully"}
 
 
-@router.post("/{template_id}/create-classroom", response_model=ClassroomResponse)
-async def create_classroom_from_template(
+async def _prepare_classroom(
     template_id: str,
     classroom_data: CreateClassroomFromTemplate,
-    current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
-):
-    """Tạo lớp học mới từ template (copy lessons và assignments)"""
-    if current_user.role != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-
+    supabase: Database,
+) -> Tuple[dict, dict]:
+    """Kiểm tra template và dữ liệu lớp mới; trả về (template, payload tạo lớp)"""
     # Kiểm tra template có tồn tại không
     template_result = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("*")
         .eq("id", template_id)
         .eq("is_template", True)
@@ -378,7 +373,7 @@ async def create_classroom_from_template(
     
     # Kiểm tra code đã tồn tại chưa
     existing = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id")
         .eq("code", normalized_code)
         .execute()
@@ -392,7 +387,7 @@ async def create_classroom_from_template(
     # Kiểm tra teacher, subject, campus nếu có
     if classroom_data.teacher_id:
         teacher = (
-            supabase.table("teachers")
+            await supabase.table("teachers")
             .select("id")
             .eq("id", classroom_data.teacher_id)
             .execute()
@@ -405,7 +400,7 @@ async def create_classroom_from_template(
 
     if classroom_data.subject_id:
         subject = (
-            supabase.table("subjects")
+            await supabase.table("subjects")
             .select("id")
             .eq("id", classroom_data.subject_id)
             .execute()
@@ -418,7 +413,7 @@ async def create_classroom_from_template(
 
     if classroom_data.campus_id:
         campus = (
-            supabase.table("campuses")
+            await supabase.table("campuses")
             .select("id")
             .eq("id", classroom_data.campus_id)
             .execute()
@@ -444,185 +439,152 @@ async def create_classroom_from_template(
         "close_date": classroom_data.close_date or None,
         "is_template": False,  # Lớp học thực tế
     }
+    return template, insert_payload
 
-    result = supabase.table("classrooms").insert(insert_payload).execute()
+
+async def _clone_classroom(
+    supabase: Database,
+    template_id: str,
+    template: dict,
+    insert_payload: dict,
+    classroom_data: CreateClassroomFromTemplate,
+    created_by: Optional[str],
+    job: Optional[BackgroundJob] = None,
+) -> Tuple[dict, dict]:
+    """Tạo lớp và copy nội dung template; lỗi giữa chừng thì xóa mọi thứ đã tạo.
+    Trả về (lớp mới, số dòng đã copy theo bảng)"""
+    graph = await load_template_graph(
+        supabase, template_id, classroom_data.copy_lessons, classroom_data.copy_assignments
+    )
+    if job is not None:
+        job.total = graph.total_rows + 1
+
+    result = await supabase.table("classrooms").insert(insert_payload).execute()
     if not result.data:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create classroom"
         )
-    
     created_classroom = result.data[0]
     created_classroom_id = created_classroom["id"]
+    if job is not None:
+        job.advance(1)
 
-    # Copy lessons nếu được yêu cầu
-    if classroom_data.copy_lessons:
-        lessons_result = (
-            supabase.table("lessons")
-            .select("*")
-            .eq("classroom_id", template_id)
-            .execute()
-        )
-        
-        if lessons_result.data:
-            for lesson in lessons_result.data:
-                # Copy lesson files
-                lesson_files_result = (
-                    supabase.table("lesson_files")
-                    .select("*")
-                    .eq("lesson_id", lesson["id"])
-                    .execute()
-                )
-                
-                # Tạo lesson mới
-                new_lesson = {
-                    "classroom_id": created_classroom_id,
-                    "title": lesson["title"],
-                    "description": lesson.get("description"),
-                    "file_url": lesson.get("file_url"),
-                    "file_name": lesson.get("file_name"),
-                    "storage_path": lesson.get("storage_path"),
-                    "sort_order": lesson.get("sort_order", 0),
-                    "shared_classroom_ids": [],
-                    "available_at": lesson.get("available_at"),
-                    "assignment_id": None,  # Sẽ xử lý sau nếu copy assignments
-                }
-                
-                new_lesson_result = supabase.table("lessons").insert(new_lesson).execute()
-                if new_lesson_result.data:
-                    new_lesson_id = new_lesson_result.data[0]["id"]
-                    
-                    # Copy lesson files
-                    if lesson_files_result.data:
-                        for lesson_file in lesson_files_result.data:
-                            new_lesson_file = {
-                                "lesson_id": new_lesson_id,
-                                "file_url": lesson_file.get("file_url"),
-                                "file_name": lesson_file.get("file_name"),
-                                "storage_path": lesson_file.get("storage_path"),
-                                "file_size": lesson_file.get("file_size"),
-                                "file_type": lesson_file.get("file_type"),
-                                "sort_order": lesson_file.get("sort_order", 0),
-                            }
-                            supabase.table("lesson_files").insert(new_lesson_file).execute()
-
-    # Copy assignments nếu được yêu cầu
-    assignment_mapping = {}  # Map old assignment_id -> new assignment_id
-    if classroom_data.copy_assignments:
-        # Lấy tất cả assignments của template
-        template_assignments_result = (
-            supabase.table("assignment_classrooms")
-            .select("assignment_id")
-            .eq("classroom_id", template_id)
-            .execute()
-        )
-        
-        if template_assignments_result.data:
-            assignment_ids = [item["assignment_id"] for item in template_assignments_result.data]
-            
-            # Lấy chi tiết assignments
-            assignments_result = (
-                supabase.table("assignments")
-                .select("*")
-                .in_("id", assignment_ids)
-                .execute()
-            )
-            
-            for assignment in assignments_result.data:
-                # Tạo assignment mới
-                new_assignment = {
-                    "title": assignment["title"],
-                    "description": assignment.get("description"),
-                    "subject_id": classroom_data.subject_id or assignment.get("subject_id"),
-                    "teacher_id": classroom_data.teacher_id or assignment.get("teacher_id"),
-                    "assignment_type": assignment["assignment_type"],
-                    "total_points": assignment.get("total_points", 100.0),
-                    "due_date": assignment.get("due_date"),
-                    "is_active": assignment.get("is_active", True),
-                    "time_limit_minutes": assignment.get("time_limit_minutes", 0),
-                    "attempts_allowed": assignment.get("attempts_allowed", 1),
-                    "shuffle_questions": assignment.get("shuffle_questions", False),
-                }
-                
-                new_assignment_result = supabase.table("assignments").insert(new_assignment).execute()
-                if new_assignment_result.data:
-                    new_assignment_id = new_assignment_result.data[0]["id"]
-                    old_assignment_id = assignment["id"]
-                    assignment_mapping[old_assignment_id] = new_assignment_id
-                    
-                    # Gán assignment cho lớp mới
-                    supabase.table("assignment_classrooms").insert({
-                        "assignment_id": new_assignment_id,
-                        "classroom_id": created_classroom_id,
-                    }).execute()
-                    
-                    # Copy assignment questions
-                    questions_result = (
-                        supabase.table("assignment_questions")
-                        .select("*")
-                        .eq("assignment_id", old_assignment_id)
-                        .order("order_index")
-                        .execute()
-                    )
-                    
-                    if questions_result.data:
-                        for question in questions_result.data:
-                            new_question = {
-                                "assignment_id": new_assignment_id,
-                                "question_text": question["question_text"],
-                                "question_type": question["question_type"],
-                                "points": question.get("points", 1.0),
-                                "options": question.get("options"),
-                                "correct_answer": question.get("correct_answer"),
-                                "order_index": question.get("order_index", 0),
-                            }
-                            supabase.table("assignment_questions").insert(new_question).execute()
-            
-            # Cập nhật assignment_id trong lessons nếu có
-            if assignment_mapping and classroom_data.copy_lessons:
-                lessons_result = (
-                    supabase.table("lessons")
-                    .select("*")
-                    .eq("classroom_id", created_classroom_id)
-                    .execute()
-                )
-                
-                for lesson in lessons_result.data:
-                    if lesson.get("assignment_id") and lesson["assignment_id"] in assignment_mapping:
-                        supabase.table("lessons").update({
-                            "assignment_id": assignment_mapping[lesson["assignment_id"]]
-                        }).eq("id", lesson["id"]).execute()
-
-    # Gán học sinh nếu có
-    if classroom_data.student_ids:
-        ids = [sid for sid in classroom_data.student_ids if sid and sid.strip()]
-        if ids:
-            supabase.table("students").update({"classroom_id": created_classroom_id}).in_("id", ids).execute()
+    cloner = ClassroomCloner(supabase, job)
+    try:
+        rows = build_clone_rows(graph, created_classroom_id, classroom_data.subject_id, classroom_data.teacher_id)
+        copied = await cloner.write(rows)
+
+        # Gán học sinh nếu có
+        if classroom_data.student_ids:
+            ids = [sid for sid in classroom_data.student_ids if sid and sid.strip()]
+            if ids:
+                await supabase.table("students").update({"classroom_id": created_classroom_id}).in_("id", ids).execute()
+    except Exception as e:
+        print(f"Failed to copy template {template_id}, rolling back classroom {created_classroom_id}: {e}")
+        await cloner.rollback()
+        try:
+            await supabase.table("classrooms").delete().eq("id", created_classroom_id).execute()
+        except Exception as cleanup_error:
+            print(f"Failed to delete classroom {created_classroom_id} during rollback: {cleanup_error}")
+        raise
 
     # Lưu lịch sử sử dụng template
     try:
-        supabase.table("template_usage").insert({
+        await supabase.table("template_usage").insert({
             "template_id": template_id,
             "created_classroom_id": created_classroom_id,
-            "created_by": current_user.id,
+            "created_by": created_by,
             "notes": f"Created from template: {template.get('name')}",
         }).execute()
     except Exception as e:
         print(f"Failed to log template usage: {e}")
 
+    return created_classroom, copied
+
+
+@router.post("/{template_id}/create-classroom", response_model=ClassroomResponse)
+async def create_classroom_from_template(
+    template_id: str,
+    classroom_data: CreateClassroomFromTemplate,
+    current_user=Depends(get_current_user),
+    supabase: Database = Depends(get_db),
+):
+    """Tạo lớp học mới từ template (copy lessons và assignments)"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+
+    template, insert_payload = await _prepare_classroom(template_id, classroom_data, supabase)
+    try:
+        created_classroom, _ = await _clone_classroom(
+            supabase, template_id, template, insert_payload, classroom_data, current_user.id
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create classroom from template: {str(e)}"
+        )
     return created_classroom
 
 
+@router.post("/{template_id}/create-classroom/async", status_code=status.HTTP_202_ACCEPTED)
+async def create_classroom_from_template_async(
+    template_id: str,
+    classroom_data: CreateClassroomFromTemplate,
+    current_user=Depends(get_current_user),
+    supabase: Database = Depends(get_db),
+):
+    """Tạo lớp từ template lớn ở background; theo dõi tiến độ qua /jobs/{job_id}"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+
+    template, insert_payload = await _prepare_classroom(template_id, classroom_data, supabase)
+
+    async def run(job: BackgroundJob):
+        created_classroom, copied = await _clone_classroom(
+            supabase, template_id, template, insert_payload, classroom_data, current_user.id, job
+        )
+        return {"classroom": created_classroom, "copied": copied}
+
+    job = job_registry.start(CLONE_JOB_KIND, run, created_by=current_user.id)
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}")
+async def get_clone_job(
+    job_id: str,
+    current_user=Depends(get_current_user),
+):
+    """Trạng thái/tiến độ của một lần tạo lớp từ template chạy ở background (chỉ admin)"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    job = job_registry.get(job_id)
+    if job is None or job.kind != CLONE_JOB_KIND:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @router.get("/{template_id}/usage", response_model=List[TemplateUsageResponse])
 async def get_template_usage(
     template_id: str,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy lịch sử sử dụng template"""
     # Kiểm tra template có tồn tại không
     template_result = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id")
         .eq("id", template_id)
         .eq("is_template", True)
@@ -635,7 +597,7 @@ async def get_template_usage(
         )
 
     result = (
-        supabase.table("template_usage")
+        await supabase.table("template_usage")
         .select("*")
         .eq("template_id", template_id)
         .order("created_at", desc=True)
@@ -648,12 +610,12 @@ async def get_template_usage(
 async def get_template_lessons(
     template_id: str,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy danh sách bài học của template"""
     # Kiểm tra template có tồn tại không
     template_result = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id")
         .eq("id", template_id)
         .eq("is_template", True)
@@ -666,7 +628,7 @@ async def get_template_lessons(
         )
 
     result = (
-        supabase.table("lessons")
+        await supabase.table("lessons")
         .select("*")
         .eq("classroom_id", template_id)
         .order("sort_order")
@@ -679,12 +641,12 @@ async def get_template_lessons(
 async def get_template_assignments(
     template_id: str,
     current_user=Depends(get_current_user),
-    supabase: Client = Depends(get_db),
+    supabase: Database = Depends(get_db),
 ):
     """Lấy danh sách bài tập của template"""
     # Kiểm tra template có tồn tại không
     template_result = (
-        supabase.table("classrooms")
+        await supabase.table("classrooms")
         .select("id")
         .eq("id", template_id)
         .eq("is_template", True)
@@ -698,7 +660,7 @@ async def get_template_assignments(
 
     # Lấy assignments từ assignment_classrooms
     class_result = (
-        supabase.table("assignment_classrooms")
+        await supabase.table("assignment_classrooms")
         .select("assignment_id")
         .eq("classroom_id", template_id)
         .execute()
@@ -711,7 +673,7 @@ async def get_template_assignments(
     
     # Lấy chi tiết assignments
     assignments_result = (
-        supabase.table("assignments")
+        await supabase.table("assignments")
         .select("id, title, description, assignment_type, total_points, due_date")
         .in_("id", assignment_ids)
         .order("created_at", desc=True)
@@ -6,11 +6,12 @@ Router cho quản lý người dùng
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from pydantic import BaseModel
-from supabase import Client
 
-from database import get_db
+from database import get_db, Database
 from models.user import User, UserRole
 from routers.auth import get_current_user
+from services.token_cache import token_cache
+from services.permission_registry import permission_registry
 
 router = APIRouter()
 
@@ -34,7 +35,7 @@ async def get_users(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy danh sách tất cả người dùng (chỉ admin)"""
     if current_user.role != UserRole.ADMIN:
@@ -44,7 +45,7 @@ async def get_users(
         )
     
     try:
-        response = supabase.table('users').select('*').range(skip, skip + limit - 1).execute()
+        response = await supabase.table('users').select('*').range(skip, skip + limit - 1).execute()
         users_data = response.data if response.data else []
         
         # Convert to UserResponse format
@@ -69,7 +70,7 @@ async def get_users(
 async def get_user(
     user_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Lấy thông tin một người dùng"""
     if current_user.role != UserRole.ADMIN and current_user.id != user_id:
@@ -79,7 +80,7 @@ async def get_user(
         )
     
     try:
-        response = supabase.table('users').select('*').eq('id', user_id).execute()
+        response = await supabase.table('users').select('*').eq('id', user_id).execute()
         if not response.data or len(response.data) == 0:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -108,7 +109,7 @@ async def update_user(
     user_id: str,
     user_update: UserUpdate,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Cập nhật thông tin người dùng"""
     if current_user.role != UserRole.ADMIN and current_user.id != user_id:
@@ -119,7 +120,7 @@ async def update_user(
     
     try:
         # Check if user exists
-        response = supabase.table('users').select('*').eq('id', user_id).execute()
+        response = await supabase.table('users').select('*').eq('id', user_id).execute()
         if not response.data or len(response.data) == 0:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -144,7 +145,7 @@ async def update_user(
         from datetime import datetime
         update_data['updated_at'] = datetime.now().isoformat()
         
-        update_response = supabase.table('users').update(update_data).eq('id', user_id).execute()
+        update_response = await supabase.table('users').update(update_data).eq('id', user_id).execute()
         
         if not update_response.data or len(update_response.data) == 0:
             raise HTTPException(
@@ -152,6 +153,11 @@ async def update_user(
                 detail="Failed to update user"
             )
         
+        # Token cũ phải xác thực lại (role/is_active có thể đã đổi)
+        token_cache.invalidate_user(user_id)
+        if 'role' in update_data:
+            permission_registry.invalidate()
+        
         updated_user_data = update_response.data[0]
         return UserResponse(
             id=updated_user_data['id'],
@@ -173,7 +179,7 @@ async def update_user(
 async def delete_user(
     user_id: str,
     current_user: User = Depends(get_current_user),
-    supabase: Client = Depends(get_db)
+    supabase: Database = Depends(get_db)
 ):
     """Xóa người dùng (chỉ admin)"""
     if current_user.role != UserRole.ADMIN:
@@ -184,7 +190,7 @@ async def delete_user(
     
     try:
         # Check if user exists
-        response = supabase.table('users').select('*').eq('id', user_id).execute()
+        response = await supabase.table('users').select('*').eq('id', user_id).execute()
         if not response.data or len(response.data) == 0:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -192,7 +198,9 @@ async def delete_user(
             )
         
         # Delete user
-        supabase.table('users').delete().eq('id', user_id).execute()
+        await supabase.table('users').delete().eq('id', user_id).execute()
+        token_cache.invalidate_user(user_id)
+        permission_registry.invalidate()
         
         return {"message": "User deleted successfully"}
     except HTTPException:
@@ -0,0 +1,142 @@
+"""
+Audit log writer
+Hàng đợi có giới hạn trong bộ nhớ + một task nền gom audit log thành batch và
+insert một lần (theo kích thước batch hoặc theo thời gian), để request ghi dữ
+liệu không phải chờ thêm một round-trip tới audit_logs.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from database import Database, get_database
+
+
+class AuditLogWriter:
+    """Bounded queue + background flusher cho bảng audit_logs.
+
+    Khi hàng đợi đầy, submit() chờ tối đa `block_timeout` giây (backpressure) rồi
+    bỏ bản ghi và tăng bộ đếm `dropped`.
+    """
+
+    def __init__(
+        self,
+        max_queue: int,
+        batch_size: int,
+        flush_interval: float,
+        block_timeout: float = 0.0,
+        table: str = "audit_logs",
+    ):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.table = table
+        self._db: Optional[Database] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    def bind(self, db: Database) -> None:
+        """Dùng `db` thay cho Database mặc định của process"""
+        self._db = db
+
+    def start(self) -> None:
+        """Khởi động task flush (gọi trong event loop, vd: startup event)"""
+        if self._task is not None and not self._task.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Dừng task nền và ghi nốt những gì còn trong hàng đợi"""
+        self._stopping = True
+        if self._task is not None:
+            try:
+                # Task tự thoát sau tối đa một flush_interval (batch đang ghi không bị cắt ngang)
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=self.flush_interval * 2)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            await self._flush(self._drain(self.batch_size))
+
+    async def submit(self, record: Dict[str, Any]) -> bool:
+        """Đưa một bản ghi vào hàng đợi; trả về False nếu bị bỏ do đầy"""
+        if self._task is None or self._task.done():
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            if self.block_timeout <= 0:
+                self._counters["dropped"] += 1
+                return False
+            try:
+                await asyncio.wait_for(self._queue.put(record), timeout=self.block_timeout)
+            except asyncio.TimeoutError:
+                self._counters["dropped"] += 1
+                return False
+        self._counters["enqueued"] += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                continue
+            batch = [first]
+            # Gom thêm tới batch_size, hoặc chờ tới hết flush_interval nếu chưa đủ
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                remaining = deadline - asyncio.get_running_loop().time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        db = self._db or get_database()
+        try:
+            await db.table(self.table).insert(batch).execute()
+            self._counters["written"] += len(batch)
+            self._counters["batches"] += 1
+        except Exception as e:
+            self._counters["failed"] += len(batch)
+            print(f"[audit_writer] Could not write {len(batch)} audit logs: {e}")
+
+
+audit_writer = AuditLogWriter(
+    max_queue=settings.AUDIT_QUEUE_MAX_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+    block_timeout=settings.AUDIT_ENQUEUE_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,113 @@
+"""
+Background jobs
+Chạy các tác vụ dài (gửi thông báo hàng loạt, ...) bằng asyncio task trong process
+và lưu trạng thái/tiến độ trong bộ nhớ để client hỏi lại qua endpoint trạng thái.
+
+Trạng thái job chỉ tồn tại trong worker đã chạy nó và mất khi restart; registry
+giữ tối đa `max_jobs` job, job đã xong cũ nhất bị bỏ trước.
+"""
+
+import asyncio
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class BackgroundJob:
+    id: str
+    kind: str
+    status: str = JOB_PENDING
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_by: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    def advance(self, processed: int = 0, failed: int = 0) -> None:
+        self.processed += processed
+        self.failed += failed
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = round(self.processed * 100 / self.total, 1) if self.total else (100.0 if self.done else 0.0)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "progress": progress,
+            "result": self.result,
+            "error": self.error,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRegistry:
+    def __init__(self, max_jobs: int = 500):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, BackgroundJob]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(
+        self,
+        kind: str,
+        run: Callable[[BackgroundJob], Awaitable[Optional[Dict[str, Any]]]],
+        total: int = 0,
+        created_by: Optional[str] = None,
+    ) -> BackgroundJob:
+        """Tạo job và chạy `run(job)` ở background; giá trị trả về thành job.result"""
+        job = BackgroundJob(id=str(uuid.uuid4()), kind=kind, total=total, created_by=created_by)
+        self._jobs[job.id] = job
+        self._prune()
+        # Giữ tham chiếu tới task để không bị garbage collect khi đang chạy
+        task = asyncio.get_running_loop().create_task(self._execute(job, run))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    async def _execute(self, job: BackgroundJob, run) -> None:
+        job.status = JOB_RUNNING
+        job.started_at = datetime.now().isoformat()
+        try:
+            job.result = await run(job)
+            job.status = JOB_COMPLETED
+        except Exception as e:
+            print(f"[background_jobs] Job {job.kind} {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = datetime.now().isoformat()
+
+    def get(self, job_id: str) -> Optional[BackgroundJob]:
+        return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done]:
+            if len(self._jobs) <= self.max_jobs:
+                break
+            del self._jobs[job_id]
+
+
+job_registry = JobRegistry()
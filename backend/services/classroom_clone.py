@@ -0,0 +1,224 @@
+"""
+Classroom clone
+Copy nội dung của lớp mẫu (lessons, lesson_files, assignments, câu hỏi) sang lớp
+mới với số query không phụ thuộc kích thước template.
+
+- Đọc: toàn bộ đồ thị template bằng vài query in_() đọc theo trang, đối chiếu với
+  count='exact' để không copy thiếu
+- Ghi: id mới được sinh ở client nên quan hệ (lesson -> assignment, file -> lesson,
+  câu hỏi -> assignment) được ánh xạ lại trong bộ nhớ, mỗi bảng ghi bằng insert
+  hàng loạt theo chunk (TEMPLATE_CLONE_CHUNK_SIZE dòng)
+- Lỗi giữa chừng: xóa mọi dòng đã tạo theo thứ tự ngược lại (PostgREST không có
+  transaction nhiều câu lệnh nên dùng bù trừ thay cho rollback)
+"""
+
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from postgrest.types import ReturnMethod
+
+from config import settings
+from database import Database
+from services.background_jobs import BackgroundJob
+from services.paging import stream_rows
+from services.relations import IN_CHUNK_SIZE, fetch_in_paged
+
+# Thứ tự ghi (bảng cha trước); rollback đi theo thứ tự ngược lại
+CLONE_TABLES = ("assignments", "assignment_classrooms", "assignment_questions", "lessons", "lesson_files")
+
+
+@dataclass
+class TemplateGraph:
+    lessons: List[Dict[str, Any]] = field(default_factory=list)
+    lesson_files: List[Dict[str, Any]] = field(default_factory=list)
+    assignments: List[Dict[str, Any]] = field(default_factory=list)
+    questions: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def total_rows(self) -> int:
+        # assignment_classrooms: một dòng cho mỗi assignment
+        return len(self.lessons) + len(self.lesson_files) + 2 * len(self.assignments) + len(self.questions)
+
+
+async def _read_all(build) -> List[Dict[str, Any]]:
+    return [row async for row in stream_rows(build)]
+
+
+async def _count(query) -> int:
+    result = await query.limit(1).execute()
+    return result.count or 0
+
+
+async def _count_in(supabase: Database, table: str, column: str, values: List[Any]) -> int:
+    keys = list(dict.fromkeys(values))
+    chunks = [keys[i:i + IN_CHUNK_SIZE] for i in range(0, len(keys), IN_CHUNK_SIZE)]
+    counts = await asyncio.gather(*[
+        _count(supabase.table(table).select("id", count="exact").in_(column, chunk))
+        for chunk in chunks
+    ])
+    return sum(counts)
+
+
+async def load_template_graph(
+    supabase: Database,
+    template_id: str,
+    copy_lessons: bool = True,
+    copy_assignments: bool = True,
+) -> TemplateGraph:
+    """Đọc nội dung template theo trang (keyset), số query không phụ thuộc số
+    lesson/assignment. Số dòng đọc được được đối chiếu với count='exact': nếu
+    thiếu (vd: bị cắt) thì báo lỗi thay vì copy thiếu nội dung."""
+    graph = TemplateGraph()
+    expected: Dict[str, Any] = {}
+    if copy_lessons:
+        lessons = await _read_all(lambda: supabase.table("lessons").select("*").eq("classroom_id", template_id))
+        graph.lessons = sorted(lessons, key=lambda l: (l.get("sort_order") is None, l.get("sort_order") or 0))
+        lesson_ids = [l["id"] for l in graph.lessons]
+        graph.lesson_files = await fetch_in_paged(supabase, "lesson_files", "lesson_id", lesson_ids)
+        expected["lessons"] = (len(graph.lessons), lambda: _count(
+            supabase.table("lessons").select("id", count="exact").eq("classroom_id", template_id)
+        ))
+        expected["lesson_files"] = (len(graph.lesson_files), lambda: _count_in(supabase, "lesson_files", "lesson_id", lesson_ids))
+    if copy_assignments:
+        links = await _read_all(
+            lambda: supabase.table("assignment_classrooms").select("id, assignment_id").eq("classroom_id", template_id)
+        )
+        assignment_ids = list(dict.fromkeys(link["assignment_id"] for link in links))
+        graph.assignments = await fetch_in_paged(supabase, "assignments", "id", assignment_ids)
+        graph.questions = await fetch_in_paged(supabase, "assignment_questions", "assignment_id", assignment_ids)
+        graph.questions.sort(key=lambda q: (q.get("order_index") or 0))
+        expected["assignment_classrooms"] = (len(links), lambda: _count(
+            supabase.table("assignment_classrooms").select("id", count="exact").eq("classroom_id", template_id)
+        ))
+        expected["assignments"] = (len(graph.assignments), lambda: _count_in(supabase, "assignments", "id", assignment_ids))
+        expected["assignment_questions"] = (len(graph.questions), lambda: _count_in(supabase, "assignment_questions", "assignment_id", assignment_ids))
+
+    counts = await asyncio.gather(*[count() for _, count in expected.values()])
+    for (table, (read, _)), count in zip(expected.items(), counts):
+        if read != count:
+            raise RuntimeError(f"Template {template_id}: read {read} of {count} {table} rows")
+    return graph
+
+
+def build_clone_rows(
+    graph: TemplateGraph,
+    classroom_id: str,
+    subject_id: Optional[str] = None,
+    teacher_id: Optional[str] = None,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Tạo các dòng mới cho từng bảng với id mới và khóa ngoại đã ánh xạ lại"""
+    assignment_ids = {a["id"]: str(uuid.uuid4()) for a in graph.assignments}
+    lesson_ids = {l["id"]: str(uuid.uuid4()) for l in graph.lessons}
+
+    assignments = [
+        {
+            "id": assignment_ids[a["id"]],
+            "title": a["title"],
+            "description": a.get("description"),
+            "subject_id": subject_id or a.get("subject_id"),
+            "teacher_id": teacher_id or a.get("teacher_id"),
+            "assignment_type": a["assignment_type"],
+            "total_points": a.get("total_points", 100.0),
+            "due_date": a.get("due_date"),
+            "is_active": a.get("is_active", True),
+            "time_limit_minutes": a.get("time_limit_minutes", 0),
+            "attempts_allowed": a.get("attempts_allowed", 1),
+            "shuffle_questions": a.get("shuffle_questions", False),
+        }
+        for a in graph.assignments
+    ]
+    links = [
+        {"id": str(uuid.uuid4()), "assignment_id": new_id, "classroom_id": classroom_id}
+        for new_id in assignment_ids.values()
+    ]
+    questions = [
+        {
+            "id": str(uuid.uuid4()),
+            "assignment_id": assignment_ids[q["assignment_id"]],
+            "question_text": q["question_text"],
+            "question_type": q["question_type"],
+            "points": q.get("points", 1.0),
+            "options": q.get("options"),
+            "correct_answer": q.get("correct_answer"),
+            "order_index": q.get("order_index", 0),
+        }
+        for q in graph.questions
+        if q.get("assignment_id") in assignment_ids
+    ]
+    lessons = [
+        {
+            "id": lesson_ids[l["id"]],
+            "classroom_id": classroom_id,
+            "title": l["title"],
+            "description": l.get("description"),
+            "file_url": l.get("file_url"),
+            "file_name": l.get("file_name"),
+            "storage_path": l.get("storage_path"),
+            "sort_order": l.get("sort_order", 0),
+            "shared_classroom_ids": [],
+            "available_at": l.get("available_at"),
+            # Bài tập gắn với lesson trỏ sang bản copy (nếu assignment cũng được copy)
+            "assignment_id": assignment_ids.get(l.get("assignment_id")),
+        }
+        for l in graph.lessons
+    ]
+    lesson_files = [
+        {
+            "id": str(uuid.uuid4()),
+            "lesson_id": lesson_ids[f["lesson_id"]],
+            "file_url": f.get("file_url"),
+            "file_name": f.get("file_name"),
+            "storage_path": f.get("storage_path"),
+            "file_size": f.get("file_size"),
+            "file_type": f.get("file_type"),
+            "sort_order": f.get("sort_order", 0),
+        }
+        for f in graph.lesson_files
+        if f.get("lesson_id") in lesson_ids
+    ]
+    return {
+        "assignments": assignments,
+        "assignment_classrooms": links,
+        "assignment_questions": questions,
+        "lessons": lessons,
+        "lesson_files": lesson_files,
+    }
+
+
+class ClassroomCloner:
+    """Ghi các dòng của build_clone_rows(); gọi rollback() nếu có lỗi"""
+
+    def __init__(self, supabase: Database, job: Optional[BackgroundJob] = None, chunk_size: Optional[int] = None):
+        self.supabase = supabase
+        self.job = job
+        self.chunk_size = max(1, chunk_size or settings.TEMPLATE_CLONE_CHUNK_SIZE)
+        self.created: Dict[str, List[str]] = {table: [] for table in CLONE_TABLES}
+
+    async def write(self, rows: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+        for table in CLONE_TABLES:
+            table_rows = rows.get(table) or []
+            for start in range(0, len(table_rows), self.chunk_size):
+                chunk = table_rows[start:start + self.chunk_size]
+                # Ghi nhận id trước khi insert: nếu request lỗi sau khi database đã
+                # ghi, rollback vẫn xóa được
+                self.created[table].extend(row["id"] for row in chunk)
+                await self.supabase.table(table).insert(chunk, returning=ReturnMethod.minimal).execute()
+                if self.job is not None:
+                    self.job.advance(len(chunk))
+        return {table: len(rows.get(table) or []) for table in CLONE_TABLES}
+
+    async def rollback(self) -> List[Tuple[str, str]]:
+        """Xóa các dòng đã tạo (bảng con trước); trả về các bảng xóa lỗi"""
+        errors: List[Tuple[str, str]] = []
+        for table in reversed(CLONE_TABLES):
+            ids = self.created[table]
+            for start in range(0, len(ids), IN_CHUNK_SIZE):
+                try:
+                    await self.supabase.table(table).delete().in_("id", ids[start:start + IN_CHUNK_SIZE]).execute()
+                except Exception as e:
+                    print(f"[classroom_clone] Rollback of {table} failed: {e}")
+                    errors.append((table, str(e)))
+            self.created[table] = []
+        return errors
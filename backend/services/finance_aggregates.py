@@ -0,0 +1,108 @@
+"""
+Finance aggregates
+Tổng thu/chi theo loại, danh mục, lớp và tháng, tính trong Postgres qua RPC
+finance_summary_totals (xem finance_aggregates.sql) nên bảng finances không phải
+tải về mỗi lần mở dashboard và tổng không bị giới hạn số dòng của PostgREST cắt.
+
+Nếu RPC chưa có (chưa chạy migration) hoặc bị tắt, tính lại bằng cách đọc
+finances theo trang: chậm hơn nhưng vẫn chính xác.
+"""
+
+from typing import Any, Dict, Optional
+
+from config import settings
+from database import Database
+from services.paging import stream_rows
+
+FINANCE_TYPES = ("income", "expense")
+SECTIONS = ("by_category", "by_classroom", "by_month")
+
+
+def empty_totals() -> Dict[str, Any]:
+    return {
+        "totals": {t: 0.0 for t in FINANCE_TYPES},
+        "counts": {t: 0 for t in FINANCE_TYPES},
+        **{section: {t: {} for t in FINANCE_TYPES} for section in SECTIONS},
+    }
+
+
+def normalize_totals(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Kết quả RPC -> cùng dạng với empty_totals(), số tiền là float"""
+    totals = empty_totals()
+    for finance_type, amount in (raw.get("totals") or {}).items():
+        totals["totals"][finance_type] = float(amount or 0)
+    for finance_type, count in (raw.get("counts") or {}).items():
+        totals["counts"][finance_type] = int(count or 0)
+    for section in SECTIONS:
+        for finance_type, amounts in (raw.get(section) or {}).items():
+            totals[section][finance_type] = {key: float(value or 0) for key, value in (amounts or {}).items()}
+    return totals
+
+
+async def _rpc_totals(
+    supabase: Database,
+    start: Optional[str],
+    end: Optional[str],
+    classroom_id: Optional[str],
+) -> Dict[str, Any]:
+    result = await supabase.rpc("finance_summary_totals", {
+        "p_start": start,
+        "p_end": end,
+        "p_classroom_id": classroom_id,
+    }).execute()
+    data = result.data
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    return normalize_totals(data or {})
+
+
+async def _scan_totals(
+    supabase: Database,
+    start: Optional[str],
+    end: Optional[str],
+    classroom_id: Optional[str],
+) -> Dict[str, Any]:
+    totals = empty_totals()
+
+    def build():
+        query = supabase.table("finances").select("id, amount, finance_type, category, classroom_id, date")
+        if start:
+            query = query.gte("date", start)
+        if end:
+            query = query.lte("date", end)
+        if classroom_id:
+            query = query.eq("classroom_id", classroom_id)
+        return query
+
+    async for row in stream_rows(build):
+        finance_type = row.get("finance_type")
+        if finance_type not in totals["totals"]:
+            continue
+        amount = float(row.get("amount") or 0)
+        totals["totals"][finance_type] += amount
+        totals["counts"][finance_type] += 1
+        keys = {
+            "by_category": row.get("category") or "other",
+            "by_classroom": row.get("classroom_id"),
+            "by_month": f"{str(row.get('date') or '')[:7]}-01" if row.get("date") else None,
+        }
+        for section, key in keys.items():
+            if key:
+                bucket = totals[section][finance_type]
+                bucket[key] = bucket.get(key, 0.0) + amount
+    return totals
+
+
+async def finance_totals(
+    supabase: Database,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    classroom_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Tổng hợp finances trong [start, end] (và theo lớp nếu có)"""
+    if settings.FINANCE_AGGREGATE_RPC_ENABLED:
+        try:
+            return await _rpc_totals(supabase, start, end, classroom_id)
+        except Exception as e:
+            print(f"[finance_aggregates] RPC finance_summary_totals failed, scanning finances instead: {e}")
+    return await _scan_totals(supabase, start, end, classroom_id)
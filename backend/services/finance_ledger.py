@@ -0,0 +1,113 @@
+"""
+Finance ledger
+Snapshot tổng thu/chi theo (tháng, loại, danh mục, lớp) trong bảng
+finance_ledger_snapshots (xem finance_ledger_snapshots.sql). Mỗi lần tạo/sửa/xóa
+giao dịch trong finances, backend cộng/trừ phần chênh lệch vào snapshot, nên
+dashboard tổng quan và theo năm chỉ đọc snapshot thay vì quét mọi giao dịch.
+
+Tháng đã khóa sổ (finance_ledger_periods) bị đóng băng: router kiểm tra
+closed_months() trước khi ghi và từ chối giao dịch thuộc tháng đó.
+
+Giống grade_rollups, việc cập nhật snapshot không bao giờ làm hỏng request chính:
+lỗi chỉ được log lại và có thể sửa bằng rebuild().
+"""
+
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import settings
+from database import Database
+from services.finance_aggregates import normalize_totals
+
+
+def month_of(value: Any) -> Optional[str]:
+    """'2024-03-15T10:00:00', date, datetime -> '2024-03-01'"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%Y-%m-01")
+    text = str(value)
+    datetime.strptime(text[:7], "%Y-%m")  # ValueError nếu sai định dạng
+    return f"{text[:7]}-01"
+
+
+async def closed_months(supabase: Database, values: Iterable[Any]) -> List[str]:
+    """Các tháng (của các ngày trong `values`) đã khóa sổ"""
+    months = list(dict.fromkeys(m for m in (month_of(v) for v in values) if m))
+    if not settings.FINANCE_LEDGER_ENABLED or not months:
+        return []
+    try:
+        result = await supabase.table("finance_ledger_periods").select("month").in_("month", months).execute()
+    except Exception as e:
+        print(f"[finance_ledger] Could not read closed periods: {e}")
+        return []
+    return sorted(str(row["month"])[:10] for row in (result.data or []))
+
+
+def _delta(row: Dict[str, Any], sign: int) -> Optional[Dict[str, Any]]:
+    if not row or not row.get("date") or not row.get("finance_type"):
+        return None
+    return {
+        "p_date": str(row["date"]),
+        "p_finance_type": row["finance_type"],
+        "p_category": row.get("category") or "other",
+        "p_classroom_id": row.get("classroom_id"),
+        "p_amount_delta": sign * float(row.get("amount") or 0),
+        "p_count_delta": sign,
+    }
+
+
+async def record_change(
+    supabase: Database,
+    previous: Optional[Dict[str, Any]] = None,
+    current: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Áp thay đổi của một giao dịch: previous=None là tạo mới, current=None là xóa"""
+    if not settings.FINANCE_LEDGER_ENABLED:
+        return
+    deltas = [d for d in (_delta(previous, -1), _delta(current, 1)) if d]
+    for params in deltas:
+        try:
+            await supabase.rpc("apply_finance_ledger_delta", params).execute()
+        except Exception as e:
+            print(f"[finance_ledger] Could not update snapshot for {params['p_date'][:7]}: {e}")
+
+
+async def load_totals(
+    supabase: Database,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    classroom_id: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Tổng hợp từ snapshot (cùng dạng với finance_aggregates.finance_totals);
+    None nếu ledger bị tắt hoặc không đọc được (caller tự tính từ finances)"""
+    if not settings.FINANCE_LEDGER_ENABLED:
+        return None
+    try:
+        result = await supabase.rpc("finance_ledger_totals", {
+            "p_start_month": start_month,
+            "p_end_month": end_month,
+            "p_classroom_id": classroom_id,
+        }).execute()
+    except Exception as e:
+        print(f"[finance_ledger] Could not read ledger totals: {e}")
+        return None
+    data = result.data
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    return normalize_totals(data or {})
+
+
+async def rebuild(supabase: Database, month: Optional[str] = None) -> int:
+    """Tính lại snapshot từ finances (None = mọi tháng chưa khóa)"""
+    params = {"p_month": month_of(month)} if month else {}
+    result = await supabase.rpc("rebuild_finance_ledger", params).execute()
+    return result.data or 0
+
+
+async def close_month(supabase: Database, month: str, closed_by: Optional[str] = None, notes: Optional[str] = None) -> None:
+    await supabase.rpc("close_finance_month", {
+        "p_month": month_of(month),
+        "p_closed_by": closed_by,
+        "p_notes": notes,
+    }).execute()
@@ -0,0 +1,127 @@
+"""
+Student grade rollups
+Bảng student_grade_rollups giữ sẵn số bài nộp, số bài có điểm, tổng điểm và
+điểm gần nhất theo (học sinh, môn, lớp). Bảng được cập nhật tăng dần khi nộp bài
+/ chấm bài, nên các trang bảng điểm chỉ đọc vài dòng thay vì quét mọi submission.
+
+Việc cập nhật rollup không bao giờ làm hỏng request chính: nếu lỗi (vd: chưa chạy
+student_grade_rollups_schema.sql) thì chỉ log lại, và có thể sửa bằng rebuild.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import settings
+from database import Database
+
+ROLLUP_TABLE = "student_grade_rollups"
+
+
+async def _apply_delta(supabase: Database, params: Dict[str, Any]) -> None:
+    try:
+        await supabase.rpc("apply_grade_rollup_delta", params).execute()
+    except Exception as e:
+        print(f"[grade_rollups] Could not update rollup for student {params.get('p_student_id')}: {e}")
+
+
+def _graded_score(submission: Dict[str, Any]) -> Optional[float]:
+    """Điểm của bài nộp nếu bài được tính là đã chấm (is_graded và có score)"""
+    score = submission.get("score")
+    if not submission.get("is_graded") or score is None:
+        return None
+    return float(score)
+
+
+async def record_submission(supabase: Database, submission: Dict[str, Any], first_attempt: bool = True) -> None:
+    """Một bài nộp mới (có thể đã được chấm tự động); `first_attempt`: lần nộp
+    đầu tiên của học sinh cho bài tập này"""
+    score = _graded_score(submission)
+    await _apply_delta(supabase, {
+        "p_student_id": submission["student_id"],
+        "p_assignment_id": submission["assignment_id"],
+        "p_submission_delta": 1,
+        "p_assignment_delta": 1 if first_attempt else 0,
+        "p_graded_delta": 1 if score is not None else 0,
+        "p_score_delta": score if score is not None else 0,
+        "p_latest_score": score,
+    })
+
+
+async def record_grade(supabase: Database, previous: Dict[str, Any], score: float) -> None:
+    """Bài nộp `previous` vừa được chấm (hoặc chấm lại) với điểm `score`"""
+    previous_score = _graded_score(previous)
+    await _apply_delta(supabase, {
+        "p_student_id": previous["student_id"],
+        "p_assignment_id": previous["assignment_id"],
+        "p_submission_delta": 0,
+        "p_graded_delta": 0 if previous_score is not None else 1,
+        "p_score_delta": float(score) - (previous_score or 0),
+        "p_latest_score": score,
+    })
+
+
+async def rebuild(supabase: Database, student_ids: Optional[Iterable[str]] = None) -> int:
+    """Tính lại rollup từ assignment_submissions (None = toàn bộ học sinh)"""
+    params = {"p_student_ids": list(student_ids)} if student_ids is not None else {}
+    if student_ids is not None and not params["p_student_ids"]:
+        return 0
+    result = await supabase.rpc("rebuild_student_grade_rollups", params).execute()
+    return result.data or 0
+
+
+async def refresh_students(supabase: Database, student_ids: Iterable[str]) -> None:
+    """Tính lại rollup cho vài học sinh (vd: chuyển lớp), chỉ log nếu lỗi"""
+    student_ids = list(student_ids)
+    try:
+        await rebuild(supabase, student_ids)
+    except Exception as e:
+        print(f"[grade_rollups] Could not rebuild rollups for students {student_ids}: {e}")
+
+
+async def rebuild_for_assignment(supabase: Database, assignment_id: str, student_ids: Optional[List[str]] = None) -> None:
+    """Tính lại rollup của các học sinh đã nộp bài `assignment_id` (khi đổi môn/lớp hoặc xoá bài)"""
+    try:
+        if student_ids is None:
+            student_ids = await students_with_submissions(supabase, assignment_id)
+    except Exception as e:
+        print(f"[grade_rollups] Could not load submissions of assignment {assignment_id}: {e}")
+        return
+    await refresh_students(supabase, student_ids)
+
+
+async def students_with_submissions(supabase: Database, assignment_id: str) -> List[str]:
+    result = await supabase.table("assignment_submissions").select("student_id").eq("assignment_id", assignment_id).execute()
+    return list(dict.fromkeys(row["student_id"] for row in (result.data or [])))
+
+
+async def load_rollups(
+    supabase: Database,
+    student_id: str,
+    classroom_id: Optional[str] = None,
+    subject_id: Optional[str] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """Các dòng rollup của học sinh; None nếu rollup bị tắt hoặc không đọc được
+    (caller tự tính lại từ assignment_submissions)"""
+    if not settings.GRADE_ROLLUPS_ENABLED:
+        return None
+    try:
+        query = supabase.table(ROLLUP_TABLE).select("*").eq("student_id", student_id)
+        if classroom_id:
+            query = query.eq("classroom_id", classroom_id)
+        if subject_id:
+            query = query.eq("subject_id", subject_id)
+        result = await query.execute()
+        return result.data or []
+    except Exception as e:
+        print(f"[grade_rollups] Could not read rollups for student {student_id}: {e}")
+        return None
+
+
+def combine(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cộng dồn nhiều dòng rollup thành {submission_count, assignment_count, graded_count, total_score}"""
+    totals = {"submission_count": 0, "assignment_count": 0, "graded_count": 0, "total_score": 0.0}
+    for row in rows:
+        totals["submission_count"] += int(row.get("submission_count") or 0)
+        totals["assignment_count"] += int(row.get("assignment_count") or 0)
+        totals["graded_count"] += int(row.get("graded_count") or 0)
+        totals["total_score"] += float(row.get("total_score") or 0)
+    return totals
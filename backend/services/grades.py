@@ -0,0 +1,62 @@
+"""
+Grade aggregation
+Tính tổng điểm, điểm trung bình và xếp loại cho nhiều học sinh trong một lần
+duyệt qua danh sách submissions đã tải sẵn (thay vì một query cho mỗi học sinh).
+"""
+
+from typing import Any, Dict, Iterable, List
+
+NO_GRADE_CLASSIFICATION = "Chưa có điểm"
+
+
+def calculate_grade_classification(average_score: float) -> str:
+    """Tính xếp loại học sinh dựa trên điểm trung bình"""
+    if average_score >= 8.0:
+        return "Giỏi"
+    elif average_score >= 6.5:
+        return "Khá"
+    elif average_score >= 5.0:
+        return "Trung bình"
+    elif average_score >= 3.5:
+        return "Yếu"
+    else:
+        return "Kém"
+
+
+def empty_score_totals() -> Dict[str, Any]:
+    return {"graded_count": 0, "total_score": 0.0}
+
+
+def aggregate_scores(
+    submissions: Iterable[Dict[str, Any]],
+    key: str = "student_id",
+) -> Dict[Any, Dict[str, Any]]:
+    """Gom điểm theo `key`: {key: {graded_count, total_score}}.
+
+    Chỉ tính những submission đã có điểm (score khác None).
+    """
+    totals: Dict[Any, Dict[str, Any]] = {}
+    for submission in submissions:
+        score = submission.get("score")
+        if score is None:
+            continue
+        entry = totals.get(submission.get(key))
+        if entry is None:
+            entry = totals[submission.get(key)] = empty_score_totals()
+        entry["graded_count"] += 1
+        entry["total_score"] += float(score)
+    return totals
+
+
+def score_summary(graded_count: int, total_score: float, total_assignments: int) -> Dict[str, Any]:
+    """Các trường điểm chung của bảng điểm (đã làm tròn, kèm xếp loại)"""
+    average_score = (total_score / graded_count) if graded_count > 0 else 0.0
+    return {
+        "total_assignments": total_assignments,
+        "graded_assignments": graded_count,
+        "pending_assignments": total_assignments - graded_count,
+        "total_score": round(total_score, 2),
+        "average_score": round(average_score, 2),
+        "classification": calculate_grade_classification(average_score) if graded_count > 0 else NO_GRADE_CLASSIFICATION,
+    }
+
@@ -0,0 +1,197 @@
+"""
+Notification broker
+Pub/sub cho việc đẩy thông báo tới các kết nối đang mở (SSE) thay cho polling.
+
+Mỗi kết nối đăng ký một số kênh ("teacher:<id>", "student:<id>", "all") và có
+hàng đợi riêng giới hạn kích thước: client chậm chỉ mất các sự kiện cũ nhất của
+chính nó (và được báo để tải lại), không làm chậm người gửi.
+
+Broker có thể thay thế:
+- memory: trong process (mặc định, đủ khi chạy một worker)
+- redis: Redis pub/sub để nhiều worker/máy cùng nhận sự kiện (cần `pip install redis`)
+"""
+
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config import settings
+
+ALL_CHANNEL = "all"
+
+
+class Subscription:
+    """Một kết nối đang nghe: hàng đợi giới hạn, bỏ sự kiện cũ nhất khi đầy"""
+
+    def __init__(self, broker: "NotificationBroker", channels: Iterable[str], max_queue: int):
+        self.broker = broker
+        self.channels = list(dict.fromkeys(channels))
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_queue))
+        self.dropped = 0
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.queue.put_nowait(event)
+            self.dropped += 1
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Sự kiện tiếp theo, hoặc None nếu hết `timeout` giây (để gửi heartbeat)"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class NotificationBroker(ABC):
+    """Broker interface: publish sự kiện lên các kênh, subscribe nhận sự kiện"""
+
+    @abstractmethod
+    async def publish(self, channels: Iterable[str], event: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription) -> None:
+        ...
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemoryNotificationBroker(NotificationBroker):
+    """Phân phối sự kiện tới các subscription trong process"""
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+
+    async def publish(self, channels: Iterable[str], event: Dict[str, Any]) -> None:
+        self._dispatch(channels, event)
+
+    def _dispatch(self, channels: Iterable[str], event: Dict[str, Any]) -> None:
+        self.published += 1
+        targets: Set[Subscription] = set()
+        for channel in channels:
+            targets.update(self._subscribers.get(channel, ()))
+        for subscription in targets:
+            subscription.deliver(event)
+
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        subscription = Subscription(self, channels, self.max_queue)
+        for channel in subscription.channels:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for channel in subscription.channels:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def stats(self) -> Dict[str, Any]:
+        connections = {id(s) for subscribers in self._subscribers.values() for s in subscribers}
+        return {
+            "backend": "memory",
+            "connections": len(connections),
+            "channels": len(self._subscribers),
+            "published": self.published,
+        }
+
+
+class RedisNotificationBroker(InMemoryNotificationBroker):
+    """Publish qua Redis pub/sub; mỗi worker nghe kênh chung và phân phối cho các
+    kết nối của chính nó (kể cả sự kiện do chính worker đó publish)"""
+
+    def __init__(self, url: str, max_queue: int = 100, channel: str = "notifications:events"):
+        super().__init__(max_queue)
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("NOTIFICATION_BROKER_BACKEND=redis cần package `redis` (pip install redis)") from e
+        self.url = url
+        self.channel = channel
+        self._redis = redis_asyncio.from_url(url)
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, channels: Iterable[str], event: Dict[str, Any]) -> None:
+        payload = json.dumps({"channels": list(channels), "event": event}, default=str)
+        await self._redis.publish(self.channel, payload)
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        payload = json.loads(message["data"])
+                        self._dispatch(payload["channels"], payload["event"])
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"[notification_broker] Invalid message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Mất kết nối Redis: thử lại sau một lúc
+                print(f"[notification_broker] Redis listener error, retrying: {e}")
+                await asyncio.sleep(1.0)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "backend": "redis", "listening": self._task is not None and not self._task.done()}
+
+
+def create_broker(backend: Optional[str] = None) -> NotificationBroker:
+    """Tạo broker theo NOTIFICATION_BROKER_BACKEND"""
+    backend = (backend or settings.NOTIFICATION_BROKER_BACKEND).lower()
+    if backend == "redis":
+        return RedisNotificationBroker(settings.NOTIFICATION_BROKER_REDIS_URL, settings.NOTIFICATION_STREAM_QUEUE_SIZE)
+    return InMemoryNotificationBroker(settings.NOTIFICATION_STREAM_QUEUE_SIZE)
+
+
+notification_broker = create_broker()
+
+
+async def publish(channels: List[str], event: Dict[str, Any]) -> None:
+    """Publish và không làm hỏng request gọi nó nếu broker lỗi"""
+    try:
+        await notification_broker.publish(channels, event)
+    except Exception as e:
+        print(f"[notification_broker] Could not publish event: {e}")
@@ -0,0 +1,71 @@
+"""
+Streaming fetch
+Đọc toàn bộ kết quả của một query theo từng trang (keyset: ORDER BY key, key > giá
+trị cuối của trang trước) thay vì một lần .execute() không giới hạn, vốn bị
+max-rows của PostgREST cắt bớt mà không báo lỗi.
+
+stream_rows() là async generator: code tổng hợp xử lý từng dòng khi trang đến, nên
+bộ nhớ chỉ giữ một trang. Kích thước trang tự giảm nếu một trang ước lượng vượt
+STREAM_FETCH_MAX_PAGE_BYTES (vd: cột JSONB lớn).
+"""
+
+import json
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from config import settings
+from database import Query
+
+# Số dòng đầu trang dùng để ước lượng kích thước một dòng
+_SAMPLE_ROWS = 20
+
+
+def _estimate_row_bytes(page: List[Dict[str, Any]]) -> float:
+    sample = page[:_SAMPLE_ROWS]
+    return len(json.dumps(sample, default=str)) / max(1, len(sample))
+
+
+async def stream_pages(
+    build: Callable[[], Query],
+    key: str = "id",
+    page_size: Optional[int] = None,
+    max_page_bytes: Optional[int] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Từng trang của query `build()` theo thứ tự tăng dần của `key`.
+
+    `build` trả về một query mới mỗi lần gọi (select + các điều kiện lọc, chưa
+    order/range); select phải gồm cột `key` và `key` phải duy nhất.
+    """
+    size = max(1, page_size or settings.STREAM_FETCH_PAGE_SIZE)
+    ceiling = max_page_bytes if max_page_bytes is not None else settings.STREAM_FETCH_MAX_PAGE_BYTES
+    last = None
+    while True:
+        query = build()
+        if last is not None:
+            query = query.gt(key, last)
+        result = await query.order(key).limit(size).execute()
+        page = result.data or []
+        if not page:
+            return
+        if last is not None and page[-1][key] <= last:
+            # Key không tăng (lọc `gt` không được áp dụng): dừng thay vì lặp mãi
+            print(f"[paging] keyset on '{key}' did not advance past {last!r}, stopping")
+            return
+        last = page[-1][key]
+        yield page
+        # Trang ngắn hơn `size` có thể do max-rows của PostgREST chứ không phải
+        # hết dữ liệu, nên chỉ dừng khi gặp trang rỗng
+        if ceiling and size > 1:
+            fits = int(ceiling // max(1.0, _estimate_row_bytes(page)))
+            size = max(1, min(size, fits))
+
+
+async def stream_rows(
+    build: Callable[[], Query],
+    key: str = "id",
+    page_size: Optional[int] = None,
+    max_page_bytes: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Từng dòng của query `build()` (xem stream_pages)"""
+    async for page in stream_pages(build, key, page_size, max_page_bytes):
+        for row in page:
+            yield row
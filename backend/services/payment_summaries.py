@@ -0,0 +1,134 @@
+"""
+Payment summaries
+Tổng quan thanh toán theo lớp (tiền đã thu / chờ thu, số học sinh đã / chưa đóng)
+tính trong Postgres qua RPC classroom_payment_summaries (xem
+classroom_payment_summaries.sql): một lần gọi cho nhiều lớp.
+
+Nếu RPC chưa có hoặc bị tắt (FINANCE_AGGREGATE_RPC_ENABLED), tính lại từ students
+và student_payments đọc theo trang.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from database import Database
+from services.paging import stream_rows
+from services.relations import fetch_in_paged
+
+# Số lớp mỗi lần gọi RPC / mỗi query in_() của đường dự phòng
+CLASSROOM_CHUNK_SIZE = 100
+
+
+def _summary(classroom_id: str, row: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    row = row or {}
+    paid_student_ids = [str(sid) for sid in (row.get("paid_student_ids") or [])]
+    return {
+        "classroom_id": classroom_id,
+        "total_students": int(row.get("total_students") or 0),
+        "paid_student_count": int(row.get("paid_student_count") or len(paid_student_ids)),
+        "unpaid_student_count": int(row.get("unpaid_student_count") or 0),
+        "total_paid": float(row.get("total_paid") or 0),
+        "total_pending": float(row.get("total_pending") or 0),
+        "paid_student_ids": paid_student_ids,
+    }
+
+
+async def _rpc_summaries(supabase: Database, classroom_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    chunks = [classroom_ids[i:i + CLASSROOM_CHUNK_SIZE] for i in range(0, len(classroom_ids), CLASSROOM_CHUNK_SIZE)]
+    results = await asyncio.gather(*[
+        supabase.rpc("classroom_payment_summaries", {"p_classroom_ids": chunk}).execute()
+        for chunk in chunks
+    ])
+    summaries: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        for row in result.data or []:
+            summaries[str(row["classroom_id"])] = _summary(str(row["classroom_id"]), row)
+    return summaries
+
+
+async def _scan_summaries(supabase: Database, classroom_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    totals: Dict[str, Dict[str, Any]] = {
+        cid: {"students": set(), "paid_ids": set(), "total_paid": 0.0, "total_pending": 0.0}
+        for cid in classroom_ids
+    }
+    for i in range(0, len(classroom_ids), CLASSROOM_CHUNK_SIZE):
+        chunk = classroom_ids[i:i + CLASSROOM_CHUNK_SIZE]
+        students, payments = await asyncio.gather(
+            fetch_in_paged(supabase, "students", "classroom_id", chunk, "id, classroom_id"),
+            fetch_in_paged(supabase, "student_payments", "classroom_id", chunk, "id, classroom_id, student_id, amount, payment_status"),
+        )
+        for student in students:
+            if student.get("classroom_id") in totals:
+                totals[student["classroom_id"]]["students"].add(student["id"])
+        for payment in payments:
+            entry = totals.get(payment.get("classroom_id"))
+            if entry is None:
+                continue
+            if payment.get("payment_status") == "paid":
+                entry["total_paid"] += float(payment.get("amount") or 0)
+                if payment.get("student_id"):
+                    entry["paid_ids"].add(payment["student_id"])
+            elif payment.get("payment_status") == "pending":
+                entry["total_pending"] += float(payment.get("amount") or 0)
+
+    return {
+        cid: _summary(cid, {
+            "total_students": len(entry["students"]),
+            "paid_student_count": len(entry["paid_ids"]),
+            "unpaid_student_count": len(entry["students"] - entry["paid_ids"]),
+            "total_paid": entry["total_paid"],
+            "total_pending": entry["total_pending"],
+            "paid_student_ids": sorted(entry["paid_ids"]),
+        })
+        for cid, entry in totals.items()
+    }
+
+
+async def _all_classroom_summaries(supabase: Database) -> Dict[str, Dict[str, Any]]:
+    """Mọi lớp thực tế (không phải lớp mẫu): RPC với p_classroom_ids NULL, đọc theo
+    trang trên classroom_id vì kết quả (một dòng mỗi lớp) cũng bị max-rows giới hạn"""
+    if settings.FINANCE_AGGREGATE_RPC_ENABLED:
+        try:
+            return {
+                str(row["classroom_id"]): _summary(str(row["classroom_id"]), row)
+                async for row in stream_rows(
+                    lambda: supabase.rpc("classroom_payment_summaries", {"p_classroom_ids": None}),
+                    key="classroom_id",
+                )
+            }
+        except Exception as e:
+            print(f"[payment_summaries] RPC classroom_payment_summaries failed, scanning payments instead: {e}")
+    classroom_ids = [
+        row["id"]
+        async for row in stream_rows(
+            lambda: supabase.table("classrooms").select("id").or_("is_template.is.null,is_template.eq.false")
+        )
+    ]
+    if not classroom_ids:
+        return {}
+    summaries = await _scan_summaries(supabase, classroom_ids)
+    return {cid: summaries.get(cid) or _summary(cid) for cid in classroom_ids}
+
+
+async def classroom_payment_summaries(
+    supabase: Database,
+    classroom_ids: Optional[List[str]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """{classroom_id: tổng quan thanh toán} cho mọi lớp trong `classroom_ids`
+    (None = mọi lớp không phải lớp mẫu)"""
+    if classroom_ids is None:
+        return await _all_classroom_summaries(supabase)
+    classroom_ids = list(dict.fromkeys(cid for cid in classroom_ids if cid))
+    if not classroom_ids:
+        return {}
+    summaries: Optional[Dict[str, Dict[str, Any]]] = None
+    if settings.FINANCE_AGGREGATE_RPC_ENABLED:
+        try:
+            summaries = await _rpc_summaries(supabase, classroom_ids)
+        except Exception as e:
+            print(f"[payment_summaries] RPC classroom_payment_summaries failed, scanning payments instead: {e}")
+    if summaries is None:
+        summaries = await _scan_summaries(supabase, classroom_ids)
+    # Lớp không tồn tại / chưa có dữ liệu vẫn có một dòng toàn 0
+    return {cid: summaries.get(cid) or _summary(cid) for cid in classroom_ids}
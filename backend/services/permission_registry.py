@@ -0,0 +1,154 @@
+"""
+Permission registry
+Nạp roles, permissions, role_permissions và user_roles bằng một số query cố định
+(không phụ thuộc số role/user) và giữ trong bộ nhớ để kiểm tra quyền O(1).
+
+Mỗi permission được gán một bit; quyền của role là bitmask OR các bit đó (quyền
+"<module>.manage" bao gồm mọi quyền khác của module), quyền của user là OR các
+role của user. has_permission() chỉ là một phép AND trên số nguyên.
+
+Registry được nạp lười, xóa khi tạo/sửa/xóa role, gán role cho user, đổi role hoặc xóa user qua API,
+và nạp lại sau PERMISSION_REGISTRY_TTL_SECONDS để thấy thay đổi từ worker khác.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, FrozenSet, List, Optional
+
+from config import settings
+from database import Database
+from services.paging import stream_pages
+
+MANAGE_ACTION = "manage"
+
+
+async def _fetch_all(supabase: Database, table: str, columns: str) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    async for page in stream_pages(lambda: supabase.table(table).select(columns)):
+        rows.extend(page)
+    return rows
+
+
+class PermissionRegistry:
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self._bits: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._role_masks: Dict[str, int] = {}
+        self._role_names: Dict[str, str] = {}
+        self._user_roles: Dict[str, FrozenSet[str]] = {}
+        self._user_masks: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.loads = 0
+
+    @property
+    def loaded(self) -> bool:
+        if self._loaded_at is None:
+            return False
+        return self.ttl_seconds <= 0 or time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    async def ensure_loaded(self, supabase: Database) -> None:
+        if self.loaded:
+            return
+        async with self._lock:
+            if self.loaded:
+                return
+            await self._load(supabase)
+
+    async def _load(self, supabase: Database) -> None:
+        # 3 query (có phân trang) cho toàn bộ dữ liệu phân quyền
+        permissions, roles, user_roles = await asyncio.gather(
+            _fetch_all(supabase, "permissions", "id, name, module, action"),
+            _fetch_all(supabase, "roles", "id, name, role_permissions(permission_id)"),
+            _fetch_all(supabase, "user_roles", "id, user_id, role_id"),
+        )
+
+        bits: Dict[str, int] = {}
+        names: List[str] = []
+        bit_by_id: Dict[str, int] = {}
+        module_masks: Dict[str, int] = {}
+        manage_modules: Dict[str, str] = {}
+        for permission in permissions:
+            name = permission.get("name")
+            if not name:
+                continue
+            if name not in bits:
+                bits[name] = len(names)
+                names.append(name)
+            bit = 1 << bits[name]
+            bit_by_id[permission["id"]] = bit
+            module = permission.get("module")
+            if module:
+                module_masks[module] = module_masks.get(module, 0) | bit
+                if permission.get("action") == MANAGE_ACTION:
+                    manage_modules[permission["id"]] = module
+
+        role_masks: Dict[str, int] = {}
+        role_names: Dict[str, str] = {}
+        for role in roles:
+            mask = 0
+            for link in role.get("role_permissions") or []:
+                permission_id = link.get("permission_id")
+                mask |= bit_by_id.get(permission_id, 0)
+                if permission_id in manage_modules:
+                    mask |= module_masks[manage_modules[permission_id]]
+            role_masks[role["id"]] = mask
+            role_names[role["id"]] = role.get("name") or ""
+
+        grouped: Dict[str, set] = {}
+        for user_role in user_roles:
+            grouped.setdefault(user_role["user_id"], set()).add(user_role["role_id"])
+
+        self._bits = bits
+        self._names = names
+        self._role_masks = role_masks
+        self._role_names = role_names
+        self._user_roles = {user_id: frozenset(role_ids) for user_id, role_ids in grouped.items()}
+        self._user_masks = {}
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    def _mask_for(self, user_id: str) -> int:
+        mask = self._user_masks.get(user_id)
+        if mask is None:
+            mask = 0
+            for role_id in self._user_roles.get(user_id, ()):
+                mask |= self._role_masks.get(role_id, 0)
+            self._user_masks[user_id] = mask
+        return mask
+
+    def has_permission(self, user: Any, permission: str) -> bool:
+        """User có quyền `permission` (vd: "teachers.update") không; admin có mọi quyền"""
+        if getattr(user, "role", None) == "admin":
+            return True
+        bit = self._bits.get(permission)
+        if bit is None:
+            return False
+        return bool(self._mask_for(str(user.id)) >> bit & 1)
+
+    def permissions_for(self, user_id: str) -> List[str]:
+        mask = self._mask_for(user_id)
+        return [name for i, name in enumerate(self._names) if mask >> i & 1]
+
+    def roles_for(self, user_id: str) -> List[Dict[str, str]]:
+        return [
+            {"id": role_id, "name": self._role_names.get(role_id, "")}
+            for role_id in sorted(self._user_roles.get(user_id, ()))
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "permissions": len(self._names),
+            "roles": len(self._role_masks),
+            "users": len(self._user_roles),
+            "loads": self.loads,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+permission_registry = PermissionRegistry(ttl_seconds=settings.PERMISSION_REGISTRY_TTL_SECONDS)
@@ -0,0 +1,157 @@
+"""
+Relation loaders
+Tải quan hệ cho cả một trang kết quả bằng các query in_() thay vì một query cho
+mỗi dòng (N+1), rồi ghép lại trong bộ nhớ.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from database import Database
+from services.paging import stream_pages
+
+# Giữ URL của PostgREST ngắn (mỗi UUID ~37 ký tự trong in_())
+IN_CHUNK_SIZE = 100
+
+
+def _unique(values: Iterable[Any]) -> List[Any]:
+    return list(dict.fromkeys(v for v in values if v is not None))
+
+
+async def fetch_in(
+    supabase: Database,
+    table: str,
+    column: str,
+    values: Iterable[Any],
+    columns: str = "*",
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Lấy mọi dòng có `column` thuộc `values` (và khớp các điều kiện eq trong
+    `filters`), chia chunk và chạy song song"""
+    keys = _unique(values)
+    if not keys:
+        return []
+
+    def build(chunk):
+        query = supabase.table(table).select(columns).in_(column, chunk)
+        for name, value in (filters or {}).items():
+            query = query.eq(name, value)
+        return query.execute()
+
+    chunks = [keys[i:i + IN_CHUNK_SIZE] for i in range(0, len(keys), IN_CHUNK_SIZE)]
+    results = await asyncio.gather(*[build(chunk) for chunk in chunks])
+    rows: List[Dict[str, Any]] = []
+    for result in results:
+        rows.extend(result.data or [])
+    return rows
+
+
+async def fetch_in_paged(
+    supabase: Database,
+    table: str,
+    column: str,
+    values: Iterable[Any],
+    columns: str = "*",
+    filters: Optional[Dict[str, Any]] = None,
+    key: str = "id",
+) -> List[Dict[str, Any]]:
+    """Như fetch_in nhưng mỗi chunk được đọc theo trang (keyset trên `key`, phải có
+    trong `columns`): dùng khi một chunk có thể vượt max-rows của PostgREST"""
+    keys = _unique(values)
+    if not keys:
+        return []
+
+    def build(chunk):
+        def query():
+            q = supabase.table(table).select(columns).in_(column, chunk)
+            for name, value in (filters or {}).items():
+                q = q.eq(name, value)
+            return q
+        return query
+
+    async def read(chunk):
+        rows: List[Dict[str, Any]] = []
+        async for page in stream_pages(build(chunk), key=key):
+            rows.extend(page)
+        return rows
+
+    chunks = [keys[i:i + IN_CHUNK_SIZE] for i in range(0, len(keys), IN_CHUNK_SIZE)]
+    results = await asyncio.gather(*[read(chunk) for chunk in chunks])
+    return [row for rows in results for row in rows]
+
+
+async def load_related(
+    supabase: Database,
+    table: str,
+    key_column: str,
+    keys: Iterable[Any],
+    columns: str = "*",
+) -> Dict[Any, List[Dict[str, Any]]]:
+    """Quan hệ một-nhiều: {key: [rows]} cho mọi key (key không có dòng nào -> [])"""
+    keys = _unique(keys)
+    grouped: Dict[Any, List[Dict[str, Any]]] = {key: [] for key in keys}
+    for row in await fetch_in(supabase, table, key_column, keys, columns):
+        grouped.setdefault(row.get(key_column), []).append(row)
+    return grouped
+
+
+async def fetch_by_ids(
+    supabase: Database,
+    table: str,
+    ids: Iterable[Any],
+    columns: str = "*",
+    key: str = "id",
+) -> Dict[Any, Dict[str, Any]]:
+    """Quan hệ một-một: {id: row}. Lỗi khi tải chỉ được log (trả về {}) để trang
+    danh sách vẫn hiển thị được, chỉ thiếu phần thông tin bổ sung"""
+    try:
+        rows = await fetch_in(supabase, table, key, ids, columns)
+    except Exception as e:
+        print(f"Warning: Failed to fetch {table} records: {e}")
+        return {}
+    return {row[key]: row for row in rows if row.get(key) is not None}
+
+
+@dataclass
+class Relation:
+    """Một khóa ngoại trên các dòng cần hydrate.
+
+    `columns` phải gồm cả `key`; `nested` là các quan hệ của chính bảng `table`
+    (vd: students -> users) và được tải sau khi có các dòng của `table`.
+    """
+    table: str
+    foreign_key: str
+    columns: str = "*"
+    key: str = "id"
+    nested: Dict[str, "Relation"] = field(default_factory=dict)
+
+
+async def hydrate(
+    supabase: Database,
+    rows: List[Dict[str, Any]],
+    relations: Dict[str, Relation],
+) -> List[Dict[str, Any]]:
+    """Gắn row[name] = bản ghi liên quan (hoặc None) cho mỗi relation.
+
+    Mỗi bảng liên quan chỉ tốn một query in_() (theo chunk) cho cả danh sách; các
+    relation cùng cấp được tải song song.
+    """
+    if not rows or not relations:
+        return rows
+
+    async def load(name: str, relation: Relation):
+        records = await fetch_by_ids(
+            supabase,
+            relation.table,
+            (row.get(relation.foreign_key) for row in rows),
+            relation.columns,
+            relation.key,
+        )
+        if relation.nested:
+            await hydrate(supabase, list(records.values()), relation.nested)
+        for row in rows:
+            row[name] = records.get(row.get(relation.foreign_key))
+
+    await asyncio.gather(*[load(name, relation) for name, relation in relations.items()])
+    return rows
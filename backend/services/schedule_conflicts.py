@@ -0,0 +1,271 @@
+"""
+Schedule conflict index
+Index trong bộ nhớ để phát hiện trùng lịch phòng học, giáo viên và lớp học.
+
+Mỗi lịch chiếm một khoảng [start, end) trong một "ngày":
+- lịch có ngày cụ thể: ngày đó (date)
+- lịch định kỳ (date NULL): thứ trong tuần (day_of_week)
+(giống cách kiểm tra cũ: lịch có ngày chỉ so với lịch có ngày, lịch định kỳ chỉ
+so với lịch định kỳ).
+
+Với mỗi khóa (campus, phòng, ngày), (giáo viên, ngày), (lớp, ngày) index giữ một
+mảng khoảng sắp xếp theo start cùng độ dài khoảng lớn nhất, nên một truy vấn
+chồng lấn chỉ cần bisect trong (start - max_duration, end): O(log n + k).
+
+Index được nạp lười ở lần kiểm tra đầu tiên, cập nhật khi tạo/sửa/xóa lịch qua
+API và nạp lại sau SCHEDULE_CONFLICT_INDEX_TTL_SECONDS để thấy thay đổi từ worker
+khác (ràng buộc unique trong database vẫn là chốt chặn cuối cùng).
+"""
+
+import asyncio
+import bisect
+import time as time_module
+from dataclasses import dataclass
+from datetime import date, time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+from database import Database
+from services.paging import stream_pages
+from services.relations import fetch_by_ids
+
+SCHEDULE_COLUMNS = "id, classroom_id, teacher_id, campus_id, room, room_id, date, day_of_week, start_time, end_time"
+CONFLICT_KINDS = ("room", "teacher", "classroom")
+
+
+def time_to_seconds(value: Any) -> int:
+    """'08:00', '08:00:00', datetime.time -> số giây từ 00:00"""
+    if isinstance(value, time):
+        parsed = value
+    else:
+        parsed = time.fromisoformat(str(value).split("T")[-1])
+    return parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+
+def seconds_to_time(value: int) -> str:
+    return f"{value // 3600:02d}:{value % 3600 // 60:02d}:{value % 60:02d}"
+
+
+@dataclass
+class ScheduleSlot:
+    """Một lịch học đã chuẩn hóa để kiểm tra trùng"""
+    id: Optional[str]
+    classroom_id: Optional[str]
+    teacher_id: Optional[str]
+    campus_id: Optional[str]
+    room: Optional[str]
+    date: Optional[str]
+    day_of_week: Optional[int]
+    start: int
+    end: int
+
+    @property
+    def day(self) -> str:
+        return f"date:{self.date}" if self.date else f"dow:{self.day_of_week}"
+
+    def keys(self) -> Dict[str, Tuple]:
+        keys: Dict[str, Tuple] = {}
+        room = (self.room or "").strip().lower()
+        if self.campus_id and room:
+            keys["room"] = (self.campus_id, room, self.day)
+        if self.teacher_id:
+            keys["teacher"] = (self.teacher_id, self.day)
+        if self.classroom_id:
+            keys["classroom"] = (self.classroom_id, self.day)
+        return keys
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any], campus_id: Optional[str] = None) -> "ScheduleSlot":
+        schedule_date = row.get("date")
+        if isinstance(schedule_date, date):
+            schedule_date = schedule_date.isoformat()
+        day_of_week = row.get("day_of_week")
+        return cls(
+            id=row.get("id"),
+            classroom_id=row.get("classroom_id"),
+            teacher_id=row.get("teacher_id"),
+            campus_id=row.get("campus_id") or campus_id,
+            room=row.get("room"),
+            date=schedule_date or None,
+            day_of_week=int(day_of_week) if day_of_week is not None else None,
+            start=time_to_seconds(row["start_time"]),
+            end=time_to_seconds(row["end_time"]),
+        )
+
+
+class _IntervalList:
+    """Các khoảng [start, end) sắp xếp theo start"""
+
+    __slots__ = ("items", "max_duration")
+
+    def __init__(self):
+        self.items: List[Tuple[int, int, str]] = []
+        self.max_duration = 0
+
+    def add(self, start: int, end: int, schedule_id: str) -> None:
+        bisect.insort(self.items, (start, end, schedule_id))
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, start: int, end: int, schedule_id: str) -> None:
+        i = bisect.bisect_left(self.items, (start, end, schedule_id))
+        if i < len(self.items) and self.items[i] == (start, end, schedule_id):
+            del self.items[i]
+
+    def overlapping(self, start: int, end: int) -> List[Tuple[int, int, str]]:
+        # Khoảng chồng lấn có start trong (start - max_duration, end)
+        lo = bisect.bisect_right(self.items, (start - self.max_duration, float("inf"), ""))
+        hi = bisect.bisect_left(self.items, (end, -1, ""))
+        return [item for item in self.items[lo:hi] if item[1] > start]
+
+
+class ScheduleConflictIndex:
+    """Index các lịch học theo phòng/giáo viên/lớp và ngày"""
+
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self._lists: Dict[str, Dict[Tuple, _IntervalList]] = {kind: {} for kind in CONFLICT_KINDS}
+        self._slots: Dict[str, ScheduleSlot] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        if self._loaded_at is None:
+            return False
+        return self.ttl_seconds <= 0 or time_module.monotonic() - self._loaded_at < self.ttl_seconds
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    def clear(self) -> None:
+        self._lists = {kind: {} for kind in CONFLICT_KINDS}
+        self._slots = {}
+
+    async def ensure_loaded(self, supabase: Database) -> None:
+        if self.loaded:
+            return
+        async with self._lock:
+            if self.loaded:
+                return
+            await self._load(supabase)
+
+    async def _load(self, supabase: Database) -> None:
+        rows: List[Dict[str, Any]] = []
+        async for page in stream_pages(lambda: supabase.table("schedules").select(SCHEDULE_COLUMNS)):
+            rows.extend(page)
+
+        # Lịch cũ chưa có campus_id: lấy theo cơ sở của lớp
+        campus_by_classroom: Dict[str, Optional[str]] = {}
+        missing = {row.get("classroom_id") for row in rows if not row.get("campus_id") and row.get("classroom_id")}
+        if missing:
+            classrooms = await fetch_by_ids(supabase, "classrooms", missing, "id, campus_id")
+            campus_by_classroom = {cid: c.get("campus_id") for cid, c in classrooms.items()}
+
+        self.clear()
+        for row in rows:
+            try:
+                self.add(ScheduleSlot.from_row(row, campus_by_classroom.get(row.get("classroom_id"))))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Warning: Skipping schedule {row.get('id')} in conflict index: {e}")
+        self._loaded_at = time_module.monotonic()
+
+    def add(self, slot: ScheduleSlot) -> None:
+        if not slot.id:
+            return
+        if slot.id in self._slots:
+            self.remove(slot.id)
+        self._slots[slot.id] = slot
+        for kind, key in slot.keys().items():
+            self._lists[kind].setdefault(key, _IntervalList()).add(slot.start, slot.end, slot.id)
+
+    def remove(self, schedule_id: str) -> None:
+        slot = self._slots.pop(schedule_id, None)
+        if slot is None:
+            return
+        for kind, key in slot.keys().items():
+            intervals = self._lists[kind].get(key)
+            if intervals is not None:
+                intervals.remove(slot.start, slot.end, slot.id)
+                if not intervals.items:
+                    del self._lists[kind][key]
+
+    def record(self, row: Dict[str, Any]) -> None:
+        """Cập nhật index sau khi tạo/sửa lịch (bỏ qua nếu index chưa được nạp)"""
+        if self._loaded_at is None:
+            return
+        try:
+            self.add(ScheduleSlot.from_row(row))
+        except (KeyError, TypeError, ValueError):
+            self.invalidate()
+
+    def discard(self, schedule_id: str) -> None:
+        """Cập nhật index sau khi xóa lịch"""
+        if self._loaded_at is not None:
+            self.remove(schedule_id)
+
+    def find_conflicts(self, slot: ScheduleSlot, exclude_ids: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """Các lịch đã có chồng giờ với `slot` theo phòng, giáo viên hoặc lớp"""
+        return _find(self._lists, self._slots, slot, set(exclude_ids) | ({slot.id} if slot.id else set()))
+
+    def validate_batch(self, slots: List[ScheduleSlot]) -> Dict[int, List[Dict[str, Any]]]:
+        """Kiểm tra một thời khóa biểu đề xuất: mỗi dòng với dữ liệu hiện có (trừ các
+        lịch đang được thay thế trong batch) và với các dòng khác trong batch.
+        Trả về {vị trí dòng: [xung đột]} cho các dòng có xung đột."""
+        replaced = {slot.id for slot in slots if slot.id}
+        batch_lists: Dict[str, Dict[Tuple, _IntervalList]] = {kind: {} for kind in CONFLICT_KINDS}
+        batch_slots: Dict[str, ScheduleSlot] = {}
+        report: Dict[int, List[Dict[str, Any]]] = {}
+
+        for position, slot in enumerate(slots):
+            conflicts = self.find_conflicts(slot, replaced)
+            for conflict in _find(batch_lists, batch_slots, slot, set()):
+                conflict["row"] = int(conflict.pop("schedule_id"))
+                conflicts.append(conflict)
+            if conflicts:
+                report[position] = conflicts
+
+            batch_id = str(position)
+            batch_slots[batch_id] = slot
+            for kind, key in slot.keys().items():
+                batch_lists[kind].setdefault(key, _IntervalList()).add(slot.start, slot.end, batch_id)
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "schedules": len(self._slots),
+            "keys": {kind: len(lists) for kind, lists in self._lists.items()},
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+def _find(
+    lists: Dict[str, Dict[Tuple, _IntervalList]],
+    slots: Dict[str, ScheduleSlot],
+    slot: ScheduleSlot,
+    exclude_ids: set,
+) -> List[Dict[str, Any]]:
+    conflicts: List[Dict[str, Any]] = []
+    for kind, key in slot.keys().items():
+        intervals = lists[kind].get(key)
+        if intervals is None:
+            continue
+        for start, end, schedule_id in intervals.overlapping(slot.start, slot.end):
+            if schedule_id in exclude_ids:
+                continue
+            existing = slots[schedule_id]
+            conflicts.append({
+                "type": kind,
+                "schedule_id": schedule_id,
+                "date": existing.date,
+                "day_of_week": existing.day_of_week,
+                "start_time": seconds_to_time(start),
+                "end_time": seconds_to_time(end),
+                "room": existing.room,
+                "teacher_id": existing.teacher_id,
+                "classroom_id": existing.classroom_id,
+            })
+    return conflicts
+
+
+schedule_index = ScheduleConflictIndex(ttl_seconds=settings.SCHEDULE_CONFLICT_INDEX_TTL_SECONDS)
@@ -1,22 +1,160 @@
+"""
+Supabase client registry
+Giữ một client Supabase duy nhất cho toàn bộ process, dùng chung connection pool
+keep-alive thay vì gọi create_client() cho mỗi request.
+"""
+
 import os
-from supabase import create_client, Client
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+from supabase import create_client, Client, ClientOptions
+from supabase._sync.client import SyncClient
+from postgrest import SyncPostgrestClient
 from dotenv import load_dotenv
 
+from config import settings
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.SUPABASE_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.SUPABASE_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.SUPABASE_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+class PooledClient(SyncClient):
+    """Supabase client whose PostgREST sub-client uses a sized keep-alive pool.
+
+    postgrest rewrites base_url/headers on whatever httpx client it is given, so
+    the pool is private to this PostgREST instance rather than shared through
+    ClientOptions.httpx_client with auth/storage.
+    """
+
+    @staticmethod
+    def _init_postgrest_client(
+        rest_url: str,
+        headers: Dict[str, str],
+        schema: str,
+        timeout=settings.SUPABASE_HTTP_TIMEOUT,
+        verify: bool = True,
+        proxy: Optional[str] = None,
+        http_client: Optional[httpx.Client] = None,
+    ) -> SyncPostgrestClient:
+        session = httpx.Client(
+            limits=_pool_limits(),
+            timeout=timeout,
+            verify=verify,
+            proxy=proxy,
+            follow_redirects=True,
+            http2=True,
+        )
+        return SyncPostgrestClient(rest_url, headers=headers, schema=schema, http_client=session)
+
+
+class SupabaseClientRegistry:
+    """Process-wide registry of long-lived Supabase clients.
+
+    The clients are built lazily on first use and then shared by every request.
+    They never sign in, so their Authorization header always stays on the API key;
+    flows that call sign_in/sign_up must use create_session_client() instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Client] = {}
+        self._created = 0
+
+    def _options(self) -> ClientOptions:
+        return ClientOptions(
+            auto_refresh_token=False,
+            persist_session=False,
+            postgrest_client_timeout=settings.SUPABASE_HTTP_TIMEOUT,
+        )
+
+    def get(self, name: str, key: Optional[str]) -> Client:
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                if not SUPABASE_URL or not key:
+                    raise ValueError("Supabase URL and Key must be set in environment variables")
+                client = PooledClient(SUPABASE_URL, key, options=self._options())
+                self._clients[name] = client
+                self._created += 1
+        return client
+
+    def close(self):
+        """Close every pooled connection (called on app shutdown)"""
+        with self._lock:
+            for client in self._clients.values():
+                postgrest = getattr(client, '_postgrest', None)
+                if postgrest is not None:
+                    postgrest.session.close()
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy for the health/metrics endpoint"""
+        pools = {}
+        for name, client in list(self._clients.items()):
+            postgrest = getattr(client, '_postgrest', None)
+            pools[name] = _session_stats(postgrest.session if postgrest is not None else None)
+        return {
+            "clients_created": self._created,
+            "limits": {
+                "max_connections": settings.SUPABASE_POOL_MAX_CONNECTIONS,
+                "max_keepalive_connections": settings.SUPABASE_POOL_MAX_KEEPALIVE,
+                "keepalive_expiry": settings.SUPABASE_POOL_KEEPALIVE_EXPIRY,
+            },
+            "pools": pools,
+        }
+
+
+def _session_stats(session: Optional[httpx.Client]) -> Dict[str, int]:
+    stats = {"connections": 0, "active": 0, "idle": 0, "requests": 0}
+    pool = getattr(getattr(session, '_transport', None), '_pool', None)
+    if pool is None:
+        return stats
+    connections = list(getattr(pool, 'connections', []))
+    stats["connections"] = len(connections)
+    stats["idle"] = sum(1 for conn in connections if conn.is_idle())
+    stats["active"] = stats["connections"] - stats["idle"]
+    stats["requests"] = len(getattr(pool, '_requests', []))
+    return stats
+
+
+registry = SupabaseClientRegistry()
+
+
 def get_supabase_client() -> Client:
     """Get Supabase service client for backend operations"""
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("Supabase URL and Key must be set in environment variables")
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    return registry.get("service", SUPABASE_KEY)
 
 def get_supabase_anon_client() -> Client:
     """Get Supabase anon client for JWT token verification"""
-    if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-        raise ValueError("Supabase URL and Anon Key must be set in environment variables")
-    return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+    return registry.get("anon", SUPABASE_ANON_KEY)
 
+def create_session_client() -> Client:
+    """Create a throwaway client for sign_in/sign_up flows.
+
+    Signing in rewrites the client's Authorization header to the user's token,
+    so these calls must never run on the shared service client.
+    """
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("Supabase URL and Key must be set in environment variables")
+    return create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=ClientOptions(auto_refresh_token=False, persist_session=False),
+    )
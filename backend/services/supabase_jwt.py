@@ -0,0 +1,119 @@
+"""
+Supabase JWT verification
+Xác thực access token do Supabase Auth cấp ngay trong process (HS256 bằng
+SUPABASE_JWT_SECRET, hoặc RS256/ES256 bằng JWKS của project) thay vì gọi
+auth.get_user() qua mạng ở mỗi request.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from jose import jwt, JWTError, ExpiredSignatureError
+from jose.exceptions import JWTClaimsError
+
+from config import settings
+
+_PLACEHOLDER_SECRETS = {"", "your-supabase-jwt-secret"}
+_JWKS_TTL_SECONDS = 600
+_JWKS_MIN_REFRESH_SECONDS = 30
+
+# Chỉ một coroutine tải lại JWKS tại một thời điểm; các request khác chờ kết quả
+_jwks_lock = asyncio.Lock()
+_jwks: Optional[Dict[str, Any]] = None
+_jwks_fetched_at = 0.0
+
+
+class SupabaseTokenError(Exception):
+    """Token của Supabase nhưng chắc chắn không hợp lệ (hết hạn, sai aud, thiếu sub)"""
+
+
+def is_supabase_token(token: str) -> bool:
+    """Token của Supabase Auth luôn có `iss`; app JWT (create_access_token) thì không"""
+    try:
+        return "iss" in jwt.get_unverified_claims(token)
+    except JWTError:
+        return False
+
+
+def _jwks_url() -> str:
+    return f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json"
+
+
+async def _get_jwks(force: bool = False) -> Optional[Dict[str, Any]]:
+    global _jwks, _jwks_fetched_at
+    now = time.time()
+    age = now - _jwks_fetched_at
+    if _jwks is not None and age < _JWKS_TTL_SECONDS and not force:
+        return _jwks
+    if force and age < _JWKS_MIN_REFRESH_SECONDS:
+        return _jwks
+
+    async with _jwks_lock:
+        if _jwks_fetched_at != 0.0 and time.time() - _jwks_fetched_at < _JWKS_MIN_REFRESH_SECONDS:
+            return _jwks
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                response = await client.get(_jwks_url())
+            response.raise_for_status()
+            _jwks = response.json()
+        except Exception as e:
+            print(f"[supabase_jwt] Could not fetch JWKS: {e}")
+        _jwks_fetched_at = time.time()
+    return _jwks
+
+
+async def _signing_key(header: Dict[str, Any]) -> Optional[Any]:
+    alg = header.get("alg")
+    if alg == "HS256":
+        secret = settings.SUPABASE_JWT_SECRET
+        return None if secret in _PLACEHOLDER_SECRETS else secret
+
+    if alg in ("RS256", "ES256"):
+        kid = header.get("kid")
+        for force in (False, True):
+            jwks = await _get_jwks(force=force)
+            keys = (jwks or {}).get("keys", [])
+            match = [k for k in keys if not kid or k.get("kid") == kid]
+            if match:
+                return {"keys": match}
+    return None
+
+
+async def verify_supabase_token(token: str) -> Optional[Dict[str, Any]]:
+    """Xác thực local một access token của Supabase.
+
+    Trả về claims nếu chữ ký, `exp`, `aud` và `sub` hợp lệ; trả về None nếu không
+    thể xác thực local (chưa cấu hình secret, không có key, sai chữ ký) để caller
+    gọi auth.get_user(); raise SupabaseTokenError nếu token chắc chắn không hợp lệ.
+    """
+    if not settings.SUPABASE_JWT_LOCAL_VERIFY:
+        return None
+
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        return None
+
+    key = await _signing_key(header)
+    if key is None:
+        return None
+
+    try:
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[header.get("alg")],
+            audience=settings.SUPABASE_JWT_AUDIENCE,
+        )
+    except ExpiredSignatureError:
+        raise SupabaseTokenError("Token has expired")
+    except JWTClaimsError as e:
+        raise SupabaseTokenError(f"Invalid token claims: {e}")
+    except JWTError:
+        return None
+
+    if not claims.get("sub"):
+        raise SupabaseTokenError("Token has no subject")
+    return claims
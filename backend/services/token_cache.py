@@ -0,0 +1,117 @@
+"""
+Verified-token cache
+Cache LRU có TTL cho kết quả xác thực token, để get_current_user không phải gọi
+GoTrue và bảng users ở mỗi request.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from config import settings
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """LRU cache token-hash -> resolved user.
+
+    Mỗi entry hết hạn sau `ttl` giây hoặc khi token hết hạn (`exp`), tùy cái nào
+    sớm hơn. invalidate_user() xóa mọi token của một user khi user bị sửa/xóa/khóa.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Any, float, str]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Any]:
+        key = _token_key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at, _ = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def set(self, token: str, user: Any, token_exp: Optional[float] = None):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        if expires_at <= now:
+            return
+
+        key = _token_key(token)
+        user_id = str(getattr(user, "id", ""))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user, expires_at, user_id)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: Optional[str]):
+        if not user_id:
+            return
+        with self._lock:
+            for key in list(self._by_user.get(str(user_id), ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_user.get(entry[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry[2]]
+
+
+token_cache = TokenCache(
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl=settings.AUTH_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,87 @@
+"""
+TTL cache
+Cache LRU có thời hạn trong bộ nhớ process cho dữ liệu ít thay đổi (tên hiển thị,
+...). Dữ liệu có thể cũ tối đa `ttl` giây; dùng invalidate() khi biết chắc dữ
+liệu vừa đổi.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class TTLCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """Các key còn hạn trong cache -> giá trị (key không có hoặc hết hạn bị bỏ qua)"""
+        found: Dict[Hashable, Any] = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[1] <= now:
+                    if entry is not None:
+                        del self._entries[key]
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[0]
+        return found
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, values: Dict[Hashable, Any]) -> None:
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.set_many({key: value})
+
+    def update(self, key: Hashable, fn: Callable[[Any], Any]) -> bool:
+        """Thay giá trị còn hạn bằng fn(giá trị) và giữ nguyên thời hạn; trả về False
+        nếu key không có trong cache"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                return False
+            self._entries[key] = (fn(entry[0]), entry[1])
+            return True
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,13 +1,10 @@
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+"""
+Supabase client
+Dùng chung client đã được pool trong services.supabase_client cho toàn bộ process
+"""
 
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-def get_supabase_client() -> Client:
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+from services.supabase_client import (
+    get_supabase_client,
+    get_supabase_anon_client,
+    create_session_client,
+)
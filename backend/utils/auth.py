@@ -13,6 +13,7 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from config import settings
 from services.supabase_client import get_supabase_client
+from services.supabase_jwt import is_supabase_token, verify_supabase_token
 from models.user import User, UserRole
 
 security = HTTPBearer()
@@ -64,17 +65,25 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         
         # Try to verify as Supabase JWT token first (for admin)
         try:
-            from services.supabase_client import get_supabase_anon_client
-            supabase_anon = get_supabase_anon_client()
+            if settings.SUPABASE_JWT_LOCAL_VERIFY and not is_supabase_token(token):
+                raise ValueError("Not a Supabase Auth token")
             
-            user_response = supabase_anon.auth.get_user(token)
+            # Verify locally; only ask Supabase Auth when the token can't be verified here
+            claims = await verify_supabase_token(token)
+            if claims is not None:
+                user_id, email = claims.get("sub"), claims.get("email")
+            else:
+                from services.supabase_client import get_supabase_anon_client
+                supabase_anon = get_supabase_anon_client()
+                
+                user_response = supabase_anon.auth.get_user(token)
+                user = getattr(user_response, 'user', None) if user_response else None
+                user_id = getattr(user, 'id', None)
+                email = getattr(user, 'email', None)
             
-            if user_response and hasattr(user_response, 'user') and user_response.user:
+            if user_id:
                 # This is a Supabase JWT token (admin)
-                user_id = user_response.user.id
-                email = user_response.user.email
-                
-                if not user_id or not email:
+                if not email:
                     raise HTTPException(
                         status_code=status.HTTP_401_UNAUTHORIZED,
                         detail="Invalid token payload"
@@ -0,0 +1,77 @@
+-- Migration: Tổng quan thanh toán theo lớp bằng một query
+-- Classroom payment summaries computed server-side
+--
+-- Backend gọi classroom_payment_summaries() qua RPC thay cho 5 query riêng (học
+-- sinh, tiền đã thu, tiền chờ thu, học sinh đã đóng...) rồi cộng / bỏ trùng trong
+-- Python. Số học sinh đã đóng được đếm DISTINCT trong database.
+--
+-- Mỗi lớp trả về một dòng:
+--   classroom_id, total_students, paid_student_count, unpaid_student_count,
+--   total_paid, total_pending, paid_student_ids
+--
+-- p_classroom_ids NULL = mọi lớp thực tế (không phải lớp mẫu).
+-- Dùng: GET /api/payments/classroom/{id}/summary, GET /api/payments/classrooms/summary
+
+-- 1. Index
+CREATE INDEX IF NOT EXISTS idx_student_payments_classroom_status ON student_payments(classroom_id, payment_status);
+CREATE INDEX IF NOT EXISTS idx_students_classroom_id ON students(classroom_id);
+
+-- 2. Tổng hợp
+CREATE OR REPLACE FUNCTION classroom_payment_summaries(p_classroom_ids UUID[] DEFAULT NULL)
+RETURNS TABLE (
+    classroom_id UUID,
+    total_students BIGINT,
+    paid_student_count BIGINT,
+    unpaid_student_count BIGINT,
+    total_paid DECIMAL,
+    total_pending DECIMAL,
+    paid_student_ids UUID[]
+) AS $$
+    WITH target AS (
+        SELECT c.id
+        FROM classrooms c
+        WHERE (p_classroom_ids IS NULL AND COALESCE(c.is_template, FALSE) = FALSE)
+           OR c.id = ANY(p_classroom_ids)
+    ),
+    payments AS (
+        SELECT
+            p.classroom_id,
+            COALESCE(SUM(p.amount) FILTER (WHERE p.payment_status = 'paid'), 0) AS total_paid,
+            COALESCE(SUM(p.amount) FILTER (WHERE p.payment_status = 'pending'), 0) AS total_pending,
+            ARRAY_AGG(DISTINCT p.student_id) FILTER (WHERE p.payment_status = 'paid') AS paid_student_ids
+        FROM student_payments p
+        JOIN target t ON t.id = p.classroom_id
+        GROUP BY p.classroom_id
+    ),
+    enrolled AS (
+        SELECT
+            s.classroom_id,
+            COUNT(*) AS total_students,
+            COUNT(*) FILTER (WHERE NOT EXISTS (
+                SELECT 1 FROM student_payments p
+                WHERE p.student_id = s.id
+                  AND p.classroom_id = s.classroom_id
+                  AND p.payment_status = 'paid'
+            )) AS unpaid_students
+        FROM students s
+        JOIN target t ON t.id = s.classroom_id
+        GROUP BY s.classroom_id
+    )
+    SELECT
+        t.id,
+        COALESCE(e.total_students, 0),
+        COALESCE(cardinality(p.paid_student_ids), 0)::BIGINT,
+        COALESCE(e.unpaid_students, 0),
+        COALESCE(p.total_paid, 0),
+        COALESCE(p.total_pending, 0),
+        COALESCE(p.paid_student_ids, ARRAY[]::UUID[])
+    FROM target t
+    LEFT JOIN payments p ON p.classroom_id = t.id
+    LEFT JOIN enrolled e ON e.classroom_id = t.id
+    ORDER BY t.id;
+$$ LANGUAGE sql STABLE;
+
+-- Ghi chú:
+-- - paid_student_count đếm mọi học sinh có khoản 'paid' của lớp (kể cả học sinh
+--   đã chuyển lớp), giống cách tính cũ; unpaid_student_count là số học sinh đang
+--   học trong lớp mà chưa có khoản 'paid' nào
@@ -0,0 +1,86 @@
+-- Migration: Tổng hợp tài chính tính trong database
+-- Database-side SUM/GROUP BY for finance summaries
+--
+-- Backend gọi finance_summary_totals() qua RPC thay vì tải mọi dòng finances về
+-- rồi cộng trong Python (vừa chậm, vừa bị giới hạn số dòng của PostgREST cắt bớt
+-- khi kỳ báo cáo có nhiều giao dịch). Hàm trả về MỘT giá trị JSONB nên kết quả
+-- luôn chính xác bất kể số dòng:
+--
+-- {
+--   "totals":      {"income": 1500000, "expense": 400000},
+--   "counts":      {"income": 12, "expense": 3},
+--   "by_category": {"income": {"tuition": 1500000}, "expense": {"salary": 400000}},
+--   "by_classroom":{"income": {"<classroom_id>": 1500000}, "expense": {...}},
+--   "by_month":    {"income": {"2024-01-01": 1500000}, "expense": {...}}
+-- }
+--
+-- Dùng: GET /api/finances/summary, GET /api/reports/finance/summary
+
+-- 1. Index cho lọc theo khoảng thời gian / lớp
+CREATE INDEX IF NOT EXISTS idx_finances_date ON finances(date);
+CREATE INDEX IF NOT EXISTS idx_finances_classroom_date ON finances(classroom_id, date);
+
+-- 2. Tổng hợp theo loại, danh mục, lớp và tháng trong một lần quét
+CREATE OR REPLACE FUNCTION finance_summary_totals(
+    p_start TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_end TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_classroom_id UUID DEFAULT NULL
+)
+RETURNS JSONB AS $$
+    WITH grouped AS (
+        SELECT
+            f.finance_type,
+            f.category,
+            f.classroom_id,
+            date_trunc('month', f.date)::date AS month,
+            SUM(f.amount) AS total,
+            COUNT(*) AS row_count,
+            -- 7: theo loại; 3: + danh mục; 5: + lớp; 6: + tháng
+            GROUPING(f.category, f.classroom_id, date_trunc('month', f.date)::date) AS level
+        FROM finances f
+        WHERE (p_start IS NULL OR f.date >= p_start)
+          AND (p_end IS NULL OR f.date <= p_end)
+          AND (p_classroom_id IS NULL OR f.classroom_id = p_classroom_id)
+        GROUP BY GROUPING SETS (
+            (f.finance_type),
+            (f.finance_type, f.category),
+            (f.finance_type, f.classroom_id),
+            (f.finance_type, date_trunc('month', f.date)::date)
+        )
+    )
+    SELECT jsonb_build_object(
+        'totals', COALESCE((
+            SELECT jsonb_object_agg(finance_type, total) FROM grouped WHERE level = 7
+        ), '{}'::jsonb),
+        'counts', COALESCE((
+            SELECT jsonb_object_agg(finance_type, row_count) FROM grouped WHERE level = 7
+        ), '{}'::jsonb),
+        'by_category', COALESCE((
+            SELECT jsonb_object_agg(finance_type, amounts) FROM (
+                SELECT finance_type, jsonb_object_agg(COALESCE(category, 'other'), total) AS amounts
+                FROM grouped WHERE level = 3
+                GROUP BY finance_type
+            ) t
+        ), '{}'::jsonb),
+        'by_classroom', COALESCE((
+            SELECT jsonb_object_agg(finance_type, amounts) FROM (
+                SELECT finance_type, jsonb_object_agg(classroom_id, total) AS amounts
+                FROM grouped WHERE level = 5 AND classroom_id IS NOT NULL
+                GROUP BY finance_type
+            ) t
+        ), '{}'::jsonb),
+        'by_month', COALESCE((
+            SELECT jsonb_object_agg(finance_type, amounts) FROM (
+                SELECT finance_type, jsonb_object_agg(month, total ORDER BY month) AS amounts
+                FROM grouped WHERE level = 6
+                GROUP BY finance_type
+            ) t
+        ), '{}'::jsonb)
+    );
+$$ LANGUAGE sql STABLE;
+
+-- Ghi chú:
+-- - Giao dịch không gắn lớp (classroom_id NULL) vẫn được tính vào totals,
+--   by_category và by_month, chỉ không xuất hiện trong by_classroom
+-- - Nếu chưa chạy migration này, backend tự tính bằng cách đọc finances theo
+--   trang (chậm hơn nhưng vẫn chính xác)
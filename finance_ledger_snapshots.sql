@@ -0,0 +1,229 @@
+-- Migration: Sổ cái tài chính theo tháng (snapshot cộng dồn)
+-- Monthly finance ledger snapshots
+--
+-- finance_ledger_snapshots giữ tổng tiền và số giao dịch theo (tháng, loại, danh
+-- mục, lớp). Backend cập nhật tăng dần mỗi khi tạo/sửa/xóa giao dịch trong
+-- finances (kể cả giao dịch tự tạo khi thu học phí) qua apply_finance_ledger_delta,
+-- nên dashboard tổng quan / theo năm chỉ đọc vài dòng snapshot thay vì quét mọi
+-- giao dịch.
+--
+-- Tháng đã khóa sổ (finance_ledger_periods) bị đóng băng: snapshot không đổi nữa
+-- và backend từ chối tạo/sửa/xóa giao dịch thuộc tháng đó.
+--
+-- Sau khi chạy migration, backfill dữ liệu cũ bằng:
+--   SELECT rebuild_finance_ledger();
+
+-- 1. Bảng snapshot
+CREATE TABLE IF NOT EXISTS finance_ledger_snapshots (
+    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+    month DATE NOT NULL,                          -- Ngày đầu tháng
+    finance_type VARCHAR(50) NOT NULL,
+    category VARCHAR(50) NOT NULL,
+    classroom_id UUID,                            -- Không có FK: xem trigger ở mục 3
+    total_amount DECIMAL(15,2) NOT NULL DEFAULT 0,
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    CONSTRAINT finance_ledger_snapshots_key UNIQUE NULLS NOT DISTINCT (month, finance_type, category, classroom_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_finance_ledger_snapshots_month ON finance_ledger_snapshots(month);
+CREATE INDEX IF NOT EXISTS idx_finance_ledger_snapshots_classroom_month ON finance_ledger_snapshots(classroom_id, month);
+
+-- Bản cài trước có FK ON DELETE SET NULL: xóa lớp làm trùng khóa (tháng, loại,
+-- danh mục, NULL) và DELETE FROM classrooms bị lỗi unique violation
+ALTER TABLE finance_ledger_snapshots DROP CONSTRAINT IF EXISTS finance_ledger_snapshots_classroom_id_fkey;
+
+-- 2. Các tháng đã khóa sổ
+CREATE TABLE IF NOT EXISTS finance_ledger_periods (
+    month DATE PRIMARY KEY,
+    closed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    closed_by UUID REFERENCES users(id) ON DELETE SET NULL,
+    notes TEXT
+);
+
+-- 3. Xóa lớp: finances.classroom_id được SET NULL, nên snapshot của lớp (các tháng
+--    chưa khóa) được cộng dồn vào dòng không có lớp thay vì bị xóa hay trùng khóa
+CREATE OR REPLACE FUNCTION fold_finance_ledger_classroom()
+RETURNS TRIGGER AS $$
+BEGIN
+    LOCK TABLE finance_ledger_snapshots IN SHARE ROW EXCLUSIVE MODE;
+
+    INSERT INTO finance_ledger_snapshots (
+        month, finance_type, category, classroom_id,
+        total_amount, transaction_count, updated_at
+    )
+    SELECT s.month, s.finance_type, s.category, NULL, s.total_amount, s.transaction_count, NOW()
+    FROM finance_ledger_snapshots s
+    WHERE s.classroom_id = OLD.id
+      AND NOT EXISTS (SELECT 1 FROM finance_ledger_periods p WHERE p.month = s.month)
+    ON CONFLICT ON CONSTRAINT finance_ledger_snapshots_key DO UPDATE SET
+        total_amount = finance_ledger_snapshots.total_amount + EXCLUDED.total_amount,
+        transaction_count = finance_ledger_snapshots.transaction_count + EXCLUDED.transaction_count,
+        updated_at = NOW();
+
+    DELETE FROM finance_ledger_snapshots s
+    WHERE s.classroom_id = OLD.id
+      AND NOT EXISTS (SELECT 1 FROM finance_ledger_periods p WHERE p.month = s.month);
+
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fold_finance_ledger_classroom ON classrooms;
+CREATE TRIGGER trg_fold_finance_ledger_classroom
+    AFTER DELETE ON classrooms
+    FOR EACH ROW EXECUTE FUNCTION fold_finance_ledger_classroom();
+
+-- 4. Cập nhật tăng dần cho một giao dịch (gọi qua RPC từ backend)
+CREATE OR REPLACE FUNCTION apply_finance_ledger_delta(
+    p_date TIMESTAMP WITH TIME ZONE,
+    p_finance_type VARCHAR,
+    p_category VARCHAR,
+    p_classroom_id UUID DEFAULT NULL,
+    p_amount_delta DECIMAL DEFAULT 0,
+    p_count_delta INTEGER DEFAULT 0
+)
+RETURNS VOID AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_date)::date;
+BEGIN
+    IF EXISTS (SELECT 1 FROM finance_ledger_periods WHERE month = v_month) THEN
+        RAISE EXCEPTION 'Finance period % is closed', to_char(v_month, 'YYYY-MM');
+    END IF;
+
+    INSERT INTO finance_ledger_snapshots (
+        month, finance_type, category, classroom_id,
+        total_amount, transaction_count, updated_at
+    )
+    VALUES (
+        v_month, p_finance_type, COALESCE(p_category, 'other'), p_classroom_id,
+        p_amount_delta, p_count_delta, NOW()
+    )
+    ON CONFLICT ON CONSTRAINT finance_ledger_snapshots_key DO UPDATE SET
+        total_amount = finance_ledger_snapshots.total_amount + EXCLUDED.total_amount,
+        transaction_count = finance_ledger_snapshots.transaction_count + EXCLUDED.transaction_count,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- 5. Tính lại snapshot từ finances (NULL = mọi tháng chưa khóa)
+CREATE OR REPLACE FUNCTION rebuild_finance_ledger(p_month DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_month)::date;
+    v_rows INTEGER;
+BEGIN
+    -- Chặn apply_finance_ledger_delta (và rebuild khác) tới khi transaction này
+    -- xong, để một delta không bị cộng hai lần hoặc mất giữa DELETE và INSERT
+    LOCK TABLE finance_ledger_snapshots IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM finance_ledger_snapshots s
+    WHERE (v_month IS NULL OR s.month = v_month)
+      AND NOT EXISTS (SELECT 1 FROM finance_ledger_periods p WHERE p.month = s.month);
+
+    INSERT INTO finance_ledger_snapshots (
+        month, finance_type, category, classroom_id,
+        total_amount, transaction_count, updated_at
+    )
+    SELECT
+        date_trunc('month', f.date)::date,
+        f.finance_type,
+        COALESCE(f.category, 'other'),
+        f.classroom_id,
+        SUM(f.amount),
+        COUNT(*),
+        NOW()
+    FROM finances f
+    WHERE (v_month IS NULL OR date_trunc('month', f.date)::date = v_month)
+      AND NOT EXISTS (
+          SELECT 1 FROM finance_ledger_periods p WHERE p.month = date_trunc('month', f.date)::date
+      )
+    GROUP BY 1, 2, 3, 4;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 6. Khóa sổ một tháng: tính lại lần cuối rồi đóng băng
+CREATE OR REPLACE FUNCTION close_finance_month(
+    p_month DATE,
+    p_closed_by UUID DEFAULT NULL,
+    p_notes TEXT DEFAULT NULL
+)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM rebuild_finance_ledger(p_month);
+    INSERT INTO finance_ledger_periods (month, closed_by, notes)
+    VALUES (date_trunc('month', p_month)::date, p_closed_by, p_notes)
+    ON CONFLICT (month) DO NOTHING;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 7. Tổng hợp từ snapshot, cùng dạng JSONB với finance_summary_totals
+--    (xem finance_aggregates.sql)
+CREATE OR REPLACE FUNCTION finance_ledger_totals(
+    p_start_month DATE DEFAULT NULL,
+    p_end_month DATE DEFAULT NULL,
+    p_classroom_id UUID DEFAULT NULL
+)
+RETURNS JSONB AS $$
+    WITH grouped AS (
+        SELECT
+            s.finance_type,
+            s.category,
+            s.classroom_id,
+            s.month,
+            SUM(s.total_amount) AS total,
+            SUM(s.transaction_count) AS row_count,
+            GROUPING(s.category, s.classroom_id, s.month) AS level
+        FROM finance_ledger_snapshots s
+        WHERE (p_start_month IS NULL OR s.month >= date_trunc('month', p_start_month)::date)
+          AND (p_end_month IS NULL OR s.month <= date_trunc('month', p_end_month)::date)
+          AND (p_classroom_id IS NULL OR s.classroom_id = p_classroom_id)
+        GROUP BY GROUPING SETS (
+            (s.finance_type),
+            (s.finance_type, s.category),
+            (s.finance_type, s.classroom_id),
+            (s.finance_type, s.month)
+        )
+    )
+    SELECT jsonb_build_object(
+        'totals', COALESCE((
+            SELECT jsonb_object_agg(finance_type, total) FROM grouped WHERE level = 7
+        ), '{}'::jsonb),
+        'counts', COALESCE((
+            SELECT jsonb_object_agg(finance_type, row_count) FROM grouped WHERE level = 7
+        ), '{}'::jsonb),
+        'by_category', COALESCE((
+            SELECT jsonb_object_agg(finance_type, amounts) FROM (
+                SELECT finance_type, jsonb_object_agg(category, total) AS amounts
+                FROM grouped WHERE level = 3
+                GROUP BY finance_type
+            ) t
+        ), '{}'::jsonb),
+        'by_classroom', COALESCE((
+            SELECT jsonb_object_agg(finance_type, amounts) FROM (
+                SELECT finance_type, jsonb_object_agg(classroom_id, total) AS amounts
+                FROM grouped WHERE level = 5 AND classroom_id IS NOT NULL
+                GROUP BY finance_type
+            ) t
+        ), '{}'::jsonb),
+        'by_month', COALESCE((
+            SELECT jsonb_object_agg(finance_type, amounts) FROM (
+                SELECT finance_type, jsonb_object_agg(month, total ORDER BY month) AS amounts
+                FROM grouped WHERE level = 6
+                GROUP BY finance_type
+            ) t
+        ), '{}'::jsonb)
+    );
+$$ LANGUAGE sql STABLE;
+
+-- 8. Backfill
+SELECT rebuild_finance_ledger();
+
+-- Ghi chú:
+-- - Snapshot có thể lệch nếu finances bị sửa trực tiếp trong database (không qua
+--   API); chạy lại rebuild_finance_ledger() cho tháng đó (tháng đã khóa không đổi)
+-- - Mở khóa một tháng: DELETE FROM finance_ledger_periods WHERE month = '2024-01-01';
+--   rồi SELECT rebuild_finance_ledger('2024-01-01');
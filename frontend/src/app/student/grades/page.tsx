@@ -119,7 +119,7 @@ export default function StudentGradesPage() {
 
           // Load grade summary for this classroom
           const gradeRes = await fetch(
-            `${API_BASE_URL}/api/assignments/students/${student.id}/grade-summary?classroom_id=${student.classroom_id}`,
+            `${API_BASE_URL}/api/assignments/students/${student.id}/grade-summary?classroom_id=${student.classroom_id}&include_assignments=true`,
             {
               headers: {
                 'Content-Type': 'application/json',
@@ -155,7 +155,7 @@ export default function StudentGradesPage() {
     try {
       const token = localStorage.getItem('auth_token') || localStorage.getItem('access_token');
       const gradeRes = await fetch(
-        `${API_BASE_URL}/api/assignments/students/${studentId}/grade-summary?classroom_id=${classroomId}`,
+        `${API_BASE_URL}/api/assignments/students/${studentId}/grade-summary?classroom_id=${classroomId}&include_assignments=true`,
         {
           headers: {
             'Content-Type': 'application/json',
@@ -0,0 +1,17 @@
+-- Indexes cho phân trang keyset của GET /api/schedules
+-- Danh sách thời khóa biểu được sắp xếp theo (date, start_time, id) và lọc theo
+-- classroom/teacher/campus, nên mỗi trang là một lần quét index thay vì sort cả bảng.
+
+CREATE INDEX IF NOT EXISTS idx_schedules_date_start_id
+    ON public.schedules(date, start_time, id);
+
+CREATE INDEX IF NOT EXISTS idx_schedules_classroom_date_start_id
+    ON public.schedules(classroom_id, date, start_time, id);
+
+CREATE INDEX IF NOT EXISTS idx_schedules_teacher_date_start_id
+    ON public.schedules(teacher_id, date, start_time, id);
+
+CREATE INDEX IF NOT EXISTS idx_schedules_campus_date_start_id
+    ON public.schedules(campus_id, date, start_time, id);
+
+ANALYZE public.schedules;
@@ -0,0 +1,134 @@
+-- Migration: Bảng tổng hợp điểm theo (học sinh, môn, lớp)
+-- Precomputed grade rollup per (student, subject, classroom)
+--
+-- Backend cập nhật bảng này theo từng lần nộp/chấm bài (apply_grade_rollup_delta),
+-- nên các trang bảng điểm chỉ cần đọc vài dòng thay vì quét toàn bộ
+-- assignment_submissions của học sinh.
+--
+-- classroom_id là lớp hiện tại của học sinh nếu bài tập được giao cho lớp đó,
+-- ngược lại là NULL. subject_id là môn của bài tập (có thể NULL).
+-- Bài "đã chấm" là bài có is_graded = TRUE và có score, giống điều kiện của trang
+-- bảng điểm khi quét assignment_submissions.
+--
+-- Sau khi chạy migration, backfill dữ liệu cũ bằng:
+--   SELECT rebuild_student_grade_rollups();
+-- hoặc: cd backend && python rebuild_grade_rollups.py
+
+-- 1. Bảng rollup
+CREATE TABLE IF NOT EXISTS student_grade_rollups (
+    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+    student_id UUID REFERENCES students(id) ON DELETE CASCADE NOT NULL,
+    subject_id UUID REFERENCES subjects(id) ON DELETE CASCADE,
+    classroom_id UUID REFERENCES classrooms(id) ON DELETE CASCADE,
+    submission_count INTEGER NOT NULL DEFAULT 0,  -- Tổng số bài nộp (kể cả chưa chấm)
+    assignment_count INTEGER NOT NULL DEFAULT 0,  -- Số bài tập khác nhau đã nộp
+    graded_count INTEGER NOT NULL DEFAULT 0,      -- Số bài nộp đã có điểm
+    total_score DECIMAL(12,2) NOT NULL DEFAULT 0, -- Tổng điểm các bài đã có điểm
+    latest_score DECIMAL(5,2),
+    latest_graded_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    CONSTRAINT student_grade_rollups_key UNIQUE NULLS NOT DISTINCT (student_id, subject_id, classroom_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_student_grade_rollups_student ON student_grade_rollups(student_id);
+CREATE INDEX IF NOT EXISTS idx_student_grade_rollups_classroom ON student_grade_rollups(classroom_id);
+
+-- Bản cài trước chưa có assignment_count (chạy lại rebuild_student_grade_rollups())
+ALTER TABLE student_grade_rollups ADD COLUMN IF NOT EXISTS assignment_count INTEGER NOT NULL DEFAULT 0;
+DROP FUNCTION IF EXISTS apply_grade_rollup_delta(UUID, UUID, INTEGER, INTEGER, DECIMAL, DECIMAL);
+
+-- 2. Cập nhật tăng dần cho một bài nộp (gọi qua RPC từ backend)
+CREATE OR REPLACE FUNCTION apply_grade_rollup_delta(
+    p_student_id UUID,
+    p_assignment_id UUID,
+    p_submission_delta INTEGER DEFAULT 0,
+    p_graded_delta INTEGER DEFAULT 0,
+    p_score_delta DECIMAL DEFAULT 0,
+    p_latest_score DECIMAL DEFAULT NULL,
+    p_assignment_delta INTEGER DEFAULT 0
+)
+RETURNS VOID AS $$
+DECLARE
+    v_subject_id UUID;
+    v_classroom_id UUID;
+BEGIN
+    SELECT a.subject_id INTO v_subject_id
+    FROM assignments a
+    WHERE a.id = p_assignment_id;
+
+    SELECT ac.classroom_id INTO v_classroom_id
+    FROM students s
+    JOIN assignment_classrooms ac
+        ON ac.classroom_id = s.classroom_id AND ac.assignment_id = p_assignment_id
+    WHERE s.id = p_student_id;
+
+    INSERT INTO student_grade_rollups (
+        student_id, subject_id, classroom_id,
+        submission_count, assignment_count, graded_count, total_score,
+        latest_score, latest_graded_at, updated_at
+    )
+    VALUES (
+        p_student_id, v_subject_id, v_classroom_id,
+        GREATEST(p_submission_delta, 0), GREATEST(p_assignment_delta, 0), GREATEST(p_graded_delta, 0), p_score_delta,
+        p_latest_score, CASE WHEN p_latest_score IS NOT NULL THEN NOW() END, NOW()
+    )
+    ON CONFLICT ON CONSTRAINT student_grade_rollups_key DO UPDATE SET
+        submission_count = student_grade_rollups.submission_count + p_submission_delta,
+        assignment_count = student_grade_rollups.assignment_count + p_assignment_delta,
+        graded_count = student_grade_rollups.graded_count + p_graded_delta,
+        total_score = student_grade_rollups.total_score + p_score_delta,
+        latest_score = COALESCE(p_latest_score, student_grade_rollups.latest_score),
+        latest_graded_at = CASE
+            WHEN p_latest_score IS NOT NULL THEN NOW()
+            ELSE student_grade_rollups.latest_graded_at
+        END,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- 3. Tính lại toàn bộ (hoặc cho một danh sách học sinh) từ assignment_submissions
+CREATE OR REPLACE FUNCTION rebuild_student_grade_rollups(p_student_ids UUID[] DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    v_rows INTEGER;
+BEGIN
+    DELETE FROM student_grade_rollups
+    WHERE p_student_ids IS NULL OR student_id = ANY(p_student_ids);
+
+    INSERT INTO student_grade_rollups (
+        student_id, subject_id, classroom_id,
+        submission_count, assignment_count, graded_count, total_score,
+        latest_score, latest_graded_at, updated_at
+    )
+    SELECT
+        sub.student_id,
+        a.subject_id,
+        ac.classroom_id,
+        COUNT(*),
+        COUNT(DISTINCT sub.assignment_id),
+        COUNT(*) FILTER (WHERE sub.is_graded AND sub.score IS NOT NULL),
+        COALESCE(SUM(sub.score) FILTER (WHERE sub.is_graded), 0),
+        (ARRAY_AGG(sub.score ORDER BY COALESCE(sub.graded_at, sub.submitted_at) DESC)
+            FILTER (WHERE sub.is_graded AND sub.score IS NOT NULL))[1],
+        MAX(sub.graded_at) FILTER (WHERE sub.is_graded),
+        NOW()
+    FROM assignment_submissions sub
+    JOIN assignments a ON a.id = sub.assignment_id
+    LEFT JOIN students s ON s.id = sub.student_id
+    LEFT JOIN assignment_classrooms ac
+        ON ac.assignment_id = sub.assignment_id AND ac.classroom_id = s.classroom_id
+    WHERE p_student_ids IS NULL OR sub.student_id = ANY(p_student_ids)
+    GROUP BY sub.student_id, a.subject_id, ac.classroom_id;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ghi chú:
+-- - graded_count chỉ đếm bài is_graded có score (khớp với cách tính điểm trung bình ở backend)
+-- - Mỗi bài tập chỉ thuộc một dòng (môn của bài, lớp của học sinh nếu bài được giao
+--   cho lớp đó), nên cộng assignment_count của nhiều dòng không bị trùng
+-- - Điểm trung bình = total_score / graded_count
+-- - Khi bài tập đổi môn/lớp, hoặc học sinh chuyển lớp, backend gọi
+--   rebuild_student_grade_rollups(ARRAY[...]) cho các học sinh bị ảnh hưởng